@@ -0,0 +1,121 @@
+"""
+__main__.py
+Command line entry point: python -m mytd_parser [command]
+Created By: mkimble
+"""
+
+import argparse
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='mytd_parser')
+    subparsers = parser.add_subparsers(dest='command')
+
+    watch_parser = subparsers.add_parser('watch', help='parse runs in staging and the server download dir as '
+                                                       'soon as they are complete')
+    watch_parser.add_argument('--no-staging', action='store_true', help='do not watch MISEQ_STAGING_DIR')
+    watch_parser.add_argument('--no-server', action='store_true', help='do not watch SERVER_DOWNLOAD_DIR')
+    watch_parser.add_argument('--upload-parsing', action='store_true')
+    watch_parser.add_argument('--move-parsing', action='store_true')
+    watch_parser.add_argument('--move-staging', action='store_true')
+    watch_parser.add_argument('--check-gdrive', action='store_true')
+    watch_parser.add_argument('--poll', action='store_true', help='poll instead of using inotify')
+
+    export_parser = subparsers.add_parser('catalog-export', help='write seq_dirlist.csv, server_dirlist.csv and '
+                                                                 'fastq_filelist.csv from the run catalog')
+    export_parser.add_argument('--output-dir', help='default: LOG_FILE_DIR')
+
+    archive_parser = subparsers.add_parser('archive-export', help='write fastq records from the fastq archive '
+                                                                  'to a csv file')
+    archive_parser.add_argument('output_csv', help='csv file to write')
+    archive_parser.add_argument('--project')
+    archive_parser.add_argument('--run-id')
+
+    reconcile_parser = subparsers.add_parser('reconcile', help='write the fastq files of Fastq_filelist.csv '
+                                                                'manifests that are missing or mismatched in '
+                                                                'MyTardis to a csv file')
+    reconcile_parser.add_argument('output_csv', help='csv file to write')
+    reconcile_parser.add_argument('--manifest-dir', action='append',
+                                  help='Upload dir laid out project/run_id/Fastq_*/ (repeatable); '
+                                       'default: MISEQ_UPLOAD_DIR and MISEQ_BACKUP_DIR/Upload/')
+    reconcile_parser.add_argument('--api-url', help='default: MYTARDIS_API_URL')
+    reconcile_parser.add_argument('--experiment-id', type=int, help='default: MAINE_EDNA_EXPERIMENT_ID')
+
+    bench_parser = subparsers.add_parser('bench', help='time the parsers on synthetic run trees, with Google '
+                                                       'Sheets and MyTardis stubbed')
+    bench_parser.add_argument('--runs', type=int, nargs='+', default=[1, 10, 100], help='run counts (default: '
+                                                                                         '1 10 100)')
+    bench_parser.add_argument('--case', action='append', dest='cases',
+                              help='discover, copy_metadata, copy_fastq, server_check, server_move or '
+                                   'dataset_filter (repeatable); default: all')
+    bench_parser.add_argument('--repeat', type=int, default=3)
+    bench_parser.add_argument('--generic-runs', type=int, default=0, help='runs from another facility per run '
+                                                                         'count')
+    bench_parser.add_argument('--fastq-files', type=int, default=24, help='fastq files per run')
+    bench_parser.add_argument('--fastq-size', type=int, default=1048576, help='bytes per (sparse) fastq file')
+    bench_parser.add_argument('--thumbnails', type=int, default=1000, help='Thumbnail_Images files per MiSeq run')
+    bench_parser.add_argument('--no-check-gdrive', action='store_true', help='skip the stubbed gsheet lookups')
+    bench_parser.add_argument('--work-dir', help='default: a temp dir')
+    bench_parser.add_argument('--keep', action='store_true', help='keep the generated trees')
+    bench_parser.add_argument('--output-json', help='also write the results to this file')
+
+    synth_parser = subparsers.add_parser('synth-tree', help='write a synthetic staging tree of MiSeq and '
+                                                            'generic runs')
+    synth_parser.add_argument('staging_dir')
+    synth_parser.add_argument('--runs', type=int, default=10, help='MiSeq runs')
+    synth_parser.add_argument('--generic-runs', type=int, default=0)
+    synth_parser.add_argument('--project', default='maine-edna')
+    synth_parser.add_argument('--fastq-files', type=int, default=24, help='fastq files per run')
+    synth_parser.add_argument('--fastq-size', type=int, default=1048576, help='bytes per (sparse) fastq file')
+    synth_parser.add_argument('--thumbnails', type=int, default=1000, help='Thumbnail_Images files per MiSeq run')
+
+    args = parser.parse_args(argv)
+    from mytd_parser.logger_settings import start_async_logging
+    start_async_logging()
+    if args.command == 'watch':
+        from mytd_parser.watch import watch
+        watch(staging=not args.no_staging, server=not args.no_server, upload_parsing=args.upload_parsing,
+              move_parsing=args.move_parsing, move_staging=args.move_staging, check_gdrive=args.check_gdrive,
+              use_inotify=not args.poll)
+    elif args.command == 'catalog-export':
+        from mytd_parser import settings
+        from mytd_parser.run_catalog import RunCatalog
+        output_dir = args.output_dir if args.output_dir else settings.LOG_FILE_DIR
+        for output_csv_filename in RunCatalog().export_csv(output_dir):
+            print(output_csv_filename)
+    elif args.command == 'archive-export':
+        from mytd_parser.fastq_archive import FastqArchive
+        fastq_df = FastqArchive().read(project=args.project, run_id=args.run_id)
+        fastq_df.to_csv(args.output_csv, encoding='utf-8', index=False)
+        print(str(len(fastq_df)) + ' fastq files: ' + args.output_csv)
+    elif args.command == 'reconcile':
+        from mytd_parser import settings
+        from mytd_parser.mytardis_api import MyTardisClient
+        from mytd_parser.reconcile import reconcile_uploads
+        client = MyTardisClient(mytardis_api_url=args.api_url if args.api_url else settings.MYTARDIS_API_URL)
+        experiment_id = args.experiment_id if args.experiment_id else settings.MAINE_EDNA_EXPERIMENT_ID
+        reconcile_df = reconcile_uploads(args.output_csv, manifest_dirs=args.manifest_dir, client=client,
+                                         dataset_params={'experiments__id': experiment_id})
+        print(str(len(reconcile_df)) + ' missing or mismatched fastq files: ' + args.output_csv)
+    elif args.command == 'bench':
+        from mytd_parser.bench import run_benchmarks, format_results, write_results, CASES
+        results = run_benchmarks(work_dir=args.work_dir, run_counts=args.runs,
+                                 cases=args.cases if args.cases else CASES, repeat=args.repeat,
+                                 num_generic_runs=args.generic_runs, num_fastq_files=args.fastq_files,
+                                 fastq_size=args.fastq_size, num_thumbnails=args.thumbnails,
+                                 check_gdrive=not args.no_check_gdrive, keep=args.keep)
+        print(format_results(results))
+        if args.output_json:
+            write_results(results, args.output_json)
+    elif args.command == 'synth-tree':
+        from mytd_parser.synthetic import make_staging_tree
+        run_dirs = make_staging_tree(args.staging_dir, args.runs, args.generic_runs, project=args.project,
+                                     num_fastq_files=args.fastq_files, fastq_size=args.fastq_size,
+                                     num_thumbnails=args.thumbnails)
+        print(str(len(run_dirs)) + ' runs: ' + args.staging_dir)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""
+bench.py
+Benchmarks of the parsers on synthetic run trees: discovery, metadata copy, fastq copy and the server
+completeness check and move, at 1, 10 and 100 runs. Google Sheets and MyTardis are replaced by in-memory
+stubs, so the benchmarks run on any Linux box without credentials or network access
+Created By: mkimble
+"""
+
+import os
+import json
+import shutil
+import logging
+import tempfile
+import statistics
+import time
+from urllib.parse import urlparse, parse_qs
+from . import settings
+from . import gsheets
+from .logger_settings import api_logger
+from .metrics import get_metrics, FILES_COPIED, BYTES_COPIED
+from .synthetic import make_staging_tree
+from .pipeline import ParsePipeline, DISCOVER, VALIDATE, COPY_METADATA, COPY_FASTQ, MANIFEST, PARSE_STAGES
+from .parse_seq_run import get_parser_class, get_sampleid_primerpair_name
+from .parse_server_copy import ServerParse
+from .run_tree_index import RunTreeIndex
+from .run_metadata import parse_run_info_xml, parse_completed_job_info_xml, parse_rta_complete_txt
+from .mytardis_api import MyTardisClient
+
+DISCOVER_CASE = 'discover'
+COPY_METADATA_CASE = 'copy_metadata'
+COPY_FASTQ_CASE = 'copy_fastq'
+SERVER_CHECK_CASE = 'server_check'
+SERVER_MOVE_CASE = 'server_move'
+DATASET_FILTER_CASE = 'dataset_filter'
+CASES = (DISCOVER_CASE, COPY_METADATA_CASE, COPY_FASTQ_CASE, SERVER_CHECK_CASE, SERVER_MOVE_CASE,
+         DATASET_FILTER_CASE)
+RUN_COUNTS = (1, 10, 100)
+STUB_MYTARDIS_API_URL = 'https://mytardis.invalid/api/v1/'
+
+
+class StubWorksheet:
+    """
+     in-memory worksheet with a RunID and "Number of FASTQ files" row per run, for check_gdrive
+    """
+    def __init__(self, rows):
+        self.id = 0
+        self.spreadsheet = None
+        self.rows = [['RunID', 'Number of FASTQ files', gsheets.GSHEETS_PARSE_STATUS_COLUMN]] + rows
+        self.num_batch_updates = 0
+
+    def get_all_values(self):
+        return [list(row) for row in self.rows]
+
+    def batch_update(self, data):
+        self.num_batch_updates += 1
+
+
+class StubGsheetClient:
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+
+    def get_worksheet(self):
+        return self.worksheet
+
+
+class StubResponse:
+    def __init__(self, data_json, status_code=200):
+        self.data_json = data_json
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = {}
+
+    def json(self):
+        return self.data_json
+
+
+class StubMyTardisSession:
+    """
+     answers MyTardis dataset listings with limit/offset pages of objects
+    """
+    def __init__(self, objects):
+        self.objects = objects
+
+    def get(self, uri, **kwargs):
+        query = parse_qs(urlparse(uri).query)
+        limit = int(query.get('limit', ['20'])[0])
+        offset = int(query.get('offset', ['0'])[0])
+        return StubResponse({'meta': {'limit': limit, 'offset': offset, 'total_count': len(self.objects)},
+                             'objects': self.objects[offset:offset + limit]})
+
+
+def clear_caches():
+    """
+     drop the per-process memoization so every repeat parses the run metadata from disk
+    """
+    parse_run_info_xml.cache_clear()
+    parse_completed_job_info_xml.cache_clear()
+    parse_rta_complete_txt.cache_clear()
+    get_sampleid_primerpair_name.cache_clear()
+    gsheets.clear_gsheet_snapshots()
+
+
+class ParserBench:
+    """
+     synthetic staging tree of num_runs runs (num_generic_runs of them from another facility) in work_dir, and
+     the cases run against it. Outputs (Upload, server output, catalogs) are removed before each repeat
+    """
+    def __init__(self, work_dir, num_runs, num_generic_runs=0, num_fastq_files=24, fastq_size=1048576,
+                 num_thumbnails=1000, check_gdrive=True):
+        self.work_dir = work_dir.replace('\\', '/').rstrip('/') + '/'
+        self.num_runs = num_runs
+        self.num_generic_runs = num_generic_runs
+        self.num_fastq_files = num_fastq_files
+        self.fastq_size = fastq_size
+        self.num_thumbnails = num_thumbnails
+        self.check_gdrive = check_gdrive
+        self.staging_dir = self.work_dir + 'Staging/'
+        self.upload_dir = self.work_dir + 'Upload/'
+        self.server_output_dir = self.work_dir + 'Server/'
+        self.bioinfo_results_dir = self.work_dir + 'Bioinformatics_Results/'
+        self.log_file_dir = self.work_dir + 'logs/'
+        self.run_dirs = []
+        self.worksheet = None
+
+    def generate(self):
+        start_time = time.perf_counter()
+        self.run_dirs = make_staging_tree(self.staging_dir, self.num_runs - self.num_generic_runs,
+                                          self.num_generic_runs, num_fastq_files=self.num_fastq_files,
+                                          fastq_size=self.fastq_size, num_thumbnails=self.num_thumbnails)
+        rows = []
+        for run_dir in self.run_dirs:
+            rows.append([os.path.basename(run_dir.rstrip('/')), str(self.num_fastq_files), ''])
+        self.worksheet = StubWorksheet(rows)
+        api_logger.warning('[BENCH] generated ' + str(len(self.run_dirs)) + ' runs in ' +
+                           str(round(time.perf_counter() - start_time, 2)) + 's: [' + self.staging_dir + ']')
+
+    def reset_outputs(self):
+        for output_dir in (self.upload_dir, self.server_output_dir, self.bioinfo_results_dir, self.log_file_dir):
+            shutil.rmtree(output_dir, ignore_errors=True)
+        os.makedirs(self.log_file_dir)
+        clear_caches()
+
+    def get_parsers(self):
+        parsers = []
+        for run_dir in self.run_dirs:
+            project = os.path.basename(os.path.dirname(run_dir.rstrip('/')))
+            parser_class = get_parser_class(run_dir)
+            parsers.append(parser_class(project, run_dir, len(self.run_dirs), self.check_gdrive,
+                                        staging_dir=self.staging_dir, output_dir=self.upload_dir,
+                                        backup_dir=self.work_dir + 'Backup/', log_file_dir=self.log_file_dir,
+                                        run_tree_index=RunTreeIndex(run_dir)))
+        return parsers
+
+    def run_pipelines(self, stages, ignore_metadata_dirs=True):
+        for parser in self.get_parsers():
+            ParsePipeline(parser, stages=stages, ignore_metadata_dirs=ignore_metadata_dirs).run()
+
+    def get_server_parse(self):
+        return ServerParse(download_dir=self.upload_dir, output_dir=self.server_output_dir,
+                           data_directory=self.bioinfo_results_dir, log_file_dir=self.log_file_dir,
+                           upload_bioinfo_results_dir=self.bioinfo_results_dir, use_scan_cache=False)
+
+    def setup_case(self, case):
+        """
+         untimed preparation of a repeat: empty outputs, and for the server cases an Upload tree as rclone
+         would have synced it to the server
+        """
+        self.reset_outputs()
+        if case in (SERVER_CHECK_CASE, SERVER_MOVE_CASE):
+            self.run_pipelines(PARSE_STAGES, ignore_metadata_dirs=False)
+            clear_caches()
+
+    def run_case(self, case):
+        if case == DISCOVER_CASE:
+            self.run_pipelines((DISCOVER, VALIDATE))
+        elif case == COPY_METADATA_CASE:
+            self.run_pipelines((DISCOVER, VALIDATE, COPY_METADATA), ignore_metadata_dirs=False)
+        elif case == COPY_FASTQ_CASE:
+            self.run_pipelines((DISCOVER, VALIDATE, COPY_FASTQ, MANIFEST))
+        elif case == SERVER_CHECK_CASE:
+            self.get_server_parse().get_dirs(export_csv=True, complete_upload=True)
+        elif case == SERVER_MOVE_CASE:
+            self.get_server_parse().move_fastq_files()
+        elif case == DATASET_FILTER_CASE:
+            client = MyTardisClient(STUB_MYTARDIS_API_URL, cache_dir=None)
+            client.session = StubMyTardisSession(
+                [{'id': dataset_id, 'description': os.path.basename(run_dir.rstrip('/'))}
+                 for dataset_id, run_dir in enumerate(self.run_dirs, 1)])
+            client.get_objects('dataset', {'experiments__id': settings.MAINE_EDNA_EXPERIMENT_ID},
+                               fields=['id', 'description'])
+        else:
+            raise ValueError('unknown bench case ' + str(case))
+
+    def time_case(self, case, repeat=3):
+        """
+         seconds of each repeat of case, with the files and bytes copied by the last one
+        """
+        try:
+            seconds = []
+            metrics = get_metrics()
+            for _ in range(repeat):
+                self.setup_case(case)
+                metrics.reset()
+                start_time = time.perf_counter()
+                self.run_case(case)
+                seconds.append(time.perf_counter() - start_time)
+            metrics_dict = metrics.to_dict()
+            files_copied = sum(value for name, labels, value in metrics_dict['counters'] if name == FILES_COPIED)
+            bytes_copied = sum(value for name, labels, value in metrics_dict['counters'] if name == BYTES_COPIED)
+            result = {'case': case, 'runs': self.num_runs, 'repeat': repeat,
+                      'min_seconds': min(seconds), 'median_seconds': statistics.median(seconds),
+                      'max_seconds': max(seconds), 'files_copied': files_copied, 'bytes_copied': bytes_copied,
+                      'mb_per_second': bytes_copied / min(seconds) / 1048576 if bytes_copied else None}
+            api_logger.warning('[BENCH] ' + case + ' (' + str(self.num_runs) + ' runs): ' +
+                               str(round(result['median_seconds'], 3)) + 's median of ' + str(repeat))
+            return result
+        except Exception as err:
+            raise RuntimeError("** Error: ParserBench time_case Failed (" + str(err) + ")")
+
+
+def run_benchmarks(work_dir=None, run_counts=RUN_COUNTS, cases=CASES, repeat=3, num_generic_runs=0,
+                   num_fastq_files=24, fastq_size=1048576, num_thumbnails=1000, check_gdrive=True, keep=False,
+                   quiet=True):
+    """
+     time each case at each run count; returns a list of result dicts (see ParserBench.time_case).
+     work_dir: where the trees are generated (default: a temp dir, removed afterwards unless keep=True).
+     quiet: only log warnings while timing, so console logging doesn't dominate the numbers
+    """
+    unknown_cases = set(cases) - set(CASES)
+    if unknown_cases:
+        raise ValueError("unknown bench cases " + str(sorted(unknown_cases)))
+    # only a work dir created here is removed afterwards; a given work_dir only loses its runs_<N> dirs
+    is_temp_work_dir = work_dir is None
+    if is_temp_work_dir:
+        work_dir = tempfile.mkdtemp(prefix='mytd_parser_bench_')
+    api_logger_level = api_logger.level
+    gsheet_client = gsheets.gsheet_client
+    try:
+        if quiet:
+            api_logger.setLevel(logging.WARNING)
+        results = []
+        for num_runs in run_counts:
+            bench_dir = os.path.join(work_dir, 'runs_' + str(num_runs))
+            shutil.rmtree(bench_dir, ignore_errors=True)
+            bench = ParserBench(bench_dir, num_runs, min(num_generic_runs, num_runs), num_fastq_files, fastq_size,
+                                num_thumbnails, check_gdrive)
+            bench.generate()
+            # check_gdrive lookups read the stub worksheet through the process-wide client
+            gsheets.gsheet_client = StubGsheetClient(bench.worksheet)
+            for case in cases:
+                results.append(bench.time_case(case, repeat))
+            if not keep:
+                shutil.rmtree(bench_dir, ignore_errors=True)
+        return results
+    finally:
+        gsheets.gsheet_client = gsheet_client
+        gsheets.clear_gsheet_snapshots()
+        api_logger.setLevel(api_logger_level)
+        if is_temp_work_dir and not keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def format_results(results):
+    lines = ['case            runs  median_s     min_s     max_s   files       MB/s']
+    for result in results:
+        mb_per_second = result['mb_per_second']
+        lines.append(result['case'].ljust(14) + str(result['runs']).rjust(6) +
+                     ('%10.3f' % result['median_seconds']) + ('%10.3f' % result['min_seconds']) +
+                     ('%10.3f' % result['max_seconds']) + str(result['files_copied']).rjust(8) +
+                     ('%11.1f' % mb_per_second if mb_per_second is not None else '-'.rjust(11)))
+    return '\n'.join(lines)
+
+
+def write_results(results, output_json):
+    with open(output_json, 'w') as output_file:
+        json.dump(results, output_file, indent=1)
@@ -0,0 +1,322 @@
+"""
+copy_engine.py
+Copy files in the kernel where possible (reflink, copy_file_range, sendfile), and copy many files at once
+with a bounded thread pool
+Created By: mkimble
+"""
+
+import os
+import sys
+import errno
+import time
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from . import settings
+from .logger_settings import api_logger
+from .metrics import get_metrics, COPY_METHOD_FILES
+
+# linux/fs.h _IOW(0x94, 9, int): share the source file's extents with the destination (btrfs, XFS)
+FICLONE = 0x40049409
+# errors meaning "this copy method isn't supported here" (other filesystem, kernel or file type), so the next
+# method is tried; any other error is a real failure and is raised
+FALLBACK_ERRNOS = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.ENOTTY, errno.EOPNOTSUPP, errno.ENOTSUP}
+# checksums copy_files can compute while copying; xxh64 needs the optional xxhash package
+CHECKSUM_ALGORITHMS = ('md5', 'blake2b', 'xxh64')
+# how copy_files places a file in its output location
+LINK_MODES = ('copy', 'hardlink', 'symlink')
+# os.link errors that mean hardlinking isn't possible here (different volume, fs without hardlinks, link limit)
+HARDLINK_FALLBACK_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP, errno.ENOTSUP}
+
+
+class ShortCopyError(OSError):
+    """
+     a copy method wrote fewer bytes than the source's size, e.g., copy_file_range stopping early on FUSE/NFS;
+     the next method is tried
+    """
+    def __init__(self, method_name, num_bytes, size):
+        super().__init__(errno.EIO, method_name + ' copied ' + str(num_bytes) + ' of ' + str(size) + ' bytes')
+
+
+def clone_file(src_fd, dst_fd, size):
+    import fcntl
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+
+
+def copy_file_range_file(src_fd, dst_fd, size):
+    offset = 0
+    while offset < size:
+        copied = os.copy_file_range(src_fd, dst_fd, min(size - offset, 1073741824), offset, offset)
+        if copied == 0:
+            raise ShortCopyError('copy_file_range', offset, size)
+        offset += copied
+
+
+def sendfile_file(src_fd, dst_fd, size):
+    offset = 0
+    while offset < size:
+        sent = os.sendfile(dst_fd, src_fd, offset, min(size - offset, 1073741824))
+        if sent == 0:
+            raise ShortCopyError('sendfile', offset, size)
+        offset += sent
+
+
+def buffered_file(src_fd, dst_fd, size):
+    with open(src_fd, 'rb', closefd=False) as fsrc, open(dst_fd, 'wb', closefd=False) as fdst:
+        shutil.copyfileobj(fsrc, fdst, settings.COPY_BUFFER_SIZE)
+
+
+def get_copy_methods():
+    """
+     copy methods to try in order for this platform
+    """
+    copy_methods = []
+    if sys.platform.startswith('linux'):
+        copy_methods.append(('reflink', clone_file))
+    if hasattr(os, 'copy_file_range'):
+        copy_methods.append(('copy_file_range', copy_file_range_file))
+    if hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+        copy_methods.append(('sendfile', sendfile_file))
+    copy_methods.append(('buffered', buffered_file))
+    return copy_methods
+
+
+COPY_METHODS = get_copy_methods()
+
+
+def fast_copyfile(src, dst):
+    """
+     copy file contents from src to dst, trying FICLONE reflink, then os.copy_file_range, then sendfile, then a
+     buffered copy. A copy that leaves dst a different size than src raises ShortCopyError (after the
+     buffered copy, e.g., if src changed while being copied). Returns the name of the method used
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        src_fd = fsrc.fileno()
+        dst_fd = fdst.fileno()
+        size = os.fstat(src_fd).st_size
+        for method_name, copy_method in COPY_METHODS:
+            try:
+                copy_method(src_fd, dst_fd, size)
+                fdst.flush()
+                dst_size = os.fstat(dst_fd).st_size
+                if dst_size != size:
+                    raise ShortCopyError(method_name, dst_size, size)
+                metrics = get_metrics()
+                metrics.inc(COPY_METHOD_FILES, method=method_name)
+                metrics.record_copy(size)
+                return method_name
+            except OSError as err:
+                is_fallback = isinstance(err, ShortCopyError) or err.errno in FALLBACK_ERRNOS
+                if not is_fallback or method_name == 'buffered':
+                    raise
+                # throw away anything partially written before trying the next method
+                os.ftruncate(dst_fd, 0)
+                os.lseek(dst_fd, 0, os.SEEK_SET)
+
+
+def fast_copy2(src, dst):
+    """
+     drop-in for shutil.copy2 using fast_copyfile: dst may be a dir, and metadata is preserved with copystat
+    """
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    fast_copyfile(src, dst)
+    shutil.copystat(src, dst)
+    return dst
+
+
+def fast_copy_tree(src, dst):
+    """
+     drop-in for distutils.dir_util.copy_tree using fast_copy2: recursively copy src into dst, creating dst
+     and overwriting existing files. Returns the list of files copied
+    """
+    if not os.path.isdir(src):
+        raise RuntimeError("cannot copy tree '" + str(src) + "': not a directory")
+    os.makedirs(dst, exist_ok=True)
+    outputs = []
+    with os.scandir(src) as entries:
+        for entry in entries:
+            dst_path = os.path.join(dst, entry.name)
+            if entry.is_dir():
+                outputs.extend(fast_copy_tree(entry.path, dst_path))
+            else:
+                outputs.append(fast_copy2(entry.path, dst_path))
+    return outputs
+
+
+def fast_move(src, dst):
+    """
+     shutil.move; copies across volumes go through fast_copy2
+    """
+    return shutil.move(src, dst, copy_function=fast_copy2)
+
+
+def get_hashers(checksum_algorithms):
+    """
+     {algorithm: hash object} for 'md5', 'blake2b' or 'xxh64' (needs the optional xxhash package)
+    """
+    hashers = {}
+    for checksum_algorithm in checksum_algorithms:
+        if checksum_algorithm == 'xxh64':
+            import xxhash
+            hashers[checksum_algorithm] = xxhash.xxh64()
+        elif checksum_algorithm in CHECKSUM_ALGORITHMS:
+            hashers[checksum_algorithm] = hashlib.new(checksum_algorithm)
+        else:
+            raise ValueError('checksum algorithm must be one of ' + str(CHECKSUM_ALGORITHMS) + ', not ' +
+                             str(checksum_algorithm))
+    return hashers
+
+
+def checksum_file(file_path, checksum_algorithms):
+    """
+     {algorithm: hexdigest} of a file, read once for every algorithm
+    """
+    hashers = get_hashers(checksum_algorithms)
+    with open(file_path, 'rb') as fsrc:
+        while True:
+            chunk = fsrc.read(settings.COPY_BUFFER_SIZE)
+            if not chunk:
+                break
+            for hasher in hashers.values():
+                hasher.update(chunk)
+    return {checksum_algorithm: hasher.hexdigest() for checksum_algorithm, hasher in hashers.items()}
+
+
+def copy_file(input_file, output_file, link_mode='copy', checksum_algorithms=()):
+    """
+     place input_file at output_file through a temp file, so an interrupted copy is never mistaken for a
+     complete one by the os.path.exists checks.
+     link_mode: 'copy' (fast_copy2), 'hardlink' (falls back to copy across volumes) or 'symlink'.
+     checksum_algorithms: hash output_file once it is placed; the copy itself still goes through the kernel
+     Returns bytes copied (0 for links), and file_info {'size': bytes, 'mtime_ns': ns, algorithm: hexdigest}
+     of output_file
+    """
+    tmp_output_file = output_file + '.part'
+    if os.path.lexists(tmp_output_file):
+        os.remove(tmp_output_file)
+    bytes_copied = 0
+    is_placed = False
+    if link_mode == 'hardlink':
+        try:
+            os.link(input_file, tmp_output_file)
+            get_metrics().inc(COPY_METHOD_FILES, method='hardlink')
+            is_placed = True
+        except OSError as err:
+            if err.errno not in HARDLINK_FALLBACK_ERRNOS:
+                raise
+    elif link_mode == 'symlink':
+        os.symlink(os.path.abspath(input_file), tmp_output_file)
+        get_metrics().inc(COPY_METHOD_FILES, method='symlink')
+        is_placed = True
+    if not is_placed:
+        fast_copy2(input_file, tmp_output_file)
+        bytes_copied = os.stat(tmp_output_file).st_size
+    os.replace(tmp_output_file, output_file)
+    return bytes_copied, get_file_info(output_file, checksum_algorithms)
+
+
+def get_stat_info(file_path):
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def get_file_info(file_path, checksum_algorithms=(), known_file_info=None):
+    """
+     {'size': bytes, 'mtime_ns': ns, algorithm: hexdigest} of file_path (a symlink is followed). The checksums
+     of known_file_info (e.g., from the run catalog) are reused if its size and mtime_ns still match the file;
+     otherwise the file is hashed
+    """
+    file_info = get_stat_info(file_path)
+    if checksum_algorithms:
+        if (known_file_info is not None and known_file_info.get('size') == file_info['size'] and
+                known_file_info.get('mtime_ns') == file_info['mtime_ns'] and
+                all(known_file_info.get(checksum_algorithm) for checksum_algorithm in checksum_algorithms)):
+            file_info.update({checksum_algorithm: known_file_info[checksum_algorithm]
+                              for checksum_algorithm in checksum_algorithms})
+        else:
+            file_info.update(checksum_file(file_path, checksum_algorithms))
+    return file_info
+
+
+def materialize_links(directory):
+    """
+     replace every symlink under directory with a copy of the file it points to, so the tree no longer
+     depends on the original files (e.g., before Staging is moved to Backup). Returns number of files replaced
+    """
+    try:
+        num_replaced = 0
+        for dir_path, dir_names, file_names in os.walk(directory):
+            for file_name in file_names:
+                file_path = os.path.join(dir_path, file_name)
+                if not os.path.islink(file_path):
+                    continue
+                target_path = os.path.realpath(file_path)
+                if not os.path.isfile(target_path):
+                    raise RuntimeError('broken symlink [' + file_path + '] -> [' + target_path + ']')
+                tmp_file_path = file_path + '.part'
+                fast_copy2(target_path, tmp_file_path)
+                os.replace(tmp_file_path, file_path)
+                num_replaced += 1
+        if num_replaced:
+            api_logger.info('materialize_links: replaced ' + str(num_replaced) + ' symlinks [' + directory + ']')
+        return num_replaced
+    except Exception as err:
+        raise RuntimeError("** Error: materialize_links Failed (" + str(err) + ")")
+
+
+def copy_files(copy_list, max_workers=settings.COPY_MAX_WORKERS, overwrite=False, link_mode='copy',
+               checksum_algorithms=(), known_file_infos=None):
+    """
+     copy (input_file, output_file) pairs with a bounded thread pool.
+     Files that already exist are skipped unless overwrite=True. Errors are collected per file instead of
+     stopping the other copies.
+     link_mode: 'copy', 'hardlink' or 'symlink'; see copy_file
+     checksum_algorithms: e.g., ['md5']; each output file is hashed after its (kernel) copy. Output files
+     that already exist reuse their known_file_infos {input_file: {'size', 'mtime_ns', algorithm: hexdigest}}
+     entry (see get_file_info), and are only hashed if it is missing or the file has changed since
+     returns file_count, bytes_copied, elapsed_time, errors [(input_file, error)],
+     file_infos {input_file: {'size': bytes, 'mtime_ns': ns, algorithm: hexdigest}} of the output files
+    """
+    try:
+        if link_mode not in LINK_MODES:
+            raise ValueError('link_mode must be one of ' + str(LINK_MODES) + ', not ' + str(link_mode))
+        start_time = time.perf_counter()
+        file_count = 0
+        bytes_copied = 0
+        errors = []
+        file_infos = {}
+        if known_file_infos is None:
+            known_file_infos = {}
+        if copy_list:
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(copy_list)))) as executor:
+                futures = []
+                for input_file, output_file in copy_list:
+                    if not overwrite and os.path.exists(output_file):
+                        # record the file already in the output location, not the input it was copied from
+                        futures.append((input_file, False,
+                                        executor.submit(get_file_info, output_file, checksum_algorithms,
+                                                        known_file_infos.get(input_file))))
+                    else:
+                        futures.append((input_file, True, executor.submit(copy_file, input_file, output_file,
+                                                                          link_mode, checksum_algorithms)))
+                for input_file, is_copied, future in futures:
+                    try:
+                        if is_copied:
+                            file_bytes_copied, file_infos[input_file] = future.result()
+                            bytes_copied += file_bytes_copied
+                            file_count += 1
+                        else:
+                            file_infos[input_file] = future.result()
+                    except Exception as err:
+                        errors.append((input_file, str(err)))
+        elapsed_time = time.perf_counter() - start_time
+        if bytes_copied and elapsed_time > 0:
+            api_logger.info('copy_files: ' + str(file_count) + ' files, ' + str(bytes_copied) + ' bytes in ' +
+                            str(round(elapsed_time, 2)) + 's (' +
+                            str(round(bytes_copied / elapsed_time / 1048576, 2)) + ' MB/s)')
+        for input_file, error in errors:
+            api_logger.error('[COPY FAILED] %s (%s)', input_file, error)
+        return file_count, bytes_copied, elapsed_time, errors, file_infos
+    except Exception as err:
+        raise RuntimeError("** Error: copy_files Failed (" + str(err) + ")")
@@ -0,0 +1,133 @@
+"""
+fastq_archive.py
+Parquet archive of the fastq filelists written by parse_fastq_files, partitioned by project and run_id
+Created By: mkimble
+"""
+
+import os
+import glob
+from datetime import datetime
+import pandas as pd
+from . import settings
+from .logger_settings import api_logger
+
+# columns that are partition dirs rather than stored in the parquet files
+PARTITION_COLUMNS = ['project', 'run_id']
+# rows are unique on these; the newest archived row wins
+KEY_COLUMNS = ['run_id', 'fastq_path']
+
+
+def get_pyarrow():
+    """
+     pyarrow is optional; returns (None, None, None) so callers can fall back to the timestamped csv files
+    """
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet
+        return pyarrow, pyarrow.dataset, pyarrow.parquet
+    except ImportError as err:
+        api_logger.info('[FASTQ ARCHIVE] pyarrow unavailable, writing csv instead (' + str(err) + ')')
+        return None, None, None
+
+
+class FastqArchive:
+    """
+     append-only store of fastq records: archive_dir/project=<project>/run_id=<run_id>/part-<date>.parquet.
+     Every parse pass appends a part file; reads drop duplicate (run_id, fastq_path) rows, keeping the newest.
+     A run partition with more than max_parts part files is compacted into one.
+    """
+    def __init__(self, archive_dir=settings.LOG_FILE_DIR + settings.FASTQ_ARCHIVE_DIRNAME,
+                 max_parts=settings.FASTQ_ARCHIVE_MAX_PARTS):
+        self.archive_dir = archive_dir
+        self.max_parts = max_parts
+        self.pa, self.ds, self.pq = get_pyarrow()
+
+    def is_available(self):
+        return self.pa is not None
+
+    def get_partition_dir(self, project, run_id):
+        return os.path.join(self.archive_dir, 'project=' + str(project), 'run_id=' + str(run_id))
+
+    def get_partitioning(self):
+        # partition values are always strings; a numeric looking run_id must not be read back as an int
+        return self.ds.partitioning(self.pa.schema([('project', self.pa.string()), ('run_id', self.pa.string())]),
+                                    flavor='hive')
+
+    def append(self, project, run_id, fastq_df):
+        """
+         append the fastq records of one fastq dir to the run's partition.
+         returns False without writing anything if pyarrow is not installed
+        """
+        try:
+            if not self.is_available():
+                return False
+            partition_dir = self.get_partition_dir(project, run_id)
+            if not os.path.exists(partition_dir):
+                os.makedirs(partition_dir)
+            archive_date = datetime.now()
+            archive_df = fastq_df.drop(columns=[column for column in PARTITION_COLUMNS if column in fastq_df.columns])
+            archive_df = archive_df.assign(archive_date=archive_date.strftime('%Y-%m-%d %H:%M:%S.%f'))
+            table = self.pa.Table.from_pandas(archive_df, preserve_index=False)
+            part_filename = archive_date.strftime('part-%Y%m%d_%H%M%S_%f') + '-' + str(os.getpid()) + '.parquet'
+            # write to a temp name so readers never pick up a half-written part
+            tmp_part_filepath = os.path.join(partition_dir, '.' + part_filename + '.tmp')
+            self.pq.write_table(table, tmp_part_filepath)
+            os.replace(tmp_part_filepath, os.path.join(partition_dir, part_filename))
+            api_logger.info('[FASTQ ARCHIVE] appended ' + str(len(archive_df)) + ' fastq files: ' + str(project) +
+                            ', ' + str(run_id))
+            if len(glob.glob(os.path.join(partition_dir, 'part-*.parquet'))) > self.max_parts:
+                self.compact(project, run_id)
+            return True
+        except Exception as err:
+            raise RuntimeError("** Error: FastqArchive append Failed (" + str(err) + ")")
+
+    def compact(self, project, run_id):
+        """
+         rewrite a run partition as a single deduplicated part file
+        """
+        try:
+            partition_dir = self.get_partition_dir(project, run_id)
+            part_filepaths = glob.glob(os.path.join(partition_dir, 'part-*.parquet'))
+            if len(part_filepaths) < 2:
+                return
+            fastq_df = self.read(project=project, run_id=run_id)
+            fastq_df = fastq_df.drop(columns=PARTITION_COLUMNS)
+            part_filename = datetime.now().strftime('part-%Y%m%d_%H%M%S_%f') + '-compact.parquet'
+            tmp_part_filepath = os.path.join(partition_dir, '.' + part_filename + '.tmp')
+            self.pq.write_table(self.pa.Table.from_pandas(fastq_df, preserve_index=False), tmp_part_filepath)
+            os.replace(tmp_part_filepath, os.path.join(partition_dir, part_filename))
+            for part_filepath in part_filepaths:
+                os.remove(part_filepath)
+            api_logger.info('[FASTQ ARCHIVE] compacted ' + str(len(part_filepaths)) + ' parts: ' + str(project) +
+                            ', ' + str(run_id))
+        except Exception as err:
+            raise RuntimeError("** Error: FastqArchive compact Failed (" + str(err) + ")")
+
+    def read(self, project=None, run_id=None, columns=None):
+        """
+         deduplicated fastq records as a df, optionally only for one project and/or run_id.
+         columns: only read these columns (the key and archive_date columns are always read)
+         e.g., FastqArchive().read(project='maine-edna', columns=['sample_id', 'size'])
+        """
+        try:
+            if not self.is_available():
+                raise RuntimeError('pyarrow is not installed')
+            if not os.path.exists(self.archive_dir):
+                return pd.DataFrame(columns=PARTITION_COLUMNS)
+            dataset = self.ds.dataset(self.archive_dir, format='parquet', partitioning=self.get_partitioning())
+            filter_expression = None
+            for column, value in (('project', project), ('run_id', run_id)):
+                if value is not None:
+                    expression = self.ds.field(column) == str(value)
+                    filter_expression = expression if filter_expression is None else filter_expression & expression
+            if columns is not None:
+                columns = list(dict.fromkeys(PARTITION_COLUMNS + KEY_COLUMNS + ['archive_date'] + list(columns)))
+            fastq_df = dataset.to_table(columns=columns, filter=filter_expression).to_pandas()
+            if fastq_df.empty:
+                return fastq_df
+            fastq_df = fastq_df.sort_values('archive_date', kind='mergesort')
+            fastq_df = fastq_df.drop_duplicates(subset=KEY_COLUMNS, keep='last')
+            return fastq_df.reset_index(drop=True)
+        except Exception as err:
+            raise RuntimeError("** Error: FastqArchive read Failed (" + str(err) + ")")
@@ -0,0 +1,264 @@
+"""
+gsheets.py
+Google Sheets access shared by the parsers: one lazily authorized worksheet handle per process, a run index
+built from one get_all_values() fetch shared by every check_gdrive lookup until it expires, and a buffered
+status writer that sends its updates in one batch_update
+Created By: mkimble
+"""
+
+import time
+import threading
+import gspread
+from gspread.utils import rowcol_to_a1
+from oauth2client.service_account import ServiceAccountCredentials
+from . import settings
+from .logger_settings import api_logger
+from .metrics import get_metrics
+
+GSHEETS_SCOPE = ["https://spreadsheets.google.com/feeds", 'https://www.googleapis.com/auth/spreadsheets',
+                 "https://www.googleapis.com/auth/drive.file", "https://www.googleapis.com/auth/drive"]
+
+# header of the column set to "COMPLETE" once a run's fastq files are moved on the server
+GSHEETS_PARSE_STATUS_COLUMN = "SERVER_PARSE_COMPLETE"
+
+# process-wide GsheetClient, created on first use
+gsheet_client = None
+gsheet_client_lock = threading.Lock()
+# {worksheet key: GsheetSnapshot}; shared by every stage and run dir in the process
+gsheet_snapshots = {}
+gsheet_snapshots_lock = threading.Lock()
+
+
+class GsheetClient:
+    """
+     gspread client and worksheet, authorized on first use and again once the authorization is older than
+     refresh_seconds, so a long running watch never works with an expired access token
+    """
+    def __init__(self, private_key=settings.GDRIVE_PRIVATE_KEY, spreadsheet_url=settings.GSHEETS_SPREADSHEET_URL,
+                 worksheet_name=settings.GSHEETS_WORKSHEET_NAME,
+                 refresh_seconds=settings.GSHEETS_CLIENT_REFRESH_SECONDS):
+        self.private_key = private_key
+        self.spreadsheet_url = spreadsheet_url
+        self.worksheet_name = worksheet_name
+        self.refresh_seconds = refresh_seconds
+        self.worksheet = None
+        self.auth_time = None
+
+    def is_expired(self, now=None):
+        if self.auth_time is None:
+            return True
+        if now is None:
+            now = time.time()
+        return now - self.auth_time >= self.refresh_seconds
+
+    def authorize(self):
+        try:
+            # JSON API file from google drive API
+            with get_metrics().api_request('gsheets', 'authorize'):
+                credentials = ServiceAccountCredentials.from_json_keyfile_name(self.private_key, GSHEETS_SCOPE)
+                gc = gspread.authorize(credentials)
+                spreadsheet = gc.open_by_url(self.spreadsheet_url)
+                self.worksheet = spreadsheet.worksheet(self.worksheet_name)
+            self.auth_time = time.time()
+            api_logger.info('[GSHEETS] authorized [' + str(self.worksheet_name) + ']')
+        except Exception as err:
+            raise RuntimeError("** Error: GsheetClient authorize Failed (" + str(err) + ")")
+
+    def get_worksheet(self):
+        if self.is_expired():
+            self.authorize()
+        return self.worksheet
+
+
+def get_gsheet_worksheet():
+    """
+     worksheet of the process-wide GsheetClient; nothing is authorized until the first call
+    """
+    global gsheet_client
+    with gsheet_client_lock:
+        if gsheet_client is None:
+            gsheet_client = GsheetClient()
+        return gsheet_client.get_worksheet()
+
+
+def get_worksheet_key(worksheet):
+    spreadsheet = getattr(worksheet, 'spreadsheet', None)
+    return getattr(spreadsheet, 'id', None), getattr(worksheet, 'id', id(worksheet))
+
+
+class GsheetSnapshot:
+    """
+     all values of a worksheet, indexed by cell value. lookups match worksheet.find(): the first cell with the
+     value, searching row by row
+    """
+    def __init__(self, worksheet, ttl_seconds=settings.GSHEETS_SNAPSHOT_TTL_SECONDS):
+        self.worksheet = worksheet
+        self.ttl_seconds = ttl_seconds
+        self.values = []
+        # {cell value: (row, col)}, 0-based
+        self.cell_index = {}
+        self.fetch_time = None
+
+    def is_expired(self, now=None):
+        if self.fetch_time is None:
+            return True
+        if now is None:
+            now = time.time()
+        return now - self.fetch_time >= self.ttl_seconds
+
+    def refresh(self):
+        try:
+            with get_metrics().api_request('gsheets', 'get_all_values'):
+                self.values = self.worksheet.get_all_values()
+            cell_index = {}
+            for row_num, row in enumerate(self.values):
+                for col_num, value in enumerate(row):
+                    if value not in cell_index:
+                        cell_index[value] = (row_num, col_num)
+            self.cell_index = cell_index
+            self.fetch_time = time.time()
+            api_logger.info('[GSHEETS] fetched ' + str(len(self.values)) + ' rows')
+        except Exception as err:
+            raise RuntimeError("** Error: GsheetSnapshot refresh Failed (" + str(err) + ")")
+
+    def find(self, value):
+        """
+         (row, col) of the first cell with value, 0-based; None if no cell matches
+        """
+        return self.cell_index.get(value)
+
+    def get_value(self, row_value, header):
+        """
+         value in the row of the first cell matching row_value (e.g., a run id) and the column of header.
+         None if either is not in the sheet
+        """
+        row_cell = self.find(row_value)
+        header_cell = self.find(header)
+        if row_cell is None or header_cell is None:
+            return None
+        return self.get_cell_value(row_cell[0], header_cell[1])
+
+    def set_value(self, row_num, col_num, value):
+        """
+         keep the snapshot in step with a cell written to the sheet; row_num, col_num are 0-based
+        """
+        while len(self.values) <= row_num:
+            self.values.append([])
+        row = self.values[row_num]
+        while len(row) <= col_num:
+            row.append('')
+        old_value = row[col_num]
+        row[col_num] = value
+        cell = (row_num, col_num)
+        if old_value != value and self.cell_index.get(old_value) == cell:
+            # the old value's first cell is gone; find its next one, if any
+            del self.cell_index[old_value]
+            next_cell = self.find_after(old_value, cell)
+            if next_cell is not None:
+                self.cell_index[old_value] = next_cell
+        first_cell = self.cell_index.get(value)
+        if first_cell is None or cell < first_cell:
+            self.cell_index[value] = cell
+
+    def find_after(self, value, cell):
+        """
+         (row, col) of the first cell with value after cell, searching row by row; None if there is none
+        """
+        for row_num in range(cell[0], len(self.values)):
+            row = self.values[row_num]
+            start_col = cell[1] + 1 if row_num == cell[0] else 0
+            for col_num in range(start_col, len(row)):
+                if row[col_num] == value:
+                    return row_num, col_num
+        return None
+
+    def get_cell_value(self, row_num, col_num):
+        """
+         value of a cell, 0-based; '' for cells past the end of the fetched values
+        """
+        if row_num >= len(self.values) or col_num >= len(self.values[row_num]):
+            return ''
+        return self.values[row_num][col_num]
+
+
+def get_gsheet_snapshot(worksheet, ttl_seconds=settings.GSHEETS_SNAPSHOT_TTL_SECONDS):
+    """
+     process-wide snapshot of worksheet, fetched again once it is older than ttl_seconds
+    """
+    with gsheet_snapshots_lock:
+        worksheet_key = get_worksheet_key(worksheet)
+        snapshot = gsheet_snapshots.get(worksheet_key)
+        if snapshot is None:
+            snapshot = GsheetSnapshot(worksheet, ttl_seconds)
+            gsheet_snapshots[worksheet_key] = snapshot
+        # a re-authorized client hands out a new handle for the same worksheet
+        snapshot.worksheet = worksheet
+        if snapshot.is_expired():
+            snapshot.refresh()
+        return snapshot
+
+
+def clear_gsheet_snapshots():
+    """
+     drop every snapshot, e.g., after writing to the sheet
+    """
+    with gsheet_snapshots_lock:
+        gsheet_snapshots.clear()
+
+
+class GsheetStatusWriter:
+    """
+     buffer of (run_id, column, value) cell updates, resolved against the shared snapshot and written in one
+     batch_update by flush() or when max_updates are buffered. A later update of the same cell replaces
+     the buffered one, and cells the snapshot already shows with the value are not written again (e.g., the
+     COMPLETE of a run that every server parse moves again). worksheet=None uses the process-wide worksheet
+    """
+    def __init__(self, worksheet=None, max_updates=settings.GSHEETS_STATUS_BATCH_SIZE):
+        self.worksheet = worksheet
+        self.max_updates = max_updates
+        # {(run_id, column): value}
+        self.updates = {}
+
+    def add(self, run_id, column, value):
+        self.updates[(run_id, column)] = value
+        if len(self.updates) >= self.max_updates:
+            self.flush()
+
+    def flush(self):
+        """
+         write the buffered updates; returns the number of cells written. Updates whose run_id or column
+         is not in the sheet are logged and dropped; on a failed write they stay buffered for the next flush
+        """
+        try:
+            if not self.updates:
+                return 0
+            worksheet = self.worksheet
+            if worksheet is None:
+                worksheet = get_gsheet_worksheet()
+            snapshot = get_gsheet_snapshot(worksheet)
+            data = []
+            cells = []
+            num_unchanged = 0
+            for (run_id, column), value in self.updates.items():
+                row_cell = snapshot.find(run_id)
+                col_cell = snapshot.find(column)
+                if row_cell is None or col_cell is None:
+                    api_logger.info('[GSHEETS] [NO GDRIVE LOOKUP MATCH] not updated: ' + str(run_id) + ', ' +
+                                    str(column))
+                    continue
+                if snapshot.get_cell_value(row_cell[0], col_cell[1]) == value:
+                    num_unchanged += 1
+                    continue
+                data.append({'range': rowcol_to_a1(row_cell[0] + 1, col_cell[1] + 1), 'values': [[value]]})
+                cells.append((row_cell[0], col_cell[1], value))
+            if data:
+                with get_metrics().api_request('gsheets', 'batch_update'):
+                    worksheet.batch_update(data)
+                for row_num, col_num, value in cells:
+                    snapshot.set_value(row_num, col_num, value)
+            self.updates = {}
+            api_logger.info('[GSHEETS] batch updated ' + str(len(data)) + ' cells, ' + str(num_unchanged) +
+                            ' already set')
+            return len(data)
+        except Exception as err:
+            raise RuntimeError("** Error: GsheetStatusWriter flush Failed (" + str(err) + ")")
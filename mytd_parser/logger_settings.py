@@ -7,8 +7,15 @@ LAST MODIFIED: 08/31/2021
 
 import sys
 import os
+import json
+import queue
+import atexit
 import logging
+import itertools
+import threading
+import multiprocessing
 from logging.config import dictConfig
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime
 
 from . import settings
@@ -16,6 +23,42 @@ from . import settings
 if not os.path.exists(settings.LOG_FILE_DIR):
     os.makedirs(settings.LOG_FILE_DIR)
 
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+     one JSON object per record, e.g., for loading the log into a df with pd.read_json(lines=True)
+    """
+    def format(self, record):
+        log_entry = {'time': self.formatTime(record, self.datefmt),
+                     'level': record.levelname,
+                     'name': record.name,
+                     'module': record.module,
+                     'line': record.lineno,
+                     'process': record.process,
+                     'message': record.getMessage()}
+        if record.exc_info:
+            log_entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(log_entry, default=str)
+
+
+class DebugSampleFilter(logging.Filter):
+    """
+     passes every record at INFO and above, and 1 of every sample_every DEBUG records
+    """
+    def __init__(self, sample_every=1):
+        super().__init__()
+        self.sample_every = max(int(sample_every), 1)
+        self.counter = itertools.count()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.sample_every == 1:
+            return True
+        return next(self.counter) % self.sample_every == 0
+
+
+# the sampling filter is only attached when it drops records
+debug_sample_filters = ['debug-sample'] if settings.LOG_DEBUG_SAMPLE_EVERY > 1 else []
+
 logging_config = dict(
     version=1,
     formatters={
@@ -27,10 +70,20 @@ logging_config = dict(
         'simple': {
             'format': '%(levelname)s %(message)s',
         },
+        'json': {
+            '()': JsonLinesFormatter,
+            'datefmt': "%Y-%m-%dT%H:%M:%S",
+        },
+    },
+    filters={
+        'debug-sample': {
+            '()': DebugSampleFilter,
+            'sample_every': settings.LOG_DEBUG_SAMPLE_EVERY,
+        },
     },
     handlers={
         'api-logger': {'class': 'logging.handlers.RotatingFileHandler',
-                           'formatter': 'verbose',
+                           'formatter': 'json' if settings.LOG_JSON else 'verbose',
                            'level': logging.DEBUG,
                            # 'filename': datetime.now().strftime(settings.LOG_FILE_DIR+'logfile_%Y%m%d.log'),
                            'filename': settings.LOG_FILE_DIR+'logfile.log',
@@ -52,11 +105,13 @@ logging_config = dict(
     loggers={
         'api_logger': {
             'handlers': ['api-logger', 'console'],
-            'level': logging.DEBUG
+            'filters': debug_sample_filters,
+            'level': settings.LOG_LEVEL
         },
         'batch_process_logger': {
             'handlers': ['batch-process-logger', 'console'],
-            'level': logging.DEBUG
+            'filters': debug_sample_filters,
+            'level': settings.LOG_LEVEL
         }
     }
 )
@@ -65,3 +120,106 @@ dictConfig(logging_config)
 
 api_logger = logging.getLogger('api_logger')
 batch_process_logger = logging.getLogger('batch_process_logger')
+
+# {logger name: (QueueHandler, QueueListener)} when LOG_ASYNC is set
+queue_listeners = {}
+queue_listeners_lock = threading.Lock()
+async_logging_started = False
+
+
+def start_queue_listeners(logger_names=('api_logger', 'batch_process_logger')):
+    """
+     move the handlers of each logger behind a QueueHandler: the caller only puts the record on a queue, a
+     QueueListener thread formats and writes it to the file and console handlers
+    """
+    with queue_listeners_lock:
+        for logger_name in logger_names:
+            logger = logging.getLogger(logger_name)
+            if logger_name in queue_listeners:
+                queue_handler, queue_listener = queue_listeners[logger_name]
+                handlers = queue_listener.handlers
+            else:
+                handlers = [handler for handler in logger.handlers if not isinstance(handler, QueueHandler)]
+                queue_handler = QueueHandler(queue.SimpleQueue())
+                for handler in handlers:
+                    logger.removeHandler(handler)
+                logger.addHandler(queue_handler)
+            # a new queue and thread, e.g., in a forked process pool worker where the parent's thread doesn't run
+            queue_handler.queue = queue.SimpleQueue()
+            queue_listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+            queue_listener.start()
+            queue_listeners[logger_name] = (queue_handler, queue_listener)
+
+
+def stop_queue_listeners():
+    """
+     write out every queued record and stop the listener threads
+    """
+    with queue_listeners_lock:
+        for queue_handler, queue_listener in queue_listeners.values():
+            if queue_listener._thread is not None:
+                queue_listener.stop()
+
+
+class LoggerDispatchHandler(logging.Handler):
+    """
+     hands a record logged in another process to the handlers of the logger of the same name in this process.
+     The record was already filtered (e.g., debug sampling) where it was logged
+    """
+    def emit(self, record):
+        for handler in logging.getLogger(record.name).handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+def start_process_log_listener():
+    """
+     queue for the log records of process pool workers (see log_to_process_queue) and the started
+     QueueListener that writes them through this process's handlers, so only one process writes (and rolls
+     over) logfile.log and batch.log. Stop the listener once the pool has shut down
+    """
+    log_queue = multiprocessing.Queue()
+    log_listener = QueueListener(log_queue, LoggerDispatchHandler())
+    log_listener.start()
+    return log_queue, log_listener
+
+
+def log_to_process_queue(log_queue, logger_names=('api_logger', 'batch_process_logger')):
+    """
+     in a process pool worker: replace the handlers of each logger (and any queue listener threads) with a
+     QueueHandler onto log_queue from start_process_log_listener. The file handlers are closed so the
+     worker holds no handle on the log files
+    """
+    with queue_listeners_lock:
+        for queue_handler, queue_listener in queue_listeners.values():
+            if queue_listener._thread is not None:
+                queue_listener.stop()
+            for handler in queue_listener.handlers:
+                handler.close()
+        queue_listeners.clear()
+    for logger_name in logger_names:
+        logger = logging.getLogger(logger_name)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+            handler.close()
+        logger.addHandler(QueueHandler(log_queue))
+
+
+def start_async_logging():
+    """
+     with LOG_ASYNC set, start the queue listener threads, stop them (writing out queued records) at exit and
+     start them again in forked children. Called by the entry points (python -m mytd_parser, run_*.py), so
+     importing the package starts no threads
+    """
+    global async_logging_started
+    if not settings.LOG_ASYNC:
+        return False
+    with queue_listeners_lock:
+        if async_logging_started:
+            return True
+        async_logging_started = True
+    start_queue_listeners()
+    atexit.register(stop_queue_listeners)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=start_queue_listeners)
+    return True
@@ -0,0 +1,358 @@
+"""
+metrics.py
+Counters, histograms and stage timers for parse runs, written as a JSON summary per run and as a node_exporter
+textfile (Prometheus text format) so time per stage, copy throughput and API latency can be tracked across runs
+Created By: mkimble
+"""
+
+import os
+import json
+import time
+import bisect
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+from . import settings
+from .logger_settings import api_logger
+
+METRIC_PREFIX = 'mytd_parser_'
+# metric names, without METRIC_PREFIX
+STAGE_SECONDS = 'stage_duration_seconds'
+OPERATION_SECONDS = 'operation_duration_seconds'
+API_REQUEST_SECONDS = 'api_request_duration_seconds'
+API_REQUESTS = 'api_requests_total'
+FILES_COPIED = 'files_copied_total'
+BYTES_COPIED = 'bytes_copied_total'
+COPY_METHOD_FILES = 'copy_method_files_total'
+RUNS = 'runs_total'
+FASTQ_DIRS = 'fastq_dirs_total'
+METRIC_HELP = {
+    STAGE_SECONDS: 'Seconds spent in each parse stage',
+    OPERATION_SECONDS: 'Seconds spent in operations inside a stage (xml_parse, mydata_upload, ...)',
+    API_REQUEST_SECONDS: 'Seconds per MyTardis, Google Sheets or MyData request',
+    API_REQUESTS: 'MyTardis, Google Sheets and MyData requests by status',
+    FILES_COPIED: 'Files copied, by the stage that copied them',
+    BYTES_COPIED: 'Bytes copied, by the stage that copied them',
+    COPY_METHOD_FILES: 'Files placed by copy_engine, by method (reflink, copy_file_range, sendfile, buffered, hardlink, '
+                       'symlink)',
+    RUNS: 'Run dirs by outcome (parsed, unchanged, failed, scanned)',
+    FASTQ_DIRS: 'Fastq dirs by outcome (valid, not_ready, moved)',
+}
+# stage label of work done outside a stage
+NO_STAGE = 'none'
+
+
+def get_labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def escape_label_value(value):
+    # backslash, double quote and line feed are the escapes of the Prometheus text format
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels_key, extra_labels=()):
+    labels = list(labels_key) + list(extra_labels)
+    if not labels:
+        return ''
+    return '{' + ','.join(name + '="' + escape_label_value(value) + '"' for name, value in labels) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """
+     cumulative counts of observations per bucket upper bound, with their count and sum
+    """
+    def __init__(self, buckets=settings.METRICS_HISTOGRAM_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.bucket_counts):
+            self.bucket_counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def get_cumulative_counts(self):
+        cumulative_counts = []
+        total = 0
+        for bucket_count in self.bucket_counts:
+            total += bucket_count
+            cumulative_counts.append(total)
+        return cumulative_counts
+
+    def to_dict(self):
+        return {'count': self.count, 'sum': self.sum, 'buckets': list(self.buckets),
+                'bucket_counts': list(self.bucket_counts)}
+
+    def merge(self, histogram_dict):
+        if tuple(histogram_dict['buckets']) != self.buckets:
+            # observations can't be rebucketed; keep count and sum only
+            self.count += histogram_dict['count']
+            self.sum += histogram_dict['sum']
+            return
+        for index, bucket_count in enumerate(histogram_dict['bucket_counts']):
+            self.bucket_counts[index] += bucket_count
+        self.count += histogram_dict['count']
+        self.sum += histogram_dict['sum']
+
+
+class Metrics:
+    """
+     process-wide store of counters {name: {labels: value}} and histograms {name: {labels: Histogram}}.
+     stage(name) times a stage and labels the files and bytes copied inside it; the current stage is shared
+     by every thread of the process, so copy_files' worker threads count towards the stage that started them.
+     Nothing is recorded when enabled is False
+    """
+    def __init__(self, enabled=settings.METRICS_ENABLED):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.current_stage = NO_STAGE
+        self.start_time = time.time()
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+            self.current_stage = NO_STAGE
+            self.start_time = time.time()
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        labels_key = get_labels_key(labels)
+        with self.lock:
+            name_counters = self.counters.setdefault(name, {})
+            name_counters[labels_key] = name_counters.get(labels_key, 0) + value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        labels_key = get_labels_key(labels)
+        with self.lock:
+            name_histograms = self.histograms.setdefault(name, {})
+            histogram = name_histograms.get(labels_key)
+            if histogram is None:
+                histogram = Histogram()
+                name_histograms[labels_key] = histogram
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+         observe the seconds spent in the with block, e.g., with metrics.timer(OPERATION_SECONDS, operation='x')
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start_time, **labels)
+
+    @contextmanager
+    def stage(self, stage):
+        """
+         time a stage and attribute the copies made inside it to the stage
+        """
+        previous_stage = self.current_stage
+        self.current_stage = stage
+        try:
+            with self.timer(STAGE_SECONDS, stage=stage):
+                yield
+        finally:
+            self.current_stage = previous_stage
+
+    def record_copy(self, num_bytes):
+        """
+         one file copied by copy_engine, counted towards the current stage
+        """
+        if not self.enabled:
+            return
+        stage = self.current_stage
+        self.inc(FILES_COPIED, stage=stage)
+        self.inc(BYTES_COPIED, num_bytes, stage=stage)
+
+    def record_api_request(self, api, operation, seconds, status):
+        self.observe(API_REQUEST_SECONDS, seconds, api=api, operation=operation)
+        self.inc(API_REQUESTS, api=api, operation=operation, status=str(status))
+
+    @contextmanager
+    def api_request(self, api, operation):
+        """
+         time a request made in the with block; status is 'ok', or 'error' if the block raised
+        """
+        start_time = time.perf_counter()
+        status = 'error'
+        try:
+            yield
+            status = 'ok'
+        finally:
+            self.record_api_request(api, operation, time.perf_counter() - start_time, status)
+
+    def to_dict(self):
+        """
+         counters and histograms as plain lists, e.g., to send a worker's metrics back to the parent process
+        """
+        with self.lock:
+            return {'counters': [[name, list(labels_key), value]
+                                 for name, name_counters in self.counters.items()
+                                 for labels_key, value in name_counters.items()],
+                    'histograms': [[name, list(labels_key), histogram.to_dict()]
+                                   for name, name_histograms in self.histograms.items()
+                                   for labels_key, histogram in name_histograms.items()]}
+
+    def merge(self, metrics_dict):
+        """
+         add the counters and histograms of to_dict() output, e.g., from a process pool worker
+        """
+        if not self.enabled or not metrics_dict:
+            return
+        with self.lock:
+            for name, labels_key, value in metrics_dict['counters']:
+                labels_key = tuple(tuple(label) for label in labels_key)
+                name_counters = self.counters.setdefault(name, {})
+                name_counters[labels_key] = name_counters.get(labels_key, 0) + value
+            for name, labels_key, histogram_dict in metrics_dict['histograms']:
+                labels_key = tuple(tuple(label) for label in labels_key)
+                name_histograms = self.histograms.setdefault(name, {})
+                histogram = name_histograms.get(labels_key)
+                if histogram is None:
+                    histogram = Histogram(histogram_dict['buckets'])
+                    name_histograms[labels_key] = histogram
+                histogram.merge(histogram_dict)
+
+    def get_stage_summary(self):
+        """
+         {stage: {'seconds', 'count', 'files', 'bytes', 'mb_per_second'}}; mb_per_second is bytes copied over
+         the time spent in the stage
+        """
+        with self.lock:
+            stage_summary = {}
+            for labels_key, histogram in self.histograms.get(STAGE_SECONDS, {}).items():
+                stage = dict(labels_key)['stage']
+                stage_summary[stage] = {'seconds': histogram.sum, 'count': histogram.count, 'files': 0, 'bytes': 0}
+            for name, field in ((FILES_COPIED, 'files'), (BYTES_COPIED, 'bytes')):
+                for labels_key, value in self.counters.get(name, {}).items():
+                    stage = dict(labels_key)['stage']
+                    stage_summary.setdefault(stage, {'seconds': 0.0, 'count': 0, 'files': 0, 'bytes': 0})
+                    stage_summary[stage][field] = value
+            for stage_values in stage_summary.values():
+                if stage_values['seconds'] > 0:
+                    stage_values['mb_per_second'] = stage_values['bytes'] / stage_values['seconds'] / 1048576
+                else:
+                    stage_values['mb_per_second'] = None
+            return stage_summary
+
+    def to_prometheus(self, job):
+        """
+         Prometheus text format; every metric is labelled with job, e.g., parse_seq_dirs or server_parse
+        """
+        job_label = (('job', job),)
+        lines = []
+        with self.lock:
+            for name in sorted(self.counters):
+                metric_name = METRIC_PREFIX + name
+                lines.append('# HELP ' + metric_name + ' ' + METRIC_HELP.get(name, name))
+                lines.append('# TYPE ' + metric_name + ' counter')
+                for labels_key, value in sorted(self.counters[name].items()):
+                    lines.append(metric_name + format_labels(job_label + labels_key) + ' ' + format_value(value))
+            for name in sorted(self.histograms):
+                metric_name = METRIC_PREFIX + name
+                lines.append('# HELP ' + metric_name + ' ' + METRIC_HELP.get(name, name))
+                lines.append('# TYPE ' + metric_name + ' histogram')
+                for labels_key, histogram in sorted(self.histograms[name].items()):
+                    labels = job_label + labels_key
+                    for bucket, cumulative_count in zip(histogram.buckets, histogram.get_cumulative_counts()):
+                        lines.append(metric_name + '_bucket' + format_labels(labels, (('le', format_value(bucket)),)) +
+                                     ' ' + str(cumulative_count))
+                    lines.append(metric_name + '_bucket' + format_labels(labels, (('le', '+Inf'),)) + ' ' +
+                                 str(histogram.count))
+                    lines.append(metric_name + '_sum' + format_labels(labels) + ' ' + format_value(histogram.sum))
+                    lines.append(metric_name + '_count' + format_labels(labels) + ' ' + str(histogram.count))
+        stage_summary = self.get_stage_summary()
+        metric_name = METRIC_PREFIX + 'stage_throughput_mb_per_second'
+        lines.append('# HELP ' + metric_name + ' MB copied per second spent in the stage, last run')
+        lines.append('# TYPE ' + metric_name + ' gauge')
+        for stage, stage_values in sorted(stage_summary.items()):
+            if stage_values['mb_per_second'] is not None and stage_values['bytes']:
+                lines.append(metric_name + format_labels(job_label + (('stage', stage),)) + ' ' +
+                             format_value(stage_values['mb_per_second']))
+        metric_name = METRIC_PREFIX + 'last_run_timestamp_seconds'
+        lines.append('# HELP ' + metric_name + ' Unix time the metrics were last written')
+        lines.append('# TYPE ' + metric_name + ' gauge')
+        lines.append(metric_name + format_labels(job_label) + ' ' + format_value(time.time()))
+        metric_name = METRIC_PREFIX + 'run_duration_seconds'
+        lines.append('# HELP ' + metric_name + ' Seconds since the metrics were reset, last run')
+        lines.append('# TYPE ' + metric_name + ' gauge')
+        lines.append(metric_name + format_labels(job_label) + ' ' + format_value(time.time() - self.start_time))
+        return '\n'.join(lines) + '\n'
+
+    def to_summary(self, job):
+        end_time = time.time()
+        summary = {'job': job,
+                   'start_time': datetime.fromtimestamp(self.start_time).strftime('%Y-%m-%d %H:%M:%S'),
+                   'end_time': datetime.fromtimestamp(end_time).strftime('%Y-%m-%d %H:%M:%S'),
+                   'duration_seconds': end_time - self.start_time,
+                   'stages': self.get_stage_summary()}
+        summary.update(self.to_dict())
+        return summary
+
+
+def write_atomic(file_path, text):
+    # node_exporter must never read a half-written textfile
+    tmp_file_path = file_path + '.' + str(os.getpid()) + '.tmp'
+    try:
+        with open(tmp_file_path, 'w') as tmp_file:
+            tmp_file.write(text)
+        os.replace(tmp_file_path, file_path)
+    except Exception:
+        if os.path.exists(tmp_file_path):
+            os.remove(tmp_file_path)
+        raise
+
+
+# process-wide Metrics
+metrics = Metrics()
+
+
+def get_metrics():
+    return metrics
+
+
+def write_metrics(job, metrics=None, summary_dir=settings.LOG_FILE_DIR + settings.METRICS_DIRNAME,
+                  textfile_dir=settings.METRICS_TEXTFILE_DIR):
+    """
+     write the run summary to summary_dir/<job>_<date>.json and the node_exporter textfile to
+     textfile_dir/mytd_parser_<job>.prom. Failures are logged, never raised, so metrics can't fail a run.
+     returns the summary path, or None if nothing was written
+    """
+    try:
+        if metrics is None:
+            metrics = get_metrics()
+        if not metrics.enabled:
+            return None
+        for output_dir in (summary_dir, textfile_dir):
+            if not os.path.exists(output_dir):
+                os.makedirs(output_dir)
+        summary = metrics.to_summary(job)
+        summary_path = os.path.join(summary_dir, job + '_' + datetime.now().strftime('%Y%m%d_%H%M%S') + '.json')
+        write_atomic(summary_path, json.dumps(summary, indent=1, default=str))
+        write_atomic(os.path.join(textfile_dir, METRIC_PREFIX + job + '.prom'), metrics.to_prometheus(job))
+        for stage, stage_values in sorted(summary['stages'].items()):
+            mb_per_second = stage_values['mb_per_second']
+            api_logger.info('[METRICS] ' + job + ' ' + stage + ': ' + str(round(stage_values['seconds'], 3)) + 's, ' +
+                            str(stage_values['files']) + ' files, ' + str(stage_values['bytes']) + ' bytes' +
+                            ('' if mb_per_second is None else ', ' + str(round(mb_per_second, 2)) + ' MB/s'))
+        return summary_path
+    except Exception as err:
+        api_logger.error('[METRICS] write_metrics Failed (' + str(err) + ')')
+        return None
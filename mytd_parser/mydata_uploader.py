@@ -0,0 +1,160 @@
+"""
+mydata_uploader.py
+In-process MyData scan and upload: mydata-python is imported once per process, its settings are only written
+when they change, and MyTardis is reached through the shared requests session
+Created By: mkimble
+"""
+
+import os
+import sys
+import threading
+from . import settings
+from .logger_settings import api_logger
+from .mytardis_api import get_mytardis_session, timed_get
+
+# {(data_directory, folder_structure, mytardis_url): MyDataUploader}
+mydata_uploaders = {}
+mydata_uploaders_lock = threading.Lock()
+
+
+def get_mydata(mydata_python_dir=settings.MYDATA_PYTHON_DIR):
+    """
+     mydata-python is run from its checkout rather than installed; returns None so callers can fall back to
+     the mydata-python/run.py subprocess
+    """
+    mydata_python_dir = os.path.abspath(mydata_python_dir)
+    if os.path.isdir(mydata_python_dir) and mydata_python_dir not in sys.path:
+        sys.path.insert(0, mydata_python_dir)
+    try:
+        import mydata.conf
+        import mydata.models.settings.serialize
+        import mydata.commands.scan
+        import mydata.commands.upload
+        return mydata
+    except ImportError as err:
+        api_logger.info('[MYDATA] mydata-python unavailable in-process, using run.py (' + str(err) + ')')
+        return None
+
+
+def is_under_paths(path, paths):
+    path = os.path.abspath(path)
+    for parent_path in paths:
+        parent_path = os.path.abspath(parent_path)
+        if path == parent_path or path.startswith(parent_path.rstrip(os.sep) + os.sep):
+            return True
+    return False
+
+
+class MyDataUploader:
+    """
+     mydata scan and upload without starting a python interpreter per call. mydata's settings are process
+     globals, so scans and uploads run one at a time
+    """
+    def __init__(self, data_directory, folder_structure, mytardis_url):
+        self.data_directory = data_directory
+        self.folder_structure = folder_structure
+        self.mytardis_url = mytardis_url
+        self.mydata = get_mydata()
+        self.lock = threading.Lock()
+
+    def is_available(self):
+        return self.mydata is not None
+
+    def load_settings(self):
+        """
+         point mydata at data_directory, folder_structure and mytardis_url; the mydata config file is only
+         rewritten when one of them changed
+        """
+        try:
+            mydata_settings = self.mydata.conf.settings
+            serialize = self.mydata.models.settings.serialize
+            if mydata_settings.data_directory == self.data_directory and \
+                    mydata_settings.folder_structure == self.folder_structure and \
+                    mydata_settings.mytardis_url == self.mytardis_url:
+                return
+            mydata_settings.data_directory = self.data_directory
+            mydata_settings.folder_structure = self.folder_structure
+            mydata_settings.mytardis_url = self.mytardis_url
+            serialize.save_settings_to_disk()
+            serialize.load_settings()
+            api_logger.info('[MYDATA] Config updated: ' + str(self.data_directory) + ', ' + str(self.folder_structure) +
+                            ', ' + str(self.mytardis_url))
+        except Exception as err:
+            raise RuntimeError("** Error: MyDataUploader load_settings Failed (" + str(err) + ")")
+
+    def check_server(self):
+        """
+         True if MyTardis answers; checked before an upload so an unreachable server doesn't cost a scan
+        """
+        try:
+            response = timed_get(get_mytardis_session(), self.mytardis_url.rstrip('/') + '/api/v1/?format=json',
+                                 'check_server', timeout=settings.MYTARDIS_API_TIMEOUT)
+            if not response.ok:
+                api_logger.info('[MYDATA] MyTardis not available: [' + str(response.status_code) + ']')
+            return response.ok
+        except Exception as err:
+            api_logger.info('[MYDATA] MyTardis not available (' + str(err) + ')')
+            return False
+
+    def scan(self, paths=None):
+        """
+         scan data_directory with mydata; returns the folders found, only those under paths if given
+        """
+        try:
+            with self.lock:
+                self.load_settings()
+                api_logger.info('Start: mydata scan')
+                users, groups, exps, folders = self.mydata.commands.scan.scan()
+                api_logger.info('End: mydata scan')
+            if paths:
+                folders = [folder for folder in folders
+                           if is_under_paths(os.path.join(folder.location, folder.name), paths)]
+            return folders
+        except Exception as err:
+            raise RuntimeError("** Error: MyDataUploader scan Failed (" + str(err) + ")")
+
+    def upload(self, paths=None):
+        """
+         scan and upload all of data_directory with mydata. paths: the dirs the caller needs uploaded; mydata
+         still uploads everything in data_directory, paths only skip the upload when none of them exist.
+         Returns True if mydata uploaded, False if there was nothing to upload; raises if MyTardis is not
+         available or mydata exits with an error
+        """
+        try:
+            if paths:
+                paths = [path for path in paths if os.path.exists(path)]
+                if not paths:
+                    api_logger.info('[MYDATA] nothing to upload, skipping upload')
+                    return False
+            if not self.check_server():
+                raise RuntimeError('MyTardis not available: [' + str(self.mytardis_url) + ']')
+            with self.lock:
+                self.load_settings()
+                api_logger.info('Start: mydata upload [' + str(self.data_directory) + ']')
+                # mydata's upload scans data_directory itself, so no separate scan is run first
+                try:
+                    exit_code = self.mydata.commands.upload.upload_cmd.main(args=['-v'], standalone_mode=False)
+                except SystemExit as err:
+                    exit_code = err.code
+                except Exception as err:
+                    # e.g., click.Abort, which has no message of its own
+                    raise RuntimeError('mydata upload stopped: ' + type(err).__name__ + ' ' + str(err))
+                if exit_code not in (None, 0):
+                    raise RuntimeError('mydata upload exited with [' + str(exit_code) + ']')
+                api_logger.info('End: mydata upload')
+            return True
+        except Exception as err:
+            raise RuntimeError("** Error: MyDataUploader upload Failed (" + str(err) + ")")
+
+
+def get_mydata_uploader(data_directory, folder_structure, mytardis_url):
+    """
+     process-wide MyDataUploader for these settings, e.g., shared by the parsers of every run dir
+    """
+    with mydata_uploaders_lock:
+        uploader_key = (data_directory, folder_structure, mytardis_url)
+        uploader = mydata_uploaders.get(uploader_key)
+        if uploader is None:
+            uploader = MyDataUploader(data_directory, folder_structure, mytardis_url)
+            mydata_uploaders[uploader_key] = uploader
+        return uploader
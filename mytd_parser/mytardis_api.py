@@ -1,6 +1,187 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from urllib.parse import urlencode, urljoin
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
 from . import settings
 from .logger_settings import api_logger
+from .metrics import get_metrics, write_metrics
+from .profiling import profiling, profile_stage
+
+# process-wide requests session, created on first use
+mytardis_session = None
+mytardis_session_lock = threading.Lock()
+
+
+def get_mytardis_session(pool_size=settings.MYTARDIS_API_POOL_SIZE):
+    """
+     requests session shared by every MyTardis call in the process, so connections (and TLS handshakes) are
+     reused instead of opened per request
+    """
+    global mytardis_session
+    with mytardis_session_lock:
+        if mytardis_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            mytardis_session = session
+        return mytardis_session
+
+
+def timed_get(session, uri, operation, **kwargs):
+    """
+     session.get(uri) with its latency and status code recorded as a mytardis api request
+    """
+    start_time = time.perf_counter()
+    status = 'error'
+    try:
+        response = session.get(uri, **kwargs)
+        status = response.status_code
+        return response
+    finally:
+        get_metrics().record_api_request('mytardis', operation, time.perf_counter() - start_time, status)
+
+
+class MyTardisClient:
+    """
+     MyTardis API client on the shared session. get_objects walks every limit/offset page of a listing, fetching
+     the pages after the first concurrently. Every page is cached on disk with its ETag/Last-Modified, and a
+     page the server reports unchanged (304) is read from the cache instead of downloaded again.
+     e.g., objects, status_code = MyTardisClient().get_objects('dataset', {'experiments__id': 1},
+                                                               fields=['id', 'description'])
+    """
+    def __init__(self, mytardis_api_url=settings.MYTARDIS_API_URL,
+                 mytardis_api_user=settings.MYTARDIS_API_USER,
+                 mytardis_api_password=settings.MYTARDIS_API_PASSWORD,
+                 page_size=settings.MYTARDIS_API_PAGE_SIZE,
+                 max_workers=settings.MYTARDIS_API_MAX_WORKERS,
+                 cache_dir=settings.LOG_FILE_DIR + settings.MYTARDIS_API_CACHE_DIRNAME,
+                 timeout=settings.MYTARDIS_API_TIMEOUT):
+        self.mytardis_api_url = mytardis_api_url
+        if mytardis_api_user:
+            self.auth = (mytardis_api_user, mytardis_api_password)
+        else:
+            self.auth = None
+        self.page_size = page_size
+        self.max_workers = max_workers
+        # None disables the cache
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.session = get_mytardis_session()
+
+    def get_uri(self, model_name, params_dict):
+        # sorted params give a page the same uri (and cache file) on every call
+        return self.mytardis_api_url + model_name + "/?" + urlencode(sorted(params_dict.items()))
+
+    def get_cache_filepath(self, uri):
+        return os.path.join(self.cache_dir, hashlib.sha1(uri.encode('utf-8')).hexdigest() + '.json')
+
+    def read_cache(self, uri):
+        if self.cache_dir is None:
+            return None
+        cache_filepath = self.get_cache_filepath(uri)
+        if not os.path.exists(cache_filepath):
+            return None
+        try:
+            with open(cache_filepath) as cache_file:
+                cache_entry = json.load(cache_file)
+        except ValueError:
+            # a corrupt cache file is fetched again
+            return None
+        if cache_entry.get('uri') != uri:
+            return None
+        return cache_entry
+
+    def write_cache(self, uri, response, data_json):
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if self.cache_dir is None or (etag is None and last_modified is None):
+            # nothing to revalidate with
+            return
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+        cache_filepath = self.get_cache_filepath(uri)
+        tmp_cache_filepath = cache_filepath + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+        with open(tmp_cache_filepath, 'w') as cache_file:
+            json.dump({'uri': uri, 'etag': etag, 'last_modified': last_modified, 'data': data_json}, cache_file)
+        os.replace(tmp_cache_filepath, cache_filepath)
+
+    def get_json(self, uri):
+        """
+         conditional GET of uri; returns data_json, status_code (data_json is False if the response is 4xx/5xx)
+        """
+        try:
+            headers = {'Accept': 'application/json'}
+            cache_entry = self.read_cache(uri)
+            if cache_entry is not None:
+                if cache_entry.get('etag'):
+                    headers['If-None-Match'] = cache_entry['etag']
+                if cache_entry.get('last_modified'):
+                    headers['If-Modified-Since'] = cache_entry['last_modified']
+            response = timed_get(self.session, uri, 'get_json', auth=self.auth, headers=headers,
+                                 timeout=self.timeout)
+            if response.status_code == 304 and cache_entry is not None:
+                api_logger.debug('get_json: [%s] not modified, using cache', uri)
+                return cache_entry['data'], response.status_code
+            api_logger.debug('get_json: [%s] response: [%s]', uri, response)
+            # checks if response is not 4xx or 5xx
+            if not response.ok:
+                return False, response.status_code
+            data_json = response.json()
+            self.write_cache(uri, response, data_json)
+            return data_json, response.status_code
+        except Exception as err:
+            raise RuntimeError("** Error: MyTardisClient get_json Failed (" + str(err) + ")")
+
+    def get_page(self, model_name, params_dict, offset):
+        page_params = dict(params_dict, limit=self.page_size, offset=offset, format='json')
+        return self.get_json(self.get_uri(model_name, page_params))
+
+    def get_objects(self, model_name, params_dict, fields=None):
+        """
+         every object of a listing, in page order; returns objects, status_code (objects is False if a page
+         failed). fields: only keep these fields of each object. Tastypie can't select fields server-side, so
+         whole objects are still downloaded and cached; fields only trims what is returned
+        """
+        try:
+            data_json, status_code = self.get_page(model_name, params_dict, 0)
+            if not data_json:
+                return False, status_code
+            pages = [data_json]
+            total_count = data_json.get('meta', {}).get('total_count')
+            if total_count is not None:
+                # every offset is known from the first page, so the other pages are fetched at once
+                offsets = list(range(self.page_size, total_count, self.page_size))
+                if offsets:
+                    with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                        page_results = list(executor.map(
+                            lambda offset: self.get_page(model_name, params_dict, offset), offsets))
+                    for page_json, page_status_code in page_results:
+                        if not page_json:
+                            return False, page_status_code
+                        pages.append(page_json)
+            else:
+                # no total_count; follow meta.next one page at a time
+                next_urn = data_json.get('meta', {}).get('next')
+                while next_urn:
+                    page_json, page_status_code = self.get_json(urljoin(self.mytardis_api_url, next_urn))
+                    if not page_json:
+                        return False, page_status_code
+                    pages.append(page_json)
+                    next_urn = page_json.get('meta', {}).get('next')
+            objects = [mytardis_object for page_json in pages for mytardis_object in page_json.get('objects', [])]
+            if fields is not None:
+                objects = [{field: mytardis_object.get(field) for field in fields} for mytardis_object in objects]
+            api_logger.info('get_objects: [' + model_name + '] ' + str(len(objects)) + ' objects, ' +
+                            str(len(pages)) + ' pages')
+            return objects, status_code
+        except Exception as err:
+            raise RuntimeError("** Error: MyTardisClient get_objects Failed (" + str(err) + ")")
 
 
 class DatasetFilter:
@@ -17,37 +198,6 @@ class DatasetFilter:
         self.mytardis_api_user = mytardis_api_user
         self.mytardis_api_password = mytardis_api_password
 
-    def get_urn(self, model_name, params_dict):
-        try:
-            param_fmt = '&'.join([f'{key}={value}' for key, value in params_dict.items()])
-            urn = model_name+"/?"+param_fmt
-            api_logger.info('set_params: [' + str(urn) + ']')
-            return urn
-        except Exception as err:
-            raise RuntimeError("** Error: set_params Failed (" + str(err) + ")")
-
-    def get_uri(self, url, urn):
-        try:
-            return url + urn
-        except Exception as err:
-            raise RuntimeError("** Error: get_uri Failed (" + str(err) + ")")
-
-    def get_response(self, uri, mytardis_api_user, mytardis_api_password):
-        try:
-            api_logger.info('get_response: [' + str(uri) + ']')
-            response = requests.get(uri, auth=(mytardis_api_user, mytardis_api_password))
-            api_logger.info('response: [' + str(response) + ']')
-            # checks if response is not 4xx or 5xx
-            if response.ok:
-                data_json = response.json()
-                # api_logger.info('data_json: [' + str(data_json) + ']')
-                return data_json, response.status_code
-            else:
-                return False, response.status_code
-
-        except Exception as err:
-            raise RuntimeError("** Error: get_response Failed (" + str(err) + ")")
-
     def make_filter_request(self):
         try:
             params_dict = self.params_dict
@@ -58,35 +208,43 @@ class DatasetFilter:
 
             api_logger.info('make_filter_request: [' + str(mytardis_api_url) + ', ' + str(mytardis_api_user) + ']')
 
-            urn = self.get_urn(model_name, params_dict)
-            uri = self.get_uri(mytardis_api_url, urn)
-            data_json, response_code = self.get_response(uri, mytardis_api_user, mytardis_api_password)
-            if data_json:
-                return data_json, response_code
+            # every page of the listing, trimmed client-side to the fields write_filter_file needs
+            client = MyTardisClient(mytardis_api_url, mytardis_api_user, mytardis_api_password)
+            objects, response_code = client.get_objects(model_name, params_dict, fields=['id', 'description'])
+            if objects is not False:
+                return {'objects': objects}, response_code
             else:
                 return False, response_code
         except Exception as err:
             raise RuntimeError("** Error: make_filter_request Failed (" + str(err) + ")")
 
-    def write_filter_file(self):
+    def write_filter_file(self, profile=settings.PROFILE):
+        """
+         profile: cProfile the dataset_filter stage into LOG_FILE_DIR/profiles/dataset_filter/
+        """
         try:
-            dataset_filter_filename = self.dataset_filter_filename
-            rclone_filter_file_dir = self.rclone_filter_file_dir
-            output_filter_file = rclone_filter_file_dir+dataset_filter_filename+".txt"
-
-            api_logger.info('write_filter_file: [' + str(output_filter_file) + ']')
-
-            data_json, response_code = self.make_filter_request()
-            if data_json:
-                filter_file = open(output_filter_file, 'w')
-                for each in data_json['objects']:
-                    dataset_description = each['description']
-                    dataset_description_fmt = "+ " + dataset_description + "*/**"
-                    filter_file.write(dataset_description_fmt+"\n")
-                # last line "exclude all else"
-                filter_file.write("- **")
-                filter_file.close()
-            else:
-                api_logger.info('[FAIL] Response: ['+str(response_code)+']')
+            metrics = get_metrics()
+            metrics.reset()
+            with profiling('dataset_filter', enabled=profile), metrics.stage('dataset_filter'), \
+                    profile_stage('dataset_filter'):
+                dataset_filter_filename = self.dataset_filter_filename
+                rclone_filter_file_dir = self.rclone_filter_file_dir
+                output_filter_file = rclone_filter_file_dir+dataset_filter_filename+".txt"
+
+                api_logger.info('write_filter_file: [' + str(output_filter_file) + ']')
+
+                data_json, response_code = self.make_filter_request()
+                if data_json:
+                    filter_file = open(output_filter_file, 'w')
+                    for each in data_json['objects']:
+                        dataset_description = each['description']
+                        dataset_description_fmt = "+ " + dataset_description + "*/**"
+                        filter_file.write(dataset_description_fmt+"\n")
+                    # last line "exclude all else"
+                    filter_file.write("- **")
+                    filter_file.close()
+                else:
+                    api_logger.info('[FAIL] Response: ['+str(response_code)+']')
+            write_metrics('dataset_filter')
         except Exception as err:
             raise RuntimeError("** Error: write_filter_file Failed (" + str(err) + ")")
@@ -8,20 +8,30 @@ LAST MODIFIED: 08/31/2021
 from . import settings
 import sys
 import os, glob, re
+import shutil
 import pandas as pd
-from shutil import copy2, move
-from .logger_settings import api_logger
+from .logger_settings import api_logger, start_process_log_listener, log_to_process_queue
 from pathlib import *
-from distutils.dir_util import copy_tree
 from subprocess import PIPE, run
 import datetime
 from datetime import datetime
 import platform
 import pathlib
 import dateutil.parser
-# for google sheets
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .scan_cache import ScanCache
+from .run_catalog import RunCatalog, STATUS_PARSED
+from .fastq_archive import FastqArchive
+from .mydata_uploader import get_mydata_uploader
+from .pipeline import ParsePipeline, RunContext, PARSE_STAGES, DISCOVER, VALIDATE, COPY_METADATA, BACKUP
+from .gsheets import get_gsheet_worksheet, get_gsheet_snapshot, GsheetStatusWriter, GSHEETS_PARSE_STATUS_COLUMN
+from .copy_engine import copy_files, fast_copy2, fast_copy_tree, fast_move, materialize_links
+from .run_tree_index import RunTreeIndex, get_stat_creation_dt, FASTQ, SUMMARY
+from .run_metadata import RunMetadata, parse_rta_complete_txt, get_mtime_ns
+from .records import RunRecord, FastqRecord, records_to_df, df_to_records
+from .metrics import get_metrics, write_metrics, RUNS, OPERATION_SECONDS
+from .profiling import profiling
 
 
 def unique(list):
@@ -41,16 +51,7 @@ def get_creation_dt(directory):
     last modified if that isn't possible.
     See http://stackoverflow.com/a/39501288/1709587 for explanation.
     """
-    if platform.system() == 'Windows':
-        return os.path.getctime(directory)
-    else:
-        stat = os.stat(directory)
-        try:
-            return stat.st_birthtime
-        except AttributeError:
-            # We're probably on Linux. No easy way to get creation dates here,
-            # so we'll settle for when its content was last modified.
-            return stat.st_mtime
+    return get_stat_creation_dt(os.stat(directory))
 
 
 def change_creation_dt(directory, mod_date):
@@ -84,25 +85,24 @@ def modify_create_date(old_dir, new_dir):
         raise RuntimeError("** Error: modify_create_date Failed (" + str(err) + ")")
 
 
-def check_rta_complete(input_run_dir):
+# the run metadata helpers below take the parser's run_tree_index (MiSeqParser.run_tree_index); without one,
+# RunMetadata uses the cached index of get_run_tree_index instead of walking the run dir on every call
+def check_rta_complete(input_run_dir, run_tree_index=None):
     """
      check to see if RTAComplete.txt exists
     """
     try:
         # input_run_dir = staging_dir + project + "/" + run_id + "/"
-        api_logger.info('check_rta_complete: [' + str(input_run_dir)+']')
-        rta_file_name = 'RTAComplete.txt'
-        rta_file_name = glob.glob(f'{input_run_dir}/**/{rta_file_name}', recursive=True)
-        if rta_file_name:
-            print(rta_file_name)
-            rta_complete_time = get_rta_complete_time(rta_file_name)
-            api_logger.info('End: RTAComplete.txt exists')
-            return True, rta_complete_time
+        api_logger.debug('check_rta_complete: [%s]', input_run_dir)
+        run_metadata = RunMetadata(input_run_dir, run_tree_index)
+        if run_metadata.rta_complete:
+            api_logger.debug('rta_complete_time: [%s]', run_metadata.rta_complete_time)
+            api_logger.debug('End: RTAComplete.txt exists')
+            return True, run_metadata.rta_complete_time
         else:
-            print(rta_file_name)
             # if RTAComplete.txt does not exist, then we do not want to proceed with processing
             # the sequencing run.
-            api_logger.info('End: RTAComplete.txt does not exist - sequencing run not complete')
+            api_logger.debug('End: RTAComplete.txt does not exist - sequencing run not complete')
             return False, False
 
     except Exception as err:
@@ -115,19 +115,17 @@ def get_rta_complete_time(rta_file_name):
     """
     try:
         # input_run_dir = staging_dir + project + "/" + run_id + "/"
-        api_logger.info('get_rta_complete_time: [' + str(rta_file_name)+']')
+        api_logger.debug('get_rta_complete_time: [%s]', rta_file_name)
         # unlist rta filename
         rta_file_name = rta_file_name[0]
-        rta_df = pd.read_csv(rta_file_name, sep=',', header=None)
-        # format as datetime
-        rta_complete_time = pd.to_datetime(rta_df.iloc[0][0] + ' ' + rta_df.iloc[0][1])
-        api_logger.info('rta_complete_time: [' + str(rta_complete_time) + ']')
+        rta_complete_time = parse_rta_complete_txt(rta_file_name, get_mtime_ns(rta_file_name))
+        api_logger.debug('rta_complete_time: [%s]', rta_complete_time)
         return rta_complete_time
     except Exception as err:
         raise RuntimeError("** Error: get_rta_complete_time Failed (" + str(err) + ")")
 
 
-def get_run_id_xml(input_run_dir):
+def get_run_id_xml(input_run_dir, run_tree_index=None):
     """
      parse RunInfo.xml to get correct run id
      If data are sent multiple times via MyData, mydata-seq-fac will append
@@ -135,26 +133,15 @@ def get_run_id_xml(input_run_dir):
      for data on the server.
     """
     try:
-        import xml.etree.ElementTree as ET
-        complete_file_name = 'RunInfo.xml'
-        # grab newest RunInfo.xml in directory
-        complete_file_path = glob.glob(f'{input_run_dir}/**/{complete_file_name}', recursive=True)
-        if complete_file_path:
-            complete_file_path = max(complete_file_path)
-            complete_file_path = complete_file_path.replace('\\', '/')
-            tree = ET.parse(complete_file_path)
-            root = tree.getroot()
-            for run_info in root.findall("Run"):
-                run_id = run_info.get('Id')
-            return run_id
-        else:
-            api_logger.info("RunInfo Missing")
-            return False
+        run_metadata = RunMetadata(input_run_dir, run_tree_index)
+        if run_metadata.run_id is False:
+            api_logger.debug('RunInfo Missing')
+        return run_metadata.run_id
     except Exception as err:
         raise RuntimeError("** Error: get_run_id_xml Failed (" + str(err) + ")")
 
 
-def get_run_date_xml(input_run_dir):
+def get_run_date_xml(input_run_dir, run_tree_index=None):
     """
      parse RunInfo.xml to get correct run date
      If data are sent multiple times via MyData, mydata-seq-fac will append
@@ -162,28 +149,17 @@ def get_run_date_xml(input_run_dir):
      for data on the server.
     """
     try:
-        import xml.etree.ElementTree as ET
-        complete_file_name = 'RunInfo.xml'
-        # grab newest RunInfo.xml in directory
-        complete_file_path = glob.glob(f'{input_run_dir}/**/{complete_file_name}', recursive=True)
-        if complete_file_path:
-            complete_file_path = max(complete_file_path)
-            complete_file_path = complete_file_path.replace('\\', '/')
-            tree = ET.parse(complete_file_path)
-            root = tree.getroot()
-            for run_info in root.findall("./Run"):
-                run_date = run_info.find('Date').text
-                api_logger.info('run_date: [' + str(run_date) + ']')
-                # print(run_date)
-            return run_date
+        run_metadata = RunMetadata(input_run_dir, run_tree_index)
+        if run_metadata.run_date is False:
+            api_logger.debug('RunInfo.xml Missing')
         else:
-            api_logger.info("RunInfo.xml Missing")
-            return False
+            api_logger.debug('run_date: [%s]', run_metadata.run_date)
+        return run_metadata.run_date
     except Exception as err:
         raise RuntimeError("** Error: get_run_date_xml Failed (" + str(err) + ")")
 
 
-def get_run_completion_time_xml(input_run_dir):
+def get_run_completion_time_xml(input_run_dir, run_tree_index=None):
     """
      parse CompletedJobInfo.xml to get correct run date
      If data are sent multiple times via MyData, mydata-seq-fac will append
@@ -191,51 +167,55 @@ def get_run_completion_time_xml(input_run_dir):
      for data on the server.
     """
     try:
-        import xml.etree.ElementTree as ET
-        complete_file_name = 'CompletedJobInfo.xml'
-        # grab newest CompletedJobInfo.xml in directory
-        complete_file_path = glob.glob(f'{input_run_dir}/**/{complete_file_name}', recursive=True)
-        if complete_file_path:
-            api_logger.info('CompletedJobInfo: [' + str(complete_file_path) + ']')
-            complete_file_path = max(complete_file_path)
-            complete_file_path = complete_file_path.replace('\\', '/')
-            tree = ET.parse(complete_file_path)
-            root = tree.getroot()
-            for run_info in root.findall("CompletionTime"):
-                completion_time = run_info.text
-                # print(completion_time)
-            completion_time_dt = dateutil.parser.parse(completion_time)
-            completion_time_fmt = completion_time_dt.strftime('%Y-%m-%d %H:%M:%S')
-            api_logger.info('get_run_completion_time_xml: [' + str(completion_time_fmt) + ']')
-            return completion_time_fmt
+        run_metadata = RunMetadata(input_run_dir, run_tree_index)
+        if run_metadata.completion_time is False:
+            api_logger.debug('CompletedJobInfo.xml Missing')
         else:
-            api_logger.info("CompletedJobInfo.xml Missing")
-            return False
+            api_logger.debug('get_run_completion_time_xml: [%s]', run_metadata.completion_time)
+        return run_metadata.completion_time
     except Exception as err:
-        raise RuntimeError("** Error: get_run_date_xml Failed (" + str(err) + ")")
+        raise RuntimeError("** Error: get_run_completion_time_xml Failed (" + str(err) + ")")
+
 
+# sample id naming conventions, see get_sampleid_primerpair_name
+SAMPLE_ID_PATTERN = re.compile("[a-z][A-Z][A-Z]-[A-Z][0-9][0-9]-[0-9][0-9][a-z]-[0-9][0-9][0-9][0-9]+")
+SAMPLE_ID_PRIMER_PAIR_PATTERN = re.compile("[a-z][A-Z][A-Z]-[A-Z][0-9][0-9]-[0-9][0-9][a-z]-[0-9][0-9][0-9][0-9]-+")
+# Illumina fastq names: {sample}_S{sample number}_L{lane}_R{read}_001.fastq.gz; the lane is absent
+# when lanes are merged, index reads are I1/I2
+ILLUMINA_FASTQ_PATTERN = re.compile(r"_S(\d+)(?:_L(\d{3}))?_([RI]\d)_\d{3}\.fastq\.gz$")
+FASTQ_NAME_COLUMNS = ['sample_id', 'primer_pair', 'sampleid_primerpair', 'sample_number', 'lane', 'read']
+# FastqRecord columns of the fastq_filelists/ log csv and of Fastq_filelist.csv; checksum columns are appended.
+# Fastq_filelist.csv lists upload_fastq_path as fastq_path
+FASTQ_LOG_COLUMNS = ['parse_date', 'sample_id', 'primer_pair', 'sampleid_primerpair', 'fastq_create_date',
+                     'fastq_path', 'sample_number', 'lane', 'read', 'size']
+FASTQ_FILELIST_COLUMNS = ['sample_id', 'primer_pair', 'sampleid_primerpair', 'fastq_create_date',
+                          'upload_fastq_path', 'sample_number', 'lane', 'read', 'size']
 
+
+@lru_cache(maxsize=65536)
 def get_sampleid_primerpair_name(sample_id):
+    """
+     memoized; the R1 and R2 files of a sample share a sample id
+    """
     try:
         # Illumina MiSeq converts underscores to dashes
         # e.g., a sample_id 'eSG_L01_19w_001' will be converted to eSG-L01-19w-001
         # so here it is being converted back to 'eSG_L01_19w_001' if it is a sample_id > 14
         if len(sample_id) > 14:
             # check if sample_id matches pattern
-            pattern = "[a-z][A-Z][A-Z]-[A-Z][0-9][0-9]-[0-9][0-9][a-z]-[0-9][0-9][0-9][0-9]+"
-            matched = re.match(pattern, sample_id)
+            matched = SAMPLE_ID_PATTERN.match(sample_id)
             is_match = bool(matched)
             # check if there is a pattern match to naming conventions
             if is_match:
-                pattern_dash = "[a-z][A-Z][A-Z]-[A-Z][0-9][0-9]-[0-9][0-9][a-z]-[0-9][0-9][0-9][0-9]-+"
-                matched = re.match(pattern_dash, sample_id)
+                pattern_dash = SAMPLE_ID_PRIMER_PAIR_PATTERN
+                matched = pattern_dash.match(sample_id)
                 is_match = bool(matched)
                 # check if there is a pattern match to naming conventions that also includes a primer pair
                 if is_match:
                     # split based on the pattern so that only things after the pattern are extracted
                     # e.g., eSG-L01-19w-001-+ anything beyond the last dash, in eSG-L01-19w-001-riaz, it would
                     # be riaz
-                    primer_pair = re.split(pattern_dash, sample_id)[1]
+                    primer_pair = pattern_dash.split(sample_id)[1]
                     sample_id = sample_id.replace("-" + primer_pair, '')
                     sample_id = sample_id.replace("-", "_")
                     sampleid_primerpair = sample_id+"-"+primer_pair
@@ -254,56 +234,104 @@ def get_sampleid_primerpair_name(sample_id):
         raise RuntimeError("** Error: get_sampleid_primerpair_name Failed (" + str(err) + ")")
 
 
-def get_gsheet():
+def parse_fastq_name(fastq_name):
+    """
+     (sample_id, primer_pair, sampleid_primerpair, sample_number, lane, read) of a fastq filename
+    """
+    # sample_id is leftmost after underscore split
+    # if pattern matches, extract sample_id and/or primer_pair
+    sample_id, primer_pair, sampleid_primerpair = get_sampleid_primerpair_name(fastq_name.split('_', 1)[0])
+    matched = ILLUMINA_FASTQ_PATTERN.search(fastq_name)
+    if matched:
+        sample_number, lane, read = matched.groups()
+        sample_number = int(sample_number)
+        lane = int(lane) if lane else None
+    else:
+        sample_number = lane = read = None
+    return sample_id, primer_pair, sampleid_primerpair, sample_number, lane, read
+
+
+def get_fastq_records(fastq_files_list, parse_date, run_tree_index):
+    """
+     one FastqRecord per fastq file with its parsed name fields and create date
+    """
     try:
-        gdrive_private_key = settings.GDRIVE_PRIVATE_KEY
-        target_spreadsheet_name = settings.GSHEETS_SPREADSHEET_URL
+        fastq_records = []
+        for fastq_file in fastq_files_list:
+            sample_id, primer_pair, sampleid_primerpair, sample_number, lane, read = \
+                parse_fastq_name(os.path.basename(fastq_file))
+            fastq_create_date = datetime.fromtimestamp(
+                run_tree_index.get_creation_dt(fastq_file)).strftime('%Y-%m-%d %H:%M:%S')
+            fastq_records.append(FastqRecord(parse_date=parse_date, sample_id=sample_id, primer_pair=primer_pair,
+                                             sampleid_primerpair=sampleid_primerpair,
+                                             fastq_create_date=fastq_create_date, fastq_path=fastq_file,
+                                             sample_number=sample_number, lane=lane, read=read))
+        return fastq_records
+    except Exception as err:
+        raise RuntimeError("** Error: get_fastq_records Failed (" + str(err) + ")")
 
-        scope = ["https://spreadsheets.google.com/feeds", 'https://www.googleapis.com/auth/spreadsheets',
-                 "https://www.googleapis.com/auth/drive.file", "https://www.googleapis.com/auth/drive"]
-        # JSON API file from google drive API
-        credentials = ServiceAccountCredentials.from_json_keyfile_name(gdrive_private_key, scope)
-        gc = gspread.authorize(credentials)
 
-        spreadsheet = gc.open_by_url(target_spreadsheet_name)
+def get_fastq_name_fields(fastq_files_list):
+    """
+     parse all fastq filenames of a run in one pass: sample_id, primer_pair and sampleid_primerpair
+     (see get_sampleid_primerpair_name) and the Illumina sample_number, lane and read (e.g., R1) fields.
+     returns a df with FASTQ_NAME_COLUMNS, one row per file in the same order as fastq_files_list
+    """
+    try:
+        rows = [parse_fastq_name(os.path.basename(fastq_file)) for fastq_file in fastq_files_list]
+        fastq_name_df = pd.DataFrame(rows, columns=FASTQ_NAME_COLUMNS)
+        fastq_name_df['sample_number'] = fastq_name_df['sample_number'].astype('Int64')
+        fastq_name_df['lane'] = fastq_name_df['lane'].astype('Int64')
+        return fastq_name_df
+    except Exception as err:
+        raise RuntimeError("** Error: get_fastq_name_fields Failed (" + str(err) + ")")
+
 
-        worksheet = spreadsheet.worksheet(settings.GSHEETS_WORKSHEET_NAME)
+def get_gsheet():
+    """
+     shared worksheet handle; authorized once per process (and again when the authorization gets old)
+    """
+    try:
+        worksheet = get_gsheet_worksheet()
         return worksheet
     except Exception as err:
         raise RuntimeError("** Error: get_gsheet Failed (" + str(err) + ")")
 
 
 def get_fastq_num_runid_gsheets(worksheet, run_id):
+    """
+     number of fastq files for run_id from the process-wide snapshot of worksheet, so every stage and run dir
+     shares one get_all_values() fetch per GSHEETS_SNAPSHOT_TTL_SECONDS
+    """
     try:
         # worksheet = get_gsheet()
-
-        # finding the cell with the header "number of fastq files" gives us the column
-        fastq_cell = worksheet.find("Number of FASTQ files")
-        # finding the cell that matches the RunID of the parsed run gives us the row
-        runid_cell = worksheet.find(run_id)
-
-        if runid_cell is not None:
-            # value at cell that matches row, col
-            num_fastq_gsheets = worksheet.cell(runid_cell.row, fastq_cell.col).value
-        else:
-            num_fastq_gsheets = None
+        snapshot = get_gsheet_snapshot(worksheet)
+        # the cell with the header "number of fastq files" gives us the column, the cell that matches the
+        # RunID of the parsed run gives us the row
+        num_fastq_gsheets = snapshot.get_value(run_id, "Number of FASTQ files")
 
         return num_fastq_gsheets
     except Exception as err:
         raise RuntimeError("** Error: get_fastq_num_runid_gsheets Failed (" + str(err) + ")")
 
 
-def update_parse_status_runid_gsheets(worksheet, run_id):
+def update_parse_status_runid_gsheets(worksheet, run_id, status_writer=None):
+    """
+     set SERVER_PARSE_COMPLETE of run_id. With a status_writer the update is only buffered, and the caller's
+     status_writer.flush() at the end of the pass writes every run in one batch_update; otherwise it is
+     written right away. Returns the number of cells written
+    """
     try:
         # worksheet = get_gsheet()
-
-        # finding the cell with the header "number of fastq files" gives us the column
-        parse_status_cell = worksheet.find("SERVER_PARSE_COMPLETE")
-        # finding the cell that matches the RunID of the parsed run gives us the row
-        runid_cell = worksheet.find(run_id)
-
-        # update value at cell that matches row, col
-        update_cell_status = worksheet.update_cell(runid_cell.row, parse_status_cell.col, "COMPLETE")
+        is_buffered = status_writer is not None
+        if not is_buffered:
+            status_writer = GsheetStatusWriter(worksheet)
+        # the cell with the header "SERVER_PARSE_COMPLETE" gives us the column, the cell that matches the
+        # RunID of the parsed run gives us the row
+        status_writer.add(run_id, GSHEETS_PARSE_STATUS_COLUMN, "COMPLETE")
+        if is_buffered:
+            return 0
+        update_cell_status = status_writer.flush()
 
         return update_cell_status
     except Exception as err:
@@ -321,10 +349,159 @@ def show_complete_dialog(upload_action, parsing_action, staging_action):
     tk.mainloop()
 
 
-def parse_seq_dirs(upload_parsing=False, move_parsing=False, move_staging=False, check_gdrive=False):
+def get_parser_class(run_dir):
+    """
+     MiSeqParser for a run dir with MiSeq output dirs (Alignment, Data, Thumbnail_Images, Config, InterOp),
+     GenericParser for a run from another sequencing facility
+    """
+    alignment_dirs_list = glob.glob(os.path.join(run_dir, '*/'))
+    # convert forward slashes to backwards slashes
+    alignment_dirs_list = [dir_path.replace('\\', '/') for dir_path in alignment_dirs_list]
+
+    miseq_run_dirs = ["Alignment", "Data", "Thumbnail_Images", "Config", "InterOp"]
+    check_miseq_dirs = [dir_path for dir_path in alignment_dirs_list
+                        if any(ignore in dir_path for ignore in miseq_run_dirs)]
+
+    # grab filepath with "Alignment" in it
+    # alignment_dir = [algndir for algndir in alignment_dirs_list if "Alignment" in algndir]
+    if not check_miseq_dirs:
+        return GenericParser
+    return MiSeqParser
+
+
+def run_seq_run_dir_pipeline(project, run_dir, num_run_dir, upload_parsing=False, move_parsing=False,
+                             move_staging=False, check_gdrive=False, scan_cache=None, skip_stages=()):
+    """
+     run the ParsePipeline stages of a single run dir in staging with MiSeqParser or GenericParser.
+     Returns (parser, context), or None if the run is unchanged since it was last fully parsed
+    """
+    try:
+        # one pruned walk of the run dir shared by every run metadata lookup
+        run_tree_index = RunTreeIndex(run_dir)
+        if scan_cache is not None:
+            fingerprint = run_tree_index.get_fingerprint()
+            if scan_cache.is_parsed(run_dir, fingerprint):
+                api_logger.debug('[SCAN CACHE] unchanged since last parse, skipping: [%s]', run_dir)
+                get_metrics().inc(RUNS, state='unchanged')
+                return None
+
+        parser_class = get_parser_class(run_dir)
+        parser = parser_class(project, run_dir, num_run_dir, check_gdrive, run_tree_index=run_tree_index,
+                              scan_cache=scan_cache)
+        context = ParsePipeline(parser, skip_stages=skip_stages, upload_parsing=upload_parsing,
+                                move_parsing=move_parsing, move_staging=move_staging).run()
+        if scan_cache is not None and not context.dirs_df.empty:
+            # only a run where every fastq dir passed all checks is skipped next time
+            scan_cache.set_parsed(run_dir, parser.num_parsed_fastq_dirs == len(context.dirs_df))
+        get_metrics().inc(RUNS, state='parsed')
+        return parser, context
+    except Exception as err:
+        raise RuntimeError("** Error: run_seq_run_dir_pipeline Failed (" + str(err) + ")")
+
+
+def get_context_actions(context):
+    if context.actions is not None:
+        return context.actions
+    return None, None, None
+
+
+def parse_seq_run_dir(project, run_dir, num_run_dir, upload_parsing=False, move_parsing=False, move_staging=False,
+                      check_gdrive=False, scan_cache=None, skip_stages=()):
+    """
+     parse a single run dir in staging with MiSeqParser or GenericParser, running the ParsePipeline stages
+     (skip_stages are left out, e.g., skip_stages=('backup',)).
+     Returns None if the run is unchanged since it was last fully parsed
+    """
+    try:
+        result = run_seq_run_dir_pipeline(project, run_dir, num_run_dir, upload_parsing, move_parsing, move_staging,
+                                          check_gdrive, scan_cache, skip_stages)
+        if result is None:
+            return None
+        parser, context = result
+        return get_context_actions(context)
+    except Exception as err:
+        raise RuntimeError("** Error: parse_seq_run_dir Failed (" + str(err) + ")")
+
+
+def backup_seq_run_dir(project, run_dir, num_run_dir, dirs_df, run_tree_index, upload_parsing=False,
+                       move_parsing=False, move_staging=False):
+    """
+     backup stage (MyData upload, MYTDComplete.txt and the moves to Backup) of a run whose other stages
+     ran in a parse_seq_run_dir_job worker; run in the parent process one run at a time, since MyData's
+     config and upload are shared by every run. dirs_df: the validated rows (RunContext.get_backup_df)
+    """
+    try:
+        parser_class = get_parser_class(run_dir)
+        parser = parser_class(project, run_dir, num_run_dir, False, run_tree_index=run_tree_index)
+        context = RunContext()
+        context.dirs_df = dirs_df
+        context.run_records = df_to_records(dirs_df, RunRecord)
+        ParsePipeline(parser, stages=(BACKUP,), upload_parsing=upload_parsing, move_parsing=move_parsing,
+                      move_staging=move_staging).run(context)
+        return get_context_actions(context)
+    except Exception as err:
+        raise RuntimeError("** Error: backup_seq_run_dir Failed (" + str(err) + ")")
+
+
+def init_parse_seq_run_dir_job(log_queue):
+    # worker log records are written by the parent process; see parse_seq_dirs
+    log_to_process_queue(log_queue)
+
+
+def parse_seq_run_dir_job(project, run_dir, num_run_dir, check_gdrive, scan_cache_entry, profile=False):
+    """
+     process pool worker for parse_seq_dirs: run every stage but backup of one run with an in-memory scan
+     cache holding only this run's entry. Returns the updated entry, the run's metrics, and the dirs_df and
+     RunTreeIndex the parent needs to run the backup stage (None if the run was unchanged), so the parent
+     process can save and finish them. Errors are returned instead of raised so one bad run doesn't abort
+     the others
+    """
+    # a worker parses several runs; each result only carries its own run's metrics
+    metrics = get_metrics()
+    metrics.reset()
+    scan_cache = None
+    if scan_cache_entry is not False:
+        scan_cache = ScanCache(None)
+        if scan_cache_entry is not None:
+            scan_cache.entries[run_dir] = scan_cache_entry
+    backup_args = None
     try:
+        with profiling('parse_seq_dirs', enabled=profile):
+            result = run_seq_run_dir_pipeline(project, run_dir, num_run_dir, check_gdrive=check_gdrive,
+                                              scan_cache=scan_cache, skip_stages=(BACKUP,))
+        if result is not None:
+            parser, context = result
+            # only the runs that passed validate are backed up by the parent
+            backup_args = (context.get_backup_df(), parser.run_tree_index)
+        error = None
+    except Exception as err:
+        error = str(err)
+    if scan_cache is not None:
+        scan_cache_entry = scan_cache.entries.get(run_dir)
+    return run_dir, error, scan_cache_entry, metrics.to_dict(), backup_args
+
+
+def parse_seq_dirs(upload_parsing=False, move_parsing=False, move_staging=False, check_gdrive=False,
+                   use_scan_cache=True, jobs=1, profile=settings.PROFILE):
+    """
+     parse every run dir in staging
+     jobs: number of runs parsed at once in a process pool; 1 parses runs one after another. The backup
+     stage (MyData upload and moves to Backup) of each run still runs in this process, one run at a time,
+     and the workers' log records are written by this process.
+     Stage times, copy throughput and runs per state are written with write_metrics('parse_seq_dirs').
+     profile: cProfile each pipeline stage of each run into LOG_FILE_DIR/profiles/<run_id>/
+    """
+    try:
+        metrics = get_metrics()
+        metrics.reset()
         project_dirs = glob.glob(os.path.join(settings.MISEQ_STAGING_DIR, '*/'))
+        # runs that are unchanged since they were last fully parsed are skipped
+        if use_scan_cache:
+            scan_cache = ScanCache(settings.LOG_FILE_DIR + settings.SEQ_SCAN_CACHE_FILENAME)
+        else:
+            scan_cache = None
 
+        run_jobs = []
         for project_dir in project_dirs:
             dir_length = len(os.listdir(project_dir))
             # if there are no files in the directory, skip processing it
@@ -336,31 +513,72 @@ def parse_seq_dirs(upload_parsing=False, move_parsing=False, move_staging=False,
             for run_dir in run_dir_list:
                 # the number of sequencing runs per project
                 num_run_dir = len(run_dir_list)
-                alignment_dirs_list = glob.glob(os.path.join(run_dir, '*/'))
-                # convert forward slashes to backwards slashes
-                alignment_dirs_list = [dir_path.replace('\\', '/') for dir_path in alignment_dirs_list]
-
-                miseq_run_dirs = ["Alignment", "Data", "Thumbnail_Images", "Config", "InterOp"]
-                check_miseq_dirs = [run_dir for run_dir in alignment_dirs_list if any(ignore in run_dir for ignore in miseq_run_dirs)]
-
-                # grab filepath with "Alignment" in it
-                # alignment_dir = [algndir for algndir in alignment_dirs_list if "Alignment" in algndir]
-                if not check_miseq_dirs:
-                    gp = GenericParser(project, run_dir, num_run_dir, check_gdrive)
-                    dirs_df = gp.parse_fastq_files()
-                    upload_action, parsing_action, staging_action = gp.complete_upload_backup(dirs_df, upload_parsing,
-                                                                                              move_parsing, move_staging)
-                else:
-                    mp = MiSeqParser(project, run_dir, num_run_dir, check_gdrive)
-                    dirs_df = mp.parse_fastq_files()
-                    upload_action, parsing_action, staging_action = mp.complete_upload_backup(dirs_df, upload_parsing,
-                                                                                              move_parsing, move_staging)
+                run_jobs.append((project, run_dir, num_run_dir))
+
+        failed_run_dirs = []
+        if jobs > 1 and len(run_jobs) > 1:
+            api_logger.info('[PARALLEL] parse_seq_dirs: ' + str(len(run_jobs)) + ' runs, ' + str(jobs) + ' jobs')
+            # {run_dir: (project, num_run_dir)}
+            run_job_args = {run_dir: (project, num_run_dir) for project, run_dir, num_run_dir in run_jobs}
+            log_queue, log_listener = start_process_log_listener()
+            try:
+                with ProcessPoolExecutor(max_workers=jobs, initializer=init_parse_seq_run_dir_job,
+                                         initargs=(log_queue,)) as executor:
+                    futures = []
+                    for project, run_dir, num_run_dir in run_jobs:
+                        if scan_cache is not None:
+                            scan_cache_entry = scan_cache.entries.get(run_dir)
+                        else:
+                            scan_cache_entry = False
+                        futures.append(executor.submit(parse_seq_run_dir_job, project, run_dir, num_run_dir,
+                                                       check_gdrive, scan_cache_entry, profile))
+                    for future in as_completed(futures):
+                        run_dir, error, scan_cache_entry, run_metrics, backup_args = future.result()
+                        metrics.merge(run_metrics)
+                        if error is None and backup_args is not None:
+                            # uploads and moves to Backup happen here, one run at a time, as runs finish parsing
+                            project, num_run_dir = run_job_args[run_dir]
+                            try:
+                                with profiling('parse_seq_dirs', enabled=profile):
+                                    backup_seq_run_dir(project, run_dir, num_run_dir, *backup_args,
+                                                       upload_parsing=upload_parsing, move_parsing=move_parsing,
+                                                       move_staging=move_staging)
+                            except Exception as err:
+                                error = str(err)
+                        if error is not None:
+                            api_logger.error('[FAILED RUN] parse_seq_dirs: [' + run_dir + '] (' + error + ')')
+                            metrics.inc(RUNS, state='failed')
+                            failed_run_dirs.append(run_dir)
+                        elif scan_cache is not None and scan_cache_entry is not None:
+                            # a run is only skipped next time once its backup has also finished
+                            scan_cache.entries[run_dir] = scan_cache_entry
+            finally:
+                log_listener.stop()
+        else:
+            with profiling('parse_seq_dirs', enabled=profile):
+                for project, run_dir, num_run_dir in run_jobs:
+                    try:
+                        parse_seq_run_dir(project, run_dir, num_run_dir, upload_parsing, move_parsing,
+                                          move_staging, check_gdrive, scan_cache)
+                    except Exception as err:
+                        api_logger.error('[FAILED RUN] parse_seq_dirs: [' + run_dir + '] (' + str(err) + ')')
+                        metrics.inc(RUNS, state='failed')
+                        failed_run_dirs.append(run_dir)
+        if scan_cache is not None:
+            scan_cache.save()
+        write_metrics('parse_seq_dirs')
+        if failed_run_dirs:
+            raise RuntimeError(str(len(failed_run_dirs)) + ' of ' + str(len(run_jobs)) + ' runs failed: ' +
+                               str(failed_run_dirs))
         # show_complete_dialog(upload_action, parsing_action, staging_action)
     except Exception as err:
         raise RuntimeError("** Error: parse_seq_dirs Failed (" + str(err) + ")")
 
 
 class MiSeqParser:
+    # columns of Fastq_filelist.csv, before the checksum columns
+    FASTQ_FILELIST_CSV_COLUMNS = FASTQ_FILELIST_COLUMNS
+
     def __init__(self, project, run_dir, num_run_dir, check_gdrive,
                  staging_dir=settings.MISEQ_STAGING_DIR,
                  output_dir=settings.MISEQ_UPLOAD_DIR,
@@ -369,7 +587,12 @@ class MiSeqParser:
                  log_file_dir=settings.LOG_FILE_DIR,
                  data_directory=settings.MISEQ_DATA_DIRECTORY,
                  folder_structure=settings.FOLDER_STRUCTURE,
-                 mytardis_url=settings.MYTARDIS_URL,):
+                 mytardis_url=settings.MYTARDIS_URL,
+                 run_tree_index=None,
+                 scan_cache=None,
+                 link_mode=settings.UPLOAD_LINK_MODE,
+                 checksum_algorithms=settings.FASTQ_CHECKSUM_ALGORITHMS,
+                 run_catalog=None):
         self.staging_dir = staging_dir
         self.backup_dir = backup_dir
         self.backup_staging_dir_name = "Staging/"
@@ -385,80 +608,69 @@ class MiSeqParser:
         self.run_dir = run_dir
         self.num_run_dir = num_run_dir
         self.check_gdrive = check_gdrive
-        # gsheet
-        self.worksheet = get_gsheet()
+        # how fastq files are placed in the Upload tree: 'copy', 'hardlink' or 'symlink'
+        self.link_mode = link_mode
+        # checksums computed while copying fastq files, written to Fastq_filelist.csv
+        self.checksum_algorithms = list(checksum_algorithms)
+        if run_tree_index is None:
+            run_tree_index = RunTreeIndex(run_dir)
+        self.run_tree_index = run_tree_index
+        # persistent scan state shared across parsers; None disables it
+        self.scan_cache = scan_cache
+        if run_catalog is None:
+            run_catalog = RunCatalog(log_file_dir + settings.RUN_CATALOG_FILENAME)
+        self.run_catalog = run_catalog
+        # parquet archive of the fastq records of every parse pass
+        self.fastq_archive = FastqArchive(log_file_dir + settings.FASTQ_ARCHIVE_DIRNAME)
+        # number of fastq dirs that passed every check and had their Fastq_filelist.csv written
+        self.num_parsed_fastq_dirs = 0
+
+    @property
+    def worksheet(self):
+        """
+         gsheet; only authorized when a check_gdrive stage first needs it, then shared by every parser
+        """
+        return get_gsheet()
 
-    def get_dirs(self, export_csv=True, rta_complete=True):
+    def scan_dirs(self):
         """
-         get dirs and put in pandas df
+         scan run dir and put in pandas df
         """
         try:
-            parse_types = []
-            parse_dates = []
-            run_ids = []
-            run_dirs = []
-            align_subdirs = []
-            fastq_dirs = []
-            projects = []
-            num_align_subdirs = []
-            rta_completes = []
-            rta_complete_times = []
-            run_dates = []
-            run_completion_times = []
-            num_fastq_files = []
-            num_run_dirs = []
-            run_dirs_create_dates = []
-            fastq_dirs_create_dates = []
-            align_subdirs_create_dates = []
-            sequencing_completes = []
+            run_records = []
 
             project = self.project
             run_dir = self.run_dir
             num_run_dir = self.num_run_dir
+            run_tree_index = self.run_tree_index
 
             parse_type = "MiSeq"
             parse_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
             # if rta_complete exists, sets variable to True to be filtered on
             # to only process rta_complete directories
-            rta_complete, rta_complete_time = check_rta_complete(run_dir)
-            # run_id = Path(run_dir).name
-            # grab run_id and run_date from RunInfo.xml
-            run_id = get_run_id_xml(run_dir)
-            run_date = get_run_date_xml(run_dir)
-            # grab completion_time from CompleteJobInfo.xml
-            completion_time = get_run_completion_time_xml(run_dir)
+            # RTAComplete.txt, RunInfo.xml and CompletedJobInfo.xml are each parsed once
+            run_metadata = RunMetadata(run_dir, run_tree_index)
+            run_metadata.log_summary()
+            rta_complete, rta_complete_time = run_metadata.rta_complete, run_metadata.rta_complete_time
             run_dir_create_date = datetime.fromtimestamp(get_creation_dt(run_dir)).strftime('%Y-%m-%d %H:%M:%S')
             # check for .fastqz files in all sub directories of the run_dir
-            fastq_files = glob.glob(os.path.join(run_dir, '**/*.fastq.gz'), recursive=True)
-            fastq_files_list = [dir_path.replace('\\', '/') for dir_path in fastq_files]
-            num_fastq_file = len(fastq_files_list)
+            fastq_files_list = run_tree_index.get_paths(FASTQ)
+            # fields shared by every fastq dir of the run
+            # run_id = Path(run_dir).name
+            # grab run_id and run_date from RunInfo.xml, completion_time from CompleteJobInfo.xml
+            run_record = RunRecord(run_id=run_metadata.run_id, parse_type=parse_type, parse_date=parse_date,
+                                   project=project, run_date=run_metadata.run_date,
+                                   run_completion_time=run_metadata.completion_time, run_dir=run_dir,
+                                   run_dir_create_date=run_dir_create_date, num_run_dir=num_run_dir,
+                                   num_fastq_files=len(fastq_files_list), rta_complete=rta_complete,
+                                   rta_complete_time=rta_complete_time)
             if not rta_complete:
                 # if rta_complete is false, then the run is not complete
-                align_subdir = align_subdir_create_date = num_align_subdir = fastq_dir = \
-                    fastq_dir_create_date = "Run Failed"
                 # if Run Failed, then Sequencing was never complete
-                sequencing_complete = False
-
-                # append to lists
-                parse_types.append(parse_type)
-                parse_dates.append(parse_date)
-                projects.append(project)
-                run_ids.append(run_id)
-                run_dates.append(run_date)
-                run_completion_times.append(completion_time)
-                num_fastq_files.append(num_fastq_file)
-                run_dirs.append(run_dir)
-                run_dirs_create_dates.append(run_dir_create_date)
-                num_run_dirs.append(num_run_dir)
-                align_subdirs.append(align_subdir)
-                align_subdirs_create_dates.append(align_subdir_create_date)
-                num_align_subdirs.append(num_align_subdir)
-                fastq_dirs.append(fastq_dir)
-                fastq_dirs_create_dates.append(fastq_dir_create_date)
-                rta_completes.append(rta_complete)
-                rta_complete_times.append(rta_complete_time)
-                sequencing_completes.append(sequencing_complete)
+                run_records.append(run_record.copy(align_subdir="Run Failed", align_subdir_create_date="Run Failed",
+                                                   num_align_subdir="Run Failed", fastq_dir="Run Failed",
+                                                   fastq_dir_create_date="Run Failed", sequencing_complete=False))
             else:
                 alignment_dirs_list = glob.glob(os.path.join(run_dir, '*/'))
                 # convert forward slashes to backwards slashes
@@ -468,43 +680,23 @@ class MiSeqParser:
                 if not alignment_dir:
                     # if there is no Alignment folder, then the Sequencing did
                     # not complete and there are no Fastq files
-                    # append to lists
-                    align_subdir = align_subdir_create_date = num_align_subdir = fastq_dir = \
-                        fastq_dir_create_date = "Sequencing Incomplete"
                     # if no alignment folder, then Sequencing was not complete
-                    sequencing_complete = False
-
-                    # append to lists
-                    parse_types.append(parse_type)
-                    parse_dates.append(parse_date)
-                    projects.append(project)
-                    run_ids.append(run_id)
-                    run_dates.append(run_date)
-                    run_completion_times.append(completion_time)
-                    num_fastq_files.append(num_fastq_file)
-                    run_dirs.append(run_dir)
-                    run_dirs_create_dates.append(run_dir_create_date)
-                    num_run_dirs.append(num_run_dir)
-                    align_subdirs.append(align_subdir)
-                    align_subdirs_create_dates.append(align_subdir_create_date)
-                    num_align_subdirs.append(num_align_subdir)
-                    fastq_dirs.append(fastq_dir)
-                    fastq_dirs_create_dates.append(fastq_dir_create_date)
-                    rta_completes.append(rta_complete)
-                    rta_complete_times.append(rta_complete_time)
-                    sequencing_completes.append(sequencing_complete)
+                    run_records.append(run_record.copy(align_subdir="Sequencing Incomplete",
+                                                       align_subdir_create_date="Sequencing Incomplete",
+                                                       num_align_subdir="Sequencing Incomplete",
+                                                       fastq_dir="Sequencing Incomplete",
+                                                       fastq_dir_create_date="Sequencing Incomplete",
+                                                       sequencing_complete=False))
                 else:
                     # convert list to string
                     alignment_dir = ''.join(alignment_dir)
                     # there is an Sequencing folder, then Sequencing should be complete
-                    sequencing_complete = True
 
                     align_subdirs_list = glob.glob(os.path.join(alignment_dir, '*/'))
                     # convert forward slashes to backwards slashes
                     align_subdirs_list = [dir_path.replace('\\', '/') for dir_path in align_subdirs_list]
                     for align_subdir in align_subdirs_list:
                         align_subdir_create_date = datetime.fromtimestamp(get_creation_dt(align_subdir)).strftime('%Y-%m-%d %H:%M:%S')
-                        num_align_subdir = len(align_subdirs_list)
                         fastq_dirs_list = glob.glob(os.path.join(align_subdir, '*/'))
                         # convert forward slashes to backwards slashes
                         fastq_dirs_list = [dir_path.replace('\\', '/') for dir_path in fastq_dirs_list]
@@ -517,64 +709,37 @@ class MiSeqParser:
                         # grab all other dirs and leave as list
                         # other_dirs = [fqdir for fqdir in fastq_dirs_list if not "Fastq" in fqdir]
 
-                        # append to lists
-                        parse_types.append(parse_type)
-                        parse_dates.append(parse_date)
-                        projects.append(project)
-                        run_ids.append(run_id)
-                        run_dates.append(run_date)
-                        run_completion_times.append(completion_time)
-                        num_fastq_files.append(num_fastq_file)
-                        run_dirs.append(run_dir)
-                        run_dirs_create_dates.append(run_dir_create_date)
-                        num_run_dirs.append(num_run_dir)
-                        align_subdirs.append(align_subdir)
-                        align_subdirs_create_dates.append(align_subdir_create_date)
-                        num_align_subdirs.append(num_align_subdir)
-                        fastq_dirs.append(fastq_dir)
-                        fastq_dirs_create_dates.append(fastq_dir_create_date)
-                        rta_completes.append(rta_complete)
-                        rta_complete_times.append(rta_complete_time)
-                        sequencing_completes.append(sequencing_complete)
-
-            dirs_df = pd.DataFrame(list(zip(run_ids, parse_types, parse_dates, projects, run_dates,
-                                            run_completion_times, run_dirs, run_dirs_create_dates, num_run_dirs,
-                                            align_subdirs, align_subdirs_create_dates, num_align_subdirs,
-                                            fastq_dirs, num_fastq_files, fastq_dirs_create_dates,
-                                            rta_completes, rta_complete_times, sequencing_completes)),
-                                   columns=['run_id', 'parse_type', 'parse_date', 'project', 'run_date',
-                                            'run_completion_time',
-                                            'run_dir', 'run_dir_create_date', 'num_run_dir',
-                                            'align_subdir', 'align_subdir_create_date', 'num_align_subdir',
-                                            'fastq_dir', 'num_fastq_files', 'fastq_dir_create_date',
-                                            'rta_complete', 'rta_complete_time', 'sequencing_complete'])
-            # output dirs to csv
+                        run_records.append(run_record.copy(align_subdir=align_subdir,
+                                                           align_subdir_create_date=align_subdir_create_date,
+                                                           num_align_subdir=len(align_subdirs_list),
+                                                           fastq_dir=fastq_dir,
+                                                           fastq_dir_create_date=fastq_dir_create_date,
+                                                           sequencing_complete=True))
+
+            dirs_df = records_to_df(run_records, RunRecord)
+            return dirs_df
+        except Exception as err:
+            raise RuntimeError("** Error: scan_dirs Failed (" + str(err) + ")")
+
+    def get_dirs(self, export_csv=True, rta_complete=True):
+        """
+         get dirs and put in pandas df
+        """
+        try:
+            run_dir = self.run_dir
+            scan_cache = self.scan_cache
+            dirs_df = None
+            if scan_cache is not None:
+                # reuse cached rows if the run dir is unchanged since the last scan
+                fingerprint = self.run_tree_index.get_fingerprint()
+                dirs_df = scan_cache.get_dirs_df(run_dir, fingerprint)
+            if dirs_df is None:
+                dirs_df = self.scan_dirs()
+                if scan_cache is not None:
+                    scan_cache.set_dirs_df(run_dir, fingerprint, dirs_df)
+            # record dirs in the run catalog; seq_dirlist.csv is exported from it (python -m mytd_parser catalog-export)
             if export_csv:
-                output_csv_filename = self.log_file_dir + 'seq_dirlist.csv'
-                if os.path.exists(output_csv_filename):
-                    # print(output_csv_filename)
-                    api_logger.info('[GET DIRS] dirs_df_old: ' +
-                                    ' [(' + output_csv_filename + ']')
-                    dirs_df_old = pd.read_csv(output_csv_filename)
-                    if not dirs_df_old.empty:
-                        dirs_df_old = dirs_df_old.set_index('run_id')
-                        dirs_df_id = dirs_df.copy()
-                        dirs_df_id = dirs_df_id.set_index('run_id')
-                        # merge the existing and new dirs_df and update fields based on run_id
-                        dirs_df_new = dirs_df_id.combine_first(dirs_df_old).reset_index()
-                        dirs_df_new.to_csv(output_csv_filename, encoding='utf-8', index=False, header=True)
-                    else:
-                        api_logger.info('[GET DIRS] dirs_df_new: ' +
-                                        ' [(' + output_csv_filename + ']')
-                        dirs_df_id = dirs_df.copy()
-                        dirs_df_id = dirs_df_id.set_index('run_id')
-                        dirs_df_id.to_csv(output_csv_filename, encoding='utf-8', index=True)
-                else:
-                    api_logger.info('[GET DIRS] dirs_df_new: ' +
-                                    ' [(' + output_csv_filename + ']')
-                    dirs_df_id = dirs_df.copy()
-                    dirs_df_id = dirs_df_id.set_index('run_id')
-                    dirs_df_id.to_csv(output_csv_filename, encoding='utf-8', index=True)
+                self.run_catalog.upsert_runs('seq_runs', df_to_records(dirs_df, RunRecord))
             if rta_complete:
                 # subset by directories that have rta_complete.txt; we do not want to process incomplete sequencing runs
                 dirs_df_rta_complete = dirs_df[(dirs_df['rta_complete'] == True) &
@@ -585,411 +750,364 @@ class MiSeqParser:
         except Exception as err:
             raise RuntimeError("** Error: get_dirs Failed (" + str(err) + ")")
 
-    def copy_metadata_dirs(self, ignore_dirs):
+    def check_run_gates(self, run_record):
         """
-         copy metadata dirs and files
+         True if a fastq dir is ready to parse: the run is complete and, with check_gdrive, the number of fastq
+         files matches the gsheet. Evaluated once per fastq dir by the pipeline's validate stage
         """
         try:
-            api_logger.info('[START] copy_metadata_dirs')
-            dirs_df = self.get_dirs(export_csv=True, rta_complete=True)
-            output_dir = self.output_dir
-            check_gdrive = self.check_gdrive
-            worksheet = self.worksheet
-            align_counter = 1
-            for index, row in dirs_df.iterrows():
-                num_align_subdir = row['num_align_subdir']
-
-                project = row['project']
-                run_id = row['run_id']
-                align_subdir = row['align_subdir']
-                fastq_dir = row['fastq_dir']
-                # check if run complete
-                completion_time = row['run_completion_time']
-                rta_complete = row['rta_complete']
-                rta_complete_time = row['rta_complete_time']
-                sequencing_complete = row['sequencing_complete']
-
-                # check if gdrive upload complete
-                num_fastq_files = row['num_fastq_files']
-
-                if check_gdrive:
-                    # worksheet = get_gsheet()
-                    num_fastq_gsheets = get_fastq_num_runid_gsheets(worksheet, run_id)
-
-                    api_logger.info('[CHECK GDRIVE] check_gdrive (num_fastq_gsheets): ' +
+            project = run_record.project
+            run_id = run_record.run_id
+            align_subdir = run_record.align_subdir
+            fastq_dir = run_record.fastq_dir
+            num_align_subdir = run_record.num_align_subdir
+
+            # check if gdrive upload complete
+            num_fastq_files = run_record.num_fastq_files
+
+            if self.check_gdrive:
+                # worksheet = get_gsheet()
+                num_fastq_gsheets = get_fastq_num_runid_gsheets(self.worksheet, run_id)
+
+                api_logger.info('[CHECK GDRIVE] check_gdrive (num_fastq_gsheets): ' +
+                                ' [(' + str(num_fastq_files) + '/' + str(num_fastq_gsheets) + '), ' +
+                                project + ', ' + run_id + ',' + fastq_dir + ']')
+                if num_fastq_gsheets is None:
+                    # if num_fastq_gsheets is None, then nothing returned on lookup via gspread.
+                    api_logger.info('[INCOMPLETE RUN] [NO GDRIVE LOOKUP MATCH] validate (num_fastq_gsheets): ' +
                                     ' [(' + str(num_fastq_files) + '/' + str(num_fastq_gsheets) + '), ' +
                                     project + ', ' + run_id + ',' + fastq_dir + ']')
-                    if num_fastq_gsheets is None:
-                        # if num_fastq_gsheets is None, then nothing returned on lookup via gspread.
-                        api_logger.info('[INCOMPLETE RUN] [NO GDRIVE LOOKUP MATCH] parse_fastq_files (num_fastq_gsheets): ' +
-                                        ' [(' + str(num_fastq_files) + '/' + str(num_fastq_gsheets) + '), ' +
-                                        project + ', ' + run_id + ',' + fastq_dir + ']')
-                        continue
-                    if str(num_fastq_gsheets) != str(num_fastq_files):
-                        # log info
-                        api_logger.info('[INCOMPLETE RUN] parse_fastq_files (num_fastq_gsheets): ' +
-                                        ' [(' + str(num_fastq_files) + '/' + str(num_fastq_gsheets) + '), ' +
-                                        project + ', ' + run_id + ',' + fastq_dir + ']')
-                        continue
-
-                if not rta_complete or not sequencing_complete:
+                    return False
+                if str(num_fastq_gsheets) != str(num_fastq_files):
                     # log info
-                    api_logger.info('[INCOMPLETE RUN] copy_metadata_dirs: ' + project + ', ' + run_id +
-                                    ', [' + align_subdir + ', ' +
-                                    fastq_dir + '], Num Subalign: ' + str(num_align_subdir))
-                    continue
-                else:
+                    api_logger.info('[INCOMPLETE RUN] validate (num_fastq_gsheets): ' +
+                                    ' [(' + str(num_fastq_files) + '/' + str(num_fastq_gsheets) + '), ' +
+                                    project + ', ' + run_id + ',' + fastq_dir + ']')
+                    return False
 
-                    # only need to copy metadata once per align_subdir
-                    if num_align_subdir == 1:
-                        # reset counter to 1 if only 1 subdir
-                        align_counter = 1
-                    if align_counter > 1:
-                        # if counter is greater than 1, skip to next
-                        continue
-                    project = row['project']
-                    run_dir = row['run_dir']
-                    run_id = row['run_id']
-                    fastq_dir_create_date = row['fastq_dir_create_date']
-                    align_subdir = row['align_subdir']
-                    fastq_dir = row['fastq_dir']
-                    # log info
-                    api_logger.info('copy_metadata_dirs: ' + project + ', ' + run_id + ', [' + run_dir + ', ' +
-                                    align_subdir + ', ' + fastq_dir + '], ' + str(num_align_subdir))
-
-                    output_metadata_dir = output_dir + project + "/" + run_id + "/run_metadata_" + run_id + "/"
-                    # if directory doesn't exist, create it and modify the run dir create date
-                    if not os.path.exists(output_metadata_dir):
-                        os.makedirs(output_metadata_dir)
-                        modify_create_date(run_dir, output_dir + project + "/" + run_id + "/")
-                        modify_create_date(run_dir, output_metadata_dir)
-
-                    run_dirs_list = glob.glob(os.path.join(run_dir, '*/'))
-                    run_dirs_list = [dir_path.replace('\\', '/') for dir_path in run_dirs_list]
-                    if ignore_dirs:
-                        # if ignore_dirs = True, do not copy any folders to Upload
-                        ignore_list = run_dirs_list
-                        api_logger.info('Ignore Dirs: ' + str(ignore_list))
-                    else:
-                        # copy files to run_metadata folder
-                        # Alignment is here because it will be treated differently
-                        ignore_list = ["Alignment", "Data", "Thumbnail_Images"]
-                        api_logger.info('Ignore Dirs: ' + str(ignore_list))
-                    # directories in run folder to keep and move to run_metadata folder
-                    keep_dirs_list = [rundir for rundir in run_dirs_list if not any(ignore in rundir for ignore in ignore_list)]
-                    api_logger.info('Keep Dirs: ' + str(keep_dirs_list))
-                    num_dirs = len(keep_dirs_list)
-
-                    run_dir_files_list = glob.glob(os.path.join(run_dir, '*'))
-                    run_dir_files_list = [dir_path.replace('\\', '/') for dir_path in run_dir_files_list]
-
-                    # files in run folder to move to run_metadata folder
-                    file_list = [file for file in run_dir_files_list if os.path.isfile(file)]
-                    num_files = len(file_list)
-                    # log info
-                    api_logger.info('Start copying ' + str(num_files) + ' files')
-                    file_count = 0
-                    for file in file_list:
-                        filename = os.path.basename(file)
-                        output_file = output_metadata_dir+filename
-                        # print(out_file)
-                        if not os.path.exists(output_file):
-                            copy2(file, output_metadata_dir)
-                            file_count += 1
-                        # log info
-                    if file_count == 0:
-                        api_logger.info('[All Exist] End copied ' + str(file_count) + ' files')
-                    else:
-                        api_logger.info('End copied ' + str(file_count) + ' files')
-                    if num_dirs > 0:
-                        # if there are directories in list, copy them. Otherwise do nothing.
-                        api_logger.info('Start copying ' + str(num_dirs) + ' dirs')
-                        dir_count = 0
-                        for keep_dir in keep_dirs_list:
-                            dir_name = Path(keep_dir).name
-                            output_dir = output_metadata_dir + dir_name + '/'
-                            # print(out_dir)
-                            if not os.path.exists(output_dir):
-                                copy_tree(keep_dir, output_dir)
-                                modify_create_date(keep_dir, output_dir)
-                                dir_count += 1
-                        if dir_count == 0:
-                            api_logger.info('[All Exist] End copied ' + str(dir_count) + ' dirs')
-                        else:
-                            # log info
-                            api_logger.info('End copied ' + str(dir_count) + ' dirs')
-                    if num_align_subdir > 1:
-                        # if more than 1 align_subdir, add 1 to counter
-                        align_counter += 1
-            api_logger.info('[END] copy_metadata_dirs')
-            return dirs_df
+            # check if run complete
+            if not run_record.rta_complete or not run_record.sequencing_complete:
+                # log info
+                api_logger.info('[INCOMPLETE RUN] validate: ' + project + ', ' + run_id +
+                                ', [' + str(align_subdir) + ', ' +
+                                fastq_dir + '], Num Subalign: ' + str(num_align_subdir))
+                return False
+            return True
         except Exception as err:
-            raise RuntimeError("** Error: copy_metadata_dirs Failed (" + str(err) + ")")
+            raise RuntimeError("** Error: check_run_gates Failed (" + str(err) + ")")
 
-    def parse_fastq_metadata_dirs(self):
+    def get_fastq_dir_name(self, run_record):
         """
-         parse fastq metadata dirs
+         name of the fastq dir in Upload after "Fastq_": the name of the Alignment subdir, e.g., "20201224_205858"
         """
-        try:
-            api_logger.info('[START] parse_fastq_metadata_dirs')
-            dirs_df = self.copy_metadata_dirs(ignore_dirs=True)
-            output_dir = self.output_dir
-            check_gdrive = self.check_gdrive
-            worksheet = self.worksheet
+        return Path(run_record.align_subdir).name
 
-            for index, row in dirs_df.iterrows():
-                num_align_subdir = row['num_align_subdir']
-                project = row['project']
-                run_id = row['run_id']
-                align_subdir = row['align_subdir']
-                fastq_dir = row['fastq_dir']
-
-                # check if run complete
-                rta_complete_time = row['rta_complete_time']
-                completion_time = row['run_completion_time']
-                rta_complete = row['rta_complete']
-                sequencing_complete = row['sequencing_complete']
+    def get_output_fastq_dir(self, run_record):
+        return (self.output_dir + run_record.project + "/" + run_record.run_id + "/Fastq_" +
+                self.get_fastq_dir_name(run_record) + "/")
 
-                # check if gdrive upload complete
-                num_fastq_files = row['num_fastq_files']
+    def get_fastq_dir_files(self, run_record):
+        """
+         fastq files and summary files of a fastq dir, from the run tree index
+        """
+        fastq_files_list = self.run_tree_index.get_files_in(FASTQ, run_record.fastq_dir)
+        fastq_summary_file_list = self.run_tree_index.get_files_in(SUMMARY, run_record.fastq_dir)
+        return fastq_files_list, fastq_summary_file_list
 
-                if check_gdrive:
-                    num_fastq_gsheets = get_fastq_num_runid_gsheets(worksheet, run_id)
-                    api_logger.info('[CHECK GDRIVE] check_gdrive (num_fastq_gsheets): ' +
-                                    ' [(' + str(num_fastq_files) + '/' + str(num_fastq_gsheets) + '), ' +
-                                    project + ', ' + run_id + ',' + fastq_dir + ']')
-                    if num_fastq_gsheets is None:
-                        # if num_fastq_gsheets is None, then nothing returned on lookup via gspread.
-                        api_logger.info('[INCOMPLETE RUN] [NO GDRIVE LOOKUP MATCH] parse_fastq_files (num_fastq_gsheets): ' +
-                                        ' [(' + str(num_fastq_files) + '/' + str(num_fastq_gsheets) + '), ' +
-                                        project + ', ' + run_id + ',' + fastq_dir + ']')
-                        continue
-                    if str(num_fastq_gsheets) != str(num_fastq_files):
-                        # log info
-                        api_logger.info('[INCOMPLETE RUN] parse_fastq_files (num_fastq_gsheets): ' +
-                                        ' [(' + str(num_fastq_files) + '/' + str(num_fastq_gsheets) + '), ' +
-                                        project + ', ' + run_id + ',' + fastq_dir + ']')
-                        continue
-
-                if not rta_complete or not sequencing_complete:
-                    # log info
-                    api_logger.info('[INCOMPLETE RUN] parse_fastq_metadata_dirs: ' + project + ', ' + run_id +
-                                    ', [' + align_subdir + ', ' +
-                                    fastq_dir + '], Num Subalign: ' + str(num_align_subdir))
-                    continue
+    def copy_run_metadata(self, run_record, ignore_dirs):
+        """
+         copy metadata files of the run dir, and with ignore_dirs=False its metadata dirs, to run_metadata
+        """
+        try:
+            output_dir = self.output_dir
+            project = run_record.project
+            run_dir = run_record.run_dir
+            run_id = run_record.run_id
+            align_subdir = run_record.align_subdir
+            fastq_dir = run_record.fastq_dir
+            num_align_subdir = run_record.num_align_subdir
+            # log info
+            api_logger.info('copy_run_metadata: ' + project + ', ' + run_id + ', [' + run_dir + ', ' +
+                            align_subdir + ', ' + fastq_dir + '], ' + str(num_align_subdir))
+
+            output_metadata_dir = output_dir + project + "/" + run_id + "/run_metadata_" + run_id + "/"
+            # if directory doesn't exist, create it and modify the run dir create date
+            if not os.path.exists(output_metadata_dir):
+                os.makedirs(output_metadata_dir)
+                modify_create_date(run_dir, output_dir + project + "/" + run_id + "/")
+                modify_create_date(run_dir, output_metadata_dir)
+
+            run_dirs_list = glob.glob(os.path.join(run_dir, '*/'))
+            run_dirs_list = [dir_path.replace('\\', '/') for dir_path in run_dirs_list]
+            if ignore_dirs:
+                # if ignore_dirs = True, do not copy any folders to Upload
+                ignore_list = run_dirs_list
+                api_logger.debug('Ignore Dirs: %s', ignore_list)
+            else:
+                # copy files to run_metadata folder
+                # Alignment is here because it will be treated differently
+                ignore_list = ["Alignment", "Data", "Thumbnail_Images"]
+                api_logger.debug('Ignore Dirs: %s', ignore_list)
+            # directories in run folder to keep and move to run_metadata folder
+            keep_dirs_list = [rundir for rundir in run_dirs_list if not any(ignore in rundir for ignore in ignore_list)]
+            api_logger.debug('Keep Dirs: %s', keep_dirs_list)
+            num_dirs = len(keep_dirs_list)
+
+            run_dir_files_list = glob.glob(os.path.join(run_dir, '*'))
+            run_dir_files_list = [dir_path.replace('\\', '/') for dir_path in run_dir_files_list]
+
+            # files in run folder to move to run_metadata folder
+            file_list = [file for file in run_dir_files_list if os.path.isfile(file)]
+            num_files = len(file_list)
+            # log info
+            api_logger.debug('Start copying %s files', num_files)
+            file_count = 0
+            for file in file_list:
+                filename = os.path.basename(file)
+                output_file = output_metadata_dir+filename
+                # print(out_file)
+                if not os.path.exists(output_file):
+                    fast_copy2(file, output_metadata_dir)
+                    file_count += 1
+                # log info
+            if file_count == 0:
+                api_logger.debug('[All Exist] End copied %s files', file_count)
+            else:
+                api_logger.debug('End copied %s files', file_count)
+            if num_dirs > 0:
+                # if there are directories in list, copy them. Otherwise do nothing.
+                api_logger.debug('Start copying %s dirs', num_dirs)
+                dir_count = 0
+                for keep_dir in keep_dirs_list:
+                    dir_name = Path(keep_dir).name
+                    output_keep_dir = output_metadata_dir + dir_name + '/'
+                    # print(out_dir)
+                    if not os.path.exists(output_keep_dir):
+                        fast_copy_tree(keep_dir, output_keep_dir)
+                        modify_create_date(keep_dir, output_keep_dir)
+                        dir_count += 1
+                if dir_count == 0:
+                    api_logger.debug('[All Exist] End copied %s dirs', dir_count)
                 else:
                     # log info
-                    api_logger.info('parse_fastq_metadata_dirs: ' + project + ', ' + run_id + ', [' + align_subdir +
-                                    ', ' +
-                                    fastq_dir + '], ' + str(num_align_subdir))
-                    output_metadata_dir = output_dir + project + "/" + run_id + "/run_metadata_" + run_id + "/"
-                    align_subdir_list = glob.glob(os.path.join(align_subdir, '*/'))
-                    align_subdir_list = [dir_path.replace('\\', '/') for dir_path in align_subdir_list]
-                    # copy files to run_metadata folder
-                    # Alignment is here because it will be treated differently
-                    ignore_list = ["Fastq"]
-                    # directories in run folder to keep and move to run_metadata folder
-                    keep_dirs_list = [subdir for subdir in align_subdir_list if not any(ignore in subdir for ignore in ignore_list)]
-                    # log info
-                    api_logger.info('Keep Dirs: '+str(keep_dirs_list))
-                    num_dirs = len(keep_dirs_list)
+                    api_logger.debug('End copied %s dirs', dir_count)
+        except Exception as err:
+            raise RuntimeError("** Error: copy_run_metadata Failed (" + str(err) + ")")
 
-                    align_subdir_files_list = glob.glob(os.path.join(align_subdir, '*'))
-                    align_subdir_files_list = [dir_path.replace('\\', '/') for dir_path in align_subdir_files_list]
+    def copy_fastq_metadata(self, run_record):
+        """
+         copy the metadata files and dirs of an Alignment subdir (everything but Fastq) to run_metadata
+        """
+        try:
+            output_dir = self.output_dir
+            project = run_record.project
+            run_id = run_record.run_id
+            align_subdir = run_record.align_subdir
+            fastq_dir = run_record.fastq_dir
+            num_align_subdir = run_record.num_align_subdir
+            # log info
+            api_logger.info('copy_fastq_metadata: ' + project + ', ' + run_id + ', [' + align_subdir +
+                            ', ' +
+                            fastq_dir + '], ' + str(num_align_subdir))
+            output_metadata_dir = output_dir + project + "/" + run_id + "/run_metadata_" + run_id + "/"
+            align_subdir_list = glob.glob(os.path.join(align_subdir, '*/'))
+            align_subdir_list = [dir_path.replace('\\', '/') for dir_path in align_subdir_list]
+            # copy files to run_metadata folder
+            # Alignment is here because it will be treated differently
+            ignore_list = ["Fastq"]
+            # directories in run folder to keep and move to run_metadata folder
+            keep_dirs_list = [subdir for subdir in align_subdir_list if not any(ignore in subdir for ignore in ignore_list)]
+            # log info
+            api_logger.debug('Keep Dirs: %s', keep_dirs_list)
+            num_dirs = len(keep_dirs_list)
+
+            align_subdir_files_list = glob.glob(os.path.join(align_subdir, '*'))
+            align_subdir_files_list = [dir_path.replace('\\', '/') for dir_path in align_subdir_files_list]
+
+            # files in run folder to move to run_metadata folder
+            file_list = [file for file in align_subdir_files_list if os.path.isfile(file)]
+            num_files = len(file_list)
+            # files in run folder to move to run_metadata folder
+
+            # log info
+            api_logger.debug('Start copying %s files', num_files)
+            align_subdir_name = self.get_fastq_dir_name(run_record)
+            output_fastq_metadata_dir = output_metadata_dir + 'Fastq_' + align_subdir_name + '/'
+            if not os.path.exists(output_fastq_metadata_dir):
+                os.makedirs(output_fastq_metadata_dir)
+                modify_create_date(fastq_dir, output_fastq_metadata_dir)
+            file_count = 0
+            for file in file_list:
+                filename = os.path.basename(file)
+                output_file = output_fastq_metadata_dir+filename
+                # print(output_file)
+                if not os.path.exists(output_file):
+                    fast_copy2(file, output_fastq_metadata_dir)
+                    file_count += 1
+            if file_count == 0:
+                api_logger.debug('[All Exist] End copied %s files', file_count)
+            else:
+                # log info
+                api_logger.debug('End copied %s files', file_count)
+            api_logger.debug('Start copying %s dirs', num_dirs)
+            dir_count = 0
+            for keep_dir in keep_dirs_list:
+                dir_name = Path(keep_dir).name
+                output_fastq_metadata_subdir = output_fastq_metadata_dir + dir_name + '/'
+                if not os.path.exists(output_fastq_metadata_subdir):
+                    os.makedirs(output_fastq_metadata_subdir)
+                    modify_create_date(keep_dir, output_fastq_metadata_subdir)
+                    fast_copy_tree(keep_dir, output_fastq_metadata_subdir)
+                    dir_count += 1
+            if dir_count == 0:
+                api_logger.debug('[All Exist] End copied %s dirs', dir_count)
+            else:
+                # log info
+                api_logger.debug('End copied %s dirs', dir_count)
+        except Exception as err:
+            raise RuntimeError("** Error: copy_fastq_metadata Failed (" + str(err) + ")")
 
-                    # files in run folder to move to run_metadata folder
-                    file_list = [file for file in align_subdir_files_list if os.path.isfile(file)]
-                    num_files = len(file_list)
-                    # files in run folder to move to run_metadata folder
+    def copy_metadata_dirs(self, ignore_dirs):
+        """
+         copy metadata dirs and files of the complete fastq dirs; runs the pipeline up to its copy_metadata stage
+        """
+        try:
+            context = ParsePipeline(self, stages=(DISCOVER, VALIDATE, COPY_METADATA),
+                                    ignore_metadata_dirs=ignore_dirs).run()
+            return context.dirs_df
+        except Exception as err:
+            raise RuntimeError("** Error: copy_metadata_dirs Failed (" + str(err) + ")")
 
-                    # log info
-                    api_logger.info('Start copying ' + str(num_files) + ' files')
-                    align_subdir_name = Path(align_subdir).name
-                    output_fastq_metadata_dir = output_metadata_dir + 'Fastq_' + align_subdir_name + '/'
-                    if not os.path.exists(output_fastq_metadata_dir):
-                        os.makedirs(output_fastq_metadata_dir)
-                        modify_create_date(fastq_dir, output_fastq_metadata_dir)
-                    file_count = 0
-                    for file in file_list:
-                        filename = os.path.basename(file)
-                        output_file = output_fastq_metadata_dir+filename
-                        # print(output_file)
-                        if not os.path.exists(output_file):
-                            copy2(file, output_fastq_metadata_dir)
-                            file_count += 1
-                    if file_count == 0:
-                        api_logger.info('[All Exist] End copied ' + str(file_count) + ' files')
-                    else:
-                        # log info
-                        api_logger.info('End copied ' + str(file_count) + ' files')
-                    api_logger.info('Start copying ' + str(num_dirs) + ' dirs')
-                    dir_count = 0
-                    for keep_dir in keep_dirs_list:
-                        dir_name = Path(keep_dir).name
-                        output_fastq_metadata_subdir = output_fastq_metadata_dir + dir_name + '/'
-                        if not os.path.exists(output_fastq_metadata_subdir):
-                            os.makedirs(output_fastq_metadata_subdir)
-                            modify_create_date(keep_dir, output_fastq_metadata_subdir)
-                            copy_tree(keep_dir, output_fastq_metadata_subdir)
-                            dir_count += 1
-                    if dir_count == 0:
-                        api_logger.info('[All Exist] End copied ' + str(dir_count) + ' dirs')
-                    else:
-                        # log info
-                        api_logger.info('End copied ' + str(dir_count) + ' dirs')
-            api_logger.info('[END] parse_fastq_metadata_dirs')
-            return dirs_df
+    def parse_fastq_metadata_dirs(self):
+        """
+         parse fastq metadata dirs
+        """
+        try:
+            return self.copy_metadata_dirs(ignore_dirs=True)
         except Exception as err:
             raise RuntimeError("** Error: parse_fastq_metadata_dirs Failed (" + str(err) + ")")
 
-    def copy2_output_fastq_dir(self, fastq_df, output_fastq_dir, align_subdir_name):
-        # unique subset of sample_ids in same order as list
-        file_count = 0
-        fastq_files_list = []
+    def copy2_output_fastq_dir(self, fastq_records, output_fastq_dir, align_subdir_name):
+        """
+         copy (or hardlink/symlink, see link_mode) fastq files into output_fastq_dir with the copy engine's
+         thread pool, hashing each copied file with checksum_algorithms. Files already in output_fastq_dir
+         reuse the size and checksums recorded in the run catalog while they are unchanged (same size and
+         mtime_ns). Fills in upload_fastq_path, size, mtime_ns and checksums of each FastqRecord from the
+         file in output_fastq_dir.
+         returns file_count, bytes_copied, elapsed_time
+        """
+        copy_list = []
         if not os.path.exists(output_fastq_dir):
             os.makedirs(output_fastq_dir)
-        for index, row in fastq_df.iterrows():
-            fastq_file = row['fastq_path']
-            fastq_filename = os.path.basename(fastq_file)
-            base_fastq_filelist = "Fastq_" + align_subdir_name + "/" + fastq_filename
-            fastq_files_list.append(base_fastq_filelist)
+        for fastq_record in fastq_records:
+            fastq_filename = os.path.basename(fastq_record.fastq_path)
+            fastq_record.upload_fastq_path = "Fastq_" + align_subdir_name + "/" + fastq_filename
             output_fastq = output_fastq_dir + fastq_filename
-            # print(out_fastq)
-            if not os.path.exists(output_fastq):
-                copy2(fastq_file, output_fastq_dir)
-                file_count += 1
+            copy_list.append((fastq_record.fastq_path, output_fastq))
+        known_file_infos = None
+        if self.checksum_algorithms:
+            known_file_infos = self.run_catalog.get_fastq_file_infos(
+                [fastq_record.fastq_path for fastq_record in fastq_records])
+        file_count, bytes_copied, elapsed_time, errors, file_infos = copy_files(
+            copy_list, link_mode=self.link_mode, checksum_algorithms=self.checksum_algorithms,
+            known_file_infos=known_file_infos)
+        if errors:
+            raise RuntimeError(str(len(errors)) + ' of ' + str(len(copy_list)) + ' fastq files failed to copy: ' +
+                               str([input_file for input_file, error in errors]))
         if file_count == 0:
-            api_logger.info('[All Exist] copied ' + str(file_count) + ' files')
+            api_logger.debug('[All Exist] copied %s files', file_count)
         else:
-            api_logger.info('[MOVED] copied ' + str(file_count) + ' files')
-        return fastq_files_list, file_count
-
-    def parse_fastq_files(self, export_csv=True):
+            api_logger.debug('[MOVED] copied %s files', file_count)
+        for fastq_record in fastq_records:
+            file_info = file_infos[fastq_record.fastq_path]
+            fastq_record.size = file_info['size']
+            fastq_record.mtime_ns = file_info['mtime_ns']
+            fastq_record.checksums = {algo: file_info[algo] for algo in self.checksum_algorithms}
+        return file_count, bytes_copied, elapsed_time
+
+    def copy_fastq_dir(self, run_record):
         """
-         parse fastq files
+         copy the fastq files (and summary files) of a fastq dir to Upload.
+         returns the FastqRecords of the fastq files, with size and checksums
         """
         try:
-            api_logger.info('[START] parse_fastq_files')
-            dirs_df = self.parse_fastq_metadata_dirs()
-            output_dir = self.output_dir
-            check_gdrive = self.check_gdrive
-            worksheet = self.worksheet
-
-            for index, row in dirs_df.iterrows():
-                num_align_subdir = row['num_align_subdir']
-                project = row['project']
-                run_id = row['run_id']
-                align_subdir = row['align_subdir']
-                fastq_dir = row['fastq_dir']
-
-                # check if run complete
-                rta_complete_time = row['rta_complete_time']
-                completion_time = row['run_completion_time']
-                rta_complete = row['rta_complete']
-                sequencing_complete = row['sequencing_complete']
-
-                # check if gdrive upload complete
-                num_fastq_files = row['num_fastq_files']
+            project = run_record.project
+            run_id = run_record.run_id
+            fastq_dir = run_record.fastq_dir
+            # log info
+            api_logger.info('copy_fastq_dir: ' + project + ', ' + run_id + ', [' + str(run_record.align_subdir) +
+                            ', ' + fastq_dir + '], Num Subalign: ' + str(run_record.num_align_subdir))
+            # grab name of Alignment subdir, e.g., "20201224_205858"
+            fastq_dir_name = self.get_fastq_dir_name(run_record)
+            output_fastq_dir = self.get_output_fastq_dir(run_record)
+            if not os.path.exists(output_fastq_dir):
+                os.makedirs(output_fastq_dir)
+                modify_create_date(fastq_dir, output_fastq_dir)
+
+            fastq_files_list, fastq_summary_file_list = self.get_fastq_dir_files(run_record)
+            num_files = len(fastq_files_list)
+
+            # log info
+            api_logger.debug('Start copying %s files', num_files)
 
-                if check_gdrive:
-                    num_fastq_gsheets = get_fastq_num_runid_gsheets(worksheet, run_id)
-                    api_logger.info('[CHECK GDRIVE] check_gdrive (num_fastq_gsheets): ' +
-                                    ' [(' + str(num_fastq_files) + '/' + str(num_fastq_gsheets) + '), ' +
-                                    project + ', ' + run_id + ',' + fastq_dir + ']')
-                    if num_fastq_gsheets is None:
-                        # if num_fastq_gsheets is None, then nothing returned on lookup via gspread.
-                        api_logger.info('[INCOMPLETE RUN] [NO GDRIVE LOOKUP MATCH] parse_fastq_files (num_fastq_gsheets): ' +
-                                        ' [(' + str(num_fastq_files) + '/' + str(num_fastq_gsheets) + '), ' +
-                                        project + ', ' + run_id + ',' + fastq_dir + ']')
-                        continue
-                    if str(num_fastq_gsheets) != str(num_fastq_files):
-                        # log info
-                        api_logger.info('[INCOMPLETE RUN] parse_fastq_files (num_fastq_gsheets): ' +
-                                        ' [(' + str(num_fastq_files) + '/' + str(num_fastq_gsheets) + '), ' +
-                                        project + ', ' + run_id + ',' + fastq_dir + ']')
-                        continue
-
-                if not rta_complete or not sequencing_complete:
-                    # log info
-                    api_logger.info('[INCOMPLETE RUN] parse_fastq_files: ' + project + ', ' + run_id + ', [' + align_subdir + ', ' +
-                                    fastq_dir + '], Num Subalign: ' + str(num_align_subdir))
-                    continue
-                else:
-                    # log info
-                    api_logger.info('parse_fastq_files: ' + project + ', ' + run_id + ', [' + align_subdir + ', ' +
-                                    fastq_dir + '], Num Subalign: ' + str(num_align_subdir))
-                    # grab name of Alignment subdir, e.g., "20201224_205858"
-                    align_subdir_name = Path(align_subdir).name
-
-                    output_run_dir = output_dir + project + "/" + run_id + "/"
-                    output_fastq_dir = output_run_dir + "Fastq_" + align_subdir_name + "/"
-                    if not os.path.exists(output_fastq_dir):
-                        os.makedirs(output_fastq_dir)
-                        modify_create_date(fastq_dir, output_fastq_dir)
-
-                    fastq_files_list = glob.glob(os.path.join(fastq_dir, '*.fastq.gz'))
-                    fastq_files_list = [dir_path.replace('\\', '/') for dir_path in fastq_files_list]
-                    fastq_summary_file_list = glob.glob(os.path.join(fastq_dir, '*.txt'))
-                    fastq_summary_file_list = [dir_path.replace('\\', '/') for dir_path in fastq_summary_file_list]
-
-                    # files in run folder to move to run_metadata folder
-                    num_files = len(fastq_files_list)
-                    # files in run folder to move to run_metadata folder
+            parse_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            # parse each fastq filename for the sample_id, primer_pair and Illumina fields
+            fastq_records = get_fastq_records(fastq_files_list, parse_date, self.run_tree_index)
+            file_count, bytes_copied, elapsed_time = \
+                self.copy2_output_fastq_dir(fastq_records, output_fastq_dir, fastq_dir_name)
+
+            for summary_file in fastq_summary_file_list:
+                # copy summary file into each fastq sampleid_primerpair folder
+                fast_copy2(summary_file, output_fastq_dir)
+
+            # log info
+            api_logger.debug('End copied %s files', file_count)
+            return fastq_records
+        except Exception as err:
+            raise RuntimeError("** Error: copy_fastq_dir Failed (" + str(err) + ")")
 
-                    # log info
-                    api_logger.info('Start copying ' + str(num_files) + ' files')
-
-                    parse_dates = []
-                    sample_ids = []
-                    primer_pairs = []
-                    sampleids_primerpairs = []
-                    fastq_create_dates = []
-                    for fastq_file in fastq_files_list:
-                        # parse each fastq filename for the sample_id
-                        # leftmost after underscore split
-                        fastq_create_date = datetime.fromtimestamp(get_creation_dt(fastq_file)).strftime('%Y-%m-%d %H:%M:%S')
-                        fastq_name = Path(fastq_file).name
-                        sample_id = fastq_name.split('_', 1)[0]
-                        parse_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                        # if pattern matches, extract sample_id and/or primer_pair
-                        sample_id, primer_pair, sampleid_primerpair = get_sampleid_primerpair_name(sample_id)
-                        parse_dates.append(parse_date)
-                        primer_pairs.append(primer_pair)
-                        sample_ids.append(sample_id)
-                        sampleids_primerpairs.append(sampleid_primerpair)
-                        fastq_create_dates.append(fastq_create_date)
-                    fastq_df = pd.DataFrame(list(zip(parse_dates, sample_ids, primer_pairs, sampleids_primerpairs,
-                                                     fastq_create_dates, fastq_files_list)),
-                                            columns=['parse_date', 'sample_id', 'primer_pair', 'sampleid_primerpair',
-                                                     'fastq_create_date', 'fastq_path'])
-                    if export_csv:
-                        fastq_filelists_log_dir = self.log_file_dir + 'fastq_filelists/'
-                        if not os.path.exists(fastq_filelists_log_dir):
-                            os.makedirs(fastq_filelists_log_dir)
-                        output_csv_filename = datetime.now().strftime(fastq_filelists_log_dir+'Fastq_' + align_subdir_name +
-                                                                      '_filelist_%Y%m%d_%H%M%S.csv')
-                        fastq_df.to_csv(output_csv_filename, encoding='utf-8', index=False)
-
-                    fastq_sid_files_list, file_count = self.copy2_output_fastq_dir(fastq_df,
-                                                                                   output_fastq_dir,
-                                                                                   align_subdir_name)
-                    for summary_file in fastq_summary_file_list:
-                        # copy summary file into each fastq sampleid_primerpair folder
-                        copy2(summary_file, output_fastq_dir)
-
-                    # add in list of all fastq files for validation server side
-                    fastq_sid_df = pd.DataFrame(list(zip(sample_ids, primer_pairs, sampleids_primerpairs,
-                                                         fastq_create_dates, fastq_sid_files_list)),
-                                                columns=['sample_id', 'primer_pair',
-                                                         'sampleid_primerpair', 'fastq_create_date',
-                                                         'fastq_path'])
-                    output_csv_filename = output_fastq_dir + 'Fastq_filelist.csv'
-                    fastq_sid_df.to_csv(output_csv_filename, encoding='utf-8', index=False)
+    def write_fastq_manifest(self, run_record, fastq_records, export_csv=True):
+        """
+         archive the fastq records, write Fastq_filelist.csv for validation server side and mark the fastq dir
+         parsed in the run catalog
+        """
+        try:
+            project = run_record.project
+            run_id = run_record.run_id
+            fastq_dir_name = self.get_fastq_dir_name(run_record)
+            output_fastq_dir = self.get_output_fastq_dir(run_record)
+            # size and checksums computed during the copy
+            checksum_columns = list(self.checksum_algorithms)
+            if export_csv:
+                fastq_df = records_to_df(fastq_records, FastqRecord, FASTQ_LOG_COLUMNS + checksum_columns)
+                # the timestamped csv is only written if pyarrow is not installed for the fastq archive
+                if not self.fastq_archive.append(project, run_id, fastq_df):
+                    fastq_filelists_log_dir = self.log_file_dir + 'fastq_filelists/'
+                    # shared by the parse_seq_dirs process pool workers
+                    os.makedirs(fastq_filelists_log_dir, exist_ok=True)
+                    output_csv_filename = datetime.now().strftime(fastq_filelists_log_dir+'Fastq_' + fastq_dir_name +
+                                                                  '_filelist_%Y%m%d_%H%M%S.csv')
+                    fastq_df.to_csv(output_csv_filename, encoding='utf-8', index=False)
+
+            # add in list of all fastq files for validation server side
+            fastq_sid_df = records_to_df(fastq_records, FastqRecord, self.FASTQ_FILELIST_CSV_COLUMNS + checksum_columns)
+            fastq_sid_df = fastq_sid_df.rename(columns={'upload_fastq_path': 'fastq_path'})
+            output_csv_filename = output_fastq_dir + 'Fastq_filelist.csv'
+            fastq_sid_df.to_csv(output_csv_filename, encoding='utf-8', index=False)
+            self.run_catalog.upsert_fastq_files(run_id, project, run_record.run_dir, run_record.fastq_dir,
+                                                fastq_records)
+            self.run_catalog.set_status('seq_runs', run_record.run_dir, run_record.fastq_dir, STATUS_PARSED)
+            self.num_parsed_fastq_dirs += 1
+        except Exception as err:
+            raise RuntimeError("** Error: write_fastq_manifest Failed (" + str(err) + ")")
 
-                # log info
-                api_logger.info('End copied ' + str(file_count) + ' files')
-            api_logger.info('[END] parse_fastq_files')
-            return dirs_df
+    def parse_fastq_files(self, export_csv=True):
+        """
+         parse fastq files; runs every pipeline stage but backup and returns the complete fastq dirs
+        """
+        try:
+            context = ParsePipeline(self, stages=PARSE_STAGES, export_csv=export_csv).run()
+            return context.dirs_df
         except Exception as err:
             raise RuntimeError("** Error: parse_fastq_files Failed (" + str(err) + ")")
 
@@ -1051,14 +1169,55 @@ class MiSeqParser:
             # call mydata-python and start upload
             api_logger.info('Start: mydata upload')
             command = ['python', 'mydata-python/run.py', 'upload', '-v']
-            run(command)
-            # result_upload = run(command, check=True)
+            run(command, check=True)
             # api_logger.info('subprocess result:\n returncode: [' + str(result_upload.returncode) + ']\n stdout: [' +
             # str(result_upload.stdout).replace("\n",", ") + ']\n stderr: [' + str(result_upload.stderr) + ']')
             api_logger.info('[END] upload_mydata_subprocess')
         except Exception as err:
             raise RuntimeError("** Error: upload_mydata_subprocess Failed (" + str(err) + ")")
 
+    def upload_mydata(self, paths=None):
+        """
+         upload with the process-wide MyDataUploader, which keeps mydata loaded between runs; falls back to
+         upload_mydata_subprocess if mydata-python can't be imported or MYDATA_IN_PROCESS is off.
+         paths: the dirs this upload is for (mydata uploads all of data_directory). Returns True if data was
+         uploaded, False if none of paths exist; raises if the upload failed
+        """
+        try:
+            if settings.MYDATA_IN_PROCESS:
+                uploader = get_mydata_uploader(self.data_directory, self.folder_structure, self.mytardis_url)
+                if uploader.is_available():
+                    with get_metrics().timer(OPERATION_SECONDS, operation='mydata_upload'):
+                        return uploader.upload(paths)
+            with get_metrics().timer(OPERATION_SECONDS, operation='mydata_upload'):
+                self.upload_mydata_subprocess()
+            return True
+        except Exception as err:
+            raise RuntimeError("** Error: upload_mydata Failed (" + str(err) + ")")
+
+    def upload_mytd_complete(self, input_copy_dir, output_move_dir, project, run_id):
+        """
+         upload MYTDComplete.txt from the emptied input_copy_dir last, then move it to output_move_dir. If it
+         wasn't uploaded, input_copy_dir is removed again so no MYTDComplete.txt is left to be uploaded later
+        """
+        try:
+            if not os.path.exists(input_copy_dir):
+                os.makedirs(input_copy_dir)
+            self.create_mytd_complete(input_copy_dir, output_move_dir, project, run_id)
+            try:
+                uploaded = self.upload_mydata(paths=[input_copy_dir])
+            except Exception:
+                shutil.rmtree(input_copy_dir, ignore_errors=True)
+                raise
+            if not uploaded:
+                shutil.rmtree(input_copy_dir, ignore_errors=True)
+                raise RuntimeError('MYTDComplete.txt not uploaded [' + project + ' - ' + run_id + ']')
+            # move MYTDComplete into the run already moved to backup, not as a nested run_id dir
+            fast_move(input_copy_dir + "MYTDComplete.txt", output_move_dir + "MYTDComplete.txt")
+            os.rmdir(input_copy_dir)
+        except Exception as err:
+            raise RuntimeError("** Error: upload_mytd_complete Failed (" + str(err) + ")")
+
     def create_mytd_complete(self, input_dir, mytd_dir, project, run_id):
         mytd_filepath = input_dir + "MYTDComplete.txt"
         with open(mytd_filepath, mode='a') as file:
@@ -1078,16 +1237,17 @@ class MiSeqParser:
             extra_backup_dirs = self.extra_backup_dirs
 
             dirs_group_df = dirs_df.groupby(['project', 'run_id', 'rta_complete']).size().reset_index().rename(columns={0: 'count'})
-            # print(dirs_group_df)
             backup_parsing_dirs = []
 
             for index, row in dirs_group_df.iterrows():
                 project = row['project']
                 run_id = row['run_id']
                 rta_complete = row['rta_complete']
-                completion_time = row['run_completion_time']
                 api_logger.info('move_parsing_backup: ' + project + ', ' + run_id)
                 input_copy_dir = output_dir + project + "/" + run_id + "/"
+                if self.link_mode == 'symlink' and os.path.exists(input_copy_dir):
+                    # symlinks into Staging would break once Staging is moved to Backup
+                    materialize_links(input_copy_dir)
 
                 # if rta_complete is false, continue to next item in list
                 # Only runs with rta_complete == True were parsed
@@ -1105,7 +1265,7 @@ class MiSeqParser:
                             # copy into each extra backup directory
                             api_logger.info('Start: backup copy - from: [' + input_copy_dir + '], to: [' +
                                             output_backup_dir + ']')
-                            copy_tree(input_copy_dir, output_backup_dir)
+                            fast_copy_tree(input_copy_dir, output_backup_dir)
                             api_logger.info('End: backup copy')
                             # generate MYTDComplete.txt in each backup folder
                             self.create_mytd_complete(output_backup_dir, input_copy_dir, project, run_id)
@@ -1115,19 +1275,13 @@ class MiSeqParser:
 
                     if upload_parsing:
                         # After copy is complete of extra backup dirs, move original data to backup location
-                        move(input_copy_dir, output_move_dir)
+                        fast_move(input_copy_dir, output_move_dir)
                         # upload MYTDComplete.txt via mydata. Need it to upload last if uploading.
-                        # generate MYTDComplete.txt in final backup location
-                        if not os.path.exists(input_copy_dir):
-                            os.makedirs(input_copy_dir)
-                        self.create_mytd_complete(input_copy_dir, output_move_dir, project, run_id)
-                        self.upload_mydata_subprocess()
-                        # move MYTDComplete back to backup folders
-                        move(input_copy_dir, output_move_dir)
+                        self.upload_mytd_complete(input_copy_dir, output_move_dir, project, run_id)
                     else:
                         self.create_mytd_complete(input_copy_dir, output_move_dir, project, run_id)
                         # when copy complete if there are extra backup dirs, move to final backup directory
-                        move(input_copy_dir, output_move_dir)
+                        fast_move(input_copy_dir, output_move_dir)
 
                     api_logger.info('End: parse backup moved')
             api_logger.info('[END] move_parsing_backup')
@@ -1154,6 +1308,10 @@ class MiSeqParser:
                 run_id = row['run_id']
                 input_copy_dir = staging_dir + project + "/" + run_id + "/"
                 output_move_dir = backup_staging_dir + project + "/" + run_id + "/"
+                upload_run_dir = self.output_dir + project + "/" + run_id + "/"
+                if self.link_mode == 'symlink' and os.path.exists(upload_run_dir):
+                    # a parsed run still in Upload must not point into the Staging run we are about to move
+                    materialize_links(upload_run_dir)
                 api_logger.info('Start: backup move - from: [' + input_copy_dir+'], to: [' + output_move_dir+']')
                 backup_staging_dirs.append(output_move_dir)
                 if extra_backup_dirs:
@@ -1164,25 +1322,19 @@ class MiSeqParser:
                         backup_staging_dirs.append(output_backup_dir)
                         api_logger.info('Start: backup copy - from: [' + input_copy_dir + '], to: [' +
                                         output_backup_dir + ']')
-                        copy_tree(input_copy_dir, output_backup_dir)
+                        fast_copy_tree(input_copy_dir, output_backup_dir)
                         api_logger.info('End: backup copy')
                         # generate MYTDComplete.txt in each backup folder
                         self.create_mytd_complete(output_backup_dir, input_copy_dir, project, run_id)
                 if upload_parsing:
                     # After copy is complete of extra backup dirs, move parsed data to backup location
-                    move(input_copy_dir, output_move_dir)
+                    fast_move(input_copy_dir, output_move_dir)
                     # upload MYTDComplete.txt via mydata. Need it to upload last if uploading.
-                    # generate MYTDComplete.txt in final backup location
-                    if not os.path.exists(input_copy_dir):
-                        os.makedirs(input_copy_dir)
-                    self.create_mytd_complete(input_copy_dir, output_move_dir, project, run_id)
-                    self.upload_mydata_subprocess()
-                    # move MYTDComplete back to backup folders
-                    move(input_copy_dir, output_move_dir)
+                    self.upload_mytd_complete(input_copy_dir, output_move_dir, project, run_id)
                 else:
                     self.create_mytd_complete(input_copy_dir, output_move_dir, project, run_id)
                     # when copy complete if there are extra backup dirs, move to final backup directory
-                    move(input_copy_dir, output_move_dir)
+                    fast_move(input_copy_dir, output_move_dir)
 
                 api_logger.info('End: backup moved')
             api_logger.info('[END] move_staging_backup')
@@ -1198,7 +1350,9 @@ class MiSeqParser:
         try:
             api_logger.info('[START] complete_upload_backup')
             if upload_parsing:
-                self.upload_mydata_subprocess()
+                # nothing is moved to backup unless the data was uploaded
+                if not self.upload_mydata():
+                    raise RuntimeError('MyData upload did not run, no backup created')
                 upload_action = "Data uploaded with MyData-Python"
             else:
                 upload_action = "Use the MyData app to upload data to MyTardis"
@@ -1297,6 +1451,8 @@ class MiSeqParser:
 
 
 class GenericParser(MiSeqParser):
+    FASTQ_FILELIST_CSV_COLUMNS = ['parse_date'] + FASTQ_FILELIST_COLUMNS
+
     def __init__(self, project, run_dir, num_run_dir, check_gdrive,
                  staging_dir=settings.MISEQ_STAGING_DIR,
                  output_dir=settings.MISEQ_UPLOAD_DIR,
@@ -1305,9 +1461,15 @@ class GenericParser(MiSeqParser):
                  log_file_dir=settings.LOG_FILE_DIR,
                  data_directory=settings.MISEQ_DATA_DIRECTORY,
                  folder_structure=settings.FOLDER_STRUCTURE,
-                 mytardis_url=settings.MYTARDIS_URL):
+                 mytardis_url=settings.MYTARDIS_URL,
+                 run_tree_index=None,
+                 scan_cache=None,
+                 link_mode=settings.UPLOAD_LINK_MODE,
+                 checksum_algorithms=settings.FASTQ_CHECKSUM_ALGORITHMS,
+                 run_catalog=None):
         super().__init__(project, run_dir, num_run_dir, check_gdrive, staging_dir, output_dir, backup_dir,
-                         extra_backup_dirs, log_file_dir, data_directory, folder_structure, mytardis_url)
+                         extra_backup_dirs, log_file_dir, data_directory, folder_structure, mytardis_url,
+                         run_tree_index, scan_cache, link_mode, checksum_algorithms, run_catalog)
         self.staging_dir = staging_dir
         self.backup_dir = backup_dir
         self.backup_staging_dir_name = "Staging/"
@@ -1324,137 +1486,78 @@ class GenericParser(MiSeqParser):
         self.num_run_dir = num_run_dir
         self.check_gdrive = check_gdrive
 
-    def get_dirs(self, export_csv=True, rta_complete=True):
+    def scan_dirs(self):
         """
-         get dirs and put in pandas df
+         scan run dir and put in pandas df
         """
         try:
-            parse_types = []
-            parse_dates = []
-            projects = []
-            run_ids = []
-            run_dirs = []
-            fastq_dirs = []
-            num_fastq_files = []
-            rta_completes = []
-            rta_complete_times = []
-            num_run_dirs = []
-            run_dates = []
-            run_completion_times = []
-            run_dirs_create_dates = []
-            fastq_dirs_create_dates = []
-            sequencing_completes = []
-
-            # to combine miseq and generic dirlist into one file, these are included but are filled in as "Generic"
-            align_subdirs = []
-            align_subdirs_create_dates = []
-            num_align_subdirs = []
+            run_records = []
 
             project = self.project
             run_dir = self.run_dir
             num_run_dir = self.num_run_dir
+            run_tree_index = self.run_tree_index
 
             parse_type = "Generic"
             parse_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            align_subdir = align_subdirs_create_date = num_align_subdir = "Generic"
             # Since run performed by different facility, we are assuming the run was complete
             # since they are sending us the completed files - but we also want to grab the datetime
-            rta_complete, rta_complete_time = check_rta_complete(run_dir)
-            # grab run_id from RunInfo.xml
-            run_id = get_run_id_xml(run_dir)
-            run_date = get_run_date_xml(run_dir)
-            completion_time = get_run_completion_time_xml(run_dir)
+            # RTAComplete.txt, RunInfo.xml and CompletedJobInfo.xml are each parsed once
+            run_metadata = RunMetadata(run_dir, run_tree_index)
+            run_metadata.log_summary()
             run_dir_create_date = datetime.fromtimestamp(get_creation_dt(run_dir)).strftime('%Y-%m-%d %H:%M:%S')
             # check for .fastqz files in all sub directories of the run_dir
-            fastq_files = glob.glob(os.path.join(run_dir, '**/*.fastq.gz'), recursive=True)
-            fastq_files_list = [dir_path.replace('\\', '/') for dir_path in fastq_files]
-            num_fastq_file = len(fastq_files_list)
+            fastq_files_list = run_tree_index.get_paths(FASTQ)
+            # grab run_id from RunInfo.xml
+            # to combine miseq and generic dirlist into one file, align_subdir columns are filled in as "Generic"
+            run_record = RunRecord(run_id=run_metadata.run_id, parse_type=parse_type, parse_date=parse_date,
+                                   project=project, run_date=run_metadata.run_date,
+                                   run_completion_time=run_metadata.completion_time, run_dir=run_dir,
+                                   run_dir_create_date=run_dir_create_date, num_run_dir=num_run_dir,
+                                   align_subdir="Generic", align_subdir_create_date="Generic",
+                                   num_align_subdir="Generic", num_fastq_files=len(fastq_files_list),
+                                   rta_complete=run_metadata.rta_complete,
+                                   rta_complete_time=run_metadata.rta_complete_time)
 
             fastq_dir = os.path.commonpath(fastq_files_list)
             fastq_dir = fastq_dir.replace('\\', '/')
 
             if not fastq_dir:
                 # if there are no fastq files, then the Sequencing did not complete
-                # append to lists
-                fastq_dir = fastq_dir_create_date = "Sequencing Incomplete"
                 # if no fastq files, then Sequencing was not complete
-                sequencing_complete = False
-
-                # append to lists
-                parse_types.append(parse_type)
-                parse_dates.append(parse_date)
-                projects.append(project)
-                run_ids.append(run_id)
-                run_dirs.append(run_dir)
-                run_dirs_create_dates.append(run_dir_create_date)
-                num_run_dirs.append(num_run_dir)
-                fastq_dirs.append(fastq_dir)
-                fastq_dirs_create_dates.append(fastq_dir_create_date)
-                rta_completes.append(rta_complete)
-                rta_complete_times.append(rta_complete_time)
-                sequencing_completes.append(sequencing_complete)
-
-                num_fastq_files.append(num_fastq_file)
-                run_dates.append(run_date)
-                run_completion_times.append(completion_time)
-
-                align_subdirs.append(align_subdir)
-                align_subdirs_create_dates.append(align_subdirs_create_date)
-                num_align_subdirs.append(num_align_subdir)
-
+                run_records.append(run_record.copy(fastq_dir="Sequencing Incomplete",
+                                                   fastq_dir_create_date="Sequencing Incomplete",
+                                                   sequencing_complete=False))
             else:
                 # there are fastq files, then Sequencing should be complete
-                sequencing_complete = True
                 fastq_dir_create_date = datetime.fromtimestamp(get_creation_dt(fastq_dir)).strftime('%Y-%m-%d %H:%M:%S')
-                # append to lists
-                parse_types.append(parse_type)
-                parse_dates.append(parse_date)
-                projects.append(project)
-                run_ids.append(run_id)
-                run_dirs.append(run_dir)
-                run_dirs_create_dates.append(run_dir_create_date)
-                num_run_dirs.append(num_run_dir)
-                fastq_dirs.append(fastq_dir)
-                fastq_dirs_create_dates.append(fastq_dir_create_date)
-                rta_completes.append(rta_complete)
-                rta_complete_times.append(rta_complete_time)
-                sequencing_completes.append(sequencing_complete)
-
-                num_fastq_files.append(num_fastq_file)
-                run_dates.append(run_date)
-                run_completion_times.append(completion_time)
-
-                align_subdirs.append(align_subdir)
-                align_subdirs_create_dates.append(align_subdirs_create_date)
-                num_align_subdirs.append(num_align_subdir)
-
-            dirs_df = pd.DataFrame(list(zip(run_ids, parse_types, parse_dates, projects, run_dates,
-                                            run_completion_times, run_dirs, run_dirs_create_dates, num_run_dirs,
-                                            align_subdirs, align_subdirs_create_dates, num_align_subdirs,
-                                            fastq_dirs, num_fastq_files, fastq_dirs_create_dates,
-                                            rta_completes, rta_complete_times, sequencing_completes)),
-                                   columns=['run_id', 'parse_type', 'parse_date', 'project', 'run_date',
-                                            'run_completion_time',
-                                            'run_dir', 'run_dir_create_date', 'num_run_dir',
-                                            'align_subdir', 'align_subdir_create_date', 'num_align_subdir',
-                                            'fastq_dir', 'num_fastq_files', 'fastq_dir_create_date',
-                                            'rta_complete', 'rta_complete_time', 'sequencing_complete'])
-
-            # output dirs to csv
+                run_records.append(run_record.copy(fastq_dir=fastq_dir, fastq_dir_create_date=fastq_dir_create_date,
+                                                   sequencing_complete=True))
+
+            dirs_df = records_to_df(run_records, RunRecord)
+            return dirs_df
+        except Exception as err:
+            raise RuntimeError("** Error: scan_dirs Failed (" + str(err) + ")")
+
+    def get_dirs(self, export_csv=True, rta_complete=True):
+        """
+         get dirs and put in pandas df
+        """
+        try:
+            run_dir = self.run_dir
+            scan_cache = self.scan_cache
+            dirs_df = None
+            if scan_cache is not None:
+                # reuse cached rows if the run dir is unchanged since the last scan
+                fingerprint = self.run_tree_index.get_fingerprint()
+                dirs_df = scan_cache.get_dirs_df(run_dir, fingerprint)
+            if dirs_df is None:
+                dirs_df = self.scan_dirs()
+                if scan_cache is not None:
+                    scan_cache.set_dirs_df(run_dir, fingerprint, dirs_df)
+            # record dirs in the run catalog; seq_dirlist.csv is exported from it (python -m mytd_parser catalog-export)
             if export_csv:
-                output_csv_filename = self.log_file_dir + 'seq_dirlist.csv'
-                if os.path.exists(output_csv_filename):
-                    dirs_df_old = pd.read_csv(output_csv_filename)
-                    dirs_df_old = dirs_df_old.set_index('run_id')
-                    dirs_df_id = dirs_df.copy()
-                    dirs_df_id = dirs_df_id.set_index('run_id')
-                    # merge the existing and new dirs_df and update fields based on run_id
-                    dirs_df_new = dirs_df_id.combine_first(dirs_df_old).reset_index()
-                    dirs_df_new.to_csv(output_csv_filename, encoding='utf-8', index=False, header=True)
-                else:
-                    dirs_df_id = dirs_df.copy()
-                    dirs_df_id = dirs_df_id.set_index('run_id')
-                    dirs_df_id.to_csv(output_csv_filename, encoding='utf-8', index=True)
+                self.run_catalog.upsert_runs('seq_runs', df_to_records(dirs_df, RunRecord))
             if rta_complete:
                 # subset by directories that have RTAComplete.txt; we do not want to process incomplete sequencing runs
                 dirs_df_rta_complete = dirs_df[(dirs_df['rta_complete'] == True) &
@@ -1465,373 +1568,156 @@ class GenericParser(MiSeqParser):
         except Exception as err:
             raise RuntimeError("** Error: get_dirs Failed (" + str(err) + ")")
 
-    def copy_metadata_dirs(self, ignore_dirs):
+    def get_fastq_dir_name(self, run_record):
         """
-         copy metadata dirs and files
+         name of the fastq dir in Upload after "Fastq_": the run completion time, e.g., "20201224_211251"
         """
-        try:
-            api_logger.info('[START] copy_metadata_dirs')
-            dirs_df = self.get_dirs(export_csv=True, rta_complete=True)
-            output_dir = self.output_dir
-            check_gdrive = self.check_gdrive
-            worksheet = self.worksheet
-
-            for index, row in dirs_df.iterrows():
-                project = row['project']
-                run_dir = row['run_dir']
-                run_id = row['run_id']
-                fastq_dir_create_date = row['fastq_dir_create_date']
-                fastq_dir = row['fastq_dir']
-
-                # check if run complete
-                completion_time = row['run_completion_time']
-                rta_complete = row['rta_complete']
-                rta_complete_time = row['rta_complete_time']
-                sequencing_complete = row['sequencing_complete']
-
-                # check if gdrive upload complete
-                num_fastq_files = row['num_fastq_files']
-
-                if check_gdrive:
-                    num_fastq_gsheets = get_fastq_num_runid_gsheets(worksheet, run_id)
-                    api_logger.info('[CHECK GDRIVE] check_gdrive (num_fastq_gsheets): ' +
-                                    ' [(' + str(num_fastq_files) + '/' + str(num_fastq_gsheets) + '), ' +
-                                    project + ', ' + run_id + ',' + fastq_dir + ']')
-                    if num_fastq_gsheets is None:
-                        # if num_fastq_gsheets is None, then nothing returned on lookup via gspread.
-                        api_logger.info('[INCOMPLETE RUN] [NO GDRIVE LOOKUP MATCH] parse_fastq_files (num_fastq_gsheets): ' +
-                                        ' [(' + str(num_fastq_files) + '/' + str(num_fastq_gsheets) + '), ' +
-                                        project + ', ' + run_id + ',' + fastq_dir + ']')
-                        continue
-                    if str(num_fastq_gsheets) != str(num_fastq_files):
-                        # log info
-                        api_logger.info('[INCOMPLETE RUN] parse_fastq_files (num_fastq_gsheets): ' +
-                                        ' [(' + str(num_fastq_files) + '/' + str(num_fastq_gsheets) + '), ' +
-                                        project + ', ' + run_id + ',' + fastq_dir + ']')
-                        continue
-
-                if not rta_complete or not sequencing_complete:
-                    # log info
-                    api_logger.info('[INCOMPLETE RUN] copy_metadata_dirs: ' + project + ', ' + run_id + ', [' +
-                                    fastq_dir + ']')
-                    continue
-                else:
-                    if not completion_time:
-                        # completion_time_dt = datetime.strptime(rta_complete_time, '%Y-%m-%d %H:%M:%S')
-                        completion_time_dt = rta_complete_time
-                        completion_time_fmt = completion_time_dt.strftime('%Y%m%d_%H%M%S')  # '20201224_211251'
-                    else:
-                        completion_time_dt = datetime.strptime(completion_time, '%Y-%m-%d %H:%M:%S')
-                        completion_time_fmt = completion_time_dt.strftime('%Y%m%d_%H%M%S')  # '20201224_211251'
-
-                    fastq_ignore_dir = "Fastq_"+completion_time_fmt + "/"
-
-                    # log info
-                    api_logger.info('copy_metadata_dirs: ' + project + ', ' + run_id + ', [' +
-                                    run_dir + ', ' + fastq_dir + ']')
-
-                    output_metadata_dir = output_dir + project + "/" + run_id + "/run_metadata_" + run_id + "/"
-                    # if directory doesn't exist, create it and modify the run dir create date
-                    if not os.path.exists(output_metadata_dir):
-                        os.makedirs(output_metadata_dir)
-                        modify_create_date(run_dir, output_dir + project + "/" + run_id + "/")
-                        modify_create_date(run_dir, output_metadata_dir)
-
-                    run_dirs_list = glob.glob(os.path.join(run_dir, '*/'))
-                    run_dirs_list = [dir_path.replace('\\', '/') for dir_path in run_dirs_list]
-                    if ignore_dirs:
-                        # if ignore_dirs = True, do not copy any folders to Upload
-                        ignore_list = run_dirs_list
-                        api_logger.info('Ignore Dirs: ' + str(ignore_list))
-                    else:
-                        # copy files to run_metadata folder
-                        # Alignment is here because it will be treated differently
-                        ignore_list = [fastq_ignore_dir, "Alignment", "Data", "Thumbnail_Images"]
-                        api_logger.info('Ignore Dirs: ' + str(ignore_list))
-                    # directories in run folder to keep and move to run_metadata folder
-                    keep_dirs_list = [rundir for rundir in run_dirs_list if not any(ignore in rundir for ignore in ignore_list)]
-                    api_logger.info('Keep Dirs: ' + str(keep_dirs_list))
-                    num_dirs = len(keep_dirs_list)
-
-                    run_dir_files_list = glob.glob(os.path.join(run_dir, '*'))
-                    run_dir_files_list = [dir_path.replace('\\', '/') for dir_path in run_dir_files_list]
-
-                    # files in run folder to move to run_metadata folder
-                    file_list = [file for file in run_dir_files_list if os.path.isfile(file)]
-                    num_files = len(file_list)
-                    # log info
-                    api_logger.info('Start copying ' + str(num_files) + ' files')
-                    file_count = 0
-                    for file in file_list:
-                        copy2(file, output_metadata_dir)
-                        file_count += 1
-                        # log info
-                    api_logger.info('End copied ' + str(file_count) + ' files')
-                    if num_dirs > 0:
-                        # if there are directories in list, copy them. Otherwise do nothing.
-                        api_logger.info('Start copying ' + str(num_dirs) + ' dirs')
-                        dir_count = 0
-                        for keep_dir in keep_dirs_list:
-                            dir_name = Path(keep_dir).name
-                            copy_tree(keep_dir, output_metadata_dir + dir_name + '/')
-                            modify_create_date(keep_dir, output_metadata_dir + dir_name + '/')
-                            dir_count += 1
-                        # log info
-                        api_logger.info('End copied ' + str(dir_count) + ' dirs')
-            api_logger.info('[END] copy_metadata_dirs')
-            return dirs_df
+        completion_time = run_record.run_completion_time
+        if not completion_time:
+            # completion_time_dt = datetime.strptime(rta_complete_time, '%Y-%m-%d %H:%M:%S')
+            completion_time_dt = run_record.rta_complete_time
+        else:
+            completion_time_dt = datetime.strptime(completion_time, '%Y-%m-%d %H:%M:%S')
+        return completion_time_dt.strftime('%Y%m%d_%H%M%S')  # '20201224_211251'
 
-        except Exception as err:
-            raise RuntimeError("** Error: copy_metadata_dirs Failed (" + str(err) + ")")
+    def get_fastq_dir_files(self, run_record):
+        """
+         recursive list of fastq files; generic runs have no summary files
+        """
+        fastq_files_list = self.run_tree_index.get_files_in(FASTQ, run_record.fastq_dir, recursive=True)
+        return fastq_files_list, []
 
-    def parse_fastq_metadata_dirs(self):
+    def copy_run_metadata(self, run_record, ignore_dirs):
         """
-         parse fastq metadata dirs
+         copy metadata files of the run dir, and with ignore_dirs=False its metadata dirs, to run_metadata
         """
         try:
-            api_logger.info('[START] parse_fastq_metadata_dirs')
-            dirs_df = self.copy_metadata_dirs(ignore_dirs=True)
             output_dir = self.output_dir
-            check_gdrive = self.check_gdrive
-            worksheet = self.worksheet
-            for index, row in dirs_df.iterrows():
-                # num_align_subdir = row['num_align_subdir']
-                project = row['project']
-                run_id = row['run_id']
-                # align_subdir = row['align_subdir']
-                fastq_dir = row['fastq_dir']
-
-                # check if run complete
-                fastq_dir_create_date = row['fastq_dir_create_date']
-                completion_time = row['run_completion_time']
-                rta_complete = row['rta_complete']
-                rta_complete_time = row['rta_complete_time']
-                sequencing_complete = row['sequencing_complete']
-
-                # check if gdrive upload complete
-                num_fastq_files = row['num_fastq_files']
-
-                if check_gdrive:
-                    num_fastq_gsheets = get_fastq_num_runid_gsheets(worksheet, run_id)
-                    api_logger.info('[CHECK GDRIVE] check_gdrive (num_fastq_gsheets): ' +
-                                    ' [(' + str(num_fastq_files) + '/' + str(num_fastq_gsheets) + '), ' +
-                                    project + ', ' + run_id + ',' + fastq_dir + ']')
-                    if num_fastq_gsheets is None:
-                        # if num_fastq_gsheets is None, then nothing returned on lookup via gspread.
-                        api_logger.info('[INCOMPLETE RUN] [NO GDRIVE LOOKUP MATCH] parse_fastq_files (num_fastq_gsheets): ' +
-                                        ' [(' + str(num_fastq_files) + '/' + str(num_fastq_gsheets) + '), ' +
-                                        project + ', ' + run_id + ',' + fastq_dir + ']')
-                        continue
-                    if str(num_fastq_gsheets) != str(num_fastq_files):
-                        # log info
-                        api_logger.info('[INCOMPLETE RUN] parse_fastq_files (num_fastq_gsheets): ' +
-                                        ' [(' + str(num_fastq_files) + '/' + str(num_fastq_gsheets) + '), ' +
-                                        project + ', ' + run_id + ',' + fastq_dir + ']')
-                        continue
-
-                if not rta_complete or not sequencing_complete:
-                    # log info
-                    api_logger.info('[INCOMPLETE RUN] parse_fastq_metadata_dirs: ' + project + ', ' + run_id + ', [' +
-                                    fastq_dir + ']')
-                    continue
-                else:
-                    if not completion_time:
-                        # completion_time_dt = datetime.strptime(rta_complete_time, '%Y-%m-%d %H:%M:%S')
-                        completion_time_dt = rta_complete_time
-                        completion_time_fmt = completion_time_dt.strftime('%Y%m%d_%H%M%S')  # '20201224_211251'
-                    else:
-                        completion_time_dt = datetime.strptime(completion_time, '%Y-%m-%d %H:%M:%S')
-                        completion_time_fmt = completion_time_dt.strftime('%Y%m%d_%H%M%S')  # '20201224_211251'
-                    # log info
-                    api_logger.info('parse_fastq_metadata_dirs: ' + project + ', ' + run_id + ', [' + fastq_dir + ']')
-
-                    output_metadata_dir = output_dir + project + "/" + run_id + "/run_metadata_" + run_id + "/"
-
-                    fastqdir_list = glob.glob(os.path.join(fastq_dir, '*/'))
-                    fastqdir_list = [dir_path.replace('\\', '/') for dir_path in fastqdir_list]
-                    # copy files to run_metadata folder
-                    # Alignment is here because it will be treated differently
-                    ignore_list = ["Fastq"]
-                    # directories in run folder to keep and move to run_metadata folder
-                    keep_dirs_list = [subdir for subdir in fastqdir_list if not any(ignore in subdir for ignore in ignore_list)]
-                    # log info
-                    api_logger.info('Keep Dirs: ' + str(keep_dirs_list))
-                    num_dirs = len(keep_dirs_list)
-
-                    # fastq_dir_files_list = glob.glob(os.path.join(fastq_dir, '*'))
-                    # cannot exclude files with two periods e.g., ".fastq.gz" from list of files
-                    # with regex, so have to subtract sets
-                    fastq_dir_all_list = glob.glob(os.path.join(fastq_dir, '**/*'), recursive=True)
-                    fastq_dir_fastq_list = glob.glob(os.path.join(fastq_dir, '**/*.fastq.gz'), recursive=True)
-                    fastq_dir_files_list = set(fastq_dir_all_list) - set(fastq_dir_fastq_list)
-                    fastq_dir_files_list = [dir_path.replace('\\', '/') for dir_path in fastq_dir_files_list]
-
-                    # files in run folder to move to run_metadata folder
-                    file_list = [file for file in fastq_dir_files_list if os.path.isfile(file)]
-                    num_files = len(file_list)
-                    # files in run folder to move to run_metadata folder
-
-                    # log info
-                    api_logger.info('Start copying ' + str(num_files) + ' files')
-
-                    output_fastq_metadata_dir = output_metadata_dir + 'Fastq_' + completion_time_fmt + '/'
-                    if not os.path.exists(output_fastq_metadata_dir):
-                        os.makedirs(output_fastq_metadata_dir)
-                        modify_create_date(fastq_dir, output_fastq_metadata_dir)
-                    file_count = 0
-                    for file in file_list:
-                        copy2(file, output_fastq_metadata_dir)
-                        file_count += 1
-                    # log info
-                    api_logger.info('End copied ' + str(file_count) + ' files')
-                    api_logger.info('Start copying ' + str(num_dirs) + ' dirs')
-                    dir_count = 0
-                    for keep_dir in keep_dirs_list:
-                        dir_name = Path(keep_dir).name
-                        output_fastq_metadata_subdir = output_fastq_metadata_dir+dir_name+'/'
-                        if not os.path.exists(output_fastq_metadata_subdir):
-                            os.makedirs(output_fastq_metadata_subdir)
-                            modify_create_date(keep_dir, output_fastq_metadata_subdir)
-                        copy_tree(keep_dir, output_fastq_metadata_subdir)
-                        dir_count += 1
-                    # log info
-                    api_logger.info('End copied ' + str(dir_count) + ' dirs')
-            api_logger.info('[END] parse_fastq_metadata_dirs')
-            return dirs_df
+            project = run_record.project
+            run_dir = run_record.run_dir
+            run_id = run_record.run_id
+            fastq_dir = run_record.fastq_dir
+
+            fastq_ignore_dir = "Fastq_" + self.get_fastq_dir_name(run_record) + "/"
+
+            # log info
+            api_logger.info('copy_run_metadata: ' + project + ', ' + run_id + ', [' +
+                            run_dir + ', ' + fastq_dir + ']')
+
+            output_metadata_dir = output_dir + project + "/" + run_id + "/run_metadata_" + run_id + "/"
+            # if directory doesn't exist, create it and modify the run dir create date
+            if not os.path.exists(output_metadata_dir):
+                os.makedirs(output_metadata_dir)
+                modify_create_date(run_dir, output_dir + project + "/" + run_id + "/")
+                modify_create_date(run_dir, output_metadata_dir)
+
+            run_dirs_list = glob.glob(os.path.join(run_dir, '*/'))
+            run_dirs_list = [dir_path.replace('\\', '/') for dir_path in run_dirs_list]
+            if ignore_dirs:
+                # if ignore_dirs = True, do not copy any folders to Upload
+                ignore_list = run_dirs_list
+                api_logger.debug('Ignore Dirs: %s', ignore_list)
+            else:
+                # copy files to run_metadata folder
+                # Alignment is here because it will be treated differently
+                ignore_list = [fastq_ignore_dir, "Alignment", "Data", "Thumbnail_Images"]
+                api_logger.debug('Ignore Dirs: %s', ignore_list)
+            # directories in run folder to keep and move to run_metadata folder
+            keep_dirs_list = [rundir for rundir in run_dirs_list if not any(ignore in rundir for ignore in ignore_list)]
+            api_logger.debug('Keep Dirs: %s', keep_dirs_list)
+            num_dirs = len(keep_dirs_list)
+
+            run_dir_files_list = glob.glob(os.path.join(run_dir, '*'))
+            run_dir_files_list = [dir_path.replace('\\', '/') for dir_path in run_dir_files_list]
+
+            # files in run folder to move to run_metadata folder
+            file_list = [file for file in run_dir_files_list if os.path.isfile(file)]
+            num_files = len(file_list)
+            # log info
+            api_logger.debug('Start copying %s files', num_files)
+            file_count = 0
+            for file in file_list:
+                fast_copy2(file, output_metadata_dir)
+                file_count += 1
+                # log info
+            api_logger.debug('End copied %s files', file_count)
+            if num_dirs > 0:
+                # if there are directories in list, copy them. Otherwise do nothing.
+                api_logger.debug('Start copying %s dirs', num_dirs)
+                dir_count = 0
+                for keep_dir in keep_dirs_list:
+                    dir_name = Path(keep_dir).name
+                    fast_copy_tree(keep_dir, output_metadata_dir + dir_name + '/')
+                    modify_create_date(keep_dir, output_metadata_dir + dir_name + '/')
+                    dir_count += 1
+                # log info
+                api_logger.debug('End copied %s dirs', dir_count)
         except Exception as err:
-            raise RuntimeError("** Error: parse_fastq_metadata_dirs Failed (" + str(err) + ")")
+            raise RuntimeError("** Error: copy_run_metadata Failed (" + str(err) + ")")
 
-    def parse_fastq_files(self, export_csv=True):
+    def copy_fastq_metadata(self, run_record):
         """
-         parse fastq files
+         copy the files and dirs of the fastq dir that are not fastq files to run_metadata
         """
         try:
-            api_logger.info('[START] parse_fastq_files')
-            dirs_df = self.parse_fastq_metadata_dirs()
             output_dir = self.output_dir
-            check_gdrive = self.check_gdrive
-            worksheet = self.worksheet
-
-            for index, row in dirs_df.iterrows():
-                # num_align_subdir = row['num_align_subdir']
-                project = row['project']
-                # align_subdir = row['align_subdir']
-                fastq_dir = row['fastq_dir']
-                # check if run complete
-                fastq_dir_create_date = row['fastq_dir_create_date']
-                completion_time = row['run_completion_time']
-                rta_complete = row['rta_complete']
-                rta_complete_time = row['rta_complete_time']
-                sequencing_complete = row['sequencing_complete']
-
-                # check if gdrive upload complete
-                num_fastq_files = row['num_fastq_files']
-                run_id = row['run_id']
-
-                if check_gdrive:
-                    num_fastq_gsheets = get_fastq_num_runid_gsheets(worksheet, run_id)
-                    api_logger.info('[CHECK GDRIVE] check_gdrive (num_fastq_gsheets): ' +
-                                    ' [(' + str(num_fastq_files) + '/' + str(num_fastq_gsheets) + '), ' +
-                                    project + ', ' + run_id + ',' + fastq_dir + ']')
-                    if num_fastq_gsheets is None:
-                        # if num_fastq_gsheets is None, then nothing returned on lookup via gspread.
-                        api_logger.info('[INCOMPLETE RUN] [NO GDRIVE LOOKUP MATCH] parse_fastq_files (num_fastq_gsheets): ' +
-                                        ' [(' + str(num_fastq_files) + '/' + str(num_fastq_gsheets) + '), ' +
-                                        project + ', ' + run_id + ',' + fastq_dir + ']')
-                        continue
-                    if str(num_fastq_gsheets) != str(num_fastq_files):
-                        # log info
-                        api_logger.info('[INCOMPLETE RUN] parse_fastq_files (num_fastq_gsheets): ' +
-                                        ' [(' + str(num_fastq_files) + '/' + str(num_fastq_gsheets) + '), ' +
-                                        project + ', ' + run_id + ',' + fastq_dir + ']')
-                        continue
-
-                if not rta_complete or not sequencing_complete:
-                    # log info
-                    api_logger.info('[INCOMPLETE RUN] parse_fastq_files (rta_complete): ' + project + ', ' +
-                                    run_id + ', [' + fastq_dir + ']')
-                    continue
-                else:
-                    if not completion_time:
-                        # completion_time_dt = datetime.strptime(rta_complete_time, '%Y-%m-%d %H:%M:%S')
-                        completion_time_dt = rta_complete_time
-                        completion_time_fmt = completion_time_dt.strftime('%Y%m%d_%H%M%S')  # '20201224_211251'
-                    else:
-                        completion_time_dt = datetime.strptime(completion_time, '%Y-%m-%d %H:%M:%S')
-                        completion_time_fmt = completion_time_dt.strftime('%Y%m%d_%H%M%S')  # '20201224_211251'
-                    # log info
-                    api_logger.info('parse_fastq_files: ' + project + ', ' + run_id + ', [' + fastq_dir + '] ')
-                    # use formatted name completion time for fastq filename. completion_time_fmt ==> "20201224_205858"
-                    output_run_dir = output_dir + project + "/" + run_id + "/"
-                    output_fastq_dir = output_run_dir + "Fastq_" + completion_time_fmt + "/"
-                    if not os.path.exists(output_fastq_dir):
-                        os.makedirs(output_fastq_dir)
-                        modify_create_date(fastq_dir, output_fastq_dir)
-
-                    # recursive list of fastq files
-                    fastq_files_list = glob.glob(os.path.join(fastq_dir, '**/*.fastq.gz'), recursive=True)
-                    fastq_files_list = [dir_path.replace('\\', '/') for dir_path in fastq_files_list]
-                    # number of fastq files
-                    num_files = len(fastq_files_list)
-
-
-                    # log info
-                    api_logger.info('Start copying ' + str(num_files) + ' files')
-                    parse_dates = []
-                    sample_ids = []
-                    primer_pairs = []
-                    sampleids_primerpairs = []
-                    fastq_create_dates = []
-                    for fastq_file in fastq_files_list:
-                        # parse each fastq filename for the sample_id
-                        # leftmost after underscore split
-                        fastq_create_date = datetime.fromtimestamp(get_creation_dt(fastq_file)).strftime('%Y-%m-%d %H:%M:%S')
-                        parse_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                        fastq_name = Path(fastq_file).name
-                        sample_id = fastq_name.split('_', 1)[0]
-                        # if pattern matches, extract sample_id and/or primer_pair
-                        sample_id, primer_pair, sampleid_primerpair = get_sampleid_primerpair_name(sample_id)
-
-                        parse_dates.append(parse_date)
-                        primer_pairs.append(primer_pair)
-                        sample_ids.append(sample_id)
-                        sampleids_primerpairs.append(sampleid_primerpair)
-                        fastq_create_dates.append(fastq_create_date)
-                    fastq_df = pd.DataFrame(list(zip(parse_dates, sample_ids, primer_pairs, sampleids_primerpairs,
-                                                     fastq_create_dates, fastq_files_list)),
-                                            columns=['parse_date', 'sample_id', 'primer_pair', 'sampleid_primerpair',
-                                                     'fastq_create_date', 'fastq_path'])
-                    if export_csv:
-                        fastq_filelist_dir = self.log_file_dir + "fastq_filelists/"
-                        if not os.path.exists(fastq_filelist_dir):
-                            os.makedirs(fastq_filelist_dir)
-                        output_csv_filename = datetime.now().strftime(fastq_filelist_dir + 'Fastq_' +
-                                                                      completion_time_fmt +
-                                                                      '_filelist_%Y%m%d_%H%M%S.csv')
-                        fastq_df.to_csv(output_csv_filename, encoding='utf-8', index=False)
-
-                    fastq_sid_files_list, file_count = self.copy2_output_fastq_dir(fastq_df,
-                                                                                   output_fastq_dir,
-                                                                                   completion_time_fmt)
-
-                    # add in list of all fastq files for validation server side
-                    fastq_sid_df = pd.DataFrame(list(zip(parse_dates,
-                                                         sample_ids,
-                                                         primer_pairs,
-                                                         sampleids_primerpairs,
-                                                         fastq_create_dates,
-                                                         fastq_sid_files_list)), columns=['parse_date',
-                                                                                          'sample_id',
-                                                                                          'primer_pair',
-                                                                                          'sampleid_primerpair',
-                                                                                          'fastq_create_date',
-                                                                                          'fastq_path'])
-                    output_csv_filename = output_fastq_dir+'Fastq_filelist.csv'
-                    fastq_sid_df.to_csv(output_csv_filename, encoding='utf-8', index=False)
-
-                    # log info
-                    api_logger.info('End copied ' + str(file_count) + ' files')
-            api_logger.info('[END] parse_fastq_files')
-            return dirs_df
+            project = run_record.project
+            run_id = run_record.run_id
+            fastq_dir = run_record.fastq_dir
+            completion_time_fmt = self.get_fastq_dir_name(run_record)
+            # log info
+            api_logger.info('copy_fastq_metadata: ' + project + ', ' + run_id + ', [' + fastq_dir + ']')
+
+            output_metadata_dir = output_dir + project + "/" + run_id + "/run_metadata_" + run_id + "/"
+
+            fastqdir_list = glob.glob(os.path.join(fastq_dir, '*/'))
+            fastqdir_list = [dir_path.replace('\\', '/') for dir_path in fastqdir_list]
+            # copy files to run_metadata folder
+            # Alignment is here because it will be treated differently
+            ignore_list = ["Fastq"]
+            # directories in run folder to keep and move to run_metadata folder
+            keep_dirs_list = [subdir for subdir in fastqdir_list if not any(ignore in subdir for ignore in ignore_list)]
+            # log info
+            api_logger.debug('Keep Dirs: %s', keep_dirs_list)
+            num_dirs = len(keep_dirs_list)
+
+            # fastq_dir_files_list = glob.glob(os.path.join(fastq_dir, '*'))
+            # cannot exclude files with two periods e.g., ".fastq.gz" from list of files
+            # with regex, so have to subtract sets
+            fastq_dir_all_list = glob.glob(os.path.join(fastq_dir, '**/*'), recursive=True)
+            fastq_dir_fastq_list = glob.glob(os.path.join(fastq_dir, '**/*.fastq.gz'), recursive=True)
+            fastq_dir_files_list = set(fastq_dir_all_list) - set(fastq_dir_fastq_list)
+            fastq_dir_files_list = [dir_path.replace('\\', '/') for dir_path in fastq_dir_files_list]
+
+            # files in run folder to move to run_metadata folder
+            file_list = [file for file in fastq_dir_files_list if os.path.isfile(file)]
+            num_files = len(file_list)
+            # files in run folder to move to run_metadata folder
+
+            # log info
+            api_logger.debug('Start copying %s files', num_files)
+
+            output_fastq_metadata_dir = output_metadata_dir + 'Fastq_' + completion_time_fmt + '/'
+            if not os.path.exists(output_fastq_metadata_dir):
+                os.makedirs(output_fastq_metadata_dir)
+                modify_create_date(fastq_dir, output_fastq_metadata_dir)
+            file_count = 0
+            for file in file_list:
+                fast_copy2(file, output_fastq_metadata_dir)
+                file_count += 1
+            # log info
+            api_logger.debug('End copied %s files', file_count)
+            api_logger.debug('Start copying %s dirs', num_dirs)
+            dir_count = 0
+            for keep_dir in keep_dirs_list:
+                dir_name = Path(keep_dir).name
+                output_fastq_metadata_subdir = output_fastq_metadata_dir+dir_name+'/'
+                if not os.path.exists(output_fastq_metadata_subdir):
+                    os.makedirs(output_fastq_metadata_subdir)
+                    modify_create_date(keep_dir, output_fastq_metadata_subdir)
+                fast_copy_tree(keep_dir, output_fastq_metadata_subdir)
+                dir_count += 1
+            # log info
+            api_logger.debug('End copied %s dirs', dir_count)
         except Exception as err:
-            raise RuntimeError("** Error: parse_fastq_files Failed (" + str(err) + ")")
+            raise RuntimeError("** Error: copy_fastq_metadata Failed (" + str(err) + ")")
@@ -8,38 +8,90 @@ LAST MODIFIED: 08/31/2021
 from . import settings
 import os, glob
 import pandas as pd
-from shutil import copy2, move
 from .logger_settings import api_logger
 from pathlib import *
 import datetime
 from datetime import datetime
-from mytd_parser.parse_seq_run import get_creation_dt, check_rta_complete, get_run_id_xml, \
-    get_run_completion_time_xml
+from mytd_parser.parse_seq_run import get_creation_dt
+from mytd_parser.run_tree_index import RunTreeIndex, FASTQ
+from mytd_parser.run_metadata import RunMetadata
+from mytd_parser.scan_cache import ScanCache
+from mytd_parser.run_catalog import RunCatalog, STATUS_MOVED
+from mytd_parser.records import ServerRunRecord, records_to_df, df_to_records
+from mytd_parser.copy_engine import fast_copy2
+from mytd_parser.gsheets import GsheetStatusWriter, GSHEETS_PARSE_STATUS_COLUMN
+from mytd_parser.metrics import get_metrics, write_metrics, RUNS, FASTQ_DIRS
+from mytd_parser.profiling import profiling, profile_stage
+
+
+def list_dir_sizes(directory):
+    """
+     {file name: size} of the files in directory from a single os.scandir; empty if directory is missing
+    """
+    dir_sizes = {}
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    dir_sizes[entry.name] = entry.stat().st_size
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        pass
+    return dir_sizes
 
 
 def check_upload_complete(fastq_list_filepath, run_dir):
-    api_logger.info('[START] check_upload_complete')
+    """
+     True once every fastq file in Fastq_filelist.csv is in run_dir. Each fastq dir is listed once and
+     compared with the manifest as a set; if the manifest has a size column, a file only counts once it has
+     its expected size, so files still being synced by rclone are not mistaken for complete uploads
+    """
+    api_logger.debug('[START] check_upload_complete')
     fastq_list_df = pd.read_csv(fastq_list_filepath)
 
     fastq_list = fastq_list_df['fastq_path'].tolist()
-    complete_fastq_list = [run_dir + s for s in fastq_list]
-    # api_logger.info(complete_fastq_list) # too much to have in log
-    num_complete = len(complete_fastq_list)
-    api_logger.info('Total fastq files from run: ' + str(num_complete))
+    if 'size' in fastq_list_df.columns:
+        expected_sizes = fastq_list_df['size'].tolist()
+    else:
+        expected_sizes = [None] * len(fastq_list)
+    num_complete = len(fastq_list)
+    api_logger.debug('Total fastq files from run: %s', num_complete)
 
-    if all(list(map(os.path.isfile, complete_fastq_list))):
-        api_logger.info('[END] check_upload_complete - True')
-        # all files exist, so upload is complete
+    # {fastq dir: {file name: expected size}}
+    expected_dirs = {}
+    for fastq_path, expected_size in zip(fastq_list, expected_sizes):
+        fastq_dir, fastq_filename = os.path.split(run_dir + fastq_path)
+        if pd.isna(expected_size):
+            expected_size = None
+        expected_dirs.setdefault(fastq_dir, {})[fastq_filename] = expected_size
+
+    num_missing = 0
+    num_partial = 0
+    for fastq_dir, expected_files in expected_dirs.items():
+        dir_sizes = list_dir_sizes(fastq_dir)
+        num_missing += len(expected_files.keys() - dir_sizes.keys())
+        num_partial += sum(1 for fastq_filename, expected_size in expected_files.items()
+                           if expected_size is not None and fastq_filename in dir_sizes and
+                           dir_sizes[fastq_filename] != int(expected_size))
+
+    if num_missing == 0 and num_partial == 0:
+        api_logger.debug('[END] check_upload_complete - True')
+        # all files exist with expected sizes, so upload is complete
         return True
     else:
-        api_logger.info('[END] check_upload_complete - False')
-        # some files missing, so upload is not complete
+        api_logger.debug('[END] check_upload_complete - False (missing: %s, partial: %s)', num_missing, num_partial)
+        # some files missing or still syncing, so upload is not complete
         return False
 
 
-def server_parse():
-    sp = ServerParse()
-    sp.move_fastq_files()
+def server_parse(run_dirs=None, update_gdrive=False, profile=settings.PROFILE):
+    """
+     profile: cProfile the server_discover and server_move stages into LOG_FILE_DIR/profiles/server_parse/
+    """
+    get_metrics().reset()
+    with profiling('server_parse', enabled=profile):
+        sp = ServerParse(update_gdrive=update_gdrive)
+        sp.move_fastq_files(run_dirs=run_dirs)
+    write_metrics('server_parse')
 
 
 class ServerParse:
@@ -47,33 +99,50 @@ class ServerParse:
                  output_dir=settings.SERVER_OUTPUT_DIR,
                  data_directory=settings.SERVER_DATA_DIRECTORY,
                  log_file_dir=settings.LOG_FILE_DIR,
-                 upload_bioinfo_results_dir=settings.SERVER_UPLOAD_BR_DIR):
+                 upload_bioinfo_results_dir=settings.SERVER_UPLOAD_BR_DIR,
+                 use_scan_cache=True,
+                 run_catalog=None,
+                 update_gdrive=False):
         self.download_dir = download_dir
         self.output_dir = output_dir
         self.upload_bioinfo_results_dir = upload_bioinfo_results_dir
         self.log_file_dir = log_file_dir
+        # runs that are unchanged since the last scan reuse their cached rows
+        if use_scan_cache:
+            self.scan_cache = ScanCache(log_file_dir + settings.SERVER_SCAN_CACHE_FILENAME)
+        else:
+            self.scan_cache = None
+        if run_catalog is None:
+            run_catalog = RunCatalog(log_file_dir + settings.RUN_CATALOG_FILENAME)
+        self.run_catalog = run_catalog
+        # set SERVER_PARSE_COMPLETE in the gsheet for moved runs, written in one batch per move_fastq_files
+        self.update_gdrive = update_gdrive
         # mydata cfgs
         self.data_directory = data_directory
-        print(self.download_dir)
+        # {run_dir: RunTreeIndex} from the last get_dirs, reused by move_run_records
+        self.run_tree_indexes = {}
+
+    def get_run_tree_index(self, run_dir):
+        """
+         the run's RunTreeIndex from get_dirs, or a new walk of the run dir if get_dirs didn't scan it
+        """
+        run_tree_index = self.run_tree_indexes.get(run_dir)
+        if run_tree_index is None:
+            run_tree_index = RunTreeIndex(run_dir)
+            self.run_tree_indexes[run_dir] = run_tree_index
+        return run_tree_index
 
-    def get_dirs(self, export_csv=True, complete_upload=True):
+    def get_dirs(self, export_csv=True, complete_upload=True, run_dirs=None):
         """
          get dirs and put in pandas df
+         run_dirs: only scan these run dirs; None scans every run dir in download_dir
         """
         try:
-            server_parse_dates = []
-            run_ids = []
-            run_dirs = []
-            fastq_dirs = []
-            projects = []
-            num_fastq_dirs = []
-            rta_completes = []
-            rta_complete_times = []
-            num_run_dirs = []
-            run_dirs_create_dates = []
-            fastq_dirs_create_dates = []
-            run_completion_times = []
-            upload_completes = []
+            run_records = []
+            self.run_tree_indexes = {}
+            # rows reused from the scan cache, and (run_dir, fingerprint) of runs scanned this time
+            cached_dirs_dfs = []
+            scanned_runs = []
             # make list of all project folders; e.g., maine-edna
             server_parse_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             project_dirs = glob.glob(os.path.join(self.download_dir, '*/'))
@@ -91,36 +160,42 @@ class ServerParse:
                 run_dir_list = [dir_path.replace('\\', '/') for dir_path in run_dir_list]
                 # loop through all sequencing run folders
                 for run_dir in run_dir_list:
+                    if run_dirs is not None and run_dir not in run_dirs:
+                        continue
                     # the number of sequencing runs per project
                     num_run_dir = len(run_dir_list)
+                    # one pruned walk of the run dir shared by every run metadata lookup
+                    run_tree_index = RunTreeIndex(run_dir)
+                    self.run_tree_indexes[run_dir] = run_tree_index
+                    if self.scan_cache is not None:
+                        fingerprint = run_tree_index.get_fingerprint()
+                        cached_dirs_df = self.scan_cache.get_dirs_df(run_dir, fingerprint)
+                        if cached_dirs_df is not None:
+                            cached_dirs_dfs.append(self.refresh_cached_dirs_df(cached_dirs_df, run_dir,
+                                                                               server_parse_date))
+                            get_metrics().inc(RUNS, state='unchanged')
+                            continue
+                        scanned_runs.append((run_dir, fingerprint))
                     # if rta_complete exists, sets variable to True to be filtered on
                     # to only process rta_complete directories
-                    rta_complete, rta_complete_time = check_rta_complete(run_dir)
-                    # grab completion_time from CompleteJobInfo.xml
-                    completion_time = get_run_completion_time_xml(run_dir)
-                    # grab run_id from CompleteJobInfo.xml
-                    run_id = get_run_id_xml(run_dir)
+                    run_metadata = RunMetadata(run_dir, run_tree_index)
+                    run_metadata.log_summary()
+                    get_metrics().inc(RUNS, state='scanned')
+                    rta_complete = run_metadata.rta_complete
                     run_dir_create_date = datetime.fromtimestamp(get_creation_dt(run_dir)).strftime('%Y-%m-%d %H:%M:%S')
+                    # fields shared by every fastq dir of the run
+                    # grab completion_time and run_id from CompleteJobInfo.xml
+                    run_record = ServerRunRecord(run_id=run_metadata.run_id, server_parse_date=server_parse_date,
+                                                 project=project, run_completion_time=run_metadata.completion_time,
+                                                 run_dir=run_dir, run_dir_create_date=run_dir_create_date,
+                                                 num_run_dir=num_run_dir, rta_complete=rta_complete,
+                                                 rta_complete_time=run_metadata.rta_complete_time)
                     if not rta_complete:
                         # if rta_complete is false, then the run is not complete
-                        fastq_dir = fastq_dir_create_date = num_fastq_dir = "Upload Incomplete"
                         # if Run Failed, then analysis was never complete
-                        upload_complete = False
-
-                        # append to lists
-                        run_completion_times.append(completion_time)
-                        server_parse_dates.append(server_parse_date)
-                        projects.append(project)
-                        run_ids.append(run_id)
-                        run_dirs.append(run_dir)
-                        run_dirs_create_dates.append(run_dir_create_date)
-                        num_run_dirs.append(num_run_dir)
-                        fastq_dirs.append(fastq_dir)
-                        fastq_dirs_create_dates.append(fastq_dir_create_date)
-                        num_fastq_dirs.append(num_fastq_dir)
-                        rta_completes.append(rta_complete)
-                        rta_complete_times.append(rta_complete_time)
-                        upload_completes.append(upload_complete)
+                        run_records.append(run_record.copy(fastq_dir="Upload Incomplete",
+                                                           fastq_dir_create_date="Upload Incomplete",
+                                                           num_fastq_dir="Upload Incomplete", upload_complete=False))
                     else:
                         fastq_dirs_list = glob.glob(os.path.join(run_dir, '*/'))
                         # convert forward slashes to backwards slashes
@@ -129,25 +204,11 @@ class ServerParse:
                         fastq_dirs_list = [fastqdir for fastqdir in fastq_dirs_list if "Fastq" in fastqdir]
                         if not fastq_dirs_list:
                             # if there are no fastq folders
-                            # append to lists
-                            fastq_dir = fastq_dir_create_date = num_fastq_dir = "Upload Incomplete"
                             # if no alignment folder, then analysis was not complete
-                            upload_complete = False
-
-                            # append to lists
-                            run_completion_times.append(completion_time)
-                            server_parse_dates.append(server_parse_date)
-                            projects.append(project)
-                            run_ids.append(run_id)
-                            run_dirs.append(run_dir)
-                            run_dirs_create_dates.append(run_dir_create_date)
-                            num_run_dirs.append(num_run_dir)
-                            fastq_dirs.append(fastq_dir)
-                            fastq_dirs_create_dates.append(fastq_dir_create_date)
-                            num_fastq_dirs.append(num_fastq_dir)
-                            rta_completes.append(rta_complete)
-                            rta_complete_times.append(rta_complete_time)
-                            upload_completes.append(upload_complete)
+                            run_records.append(run_record.copy(fastq_dir="Upload Incomplete",
+                                                               fastq_dir_create_date="Upload Incomplete",
+                                                               num_fastq_dir="Upload Incomplete",
+                                                               upload_complete=False))
                         else:
                             # fastq files and RTACompete exist, so proceed
                             num_fastq_dir = len(fastq_dirs_list)
@@ -155,65 +216,27 @@ class ServerParse:
                                 fastq_list_filepath = fastq_dir + 'Fastq_filelist.csv'
                                 fastq_list_exists = os.path.exists(fastq_list_filepath)
                                 if not fastq_list_exists:
-                                    # check if all fastq files have been uploaded via rclone
                                     upload_complete = False
-                                    # grab date of fastq dir
-                                    fastq_dir_create_date = datetime.fromtimestamp(get_creation_dt(fastq_dir)).strftime('%Y-%m-%d %H:%M:%S')
-                                    # append to lists
-                                    run_completion_times.append(completion_time)
-                                    server_parse_dates.append(server_parse_date)
-                                    projects.append(project)
-                                    run_ids.append(run_id)
-                                    run_dirs.append(run_dir)
-                                    run_dirs_create_dates.append(run_dir_create_date)
-                                    num_run_dirs.append(num_run_dir)
-                                    fastq_dirs.append(fastq_dir)
-                                    fastq_dirs_create_dates.append(fastq_dir_create_date)
-                                    num_fastq_dirs.append(num_fastq_dir)
-                                    rta_completes.append(rta_complete)
-                                    rta_complete_times.append(rta_complete_time)
-                                    upload_completes.append(upload_complete)
                                 else:
                                     # check if all fastq files have been uploaded via rclone
                                     upload_complete = check_upload_complete(fastq_list_filepath, run_dir)
-                                    # grab date of fastq dir
-                                    fastq_dir_create_date = datetime.fromtimestamp(get_creation_dt(fastq_dir)).strftime('%Y-%m-%d %H:%M:%S')
-                                    # append to lists
-                                    run_completion_times.append(completion_time)
-                                    server_parse_dates.append(server_parse_date)
-                                    projects.append(project)
-                                    run_ids.append(run_id)
-                                    run_dirs.append(run_dir)
-                                    run_dirs_create_dates.append(run_dir_create_date)
-                                    num_run_dirs.append(num_run_dir)
-                                    fastq_dirs.append(fastq_dir)
-                                    fastq_dirs_create_dates.append(fastq_dir_create_date)
-                                    num_fastq_dirs.append(num_fastq_dir)
-                                    rta_completes.append(rta_complete)
-                                    rta_complete_times.append(rta_complete_time)
-                                    upload_completes.append(upload_complete)
+                                # grab date of fastq dir
+                                fastq_dir_create_date = datetime.fromtimestamp(get_creation_dt(fastq_dir)).strftime('%Y-%m-%d %H:%M:%S')
+                                run_records.append(run_record.copy(fastq_dir=fastq_dir,
+                                                                   fastq_dir_create_date=fastq_dir_create_date,
+                                                                   num_fastq_dir=num_fastq_dir,
+                                                                   upload_complete=upload_complete))
 
-            dirs_df = pd.DataFrame(list(zip(run_ids, server_parse_dates, projects, run_completion_times, run_dirs, run_dirs_create_dates,
-                                            num_run_dirs, fastq_dirs, fastq_dirs_create_dates, num_fastq_dirs,
-                                            rta_completes, rta_complete_times, upload_completes)),
-                                   columns=['run_id', 'server_parse_date', 'project', 'run_completion_time', 'run_dir',
-                                            'run_dir_create_date', 'num_run_dir', 'fastq_dir', 'fastq_dir_create_date',
-                                            'num_fastq_dir', 'rta_complete', 'rta_complete_time', 'upload_complete'])
-            # output dirs to csv
+            dirs_df = records_to_df(run_records, ServerRunRecord)
+            if self.scan_cache is not None:
+                for run_dir, fingerprint in scanned_runs:
+                    self.scan_cache.set_dirs_df(run_dir, fingerprint, dirs_df[dirs_df['run_dir'] == run_dir])
+                self.scan_cache.save()
+                if cached_dirs_dfs:
+                    dirs_df = pd.concat([dirs_df] + cached_dirs_dfs, ignore_index=True)
+            # record dirs in the run catalog; server_dirlist.csv is exported from it (python -m mytd_parser catalog-export)
             if export_csv:
-                output_csv_filename = self.log_file_dir + 'server_dirlist.csv'
-                if os.path.exists(output_csv_filename):
-                    dirs_df_old = pd.read_csv(output_csv_filename)
-                    dirs_df_old = dirs_df_old.set_index('run_id')
-                    dirs_df_id = dirs_df.copy()
-                    dirs_df_id = dirs_df_id.set_index('run_id')
-                    # merge the existing and new dirs_df and update fields based on run_id
-                    dirs_df_new = dirs_df_id.combine_first(dirs_df_old).reset_index()
-                    dirs_df_new.to_csv(output_csv_filename, encoding='utf-8', index=False, header=True)
-                else:
-                    dirs_df_id = dirs_df.copy()
-                    dirs_df_id = dirs_df_id.set_index('run_id')
-                    dirs_df_id.to_csv(output_csv_filename, encoding='utf-8', index=True)
+                self.run_catalog.upsert_runs('server_runs', df_to_records(dirs_df, ServerRunRecord))
             if complete_upload:
                 # subset by directories that have RTAComplete.txt; we do not want to process incomplete sequencing runs
                 dirs_df_upload_complete = dirs_df[(dirs_df['rta_complete'] == True) &
@@ -224,38 +247,73 @@ class ServerParse:
         except Exception as err:
             raise RuntimeError("** Error: get_dirs Failed (" + str(err) + ")")
 
+    def refresh_cached_dirs_df(self, dirs_df, run_dir, server_parse_date):
+        """
+         cached rows of an unchanged run with this scan's server_parse_date. upload_complete is checked again for
+         fastq dirs that were not complete: Fastq_filelist.csv is not part of the run's fingerprint, so a
+         manifest rewritten in place would otherwise leave the run incomplete until something else changed
+        """
+        dirs_df = dirs_df.assign(server_parse_date=server_parse_date)
+        for index, row in dirs_df.iterrows():
+            if row['rta_complete'] != True or row['upload_complete'] == True:
+                continue
+            fastq_list_filepath = str(row['fastq_dir']) + 'Fastq_filelist.csv'
+            if os.path.exists(fastq_list_filepath):
+                dirs_df.at[index, 'upload_complete'] = check_upload_complete(fastq_list_filepath, run_dir)
+        return dirs_df
+
     def create_bioinformatics_results_dir(self, project, run_id):
         """
          parse server copy of fastq files
         """
         try:
-            api_logger.info('[START] create_bioinformatics_results_dir')
+            api_logger.debug('[START] create_bioinformatics_results_dir')
             upload_bioinfo_results_dir = self.upload_bioinfo_results_dir
             output_hpc_run_dir = upload_bioinfo_results_dir + project + '/' + run_id + '/Bioinformatics_Results/'
             if not os.path.exists(output_hpc_run_dir):
                 os.makedirs(output_hpc_run_dir)
                 api_logger.info('Created dir: ' + project + ', ' + run_id + ': [' + output_hpc_run_dir + ']')
-            api_logger.info('[END] create_bioinformatics_results_dir')
+            api_logger.debug('[END] create_bioinformatics_results_dir')
         except Exception as err:
             raise RuntimeError("** Error: create_bioinformatics_results_dir Failed (" + str(err) + ")")
 
-    def move_fastq_files(self):
+    def move_fastq_files(self, run_dirs=None):
         """
          parse server copy of fastq files
+         run_dirs: only move fastq files of these run dirs; None moves every complete run
         """
         try:
             api_logger.info('[START] move_fastq_files')
+            metrics = get_metrics()
+            with metrics.stage('server_discover'), profile_stage('server_discover'):
+                dirs_df = self.get_dirs(export_csv=True, complete_upload=True, run_dirs=run_dirs)
+            status_writer = None
+            if self.update_gdrive:
+                status_writer = GsheetStatusWriter()
+            with metrics.stage('server_move'), profile_stage('server_move'):
+                self.move_run_records(df_to_records(dirs_df, ServerRunRecord), status_writer)
+            if status_writer is not None:
+                status_writer.flush()
+            api_logger.info('[END] move_fastq_files')
+        except Exception as err:
+            raise RuntimeError("** Error: move_fastq_files Failed (" + str(err) + ")")
+
+    def move_run_records(self, run_records, status_writer=None):
+        """
+         copy the fastq files of each complete fastq dir to output_dir/run_id/ and mark the dir moved
+        """
+        try:
             output_dir = self.output_dir
-            dirs_df = self.get_dirs(export_csv=True, complete_upload=True)
-            for index, row in dirs_df.iterrows():
-                project = row['project']
-                run_id = row['run_id']
-                fastq_dir = row['fastq_dir']
+            for run_record in run_records:
+                project = run_record.project
+                run_id = run_record.run_id
+                fastq_dir = run_record.fastq_dir
                 self.create_bioinformatics_results_dir(project, run_id)
                 output_fastq_dir = output_dir + run_id + '/'
                 if not os.path.exists(output_fastq_dir):
                     os.makedirs(output_fastq_dir)
-                fastq_files = glob.glob(os.path.join(fastq_dir, '**/*.fastq.gz'), recursive=True)
+                fastq_files = self.get_run_tree_index(run_record.run_dir).get_files_in(FASTQ, fastq_dir,
+                                                                                       recursive=True)
                 num_fastq_files = len(fastq_files)
                 api_logger.info('Start move: ' + str(num_fastq_files) + ' fastq files - ' + project + ', ' + run_id +
                                 ', from: [' + fastq_dir + '], to: [' + output_fastq_dir + ']')
@@ -265,13 +323,16 @@ class ServerParse:
                     output_fastq_filename = output_fastq_dir + fastq_filename
                     if not os.path.exists(output_fastq_filename):
                         # only want to copy/move if file doesn't already exist
-                        copy2(fastq_file, output_fastq_dir)
-                        api_logger.info(str(fastq_filename) + ' moved to [' + str(output_fastq_dir) + ']')
+                        fast_copy2(fastq_file, output_fastq_dir)
+                        api_logger.debug('%s moved to [%s]', fastq_filename, output_fastq_dir)
                         fastq_counter += 1
                 if fastq_counter == 0:
-                    api_logger.info('[ALL ALREADY EXIST] Moved ' + str(fastq_counter) + ' files')
+                    api_logger.debug('[ALL ALREADY EXIST] Moved %s files', fastq_counter)
                 else:
-                    api_logger.info('[MOVED] Moved ' + str(fastq_counter) + ' files')
-            api_logger.info('[END] move_fastq_files')
+                    api_logger.debug('[MOVED] Moved %s files', fastq_counter)
+                self.run_catalog.set_status('server_runs', run_record.run_dir, fastq_dir, STATUS_MOVED)
+                get_metrics().inc(FASTQ_DIRS, state='moved')
+                if status_writer is not None:
+                    status_writer.add(run_id, GSHEETS_PARSE_STATUS_COLUMN, "COMPLETE")
         except Exception as err:
-            raise RuntimeError("** Error: move_fastq_files Failed (" + str(err) + ")")
+            raise RuntimeError("** Error: move_run_records Failed (" + str(err) + ")")
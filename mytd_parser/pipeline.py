@@ -0,0 +1,150 @@
+"""
+pipeline.py
+Staged parse of one run dir in staging: discover -> validate -> copy_metadata -> copy_fastq -> manifest -> backup
+Created By: mkimble
+"""
+
+import os
+import time
+from .logger_settings import api_logger
+from .metrics import get_metrics, FASTQ_DIRS
+from .profiling import profile_stage
+from .records import RunRecord, records_to_df, df_to_records
+
+DISCOVER = 'discover'
+VALIDATE = 'validate'
+COPY_METADATA = 'copy_metadata'
+COPY_FASTQ = 'copy_fastq'
+MANIFEST = 'manifest'
+BACKUP = 'backup'
+# stages in the order they run
+STAGES = (DISCOVER, VALIDATE, COPY_METADATA, COPY_FASTQ, MANIFEST, BACKUP)
+# every stage but backup; what parse_fastq_files runs
+PARSE_STAGES = STAGES[:-1]
+
+
+class RunContext:
+    """
+     state of one run dir shared by the stages.
+     dirs_df: complete fastq dirs from get_dirs; run_records: the same as RunRecords
+     valid_records: run_records that passed the validate gates (None if validate did not run)
+     fastq_records: {fastq_dir: [FastqRecord]} copied by copy_fastq
+     actions: (upload_action, parsing_action, staging_action) from backup
+    """
+    def __init__(self):
+        self.dirs_df = None
+        self.run_records = []
+        self.valid_records = None
+        self.fastq_records = {}
+        self.actions = None
+        # {stage: seconds}
+        self.stage_times = {}
+
+    def get_records(self):
+        """
+         records the copy stages work on: the validated ones, or every discovered one if validate was skipped
+        """
+        if self.valid_records is None:
+            return self.run_records
+        return self.valid_records
+
+    def get_backup_df(self):
+        """
+         dirs_df of the runs backup may upload and move: only validated records, and only runs where every
+         fastq dir passed validate, so a fastq dir that isn't ready is never moved to Backup unparsed
+        """
+        records = self.get_records()
+        if self.valid_records is not None:
+            valid_ids = set(id(run_record) for run_record in self.valid_records)
+            not_ready_run_ids = set(run_record.run_id for run_record in self.run_records
+                                    if id(run_record) not in valid_ids)
+            records = [run_record for run_record in records if run_record.run_id not in not_ready_run_ids]
+        return records_to_df(records, RunRecord)
+
+
+class ParsePipeline:
+    """
+     runs the stages of a MiSeqParser/GenericParser over one RunContext. get_dirs is called and every gate
+     (check_gdrive, rta_complete, sequencing_complete) is evaluated once per fastq dir, then the copy stages
+     work on the records that passed.
+     stages: the stages to run; skip_stages: stages left out, e.g., skip_stages=(BACKUP,)
+     e.g., context = ParsePipeline(parser, move_parsing=True).run()
+    """
+    def __init__(self, parser, stages=STAGES, skip_stages=(), export_csv=True, ignore_metadata_dirs=True,
+                 upload_parsing=False, move_parsing=False, move_staging=False):
+        unknown_stages = set(stages) - set(STAGES)
+        if unknown_stages:
+            raise ValueError("unknown pipeline stages " + str(sorted(unknown_stages)))
+        self.parser = parser
+        self.stages = [stage for stage in STAGES if stage in stages and stage not in skip_stages]
+        # append the fastq records of every pass to the fastq archive
+        self.export_csv = export_csv
+        # False also copies the run dir's subdirs (except Alignment, Data, Thumbnail_Images) to run_metadata
+        self.ignore_metadata_dirs = ignore_metadata_dirs
+        self.upload_parsing = upload_parsing
+        self.move_parsing = move_parsing
+        self.move_staging = move_staging
+
+    def run(self, context=None):
+        """
+         run the stages in order; pass a context from an earlier run to continue from its results
+        """
+        try:
+            if context is None:
+                context = RunContext()
+            # profiles of a run's stages go in LOG_FILE_DIR/profiles/<run_id>/ when the job is profiled
+            run_id = os.path.basename(str(self.parser.run_dir).rstrip('/'))
+            for stage in self.stages:
+                if stage != DISCOVER and context.dirs_df is None:
+                    raise RuntimeError("stage " + stage + " needs the discover stage")
+                api_logger.info('[START] ' + stage + ' [' + str(self.parser.run_dir) + ']')
+                start_time = time.perf_counter()
+                with get_metrics().stage(stage), profile_stage(stage, run_id):
+                    getattr(self, stage)(context)
+                context.stage_times[stage] = time.perf_counter() - start_time
+                api_logger.info('[END] ' + stage + ' (' + str(round(context.stage_times[stage], 3)) + 's)')
+            return context
+        except Exception as err:
+            raise RuntimeError("** Error: ParsePipeline run Failed (" + str(err) + ")")
+
+    def discover(self, context):
+        # scanned runs are always recorded in the run catalog; export_csv only covers the fastq archive
+        context.dirs_df = self.parser.get_dirs(export_csv=True, rta_complete=True)
+        context.run_records = df_to_records(context.dirs_df, RunRecord)
+
+    def validate(self, context):
+        context.valid_records = [run_record for run_record in context.run_records
+                                 if self.parser.check_run_gates(run_record)]
+        metrics = get_metrics()
+        metrics.inc(FASTQ_DIRS, len(context.valid_records), state='valid')
+        metrics.inc(FASTQ_DIRS, len(context.run_records) - len(context.valid_records), state='not_ready')
+
+    def copy_metadata(self, context):
+        copied_run_dirs = set()
+        for run_record in context.get_records():
+            # run dir files are copied once per run, fastq metadata once per fastq dir
+            if run_record.run_dir not in copied_run_dirs:
+                self.parser.copy_run_metadata(run_record, self.ignore_metadata_dirs)
+                copied_run_dirs.add(run_record.run_dir)
+            self.parser.copy_fastq_metadata(run_record)
+
+    def copy_fastq(self, context):
+        for run_record in context.get_records():
+            context.fastq_records[run_record.fastq_dir] = self.parser.copy_fastq_dir(run_record)
+
+    def manifest(self, context):
+        for run_record in context.get_records():
+            fastq_records = context.fastq_records.get(run_record.fastq_dir)
+            if fastq_records is None:
+                # copy_fastq was skipped; nothing to write a manifest for
+                continue
+            self.parser.write_fastq_manifest(run_record, fastq_records, self.export_csv)
+
+    def backup(self, context):
+        backup_df = context.get_backup_df()
+        if backup_df.empty:
+            api_logger.info('backup: no fastq dir passed validate, nothing uploaded or moved [' +
+                            str(self.parser.run_dir) + ']')
+            return
+        context.actions = self.parser.complete_upload_backup(backup_df, self.upload_parsing,
+                                                             self.move_parsing, self.move_staging)
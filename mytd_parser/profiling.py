@@ -0,0 +1,191 @@
+"""
+profiling.py
+cProfile (and optionally tracemalloc) per stage of a parse, switched on per run with the profile option of
+parse_seq_dirs, server_parse and DatasetFilter.write_filter_file, or with MYTD_PARSER_PROFILE=1
+Created By: mkimble
+"""
+
+import os
+import io
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from datetime import datetime
+from contextlib import contextmanager
+from . import settings
+from .logger_settings import api_logger
+
+# process-wide Profiler while a profiled job runs; None otherwise, so profile_stage costs a single check
+profiler = None
+profiler_lock = threading.Lock()
+
+
+def get_safe_name(name):
+    return ''.join(char if char.isalnum() or char in '-_.' else '_' for char in str(name))
+
+
+class Profiler:
+    """
+     writes, per profiled stage, profile_dir/<run_id>/<stage>_<start time>.pstats, a .txt with the top_n
+     functions by cumulative time and, with use_tracemalloc, a _alloc.txt with the top_n lines by memory
+     allocated during the stage. One stage is profiled at a time; a stage started inside another (or from a
+     second thread) is not profiled on its own
+    """
+    def __init__(self, job, profile_dir=settings.LOG_FILE_DIR + settings.PROFILE_DIRNAME,
+                 use_tracemalloc=settings.PROFILE_TRACEMALLOC, top_n=settings.PROFILE_TOP_N,
+                 tracemalloc_frames=settings.PROFILE_TRACEMALLOC_FRAMES):
+        self.job = job
+        self.profile_dir = profile_dir
+        self.use_tracemalloc = use_tracemalloc
+        self.top_n = top_n
+        self.tracemalloc_frames = tracemalloc_frames
+        self.start_time = datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.is_profiling = False
+        self.lock = threading.Lock()
+        self.started_tracemalloc = False
+
+    def start(self):
+        if self.use_tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start(self.tracemalloc_frames)
+            self.started_tracemalloc = True
+        api_logger.info('[PROFILE] start: ' + self.job + ' [' + self.profile_dir + ']')
+
+    def stop(self):
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+        api_logger.info('[PROFILE] end: ' + self.job)
+
+    def get_output_path(self, run_id, stage):
+        output_dir = os.path.join(self.profile_dir, get_safe_name(run_id))
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir, exist_ok=True)
+        output_path = os.path.join(output_dir, get_safe_name(stage) + '_' + self.start_time)
+        # a stage that runs more than once in a job (e.g., one run dir parsed twice) gets a numbered file
+        path_num = 1
+        base_output_path = output_path
+        while os.path.exists(output_path + '.pstats'):
+            path_num += 1
+            output_path = base_output_path + '_' + str(path_num)
+        return output_path
+
+    @contextmanager
+    def stage(self, stage, run_id=None):
+        with self.lock:
+            if self.is_profiling:
+                is_profiled = False
+            else:
+                self.is_profiling = is_profiled = True
+        if not is_profiled:
+            yield
+            return
+        try:
+            profile = cProfile.Profile()
+            start_snapshot = None
+            if self.use_tracemalloc and tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+                start_snapshot = tracemalloc.take_snapshot()
+            start_time = time.perf_counter()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                elapsed_time = time.perf_counter() - start_time
+                # snapshot before the reports are written so their allocations aren't counted
+                allocations = None
+                if start_snapshot is not None:
+                    allocations = (start_snapshot, tracemalloc.take_snapshot()) + tracemalloc.get_traced_memory()
+                self.write_stage(run_id if run_id is not None else self.job, stage, profile, allocations,
+                                 elapsed_time)
+        finally:
+            with self.lock:
+                self.is_profiling = False
+
+    def write_stage(self, run_id, stage, profile, allocations, elapsed_time):
+        """
+         write the stage's reports; failures are logged, never raised, so profiling can't fail a run
+        """
+        try:
+            output_path = self.get_output_path(run_id, stage)
+            profile.dump_stats(output_path + '.pstats')
+            stats_text = io.StringIO()
+            stats = pstats.Stats(profile, stream=stats_text)
+            stats.sort_stats('cumulative').print_stats(self.top_n)
+            with open(output_path + '.txt', 'w') as stats_file:
+                stats_file.write(self.job + ' ' + str(run_id) + ' ' + stage + ': ' + str(round(elapsed_time, 3)) +
+                                 's\n' + stats_text.getvalue())
+            if allocations is not None:
+                self.write_allocations(output_path + '_alloc.txt', run_id, stage, *allocations)
+            api_logger.info('[PROFILE] ' + str(run_id) + ' ' + stage + ': ' + str(round(elapsed_time, 3)) + 's [' +
+                            output_path + '.pstats]')
+        except Exception as err:
+            api_logger.error('[PROFILE] write_stage Failed (' + str(err) + ')')
+
+    def write_allocations(self, output_filepath, run_id, stage, start_snapshot, end_snapshot, current_size,
+                          peak_size):
+        """
+         top_n source lines by memory allocated (and still held) during the stage, with the stage's peak
+        """
+        # the profilers' own bookkeeping is not part of the parse
+        snapshot_filters = [tracemalloc.Filter(False, module_file)
+                            for module_file in (tracemalloc.__file__, cProfile.__file__, pstats.__file__, __file__)]
+        stat_diffs = end_snapshot.filter_traces(snapshot_filters).compare_to(
+            start_snapshot.filter_traces(snapshot_filters), 'lineno')
+        with open(output_filepath, 'w') as alloc_file:
+            alloc_file.write(self.job + ' ' + str(run_id) + ' ' + stage + ': traced ' +
+                             str(round(current_size / 1048576, 2)) + ' MB, peak ' +
+                             str(round(peak_size / 1048576, 2)) + ' MB\n')
+            alloc_file.write('top ' + str(self.top_n) + ' lines by memory allocated during the stage:\n')
+            for stat_diff in stat_diffs[:self.top_n]:
+                alloc_file.write(str(stat_diff) + '\n')
+
+
+def get_profiler():
+    return profiler
+
+
+@contextmanager
+def profiling(job, enabled=settings.PROFILE, use_tracemalloc=settings.PROFILE_TRACEMALLOC, profile_dir=None):
+    """
+     profile the stages run in the with block, e.g., with profiling('parse_seq_dirs', enabled=profile).
+     Does nothing if enabled is False or a job is already being profiled (e.g., in a process pool worker
+     forked from a profiled parse_seq_dirs). profile_dir defaults to LOG_FILE_DIR + PROFILE_DIRNAME.
+     tracemalloc is stopped again at the end only if it wasn't already tracing
+    """
+    global profiler
+    if not enabled:
+        yield
+        return
+    with profiler_lock:
+        if profiler is not None:
+            is_owner = False
+        else:
+            if profile_dir is None:
+                profile_dir = settings.LOG_FILE_DIR + settings.PROFILE_DIRNAME
+            profiler = Profiler(job, profile_dir=profile_dir, use_tracemalloc=use_tracemalloc)
+            profiler.start()
+            is_owner = True
+    try:
+        yield
+    finally:
+        if is_owner:
+            with profiler_lock:
+                profiler.stop()
+                profiler = None
+
+
+@contextmanager
+def profile_stage(stage, run_id=None):
+    """
+     cProfile the with block if a job is being profiled. run_id: the dir under profile_dir the reports go in;
+     None uses the job name, for stages that cover every run (e.g., server_move)
+    """
+    current_profiler = profiler
+    if current_profiler is None:
+        yield
+        return
+    with current_profiler.stage(stage, run_id):
+        yield
@@ -0,0 +1,171 @@
+"""
+reconcile.py
+Compare the Fastq_filelist.csv manifests of uploaded runs with the datasets and datafiles in MyTardis, listing
+the fastq files that are missing or differ in size or md5 so they can be uploaded again
+Created By: mkimble
+"""
+
+import os
+import glob
+import pandas as pd
+from . import settings
+from .logger_settings import api_logger
+from .mytardis_api import MyTardisClient
+
+# columns of the reconcile output
+RECONCILE_COLUMNS = ['project', 'run_id', 'fastq_path', 'size', 'md5', 'status', 'mytardis_size', 'mytardis_md5',
+                     'manifest_path']
+# status of a fastq file in the output; files that match are left out
+STATUS_MISSING_DATASET = 'missing_dataset'
+STATUS_MISSING = 'missing'
+STATUS_SIZE_MISMATCH = 'size_mismatch'
+STATUS_MD5_MISMATCH = 'md5_mismatch'
+# dataset ids per bulk dataset_file query
+DATASET_ID_CHUNK_SIZE = 50
+
+
+def read_manifests(manifest_dirs):
+    """
+     fastq files of every manifest in manifest_dirs (Upload dirs laid out project/run_id/Fastq_*/), one row per
+     file with project, run_id, fastq_path (relative to the run dir), size and md5
+    """
+    try:
+        manifest_dfs = []
+        for manifest_dir in manifest_dirs:
+            for manifest_path in glob.glob(os.path.join(manifest_dir, '*', '*', 'Fastq_*', 'Fastq_filelist.csv')):
+                run_path = os.path.dirname(os.path.dirname(manifest_path))
+                manifest_df = pd.read_csv(manifest_path, dtype={'fastq_path': str})
+                for column in ('size', 'md5'):
+                    if column not in manifest_df.columns:
+                        manifest_df[column] = None
+                manifest_df = manifest_df[['fastq_path', 'size', 'md5']]
+                manifest_df.insert(0, 'run_id', os.path.basename(run_path))
+                manifest_df.insert(0, 'project', os.path.basename(os.path.dirname(run_path)))
+                manifest_df['manifest_path'] = manifest_path.replace('\\', '/')
+                api_logger.debug('read_manifests: [%s] %s fastq files', manifest_path, len(manifest_df))
+                manifest_dfs.append(manifest_df)
+        if not manifest_dfs:
+            return pd.DataFrame(columns=['project', 'run_id', 'fastq_path', 'size', 'md5', 'manifest_path'])
+        manifests_df = pd.concat(manifest_dfs, ignore_index=True)
+        manifests_df['size'] = manifests_df['size'].astype('Int64')
+        api_logger.info('read_manifests: %s manifests, %s fastq files', len(manifest_dfs), len(manifests_df))
+        return manifests_df
+    except Exception as err:
+        raise RuntimeError("** Error: read_manifests Failed (" + str(err) + ")")
+
+
+def get_resource_id(resource_uri):
+    # e.g., /api/v1/dataset/12/ -> 12
+    return int(str(resource_uri).rstrip('/').rsplit('/', 1)[-1])
+
+
+class Reconciler:
+    """
+     finds the fastq files of local manifests that did not reach MyTardis. Datasets are matched to runs by
+     description (the run_id dir name with FOLDER_STRUCTURE 'User Group / Dataset') and datafiles to fastq
+     files by directory/filename, with one paged dataset listing and dataset_file listings of
+     DATASET_ID_CHUNK_SIZE datasets at a time
+    """
+    def __init__(self, client=None, dataset_params=None):
+        if client is None:
+            client = MyTardisClient()
+        self.client = client
+        if dataset_params is None:
+            dataset_params = {'experiments__id': settings.MAINE_EDNA_EXPERIMENT_ID}
+        self.dataset_params = dataset_params
+
+    def get_datasets_df(self):
+        """
+         datasets as a df of dataset_id, run_id
+        """
+        try:
+            datasets, status_code = self.client.get_objects('dataset', self.dataset_params,
+                                                            fields=['id', 'description'])
+            if datasets is False:
+                raise RuntimeError('dataset listing failed: [' + str(status_code) + ']')
+            datasets_df = pd.DataFrame(datasets, columns=['id', 'description'])
+            return datasets_df.rename(columns={'id': 'dataset_id', 'description': 'run_id'})
+        except Exception as err:
+            raise RuntimeError("** Error: Reconciler get_datasets_df Failed (" + str(err) + ")")
+
+    def get_datafiles_df(self, dataset_ids):
+        """
+         datafiles of dataset_ids as a df of dataset_id, fastq_path (directory/filename), mytardis_size,
+         mytardis_md5
+        """
+        try:
+            datafiles = []
+            dataset_ids = sorted(set(dataset_ids))
+            for index in range(0, len(dataset_ids), DATASET_ID_CHUNK_SIZE):
+                chunk_ids = dataset_ids[index:index + DATASET_ID_CHUNK_SIZE]
+                params_dict = {'dataset__id__in': ','.join(str(dataset_id) for dataset_id in chunk_ids)}
+                chunk_datafiles, status_code = self.client.get_objects(
+                    'dataset_file', params_dict, fields=['dataset', 'directory', 'filename', 'size', 'md5sum'])
+                if chunk_datafiles is False:
+                    raise RuntimeError('dataset_file listing failed: [' + str(status_code) + ']')
+                api_logger.debug('get_datafiles_df: %s datasets, %s datafiles', len(chunk_ids), len(chunk_datafiles))
+                datafiles.extend(chunk_datafiles)
+            rows = []
+            for datafile in datafiles:
+                directory = (datafile.get('directory') or '').strip('/')
+                fastq_path = directory + '/' + datafile['filename'] if directory else datafile['filename']
+                rows.append((get_resource_id(datafile['dataset']), fastq_path, datafile.get('size'),
+                             datafile.get('md5sum')))
+            datafiles_df = pd.DataFrame(rows, columns=['dataset_id', 'fastq_path', 'mytardis_size', 'mytardis_md5'])
+            datafiles_df['mytardis_size'] = pd.to_numeric(datafiles_df['mytardis_size']).astype('Int64')
+            return datafiles_df
+        except Exception as err:
+            raise RuntimeError("** Error: Reconciler get_datafiles_df Failed (" + str(err) + ")")
+
+    def reconcile(self, manifests_df):
+        """
+         rows of manifests_df whose fastq file is missing from MyTardis or differs in size or md5, with a
+         status column; md5 is only compared when both sides have one
+        """
+        try:
+            datasets_df = self.get_datasets_df()
+            # keep the newest dataset if a run was uploaded twice
+            datasets_df = datasets_df.sort_values('dataset_id').drop_duplicates('run_id', keep='last')
+            runs_df = manifests_df.merge(datasets_df, on='run_id', how='left')
+            missing_dataset = runs_df['dataset_id'].isna()
+            dataset_ids = runs_df.loc[~missing_dataset, 'dataset_id'].astype(int).tolist()
+            datafiles_df = self.get_datafiles_df(dataset_ids)
+
+            found_df = runs_df[~missing_dataset].astype({'dataset_id': int})
+            found_df = found_df.merge(datafiles_df, on=['dataset_id', 'fastq_path'], how='left')
+            found_df['status'] = None
+            found_df.loc[found_df['mytardis_md5'].notna() & found_df['md5'].notna() &
+                         (found_df['mytardis_md5'] != found_df['md5']), 'status'] = STATUS_MD5_MISMATCH
+            found_df.loc[found_df['size'].notna() & found_df['mytardis_size'].notna() &
+                         (found_df['size'] != found_df['mytardis_size']).fillna(False), 'status'] = STATUS_SIZE_MISMATCH
+            found_df.loc[found_df['mytardis_size'].isna() & found_df['mytardis_md5'].isna(), 'status'] = STATUS_MISSING
+
+            missing_dataset_df = runs_df[missing_dataset].copy()
+            missing_dataset_df['status'] = STATUS_MISSING_DATASET
+            missing_dataset_df['mytardis_size'] = pd.NA
+            missing_dataset_df['mytardis_md5'] = None
+
+            reconcile_df = pd.concat([missing_dataset_df[RECONCILE_COLUMNS],
+                                      found_df.loc[found_df['status'].notna(), RECONCILE_COLUMNS]],
+                                     ignore_index=True)
+            reconcile_df = reconcile_df.sort_values(['project', 'run_id', 'fastq_path']).reset_index(drop=True)
+            api_logger.info('reconcile: %s fastq files, %s missing or mismatched', len(manifests_df), len(reconcile_df))
+            return reconcile_df
+        except Exception as err:
+            raise RuntimeError("** Error: Reconciler reconcile Failed (" + str(err) + ")")
+
+
+def reconcile_uploads(output_csv, manifest_dirs=None, client=None, dataset_params=None):
+    """
+     write the fastq files of the manifests in manifest_dirs (default: Upload and Backup/Upload) that are
+     missing or mismatched in MyTardis to output_csv; returns the df
+    """
+    try:
+        if manifest_dirs is None:
+            manifest_dirs = [settings.MISEQ_UPLOAD_DIR, settings.MISEQ_BACKUP_DIR + 'Upload/']
+        manifests_df = read_manifests(manifest_dirs)
+        reconcile_df = Reconciler(client, dataset_params).reconcile(manifests_df)
+        reconcile_df.to_csv(output_csv, encoding='utf-8', index=False)
+        return reconcile_df
+    except Exception as err:
+        raise RuntimeError("** Error: reconcile_uploads Failed (" + str(err) + ")")
@@ -0,0 +1,126 @@
+"""
+records.py
+Fixed-field records for the run dirs and fastq files found while parsing; a df is only built to export csv
+Created By: mkimble
+"""
+
+import pandas as pd
+from .copy_engine import CHECKSUM_ALGORITHMS
+
+
+class Record:
+    """
+     base for records with __slots__; fields not passed to the constructor are None
+    """
+    __slots__ = ()
+    # fields that are exported as df columns, in column order
+    COLUMNS = ()
+    # df columns that are not fields but are read back by from_columns, e.g., checksums
+    EXTRA_COLUMNS = ()
+    # df dtypes for columns that would otherwise lose their type, e.g., ints with missing values
+    DTYPES = {}
+
+    def __init__(self, **fields):
+        for field in self.__slots__:
+            setattr(self, field, fields.pop(field, None))
+        if fields:
+            raise TypeError(type(self).__name__ + " got unexpected fields " + str(sorted(fields)))
+
+    @classmethod
+    def from_columns(cls, values):
+        """
+         record from {column: value} of a df row
+        """
+        return cls(**values)
+
+    def copy(self, **fields):
+        """
+         new record with the same fields, except for the ones passed in
+        """
+        values = {field: getattr(self, field) for field in self.__slots__}
+        values.update(fields)
+        return type(self)(**values)
+
+    def get_field(self, column):
+        return getattr(self, column)
+
+    def __repr__(self):
+        return type(self).__name__ + '(' + ', '.join(column + '=' + repr(getattr(self, column))
+                                                     for column in self.COLUMNS) + ')'
+
+
+class RunRecord(Record):
+    """
+     one row of seq_dirlist.csv: a fastq dir of a run in MISEQ_STAGING_DIR (MiSeqParser, GenericParser)
+    """
+    COLUMNS = ('run_id', 'parse_type', 'parse_date', 'project', 'run_date', 'run_completion_time',
+               'run_dir', 'run_dir_create_date', 'num_run_dir',
+               'align_subdir', 'align_subdir_create_date', 'num_align_subdir',
+               'fastq_dir', 'num_fastq_files', 'fastq_dir_create_date',
+               'rta_complete', 'rta_complete_time', 'sequencing_complete')
+    __slots__ = COLUMNS
+
+
+class ServerRunRecord(Record):
+    """
+     one row of server_dirlist.csv: a fastq dir of a run in SERVER_DOWNLOAD_DIR (ServerParse)
+    """
+    COLUMNS = ('run_id', 'server_parse_date', 'project', 'run_completion_time', 'run_dir',
+               'run_dir_create_date', 'num_run_dir', 'fastq_dir', 'fastq_dir_create_date',
+               'num_fastq_dir', 'rta_complete', 'rta_complete_time', 'upload_complete')
+    __slots__ = COLUMNS
+
+
+class FastqRecord(Record):
+    """
+     one fastq file of a fastq dir. fastq_path is the Staging path, upload_fastq_path the path relative to
+     the Upload run dir that is written to Fastq_filelist.csv. size, mtime_ns and checksums
+     ({algorithm: hex digest}) are of the file in Upload
+    """
+    COLUMNS = ('parse_date', 'sample_id', 'primer_pair', 'sampleid_primerpair', 'fastq_create_date',
+               'fastq_path', 'upload_fastq_path', 'sample_number', 'lane', 'read', 'size', 'mtime_ns')
+    __slots__ = COLUMNS + ('checksums',)
+    EXTRA_COLUMNS = CHECKSUM_ALGORITHMS
+    DTYPES = {'sample_number': 'Int64', 'lane': 'Int64', 'size': 'Int64', 'mtime_ns': 'Int64'}
+
+    @classmethod
+    def from_columns(cls, values):
+        checksums = {algorithm: values.pop(algorithm) for algorithm in cls.EXTRA_COLUMNS if algorithm in values}
+        checksums = {algorithm: checksum for algorithm, checksum in checksums.items() if checksum is not None}
+        return cls(checksums=checksums if checksums else None, **values)
+
+    def get_field(self, column):
+        if column in self.COLUMNS:
+            return getattr(self, column)
+        # checksum columns, e.g., md5
+        return (self.checksums or {}).get(column)
+
+
+def records_to_df(records, record_class, columns=None):
+    """
+     df built column by column straight from the records' fields; columns defaults to record_class.COLUMNS
+    """
+    if columns is None:
+        columns = record_class.COLUMNS
+    df = pd.DataFrame({column: [record.get_field(column) for record in records] for column in columns},
+                      columns=list(columns))
+    for column, dtype in record_class.DTYPES.items():
+        if column in df.columns:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def df_to_records(df, record_class):
+    """
+     records for the rows of a df, e.g., get_dirs output or cached rows; the reverse of records_to_df.
+     Missing values (NaN, NaT, pd.NA) are None again, and columns the record doesn't have are dropped
+    """
+    columns = [column for column in record_class.COLUMNS + record_class.EXTRA_COLUMNS if column in df.columns]
+    column_values = []
+    for column in columns:
+        values = df[column].tolist()
+        is_missing = df[column].isna()
+        if is_missing.any():
+            values = [None if missing else value for value, missing in zip(values, is_missing.tolist())]
+        column_values.append(values)
+    return [record_class.from_columns(dict(zip(columns, values))) for values in zip(*column_values)]
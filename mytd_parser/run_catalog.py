@@ -0,0 +1,265 @@
+"""
+run_catalog.py
+SQLite catalog of scanned runs and parsed fastq files, replacing the seq_dirlist.csv and server_dirlist.csv
+rewrites; the csv files can still be exported from it
+Created By: mkimble
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import closing
+from datetime import datetime
+import pandas as pd
+from . import settings
+from .logger_settings import api_logger
+from .records import RunRecord, ServerRunRecord, FastqRecord
+from .copy_engine import CHECKSUM_ALGORITHMS
+
+# run status in the catalog; a rescan never moves a parsed or moved fastq dir back to complete
+STATUS_INCOMPLETE = 'incomplete'
+STATUS_COMPLETE = 'complete'
+STATUS_PARSED = 'parsed'
+STATUS_MOVED = 'moved'
+
+# {table: spec}. complete_fields must all be True for a row to be complete; done_status is the status set
+# once the fastq dir has been handled (parse_fastq_files, move_fastq_files)
+RUN_TABLES = {
+    'seq_runs': {'record_class': RunRecord,
+                 'complete_fields': ('rta_complete', 'sequencing_complete'),
+                 'done_status': STATUS_PARSED,
+                 'csv_filename': 'seq_dirlist.csv'},
+    'server_runs': {'record_class': ServerRunRecord,
+                    'complete_fields': ('rta_complete', 'upload_complete'),
+                    'done_status': STATUS_MOVED,
+                    'csv_filename': 'server_dirlist.csv'},
+}
+# fastq_files rows are keyed by the Staging path of the fastq file
+FASTQ_TABLE = 'fastq_files'
+FASTQ_RUN_COLUMNS = ('run_id', 'project', 'run_dir', 'fastq_dir')
+FASTQ_CSV_FILENAME = 'fastq_filelist.csv'
+
+# catalog files whose tables this process has created or updated; the DDL runs once per file, not per parser
+created_catalog_filepaths = set()
+created_catalog_lock = threading.Lock()
+
+
+def to_sql_value(value):
+    """
+     sqlite only stores None, int, float, str and bytes; bools become 0/1, NaN becomes NULL and everything else
+     (e.g., the pandas Timestamp of rta_complete_time) is stored as its string
+    """
+    if value is None or isinstance(value, (int, str, bytes)):
+        return value
+    if isinstance(value, float):
+        return None if value != value else value
+    try:
+        if pd.isna(value):
+            return None
+    except (TypeError, ValueError):
+        pass
+    return str(value)
+
+
+class RunCatalog:
+    """
+     run catalog in a sqlite database in WAL mode, so readers never block the parsers and parallel parsers
+     (parse_seq_dirs(jobs=N), watch) can each write their own runs. Each call opens its own connection, so
+     a RunCatalog can be handed to process pool workers.
+    """
+    def __init__(self, catalog_filepath=settings.LOG_FILE_DIR + settings.RUN_CATALOG_FILENAME,
+                 timeout=settings.RUN_CATALOG_TIMEOUT):
+        self.catalog_filepath = catalog_filepath
+        self.timeout = timeout
+        self.create_tables()
+
+    def connect(self):
+        catalog_dir = os.path.dirname(self.catalog_filepath)
+        if catalog_dir:
+            # parse_seq_dirs process pool workers can open the catalog at the same time
+            os.makedirs(catalog_dir, exist_ok=True)
+        connection = sqlite3.connect(self.catalog_filepath, timeout=self.timeout)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def create_tables(self):
+        """
+         create the tables and indexes, and add columns missing from an older catalog, once per catalog file
+        """
+        try:
+            catalog_filepath = os.path.abspath(self.catalog_filepath)
+            with created_catalog_lock:
+                # a catalog file deleted since (e.g., to start over) is created again
+                if catalog_filepath in created_catalog_filepaths and os.path.exists(catalog_filepath):
+                    return
+                self.execute_ddl()
+                created_catalog_filepaths.add(catalog_filepath)
+        except Exception as err:
+            raise RuntimeError("** Error: RunCatalog create_tables Failed (" + str(err) + ")")
+
+    def execute_ddl(self):
+        with closing(self.connect()) as connection, connection:
+            for table, spec in RUN_TABLES.items():
+                columns = spec['record_class'].COLUMNS
+                connection.execute('CREATE TABLE IF NOT EXISTS ' + table + ' (' + ', '.join(columns) +
+                                   ', status TEXT, updated_date TEXT, PRIMARY KEY (run_dir, fastq_dir))')
+                for column in ('run_id', 'project', 'status'):
+                    connection.execute('CREATE INDEX IF NOT EXISTS ' + table + '_' + column + ' ON ' + table +
+                                       ' (' + column + ')')
+            fastq_columns = FASTQ_RUN_COLUMNS + FastqRecord.COLUMNS + CHECKSUM_ALGORITHMS
+            connection.execute('CREATE TABLE IF NOT EXISTS ' + FASTQ_TABLE + ' (' + ', '.join(fastq_columns) +
+                               ', updated_date TEXT, PRIMARY KEY (fastq_path))')
+            # catalogs created before a column was added (e.g., mtime_ns) get it with NULLs
+            existing_columns = {row[1] for row in connection.execute('PRAGMA table_info(' + FASTQ_TABLE + ')')}
+            for column in fastq_columns:
+                if column not in existing_columns:
+                    connection.execute('ALTER TABLE ' + FASTQ_TABLE + ' ADD COLUMN ' + column)
+            for column in ('run_id', 'project', 'sample_id'):
+                connection.execute('CREATE INDEX IF NOT EXISTS ' + FASTQ_TABLE + '_' + column + ' ON ' +
+                                   FASTQ_TABLE + ' (' + column + ')')
+
+    def get_status(self, table, record):
+        if all(getattr(record, field) == True for field in RUN_TABLES[table]['complete_fields']):
+            return STATUS_COMPLETE
+        return STATUS_INCOMPLETE
+
+    def upsert_runs(self, table, records):
+        """
+         insert or update the rows of the scanned runs in records (RunRecord for seq_runs, ServerRunRecord for
+         server_runs). Rows of those runs that are no longer found (e.g., the "Run Failed" row of a run that
+         has since completed) are removed
+        """
+        try:
+            if not records:
+                return
+            spec = RUN_TABLES[table]
+            columns = spec['record_class'].COLUMNS + ('status', 'updated_date')
+            updated_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            update_columns = [column + '=excluded.' + column for column in columns if column != 'status']
+            # a parsed/moved fastq dir stays that way when it is rescanned as complete
+            update_columns.append("status=CASE WHEN excluded.status = '" + STATUS_COMPLETE + "' AND " + table +
+                                  ".status = '" + spec['done_status'] + "' THEN " + table +
+                                  ".status ELSE excluded.status END")
+            upsert_sql = ('INSERT INTO ' + table + ' (' + ', '.join(columns) + ') VALUES (' +
+                          ', '.join('?' * len(columns)) + ') ON CONFLICT (run_dir, fastq_dir) DO UPDATE SET ' +
+                          ', '.join(update_columns))
+            # {run_dir: [fastq_dir]}
+            run_fastq_dirs = {}
+            rows = []
+            for record in records:
+                run_fastq_dirs.setdefault(record.run_dir, []).append(to_sql_value(record.fastq_dir))
+                rows.append([to_sql_value(getattr(record, column)) for column in spec['record_class'].COLUMNS] +
+                            [self.get_status(table, record), updated_date])
+            with closing(self.connect()) as connection, connection:
+                for run_dir, fastq_dirs in run_fastq_dirs.items():
+                    connection.execute('DELETE FROM ' + table + ' WHERE run_dir = ? AND fastq_dir NOT IN (' +
+                                       ', '.join('?' * len(fastq_dirs)) + ')', [run_dir] + fastq_dirs)
+                connection.executemany(upsert_sql, rows)
+        except Exception as err:
+            raise RuntimeError("** Error: RunCatalog upsert_runs Failed (" + str(err) + ")")
+
+    def set_status(self, table, run_dir, fastq_dir, status):
+        try:
+            with closing(self.connect()) as connection, connection:
+                connection.execute('UPDATE ' + table + ' SET status = ?, updated_date = ? WHERE run_dir = ? AND '
+                                   'fastq_dir = ?', [status, datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                                                     run_dir, fastq_dir])
+        except Exception as err:
+            raise RuntimeError("** Error: RunCatalog set_status Failed (" + str(err) + ")")
+
+    def upsert_fastq_files(self, run_id, project, run_dir, fastq_dir, fastq_records):
+        """
+         insert or update the parsed fastq files of one fastq dir, with their size and checksums
+        """
+        try:
+            columns = FASTQ_RUN_COLUMNS + FastqRecord.COLUMNS + CHECKSUM_ALGORITHMS + ('updated_date',)
+            updated_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            upsert_sql = ('INSERT OR REPLACE INTO ' + FASTQ_TABLE + ' (' + ', '.join(columns) + ') VALUES (' +
+                          ', '.join('?' * len(columns)) + ')')
+            rows = []
+            for fastq_record in fastq_records:
+                rows.append([to_sql_value(run_id), project, run_dir, fastq_dir] +
+                            [to_sql_value(fastq_record.get_field(column))
+                             for column in FastqRecord.COLUMNS + CHECKSUM_ALGORITHMS] + [updated_date])
+            with closing(self.connect()) as connection, connection:
+                connection.executemany(upsert_sql, rows)
+        except Exception as err:
+            raise RuntimeError("** Error: RunCatalog upsert_fastq_files Failed (" + str(err) + ")")
+
+    def get_fastq_file_infos(self, fastq_paths):
+        """
+         {fastq_path: {'size': bytes, 'mtime_ns': ns, algorithm: hexdigest}} recorded for the fastq files in
+         fastq_paths (Staging paths), for copy_files to reuse instead of hashing a file again. Files never
+         parsed, or parsed before mtime_ns was recorded, are left out
+        """
+        try:
+            fastq_paths = list(fastq_paths)
+            columns = ('fastq_path', 'size', 'mtime_ns') + CHECKSUM_ALGORITHMS
+            file_infos = {}
+            with closing(self.connect()) as connection:
+                # stay under sqlite's limit on query parameters
+                for index in range(0, len(fastq_paths), 500):
+                    chunk_paths = fastq_paths[index:index + 500]
+                    rows = connection.execute('SELECT ' + ', '.join(columns) + ' FROM ' + FASTQ_TABLE +
+                                              ' WHERE mtime_ns IS NOT NULL AND fastq_path IN (' +
+                                              ', '.join('?' * len(chunk_paths)) + ')', chunk_paths)
+                    for row in rows:
+                        file_infos[row[0]] = {column: value for column, value in zip(columns[1:], row[1:])
+                                              if value is not None}
+            return file_infos
+        except Exception as err:
+            raise RuntimeError("** Error: RunCatalog get_fastq_file_infos Failed (" + str(err) + ")")
+
+    def get_done_run_dirs(self, table):
+        """
+         run dirs whose every fastq dir has been handled (done_status of table), e.g., for watch to skip at start
+        """
+        try:
+            with closing(self.connect()) as connection:
+                rows = connection.execute('SELECT run_dir FROM ' + table + ' GROUP BY run_dir HAVING '
+                                          'SUM(CASE WHEN status = ? THEN 0 ELSE 1 END) = 0',
+                                          [RUN_TABLES[table]['done_status']])
+                return {row[0] for row in rows}
+        except Exception as err:
+            raise RuntimeError("** Error: RunCatalog get_done_run_dirs Failed (" + str(err) + ")")
+
+    def get_runs_df(self, table, **filters):
+        """
+         rows of table as a df, e.g., get_runs_df('seq_runs', project='maine-edna', status='complete')
+        """
+        try:
+            where_sql = ' AND '.join(column + ' = ?' for column in filters)
+            query = 'SELECT * FROM ' + table + (' WHERE ' + where_sql if where_sql else '') + ' ORDER BY run_id'
+            with closing(self.connect()) as connection:
+                return pd.read_sql_query(query, connection, params=list(filters.values()))
+        except Exception as err:
+            raise RuntimeError("** Error: RunCatalog get_runs_df Failed (" + str(err) + ")")
+
+    def export_csv(self, output_dir=settings.LOG_FILE_DIR):
+        """
+         write seq_dirlist.csv, server_dirlist.csv and fastq_filelist.csv from the catalog, for tools that
+         still read the csv files
+        """
+        try:
+            if not os.path.exists(output_dir):
+                os.makedirs(output_dir)
+            csv_filenames = {table: spec['csv_filename'] for table, spec in RUN_TABLES.items()}
+            csv_filenames[FASTQ_TABLE] = FASTQ_CSV_FILENAME
+            output_csv_filenames = []
+            for table, csv_filename in csv_filenames.items():
+                output_csv_filename = os.path.join(output_dir, csv_filename)
+                # write to a temp file and swap it in so readers never see a half-written csv
+                tmp_csv_filename = output_csv_filename + '.tmp'
+                runs_df = self.get_runs_df(table)
+                if table in RUN_TABLES:
+                    # sqlite stores bools as 0/1; write True/False like the csv files the parsers used to write
+                    for column in RUN_TABLES[table]['complete_fields']:
+                        runs_df[column] = runs_df[column].map({1: True, 0: False})
+                runs_df.to_csv(tmp_csv_filename, encoding='utf-8', index=False)
+                os.replace(tmp_csv_filename, output_csv_filename)
+                api_logger.info('[RUN CATALOG] exported ' + table + ' [' + output_csv_filename + ']')
+                output_csv_filenames.append(output_csv_filename)
+            return output_csv_filenames
+        except Exception as err:
+            raise RuntimeError("** Error: RunCatalog export_csv Failed (" + str(err) + ")")
@@ -0,0 +1,156 @@
+"""
+run_metadata.py
+Run metadata from RunInfo.xml, CompletedJobInfo.xml and RTAComplete.txt, parsed once per file
+Created By: mkimble
+"""
+
+import os
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+import pandas as pd
+import dateutil.parser
+from .logger_settings import api_logger
+from .metrics import get_metrics, OPERATION_SECONDS
+from .run_tree_index import get_run_tree_index, RTA_COMPLETE, RUN_INFO, COMPLETED_JOB_INFO
+
+# number of parsed files kept per process; one run has three
+METADATA_CACHE_SIZE = 1024
+
+
+def get_mtime_ns(path, run_tree_index=None):
+    """
+     mtime used in the memoization key; taken from the index's stat results when available
+    """
+    if run_tree_index is not None:
+        return run_tree_index.get_stat(path).st_mtime_ns
+    return os.stat(path).st_mtime_ns
+
+
+@lru_cache(maxsize=METADATA_CACHE_SIZE)
+def parse_run_info_xml(path, mtime_ns):
+    """
+     streaming parse of RunInfo.xml: run id, run date, instrument, flowcell and reads.
+     memoized by (path, mtime_ns); a rewritten file has a new mtime and is parsed again
+    """
+    run_id = run_date = instrument = flowcell = None
+    reads = []
+    tags = []
+    for event, elem in ET.iterparse(path, events=('start', 'end')):
+        if event == 'start':
+            tags.append(elem.tag)
+            continue
+        # path below the root element, e.g., Run/Reads/Read
+        tag_path = '/'.join(tags[1:])
+        if tag_path == 'Run':
+            run_id = elem.get('Id')
+        elif tag_path == 'Run/Date':
+            run_date = elem.text
+        elif tag_path == 'Run/Instrument':
+            instrument = elem.text
+        elif tag_path == 'Run/Flowcell':
+            flowcell = elem.text
+        elif tag_path == 'Run/Reads/Read' and elem.get('NumCycles') is not None:
+            reads.append((int(elem.get('NumCycles')), elem.get('IsIndexedRead') == 'Y'))
+        tags.pop()
+        elem.clear()
+    return {'run_id': run_id,
+            'run_date': run_date,
+            'instrument': instrument,
+            'flowcell': flowcell,
+            'reads': tuple(reads)}
+
+
+@lru_cache(maxsize=METADATA_CACHE_SIZE)
+def parse_completed_job_info_xml(path, mtime_ns):
+    """
+     streaming parse of CompletedJobInfo.xml for CompletionTime; stops reading once it is found.
+     memoized by (path, mtime_ns)
+    """
+    depth = 0
+    for event, elem in ET.iterparse(path, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1 and elem.tag == 'CompletionTime':
+            return elem.text
+        elem.clear()
+    return None
+
+
+@lru_cache(maxsize=METADATA_CACHE_SIZE)
+def parse_rta_complete_txt(path, mtime_ns):
+    """
+     completion date time from RTAComplete.txt, memoized by (path, mtime_ns)
+    """
+    rta_df = pd.read_csv(path, sep=',', header=None)
+    # format as datetime
+    return pd.to_datetime(rta_df.iloc[0][0] + ' ' + rta_df.iloc[0][1])
+
+
+def get_read_structure(reads):
+    """
+     read structure in Picard notation, e.g., 251T8B8B251T for a paired end dual index run
+    """
+    return ''.join(str(num_cycles) + ('B' if is_indexed else 'T') for num_cycles, is_indexed in reads)
+
+
+class RunMetadata:
+    """
+     metadata of one run dir, built from the newest RunInfo.xml and CompletedJobInfo.xml and the first
+     RTAComplete.txt in the run's RunTreeIndex. Missing files leave their fields False, matching the
+     get_*_xml helpers in parse_seq_run.py. Without a run_tree_index, the cached one of get_run_tree_index
+     is used
+    """
+    def __init__(self, run_dir, run_tree_index=None):
+        self.run_dir = run_dir
+        if run_tree_index is None:
+            run_tree_index = get_run_tree_index(run_dir)
+        self.run_tree_index = run_tree_index
+        self.rta_complete = False
+        self.rta_complete_time = False
+        self.run_id = False
+        self.run_date = False
+        self.instrument = None
+        self.flowcell = None
+        self.reads = ()
+        self.read_structure = None
+        self.completion_time = False
+        self.load()
+
+    def load(self):
+        try:
+            with get_metrics().timer(OPERATION_SECONDS, operation='xml_parse'):
+                run_tree_index = self.run_tree_index
+                rta_file_names = run_tree_index.get_paths(RTA_COMPLETE)
+                if rta_file_names:
+                    self.rta_complete = True
+                    self.rta_complete_time = parse_rta_complete_txt(
+                        rta_file_names[0], get_mtime_ns(rta_file_names[0], run_tree_index))
+                # grab newest RunInfo.xml in directory
+                run_info_path = run_tree_index.get_newest(RUN_INFO)
+                if run_info_path:
+                    run_info = parse_run_info_xml(run_info_path, get_mtime_ns(run_info_path, run_tree_index))
+                    self.run_id = run_info['run_id']
+                    self.run_date = run_info['run_date']
+                    self.instrument = run_info['instrument']
+                    self.flowcell = run_info['flowcell']
+                    self.reads = run_info['reads']
+                    self.read_structure = get_read_structure(self.reads)
+                # grab newest CompletedJobInfo.xml in directory
+                completed_job_info_path = run_tree_index.get_newest(COMPLETED_JOB_INFO)
+                if completed_job_info_path:
+                    completion_time = parse_completed_job_info_xml(
+                        completed_job_info_path, get_mtime_ns(completed_job_info_path, run_tree_index))
+                    if completion_time:
+                        completion_time_dt = dateutil.parser.parse(completion_time)
+                        self.completion_time = completion_time_dt.strftime('%Y-%m-%d %H:%M:%S')
+        except Exception as err:
+            raise RuntimeError("** Error: RunMetadata load Failed [" + str(self.run_dir) + "] (" + str(err) + ")")
+
+    def log_summary(self):
+        api_logger.info('RunMetadata: [' + str(self.run_dir) + '] run_id: ' + str(self.run_id) +
+                        ', run_date: ' + str(self.run_date) + ', completion_time: ' + str(self.completion_time) +
+                        ', rta_complete_time: ' + str(self.rta_complete_time) + ', instrument: ' +
+                        str(self.instrument) + ', flowcell: ' + str(self.flowcell) + ', read_structure: ' +
+                        str(self.read_structure))
@@ -0,0 +1,218 @@
+"""
+run_tree_index.py
+Single-pass index of the run metadata and fastq files in a sequencing run directory
+Created By: mkimble
+"""
+
+import os
+import re
+import hashlib
+import platform
+import threading
+from collections import OrderedDict
+from . import settings
+
+# file types recorded by RunTreeIndex, keyed by the name used in lookups
+RTA_COMPLETE = 'rta_complete'
+RUN_INFO = 'run_info'
+COMPLETED_JOB_INFO = 'completed_job_info'
+FASTQ = 'fastq'
+SUMMARY = 'summary'
+
+
+def get_stat_creation_dt(stat):
+    """
+     creation date from a stat result, falling back to last modified if that isn't possible.
+     See get_creation_dt in parse_seq_run.py
+    """
+    if platform.system() == 'Windows':
+        return stat.st_ctime
+    try:
+        return stat.st_birthtime
+    except AttributeError:
+        # We're probably on Linux. No easy way to get creation dates here,
+        # so we'll settle for when its content was last modified.
+        return stat.st_mtime
+
+
+def match_file_key(file_name):
+    """
+     return the RunTreeIndex key a file name is recorded under, or None if we don't care about it
+    """
+    if file_name == 'RTAComplete.txt':
+        return RTA_COMPLETE
+    if file_name == 'RunInfo.xml':
+        return RUN_INFO
+    if file_name == 'CompletedJobInfo.xml':
+        return COMPLETED_JOB_INFO
+    if file_name.endswith('.fastq.gz'):
+        return FASTQ
+    if file_name.endswith('.txt'):
+        return SUMMARY
+    return None
+
+
+class RunTreeIndex:
+    """
+     walk a run dir once with os.scandir and record every file the parsers look for
+     (RTAComplete.txt, RunInfo.xml, CompletedJobInfo.xml, *.fastq.gz, summary *.txt) with its stat result.
+     Directories that never hold these files (Thumbnail_Images, InterOp, per-lane/per-cycle basecall
+     dirs) are not descended into.
+    """
+    def __init__(self, run_dir,
+                 prune_dirs=settings.RUN_TREE_PRUNE_DIRS,
+                 prune_patterns=settings.RUN_TREE_PRUNE_PATTERNS):
+        self.run_dir = run_dir.replace('\\', '/')
+        self.prune_dirs = set(prune_dirs)
+        self.prune_patterns = [re.compile(pattern) for pattern in prune_patterns]
+        # {key: {path: stat}}
+        self.files = {RTA_COMPLETE: {}, RUN_INFO: {}, COMPLETED_JOB_INFO: {}, FASTQ: {}, SUMMARY: {}}
+        # {dir path: st_mtime} of every dir walked; adding or removing files changes these
+        self.dir_mtimes = {}
+        self.num_dirs_scanned = 0
+        self.num_dirs_pruned = 0
+        self.build()
+
+    def is_pruned(self, dir_name):
+        if dir_name in self.prune_dirs:
+            return True
+        return any(pattern.match(dir_name) for pattern in self.prune_patterns)
+
+    def build(self):
+        """
+         single os.scandir walk of run_dir
+        """
+        try:
+            root_dir = self.run_dir.rstrip('/')
+            stack = [root_dir]
+            try:
+                self.dir_mtimes[root_dir] = os.stat(root_dir).st_mtime
+            except FileNotFoundError:
+                return
+            while stack:
+                current_dir = stack.pop()
+                self.num_dirs_scanned += 1
+                try:
+                    entries = os.scandir(current_dir)
+                except (FileNotFoundError, NotADirectoryError, PermissionError):
+                    continue
+                with entries:
+                    for entry in entries:
+                        # glob('**') skips hidden files and dirs, so do the same here
+                        if entry.name.startswith('.'):
+                            continue
+                        entry_path = (current_dir + '/' + entry.name).replace('\\', '/')
+                        if entry.is_dir():
+                            if self.is_pruned(entry.name):
+                                self.num_dirs_pruned += 1
+                                continue
+                            self.dir_mtimes[entry_path] = entry.stat().st_mtime
+                            stack.append(entry_path)
+                        else:
+                            key = match_file_key(entry.name)
+                            if key is not None:
+                                self.files[key][entry_path] = entry.stat()
+        except Exception as err:
+            raise RuntimeError("** Error: RunTreeIndex build Failed (" + str(err) + ")")
+
+    def get_paths(self, key):
+        """
+         sorted list of all recorded paths for key
+        """
+        return sorted(self.files[key])
+
+    def get_newest(self, key):
+        """
+         newest file for key; matches max(glob(...)) used by the xml helpers. None if missing
+        """
+        paths = self.files[key]
+        if not paths:
+            return None
+        return max(paths)
+
+    def get_stat(self, path):
+        for key_files in self.files.values():
+            if path in key_files:
+                return key_files[path]
+        return os.stat(path)
+
+    def get_creation_dt(self, path):
+        return get_stat_creation_dt(self.get_stat(path))
+
+    def get_files_in(self, key, directory, recursive=False):
+        """
+         sorted paths for key that are in directory (or below it, if recursive)
+        """
+        directory = directory.replace('\\', '/').rstrip('/')
+        if recursive:
+            prefix = directory + '/'
+            return sorted(path for path in self.files[key] if path.startswith(prefix))
+        return sorted(path for path in self.files[key] if os.path.dirname(path) == directory)
+
+    def num_files(self, key):
+        return len(self.files[key])
+
+    def is_current(self):
+        """
+         True while no walked dir has changed, i.e., no file was added, removed or renamed since the walk.
+         One stat per dir instead of listing every dir again
+        """
+        try:
+            for dir_path, dir_mtime in self.dir_mtimes.items():
+                if os.stat(dir_path).st_mtime != dir_mtime:
+                    return False
+            return bool(self.dir_mtimes)
+        except OSError:
+            return False
+
+    def get_fingerprint(self):
+        """
+         cheap fingerprint of the run dir built from the walk: dir mtimes, number and total size of
+         recorded files. Changes whenever files are added, removed or rewritten
+        """
+        try:
+            digest = hashlib.md5()
+            for dir_path in sorted(self.dir_mtimes):
+                digest.update(('d|' + dir_path + '|' + repr(self.dir_mtimes[dir_path]) + '\n').encode('utf-8'))
+            num_files = 0
+            total_size = 0
+            for key in sorted(self.files):
+                for path in sorted(self.files[key]):
+                    stat = self.files[key][path]
+                    num_files += 1
+                    total_size += stat.st_size
+                    digest.update(('f|' + path + '|' + str(stat.st_size) + '|' + repr(stat.st_mtime) +
+                                   '\n').encode('utf-8'))
+            return {'num_dirs': len(self.dir_mtimes),
+                    'num_files': num_files,
+                    'total_size': total_size,
+                    'digest': digest.hexdigest()}
+        except Exception as err:
+            raise RuntimeError("** Error: RunTreeIndex get_fingerprint Failed (" + str(err) + ")")
+
+
+# {run_dir: RunTreeIndex} shared by lookups that aren't handed the parser's index, newest last
+run_tree_index_cache = OrderedDict()
+run_tree_index_cache_lock = threading.Lock()
+
+
+def get_run_tree_index(run_dir, max_cached=settings.RUN_TREE_INDEX_CACHE_SIZE):
+    """
+     RunTreeIndex of run_dir for callers without one (e.g., the get_*_xml helpers in parse_seq_run.py), so
+     repeated lookups in a run dir don't walk it again. The cached index is rebuilt once a dir in it changes
+    """
+    run_dir = run_dir.replace('\\', '/')
+    with run_tree_index_cache_lock:
+        run_tree_index = run_tree_index_cache.get(run_dir)
+    if run_tree_index is not None and run_tree_index.is_current():
+        with run_tree_index_cache_lock:
+            if run_dir in run_tree_index_cache:
+                run_tree_index_cache.move_to_end(run_dir)
+        return run_tree_index
+    run_tree_index = RunTreeIndex(run_dir)
+    with run_tree_index_cache_lock:
+        run_tree_index_cache[run_dir] = run_tree_index
+        run_tree_index_cache.move_to_end(run_dir)
+        while len(run_tree_index_cache) > max_cached:
+            run_tree_index_cache.popitem(last=False)
+    return run_tree_index
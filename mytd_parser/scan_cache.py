@@ -0,0 +1,99 @@
+"""
+scan_cache.py
+Persistent scan state of run dirs so unchanged runs are skipped across cron runs
+Created By: mkimble
+"""
+
+import os
+import pickle
+from datetime import datetime
+from .logger_settings import api_logger
+
+
+class ScanCache:
+    """
+     on-disk store keyed by run dir, holding the RunTreeIndex fingerprint of the run and the dirs_df rows
+     that get_dirs built for it. A run whose fingerprint hasn't changed reuses its cached rows.
+     cache_filepath=None keeps the cache in memory only (used by process pool workers)
+    """
+    def __init__(self, cache_filepath):
+        self.cache_filepath = cache_filepath
+        # {run_dir: {'fingerprint': dict, 'dirs_df': DataFrame, 'parsed': bool, 'scan_date': str}}
+        self.entries = {}
+        self.num_hits = 0
+        self.num_misses = 0
+        self.load()
+
+    def load(self):
+        """
+         load cache from disk; a missing or unreadable cache file starts an empty cache
+        """
+        if self.cache_filepath is None or not os.path.exists(self.cache_filepath):
+            return
+        try:
+            with open(self.cache_filepath, 'rb') as cache_file:
+                self.entries = pickle.load(cache_file)
+            api_logger.info('[SCAN CACHE] loaded ' + str(len(self.entries)) + ' runs [' + self.cache_filepath + ']')
+        except Exception as err:
+            api_logger.info('[SCAN CACHE] could not load, starting empty [' + self.cache_filepath + '] (' +
+                            str(err) + ')')
+            self.entries = {}
+
+    def save(self):
+        """
+         write cache to disk, dropping run dirs that no longer exist (e.g., moved to Backup)
+        """
+        if self.cache_filepath is None:
+            return
+        try:
+            self.entries = {run_dir: entry for run_dir, entry in self.entries.items() if os.path.exists(run_dir)}
+            cache_dir = os.path.dirname(self.cache_filepath)
+            if cache_dir and not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            # write to a temp file and swap it in so a crash never leaves a half-written cache
+            tmp_filepath = self.cache_filepath + '.tmp'
+            with open(tmp_filepath, 'wb') as cache_file:
+                pickle.dump(self.entries, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_filepath, self.cache_filepath)
+            api_logger.info('[SCAN CACHE] saved ' + str(len(self.entries)) + ' runs, hits: ' + str(self.num_hits) +
+                            ', misses: ' + str(self.num_misses) + ' [' + self.cache_filepath + ']')
+        except Exception as err:
+            raise RuntimeError("** Error: ScanCache save Failed (" + str(err) + ")")
+
+    def get_entry(self, run_dir, fingerprint):
+        """
+         cached entry for run_dir if its fingerprint is unchanged, otherwise None
+        """
+        entry = self.entries.get(run_dir)
+        if entry is not None and entry['fingerprint'] == fingerprint:
+            self.num_hits += 1
+            return entry
+        self.num_misses += 1
+        return None
+
+    def get_dirs_df(self, run_dir, fingerprint):
+        entry = self.get_entry(run_dir, fingerprint)
+        if entry is None:
+            return None
+        api_logger.info('[SCAN CACHE] unchanged, reusing cached dirs: [' + run_dir + ']')
+        return entry['dirs_df'].copy()
+
+    def set_dirs_df(self, run_dir, fingerprint, dirs_df):
+        """
+         store newly scanned rows; a changed run is no longer considered parsed
+        """
+        self.entries[run_dir] = {'fingerprint': fingerprint,
+                                 'dirs_df': dirs_df.copy(),
+                                 'parsed': False,
+                                 'scan_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+
+    def is_parsed(self, run_dir, fingerprint):
+        """
+         True if the run is unchanged since it was last fully parsed
+        """
+        entry = self.entries.get(run_dir)
+        return entry is not None and entry['fingerprint'] == fingerprint and entry['parsed']
+
+    def set_parsed(self, run_dir, parsed=True):
+        if run_dir in self.entries:
+            self.entries[run_dir]['parsed'] = parsed
@@ -10,6 +10,49 @@ BASE_DIR = parser_dir.replace('\\', '/')
 
 # error logging
 LOG_FILE_DIR = BASE_DIR+"/logs/"
+# log records are handed to a background thread through a queue instead of written by the caller
+LOG_ASYNC = True
+# write logfile.log as JSON lines (one object per record) instead of text
+LOG_JSON = False
+# level of api_logger and batch_process_logger; the per-run and per-file records (e.g., each fastq file moved)
+# are DEBUG, so at INFO they are dropped before their message is formatted
+LOG_LEVEL = "INFO"
+# at LOG_LEVEL = "DEBUG", keep 1 of every N debug records; 1 keeps them all
+LOG_DEBUG_SAMPLE_EVERY = 1
+
+# metrics.py settings; a json summary per run is saved in LOG_FILE_DIR
+METRICS_ENABLED = True
+METRICS_DIRNAME = "metrics/"
+# node_exporter --collector.textfile.directory; one mytd_parser_<job>.prom file per job is rewritten each run
+METRICS_TEXTFILE_DIR = LOG_FILE_DIR + "metrics/textfile/"
+# histogram bucket upper bounds, in seconds
+METRICS_HISTOGRAM_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+# profiling.py settings; per-stage cProfile .pstats and reports saved in LOG_FILE_DIR + PROFILE_DIRNAME + <run_id>/
+# default of the profile option; MYTD_PARSER_PROFILE=1 profiles a run without changing the code that starts it
+PROFILE = os.environ.get('MYTD_PARSER_PROFILE', '').lower() in ('1', 'true', 'yes')
+# also take tracemalloc snapshots around each stage (slows the run down more than cProfile)
+PROFILE_TRACEMALLOC = os.environ.get('MYTD_PARSER_PROFILE_TRACEMALLOC', '').lower() in ('1', 'true', 'yes')
+PROFILE_DIRNAME = "profiles/"
+# functions (by cumulative time) and source lines (by memory allocated) in the text reports
+PROFILE_TOP_N = 30
+# stack frames tracemalloc keeps per allocation
+PROFILE_TRACEMALLOC_FRAMES = 1
+
+# scan_cache.py settings; persistent scan state saved in LOG_FILE_DIR
+SEQ_SCAN_CACHE_FILENAME = "seq_scan_cache.pkl"
+SERVER_SCAN_CACHE_FILENAME = "server_scan_cache.pkl"
+
+# run_catalog.py settings; sqlite catalog of scanned runs and parsed fastq files saved in LOG_FILE_DIR
+RUN_CATALOG_FILENAME = "run_catalog.sqlite3"
+# seconds a writer waits for another process's write to finish
+RUN_CATALOG_TIMEOUT = 30
+
+# fastq_archive.py settings; parquet archive of fastq filelists in LOG_FILE_DIR
+# opt-in: pyarrow is not in requirements.txt, without it the timestamped csv filelists are written instead
+FASTQ_ARCHIVE_DIRNAME = "fastq_archive/"
+# part files per run before the run's partition is compacted into one
+FASTQ_ARCHIVE_MAX_PARTS = 8
 
 # parse_seq_run.py settings
 MISEQ_STAGING_DIR = "D:/NGS_Outputs/Staging/"
@@ -18,10 +61,36 @@ MISEQ_BACKUP_DIR = "D:/NGS_Outputs/Backup/"
 
 MISEQ_EXTRA_BACKUP_DIRS = []
 
+# copy_engine.py settings
+# number of files copied at once
+COPY_MAX_WORKERS = 4
+# buffer size for the buffered fallback when the kernel can't copy the file itself
+COPY_BUFFER_SIZE = 8388608
+# how fastq files are placed in the Upload tree: 'copy', 'hardlink' (same volume as Staging) or 'symlink'.
+# symlinked runs are replaced with real copies before the Upload or Staging run is moved to Backup;
+# only use 'symlink' if the MyData upload follows symlinks
+UPLOAD_LINK_MODE = 'copy'
+# checksums of the fastq files in Upload written to Fastq_filelist.csv: 'md5', 'blake2b', 'xxh64'.
+# Each file is copied in the kernel (reflink, copy_file_range, sendfile) and then read once to hash it.
+# Fastq files already in Upload reuse the checksums recorded in the run catalog instead of being hashed again
+FASTQ_CHECKSUM_ALGORITHMS = ['md5']
+
+# run_tree_index.py settings
+# dirs in a run that never hold RTAComplete.txt, RunInfo.xml, CompletedJobInfo.xml, fastq.gz or summary txt files
+RUN_TREE_PRUNE_DIRS = ["Thumbnail_Images", "InterOp"]
+# per-lane and per-cycle basecall dirs, e.g., Data/Intensities/BaseCalls/L001/C1.1/
+RUN_TREE_PRUNE_PATTERNS = [r"^L\d{3}$", r"^C\d+\.\d+$"]
+# run dirs whose RunTreeIndex is kept for lookups that aren't handed one (see get_run_tree_index)
+RUN_TREE_INDEX_CACHE_SIZE = 64
+
 # Mydata cfg
 MISEQ_DATA_DIRECTORY = MISEQ_UPLOAD_DIR
 FOLDER_STRUCTURE = 'User Group / Dataset'
 MYTARDIS_URL = 'https://mytardis.maine-edna.org'
+# mydata-python checkout (run.py), relative to the working dir as in the subprocess commands
+MYDATA_PYTHON_DIR = "mydata-python/"
+# scan and upload in-process with a shared MyDataUploader; False starts a mydata-python/run.py per call
+MYDATA_IN_PROCESS = True
 
 # parse_server_copy.py settings
 SERVER_DOWNLOAD_DIR = "/UMaine2/mytardis_download/CORE/"
@@ -31,12 +100,26 @@ SERVER_UPLOAD_BR_DIR = "/UMaine2/mytardis_upload/"
 # Mydata cfg
 SERVER_DATA_DIRECTORY = SERVER_UPLOAD_BR_DIR
 
+# watch.py settings
+# seconds a run must stay unchanged (with RTAComplete.txt/Fastq_filelist.csv present) before it is parsed
+WATCH_DEBOUNCE_SECONDS = 60
+# seconds between inotify reads, or between polls when inotify (the optional inotify_simple package) is unavailable
+WATCH_POLL_SECONDS = 30
+
 # mytd_api cfg
 MYTARDIS_API_URL = "https://mytardis.maine-edna.org:443/api/v1/"
 MYTARDIS_MODEL_NAME = "dataset"
 MAINE_EDNA_EXPERIMENT_ID = 1
 MYTARDIS_API_USER = os.environ.get('MYTARDIS_API_USER')
 MYTARDIS_API_PASSWORD = os.environ.get('MYTARDIS_API_PASSWORD')
+# connections kept open to MyTardis by the shared requests session, and seconds before a request times out
+MYTARDIS_API_POOL_SIZE = 10
+MYTARDIS_API_TIMEOUT = 60
+# objects per page of a MyTardis listing, and pages fetched at once
+MYTARDIS_API_PAGE_SIZE = 500
+MYTARDIS_API_MAX_WORKERS = 4
+# pages cached with their ETag/Last-Modified for conditional requests, in LOG_FILE_DIR
+MYTARDIS_API_CACHE_DIRNAME = "mytardis_api_cache/"
 RCLONE_FILTER_FILE_DIR = BASE_DIR+"/configs/"
 RCLONE_WASABI_FILTER_FILENAME = "filter-wasabi-files"
 MAINE_EDNA_RCLONE_GDRIVE_FILTER_FILENAME = "medna_filter-gdrive-files"
@@ -45,3 +128,9 @@ MAINE_EDNA_RCLONE_GDRIVE_FILTER_FILENAME = "medna_filter-gdrive-files"
 GDRIVE_PRIVATE_KEY = RCLONE_FILTER_FILE_DIR+"your_gdrive_key_file.json"
 GSHEETS_SPREADSHEET_URL = "https://your_gsheet_url"
 GSHEETS_WORKSHEET_NAME = "your_worksheet_name"
+# seconds a fetched copy of the worksheet is used for check_gdrive lookups before it is fetched again
+GSHEETS_SNAPSHOT_TTL_SECONDS = 300
+# seconds before the shared gspread client is authorized again; access tokens expire after an hour
+GSHEETS_CLIENT_REFRESH_SECONDS = 3000
+# number of buffered status updates that triggers a batch_update before the end of the pass
+GSHEETS_STATUS_BATCH_SIZE = 100
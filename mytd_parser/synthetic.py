@@ -0,0 +1,182 @@
+"""
+synthetic.py
+Synthetic MiSeq and generic run trees laid out like the instrument and sequencing facility outputs the parsers
+read, for benchmarks and for trying the parsers on a machine without real runs
+Created By: mkimble
+"""
+
+import os
+from datetime import datetime, timedelta
+
+# primer pairs appended to the sample ids, e.g., eSG-L01-19w-0001-MiFishU
+PRIMER_PAIRS = ['MiFishU', 'riaz', 'vert']
+# metadata files in the root of a MiSeq run dir
+MISEQ_RUN_FILES = ['RunParameters.xml', 'SampleSheet.csv', 'RunCompletionStatus.xml']
+# metadata files in an Alignment subdir, next to CompletedJobInfo.xml
+MISEQ_ALIGN_FILES = ['AnalysisLog.txt', 'AnalysisError.txt', 'CompletedJobInfo.xml', 'DemultiplexSummaryF1L1.txt']
+# summary files in a MiSeq Fastq dir
+MISEQ_SUMMARY_FILES = ['AdapterTrimming.txt', 'ConvertingSampleSheet.txt']
+
+RUN_INFO_XML = '''<?xml version="1.0"?>
+<RunInfo xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" Version="2">
+  <Run Id="{run_id}" Number="{run_number}">
+    <Flowcell>{flowcell}</Flowcell>
+    <Instrument>{instrument}</Instrument>
+    <Date>{run_date}</Date>
+    <Reads>
+      <Read NumCycles="151" Number="1" IsIndexedRead="N" />
+      <Read NumCycles="8" Number="2" IsIndexedRead="Y" />
+      <Read NumCycles="8" Number="3" IsIndexedRead="Y" />
+      <Read NumCycles="151" Number="4" IsIndexedRead="N" />
+    </Reads>
+  </Run>
+</RunInfo>
+'''
+
+COMPLETED_JOB_INFO_XML = '''<?xml version="1.0"?>
+<AnalysisJobInfo xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+  <StartTime>{start_time}</StartTime>
+  <CompletionTime>{completion_time}</CompletionTime>
+  <RTAOutputFolder>{run_dir}</RTAOutputFolder>
+  <Workflow>GenerateFASTQ</Workflow>
+</AnalysisJobInfo>
+'''
+
+
+def get_run_id(run_time, run_number, instrument='M05543'):
+    # e.g., 201224_M05543_0033_000000000-JCFTD
+    return (run_time.strftime('%y%m%d') + '_' + instrument + '_' + str(run_number).zfill(4) +
+            '_000000000-' + str(run_number).zfill(5))
+
+
+def get_fastq_names(num_fastq_files):
+    """
+     R1/R2 fastq file names of num_fastq_files // 2 samples, e.g., eSG-L01-19w-0001-MiFishU_S1_L001_R1_001.fastq.gz
+    """
+    fastq_names = []
+    for sample_number in range(1, num_fastq_files // 2 + 1):
+        sample_id = ('eSG-L01-19w-' + str(sample_number).zfill(4) + '-' +
+                     PRIMER_PAIRS[sample_number % len(PRIMER_PAIRS)])
+        for read in ('R1', 'R2'):
+            fastq_names.append(sample_id + '_S' + str(sample_number) + '_L001_' + read + '_001.fastq.gz')
+    return fastq_names
+
+
+def write_file(file_path, text=''):
+    with open(file_path, 'w') as output_file:
+        output_file.write(text)
+
+
+def write_sparse_file(file_path, size):
+    """
+     file of size bytes without writing its blocks; reads as zeros. Copies and checksums still read every byte
+    """
+    with open(file_path, 'wb') as output_file:
+        output_file.truncate(size)
+
+
+def write_fastq_files(fastq_dir, num_fastq_files, fastq_size):
+    os.makedirs(fastq_dir, exist_ok=True)
+    for fastq_name in get_fastq_names(num_fastq_files):
+        write_sparse_file(os.path.join(fastq_dir, fastq_name), fastq_size)
+
+
+def write_run_metadata(run_dir, run_id, run_number, run_time):
+    write_file(os.path.join(run_dir, 'RunInfo.xml'),
+               RUN_INFO_XML.format(run_id=run_id, run_number=run_number, flowcell='000000000-' +
+                                   str(run_number).zfill(5), instrument=run_id.split('_')[1],
+                                   run_date=run_time.strftime('%y%m%d')))
+    # e.g., 12/24/2020,20:58:58.000,Illumina RTA 1.18.54
+    write_file(os.path.join(run_dir, 'RTAComplete.txt'),
+               run_time.strftime('%m/%d/%Y,%H:%M:%S') + '.000,Illumina RTA 1.18.54\n')
+
+
+def make_miseq_run(staging_dir, project, run_number, num_fastq_files=24, fastq_size=1048576,
+                   num_thumbnails=1000, run_time=None):
+    """
+     MiSeq run dir staging_dir/project/run_id/ with RunInfo.xml, RTAComplete.txt, run metadata files, Config,
+     InterOp, Thumbnail_Images (num_thumbnails small jpgs across lanes and cycles), Data/Intensities/BaseCalls,
+     and Alignment_1/<timestamp>/ holding CompletedJobInfo.xml, a Stats dir and Fastq/ with num_fastq_files
+     sparse fastq.gz files of fastq_size bytes. Returns the run dir
+    """
+    if run_time is None:
+        run_time = datetime(2020, 12, 24, 20, 58, 58) + timedelta(days=run_number)
+    run_id = get_run_id(run_time, run_number)
+    run_dir = os.path.join(staging_dir, project, run_id).replace('\\', '/') + '/'
+    os.makedirs(run_dir, exist_ok=True)
+    write_run_metadata(run_dir, run_id, run_number, run_time)
+    for file_name in MISEQ_RUN_FILES:
+        write_file(os.path.join(run_dir, file_name), file_name + '\n')
+    for dir_name, file_names in (('Config', ['Effective.cfg', 'RTAConfiguration.xml']),
+                                 ('InterOp', ['ErrorMetricsOut.bin', 'QMetricsOut.bin', 'TileMetricsOut.bin']),
+                                 ('Recipe', ['Recipe.xml']),
+                                 ('Logs', ['CycleTimes.txt'])):
+        os.makedirs(os.path.join(run_dir, dir_name), exist_ok=True)
+        for file_name in file_names:
+            write_file(os.path.join(run_dir, dir_name, file_name), file_name + '\n')
+    # thumbnails are spread over Thumbnail_Images/L001/C<cycle>.1/ like the instrument does
+    thumbnails_per_cycle = 50
+    for thumbnail_number in range(num_thumbnails):
+        cycle_dir = os.path.join(run_dir, 'Thumbnail_Images', 'L001',
+                                 'C' + str(thumbnail_number // thumbnails_per_cycle + 1) + '.1')
+        if thumbnail_number % thumbnails_per_cycle == 0:
+            os.makedirs(cycle_dir, exist_ok=True)
+        write_file(os.path.join(cycle_dir, 's_1_' + str(thumbnail_number % thumbnails_per_cycle + 1101) + '_a.jpg'),
+                   'jpg')
+    basecalls_dir = os.path.join(run_dir, 'Data', 'Intensities', 'BaseCalls', 'L001', 'C1.1')
+    os.makedirs(basecalls_dir, exist_ok=True)
+    write_file(os.path.join(basecalls_dir, 's_1_1101.bcl'), 'bcl')
+    completion_time = run_time + timedelta(hours=1)
+    align_subdir = os.path.join(run_dir, 'Alignment_1', completion_time.strftime('%Y%m%d_%H%M%S'))
+    os.makedirs(os.path.join(align_subdir, 'Stats'), exist_ok=True)
+    for file_name in MISEQ_ALIGN_FILES:
+        if file_name == 'CompletedJobInfo.xml':
+            text = COMPLETED_JOB_INFO_XML.format(start_time=run_time.isoformat(),
+                                                 completion_time=completion_time.isoformat(), run_dir=run_dir)
+        else:
+            text = file_name + '\n'
+        write_file(os.path.join(align_subdir, file_name), text)
+    write_file(os.path.join(align_subdir, 'Stats', 'DemuxSummary.json'), '{}\n')
+    fastq_dir = os.path.join(align_subdir, 'Fastq')
+    write_fastq_files(fastq_dir, num_fastq_files, fastq_size)
+    for file_name in MISEQ_SUMMARY_FILES:
+        write_file(os.path.join(fastq_dir, file_name), file_name + '\n')
+    return run_dir
+
+
+def make_generic_run(staging_dir, project, run_number, num_fastq_files=24, fastq_size=1048576, run_time=None):
+    """
+     run dir from another sequencing facility: RunInfo.xml, RTAComplete.txt, CompletedJobInfo.xml and
+     Fastq_<completion time>/ with num_fastq_files sparse fastq.gz files and a Reports dir. Returns the run dir
+    """
+    if run_time is None:
+        run_time = datetime(2021, 1, 24, 20, 58, 58) + timedelta(days=run_number)
+    run_id = get_run_id(run_time, run_number, instrument='NB552345')
+    run_dir = os.path.join(staging_dir, project, run_id).replace('\\', '/') + '/'
+    os.makedirs(run_dir, exist_ok=True)
+    write_run_metadata(run_dir, run_id, run_number, run_time)
+    completion_time = run_time + timedelta(hours=1)
+    write_file(os.path.join(run_dir, 'CompletedJobInfo.xml'),
+               COMPLETED_JOB_INFO_XML.format(start_time=run_time.isoformat(),
+                                             completion_time=completion_time.isoformat(), run_dir=run_dir))
+    write_file(os.path.join(run_dir, 'SampleSheet.csv'), 'SampleSheet.csv\n')
+    fastq_dir = os.path.join(run_dir, 'Fastq_' + completion_time.strftime('%Y%m%d_%H%M%S'))
+    write_fastq_files(fastq_dir, num_fastq_files, fastq_size)
+    os.makedirs(os.path.join(fastq_dir, 'Reports'), exist_ok=True)
+    write_file(os.path.join(fastq_dir, 'Reports', 'index.html'), '<html></html>\n')
+    return run_dir
+
+
+def make_staging_tree(staging_dir, num_runs, num_generic_runs=0, project='maine-edna', num_fastq_files=24,
+                      fastq_size=1048576, num_thumbnails=1000):
+    """
+     num_runs MiSeq runs and num_generic_runs generic runs under staging_dir/project/.
+     returns the run dirs, MiSeq runs first
+    """
+    run_dirs = []
+    for run_number in range(1, num_runs + 1):
+        run_dirs.append(make_miseq_run(staging_dir, project, run_number, num_fastq_files, fastq_size,
+                                       num_thumbnails))
+    for run_number in range(num_runs + 1, num_runs + num_generic_runs + 1):
+        run_dirs.append(make_generic_run(staging_dir, project, run_number, num_fastq_files, fastq_size))
+    return run_dirs
@@ -0,0 +1,283 @@
+"""
+watch.py
+Long-running watch mode: parse runs in MISEQ_STAGING_DIR and SERVER_DOWNLOAD_DIR as soon as they are complete,
+instead of polling them from cron
+Created By: mkimble
+"""
+
+import os
+import glob
+import time
+from . import settings
+from .logger_settings import api_logger
+from .run_tree_index import RunTreeIndex, RTA_COMPLETE
+from .scan_cache import ScanCache
+from .run_catalog import RunCatalog
+from .parse_seq_run import parse_seq_run_dir
+from .parse_server_copy import ServerParse
+from .metrics import write_metrics
+
+# dirs below the watched root that get their own watch: project (1), run (2) and run subdirs (3).
+# Fastq_filelist.csv lands in a run subdir; deeper writes are caught by the fingerprint check.
+WATCH_DEPTH = 3
+
+
+def get_inotify():
+    """
+     inotify is opt-in (inotify_simple is not in requirements.txt, and Linux only); returns None to fall back
+     to polling
+    """
+    try:
+        from inotify_simple import INotify, flags
+        return INotify(), flags
+    except Exception as err:
+        api_logger.info('[WATCH] inotify unavailable, polling instead (' + str(err) + ')')
+        return None, None
+
+
+def has_rta_complete(run_dir, run_tree_index):
+    return run_tree_index.num_files(RTA_COMPLETE) > 0
+
+
+def has_fastq_filelist(run_dir, run_tree_index):
+    return bool(glob.glob(os.path.join(run_dir, '*/Fastq_filelist.csv')))
+
+
+class RunDirWatcher:
+    """
+     track run dirs (root/{project}/{run_id}/) that changed. A run is handed to dispatch once its trigger
+     file exists and its RunTreeIndex fingerprint has stayed the same for debounce_seconds.
+     dispatch(project, run_dir, num_run_dir)
+    """
+    def __init__(self, root_dir, has_trigger, dispatch,
+                 debounce_seconds=settings.WATCH_DEBOUNCE_SECONDS):
+        self.root_dir = root_dir.replace('\\', '/')
+        if not self.root_dir.endswith('/'):
+            self.root_dir += '/'
+        self.has_trigger = has_trigger
+        self.dispatch = dispatch
+        self.debounce_seconds = debounce_seconds
+        # {run_dir: {'last_event': float, 'fingerprint': dict or None}}
+        self.pending = {}
+        # {run_dir: shallow signature} for polling
+        self.signatures = {}
+        # {watch descriptor: dir path} for inotify
+        self.watch_dirs = {}
+
+    def get_run_dir(self, path):
+        """
+         run dir a path belongs to, or None if path is above run dir level
+        """
+        path = path.replace('\\', '/')
+        if not path.startswith(self.root_dir):
+            return None
+        parts = path[len(self.root_dir):].strip('/').split('/')
+        if len(parts) < 2 or not parts[0] or not parts[1]:
+            return None
+        return self.root_dir + parts[0] + '/' + parts[1] + '/'
+
+    def get_depth(self, path):
+        rel_path = path.replace('\\', '/')[len(self.root_dir):].strip('/')
+        if not rel_path:
+            return 0
+        return len(rel_path.split('/'))
+
+    def mark_changed(self, run_dir, now=None):
+        if now is None:
+            now = time.time()
+        if run_dir not in self.pending:
+            api_logger.info('[WATCH] changed: [' + run_dir + ']')
+            self.pending[run_dir] = {'last_event': now, 'fingerprint': None}
+        else:
+            self.pending[run_dir]['last_event'] = now
+
+    def get_run_dirs(self):
+        return [run_dir.replace('\\', '/') for run_dir in glob.glob(os.path.join(self.root_dir, '*/*/'))]
+
+    def add_watches(self, inotify, flags, dir_path=None):
+        """
+         add inotify watches on dir_path (default root_dir) and its subdirs down to WATCH_DEPTH
+        """
+        if dir_path is None:
+            dir_path = self.root_dir
+        mask = flags.CREATE | flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | flags.DELETE
+        stack = [dir_path.rstrip('/')]
+        while stack:
+            current_dir = stack.pop()
+            try:
+                wd = inotify.add_watch(current_dir, mask)
+            except OSError as err:
+                api_logger.info('[WATCH] could not watch [' + current_dir + '] (' + str(err) + ')')
+                continue
+            self.watch_dirs[wd] = current_dir
+            if self.get_depth(current_dir) >= WATCH_DEPTH:
+                continue
+            try:
+                with os.scandir(current_dir) as entries:
+                    for entry in entries:
+                        if entry.is_dir() and not entry.name.startswith('.'):
+                            stack.append(current_dir + '/' + entry.name)
+            except OSError:
+                continue
+
+    def handle_event(self, inotify, flags, event):
+        dir_path = self.watch_dirs.get(event.wd)
+        if dir_path is None:
+            return
+        path = dir_path + '/' + event.name if event.name else dir_path
+        if event.mask & flags.ISDIR and event.mask & (flags.CREATE | flags.MOVED_TO):
+            if self.get_depth(path) <= WATCH_DEPTH:
+                self.add_watches(inotify, flags, path)
+                # a run dir that was moved in whole has no further events below WATCH_DEPTH
+                for run_dir in self.get_run_dirs():
+                    if run_dir.startswith(path + '/') or path.startswith(run_dir):
+                        self.mark_changed(run_dir)
+        run_dir = self.get_run_dir(path)
+        if run_dir is not None:
+            self.mark_changed(run_dir)
+
+    def catch_up(self, done_run_dirs=(), is_polling=False):
+        """
+         mark the run dirs already in root_dir as changed so they are checked on the first dispatch, except
+         done_run_dirs (every fastq dir handled in the run catalog), which are only checked again on their next
+         change. is_polling: record each run's signature so poll only marks runs that change from now on
+        """
+        done_run_dirs = {run_dir.replace('\\', '/').rstrip('/') for run_dir in done_run_dirs}
+        num_done = 0
+        for run_dir in self.get_run_dirs():
+            if is_polling:
+                self.signatures[run_dir] = self.get_signature(run_dir)
+            if run_dir.rstrip('/') in done_run_dirs:
+                num_done += 1
+                continue
+            self.mark_changed(run_dir, now=0)
+        api_logger.info('[WATCH] catching up on ' + str(len(self.pending)) + ' runs, skipped ' + str(num_done) +
+                        ' done runs [' + self.root_dir + ']')
+
+    def get_signature(self, run_dir):
+        """
+         shallow signature for polling: mtimes of the run dir and its immediate subdirs
+        """
+        try:
+            subdir_mtimes = []
+            with os.scandir(run_dir) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        subdir_mtimes.append((entry.name, entry.stat().st_mtime))
+            return os.stat(run_dir).st_mtime, tuple(sorted(subdir_mtimes))
+        except OSError:
+            return None
+
+    def poll(self):
+        """
+         polling fallback: mark run dirs whose shallow signature changed
+        """
+        run_dirs = self.get_run_dirs()
+        for run_dir in run_dirs:
+            signature = self.get_signature(run_dir)
+            if self.signatures.get(run_dir) != signature:
+                self.signatures[run_dir] = signature
+                self.mark_changed(run_dir)
+        for run_dir in list(self.signatures):
+            if run_dir not in run_dirs:
+                del self.signatures[run_dir]
+
+    def dispatch_settled(self, now=None):
+        """
+         dispatch run dirs that have their trigger file and have not changed for debounce_seconds
+        """
+        if now is None:
+            now = time.time()
+        for run_dir in list(self.pending):
+            pending_run = self.pending[run_dir]
+            if now - pending_run['last_event'] < self.debounce_seconds:
+                continue
+            if not os.path.exists(run_dir):
+                del self.pending[run_dir]
+                continue
+            run_tree_index = RunTreeIndex(run_dir)
+            if not self.has_trigger(run_dir, run_tree_index):
+                # not complete yet; new events will put it back in pending
+                del self.pending[run_dir]
+                continue
+            fingerprint = run_tree_index.get_fingerprint()
+            if fingerprint != pending_run['fingerprint']:
+                # still being written below the watched depth, wait another debounce period
+                pending_run['fingerprint'] = fingerprint
+                pending_run['last_event'] = now
+                continue
+            del self.pending[run_dir]
+            project_dir = os.path.dirname(run_dir.rstrip('/'))
+            project = os.path.basename(project_dir)
+            num_run_dir = len(glob.glob(os.path.join(project_dir, '*/')))
+            api_logger.info('[WATCH] dispatch: ' + project + ', [' + run_dir + ']')
+            try:
+                self.dispatch(project, run_dir, num_run_dir)
+            except Exception as err:
+                # keep watching; the run is retried on its next change
+                api_logger.error('[WATCH] dispatch failed: [' + run_dir + '] (' + str(err) + ')')
+
+
+def watch(staging=True, server=True, upload_parsing=False, move_parsing=False, move_staging=False,
+          check_gdrive=False, use_inotify=True,
+          staging_dir=settings.MISEQ_STAGING_DIR,
+          download_dir=settings.SERVER_DOWNLOAD_DIR,
+          debounce_seconds=settings.WATCH_DEBOUNCE_SECONDS,
+          poll_seconds=settings.WATCH_POLL_SECONDS,
+          run_catalog=None,
+          max_loops=None):
+    """
+     watch staging_dir (MiSeqParser/GenericParser) and/or download_dir (ServerParse) and parse each run as
+     soon as it is complete. Existing runs the run catalog doesn't list as parsed (staging) or moved (server)
+     are caught up with one pass at start.
+     run_catalog: RunCatalog the parsers write to, default in LOG_FILE_DIR
+     max_loops: stop after this many loops; None runs until interrupted
+    """
+    try:
+        api_logger.info('[START] watch')
+        watchers = []
+        # run catalog table of each watcher's runs
+        catalog_tables = []
+        if staging:
+            def dispatch_staging(project, run_dir, num_run_dir):
+                scan_cache = ScanCache(settings.LOG_FILE_DIR + settings.SEQ_SCAN_CACHE_FILENAME)
+                parse_seq_run_dir(project, run_dir, num_run_dir, upload_parsing, move_parsing, move_staging,
+                                  check_gdrive, scan_cache)
+                scan_cache.save()
+                write_metrics('watch')
+            watchers.append(RunDirWatcher(staging_dir, has_rta_complete, dispatch_staging, debounce_seconds))
+            catalog_tables.append('seq_runs')
+        if server:
+            def dispatch_server(project, run_dir, num_run_dir):
+                ServerParse(download_dir=download_dir).move_fastq_files(run_dirs=[run_dir])
+                write_metrics('watch')
+            watchers.append(RunDirWatcher(download_dir, has_fastq_filelist, dispatch_server, debounce_seconds))
+            catalog_tables.append('server_runs')
+
+        inotify, flags = get_inotify() if use_inotify else (None, None)
+        if run_catalog is None:
+            run_catalog = RunCatalog(settings.LOG_FILE_DIR + settings.RUN_CATALOG_FILENAME)
+        for watcher, catalog_table in zip(watchers, catalog_tables):
+            if inotify is not None:
+                watcher.add_watches(inotify, flags)
+            # catch up on runs that arrived while nothing was watching or were never finished
+            watcher.catch_up(run_catalog.get_done_run_dirs(catalog_table), is_polling=inotify is None)
+
+        num_loops = 0
+        while max_loops is None or num_loops < max_loops:
+            num_loops += 1
+            if inotify is not None:
+                for event in inotify.read(timeout=int(poll_seconds * 1000)):
+                    for watcher in watchers:
+                        watcher.handle_event(inotify, flags, event)
+            else:
+                time.sleep(poll_seconds)
+                for watcher in watchers:
+                    watcher.poll()
+            for watcher in watchers:
+                watcher.dispatch_settled()
+        api_logger.info('[END] watch')
+    except KeyboardInterrupt:
+        api_logger.info('[END] watch - interrupted')
+    except Exception as err:
+        raise RuntimeError("** Error: watch Failed (" + str(err) + ")")
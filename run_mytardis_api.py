@@ -5,6 +5,7 @@ Created By: mkimble
 LAST MODIFIED: 09/03/2021
 """
 from mytd_parser.mytardis_api import DatasetFilter
+from mytd_parser.logger_settings import start_async_logging
 from mytd_parser.settings import MAINE_EDNA_EXPERIMENT_ID
 from mytd_parser.settings import MAINE_EDNA_RCLONE_GDRIVE_FILTER_FILENAME as dataset_filter_filename
 from mytd_parser.settings import MYTARDIS_MODEL_NAME as model_name
@@ -16,5 +17,6 @@ params_dict = {
     "experiments__id": MAINE_EDNA_EXPERIMENT_ID,
 }
 
+start_async_logging()
 mytd_df = DatasetFilter(model_name, params_dict, dataset_filter_filename)
 mytd_df.write_filter_file()
@@ -11,11 +11,13 @@ LAST MODIFIED: 08/31/2021
 """
 
 from mytd_parser.parse_seq_run import parse_seq_dirs
+from mytd_parser.logger_settings import start_async_logging
 
 
 # for generic & MiSeq run outputs from other facilities
 # parse runs in /Staging directory
 # Read parsed runs in /Upload directory, upload to MyData, and move parsed files and original files to /Backup directory
+start_async_logging()
 parse_seq_dirs(upload_parsing=False, move_parsing=False, move_staging=False, check_gdrive=False)
 
 
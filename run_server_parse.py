@@ -6,7 +6,9 @@ LAST MODIFIED: 08/31/2021
 """
 
 from mytd_parser.parse_server_copy import server_parse
+from mytd_parser.logger_settings import start_async_logging
 
+start_async_logging()
 server_parse()
 
 
@@ -0,0 +1,67 @@
+"""
+test_bench.py
+pytest-benchmark timings of discovery, metadata copy, fastq copy and the server completeness check on synthetic
+staging trees of 1, 10 and 100 runs, built with ParserBench (mytd_parser/bench.py) and its Google Sheets stub.
+Deselected from the default run (see pytest.ini), e.g.:
+python -m pytest tests/benchmarks -m benchmark --benchmark-save=baseline
+Created By: mkimble
+"""
+
+import shutil
+import logging
+import pytest
+from mytd_parser import gsheets
+from mytd_parser.logger_settings import api_logger
+from mytd_parser.metrics import get_metrics, FILES_COPIED, BYTES_COPIED
+from mytd_parser.bench import ParserBench, StubGsheetClient, RUN_COUNTS, DISCOVER_CASE, COPY_METADATA_CASE, \
+    COPY_FASTQ_CASE, SERVER_CHECK_CASE
+
+BENCH_CASES = (DISCOVER_CASE, COPY_METADATA_CASE, COPY_FASTQ_CASE, SERVER_CHECK_CASE)
+# timed rounds per case, each after an untimed ParserBench.setup_case
+BENCH_ROUNDS = 3
+
+# deselected by -m "not benchmark" in pytest.ini
+pytestmark = pytest.mark.benchmark
+
+
+@pytest.fixture(scope='module', params=RUN_COUNTS, ids=lambda num_runs: 'runs_' + str(num_runs))
+def parser_bench(request, tmp_path_factory):
+    """
+     staging tree of request.param runs, generated once for every case; check_gdrive lookups read the stub
+     worksheet through the process-wide client and console logging is limited to warnings while timing
+    """
+    bench = ParserBench(str(tmp_path_factory.mktemp('runs_' + str(request.param))), request.param)
+    gsheet_client = gsheets.gsheet_client
+    api_logger_level = api_logger.level
+    try:
+        api_logger.setLevel(logging.WARNING)
+        bench.generate()
+        gsheets.gsheet_client = StubGsheetClient(bench.worksheet)
+        yield bench
+    finally:
+        gsheets.gsheet_client = gsheet_client
+        gsheets.clear_gsheet_snapshots()
+        api_logger.setLevel(api_logger_level)
+        shutil.rmtree(bench.work_dir, ignore_errors=True)
+
+
+def get_counter_total(metrics_dict, counter_name):
+    return sum(value for name, labels, value in metrics_dict['counters'] if name == counter_name)
+
+
+@pytest.mark.parametrize('case', BENCH_CASES)
+def test_bench(benchmark, parser_bench, case):
+    metrics = get_metrics()
+
+    def setup():
+        parser_bench.setup_case(case)
+        metrics.reset()
+
+    benchmark.group = case
+    benchmark.pedantic(parser_bench.run_case, args=(case,), setup=setup, rounds=BENCH_ROUNDS, iterations=1)
+    metrics_dict = metrics.to_dict()
+    benchmark.extra_info.update({'runs': parser_bench.num_runs,
+                                 'files_copied': get_counter_total(metrics_dict, FILES_COPIED),
+                                 'bytes_copied': get_counter_total(metrics_dict, BYTES_COPIED)})
+    if case == COPY_FASTQ_CASE:
+        assert benchmark.extra_info['files_copied'] >= parser_bench.num_runs * parser_bench.num_fastq_files
@@ -0,0 +1,306 @@
+"""
+test_copy_engine.py
+copy_files and the kernel copy methods of fast_copyfile, on files in tmp dirs
+Created By: mkimble
+"""
+
+import os
+import errno
+import hashlib
+import pytest
+from mytd_parser import copy_engine
+from mytd_parser.copy_engine import copy_files
+from mytd_parser.metrics import get_metrics, COPY_METHOD_FILES
+
+KERNEL_COPY_METHODS = [method_name for method_name, copy_method in copy_engine.COPY_METHODS
+                       if method_name != 'buffered']
+
+
+def get_copy_method_counts():
+    copy_method_counts = {}
+    for name, labels, value in get_metrics().to_dict()['counters']:
+        if name == COPY_METHOD_FILES:
+            method = dict(labels)['method']
+            copy_method_counts[method] = copy_method_counts.get(method, 0) + value
+    return copy_method_counts
+
+
+def write_files(input_dir, num_files, size=65536):
+    """
+     num_files files of random bytes in input_dir; returns their paths
+    """
+    input_dir.mkdir(parents=True, exist_ok=True)
+    file_paths = []
+    for file_number in range(num_files):
+        file_path = input_dir / ('sample_' + str(file_number) + '.fastq.gz')
+        file_path.write_bytes(os.urandom(size + file_number))
+        file_paths.append(str(file_path))
+    return file_paths
+
+
+def get_copy_list(input_files, output_dir):
+    output_dir.mkdir(parents=True, exist_ok=True)
+    return [(input_file, str(output_dir / os.path.basename(input_file))) for input_file in input_files]
+
+
+def get_digest(file_path, checksum_algorithm):
+    with open(file_path, 'rb') as hashed_file:
+        return hashlib.new(checksum_algorithm, hashed_file.read()).hexdigest()
+
+
+@pytest.mark.skipif(not KERNEL_COPY_METHODS, reason='no kernel copy method on this platform')
+def test_checksums_keep_kernel_copy(tmp_path):
+    copy_list = get_copy_list(write_files(tmp_path / 'Staging', 4), tmp_path / 'Upload')
+    get_metrics().reset()
+    file_count, bytes_copied, elapsed_time, errors, file_infos = copy_files(
+        copy_list, checksum_algorithms=['md5', 'blake2b'])
+    assert (file_count, errors) == (4, [])
+    for input_file, output_file in copy_list:
+        assert file_infos[input_file]['md5'] == get_digest(output_file, 'md5')
+        assert file_infos[input_file]['blake2b'] == get_digest(output_file, 'blake2b')
+        assert file_infos[input_file]['size'] == os.path.getsize(output_file)
+    copy_method_counts = get_copy_method_counts()
+    assert 'buffered' not in copy_method_counts
+    assert sum(copy_method_counts.get(method_name, 0) for method_name in KERNEL_COPY_METHODS) == 4
+
+
+def test_existing_output_is_recorded(tmp_path):
+    copy_list = get_copy_list(write_files(tmp_path / 'Staging', 1), tmp_path / 'Upload')
+    input_file, output_file = copy_list[0]
+    # the file already in Upload differs from Staging; the manifest describes the file in Upload
+    with open(output_file, 'wb') as existing_file:
+        existing_file.write(b'already uploaded')
+    file_count, bytes_copied, elapsed_time, errors, file_infos = copy_files(copy_list, checksum_algorithms=['md5'])
+    assert file_count == 0
+    assert file_infos[input_file] == {'size': len(b'already uploaded'), 'md5': get_digest(output_file, 'md5'),
+                                      'mtime_ns': os.stat(output_file).st_mtime_ns}
+
+
+@pytest.mark.parametrize('is_unchanged', [True, False])
+def test_existing_output_reuses_known_checksums(tmp_path, is_unchanged):
+    copy_list = get_copy_list(write_files(tmp_path / 'Staging', 1), tmp_path / 'Upload')
+    copy_files(copy_list)
+    input_file, output_file = copy_list[0]
+    output_stat = os.stat(output_file)
+    known_file_info = {'size': output_stat.st_size, 'mtime_ns': output_stat.st_mtime_ns, 'md5': 'recorded'}
+    if not is_unchanged:
+        known_file_info['mtime_ns'] -= 1
+    file_count, bytes_copied, elapsed_time, errors, file_infos = copy_files(
+        copy_list, checksum_algorithms=['md5'], known_file_infos={input_file: known_file_info})
+    expected_md5 = 'recorded' if is_unchanged else get_digest(output_file, 'md5')
+    assert file_infos[input_file]['md5'] == expected_md5
+
+
+def raise_oserror(errno_value):
+    def copy_method(*args):
+        raise OSError(errno_value, os.strerror(errno_value))
+    return copy_method
+
+
+@pytest.fixture
+def kernel_copy_methods(monkeypatch):
+    """
+     the copy_file_range -> sendfile -> buffered chain on any platform, without a reflink that may or may not
+     work on the tmp dir's filesystem; os.copy_file_range and os.sendfile are patched by the tests
+    """
+    monkeypatch.setattr(copy_engine, 'COPY_METHODS', [('copy_file_range', copy_engine.copy_file_range_file),
+                                                      ('sendfile', copy_engine.sendfile_file),
+                                                      ('buffered', copy_engine.buffered_file)])
+    get_metrics().reset()
+
+
+def fast_copyfile_input(tmp_path, size=300000):
+    input_file = write_files(tmp_path / 'Staging', 1, size)[0]
+    return input_file, str(tmp_path / 'output.fastq.gz')
+
+
+@pytest.mark.parametrize('errno_value', [errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP])
+def test_fast_copyfile_falls_back_to_sendfile(tmp_path, monkeypatch, kernel_copy_methods, errno_value):
+    monkeypatch.setattr(os, 'copy_file_range', raise_oserror(errno_value), raising=False)
+    monkeypatch.setattr(os, 'sendfile', lambda out_fd, in_fd, offset, count: os.write(
+        out_fd, os.pread(in_fd, count, offset)), raising=False)
+    input_file, output_file = fast_copyfile_input(tmp_path)
+    assert copy_engine.fast_copyfile(input_file, output_file) == 'sendfile'
+    assert get_digest(output_file, 'md5') == get_digest(input_file, 'md5')
+    assert get_copy_method_counts() == {'sendfile': 1}
+
+
+def test_fast_copyfile_falls_back_to_buffered(tmp_path, monkeypatch, kernel_copy_methods):
+    monkeypatch.setattr(os, 'copy_file_range', raise_oserror(errno.EXDEV), raising=False)
+    monkeypatch.setattr(os, 'sendfile', raise_oserror(errno.ENOSYS), raising=False)
+    input_file, output_file = fast_copyfile_input(tmp_path)
+    assert copy_engine.fast_copyfile(input_file, output_file) == 'buffered'
+    assert get_digest(output_file, 'md5') == get_digest(input_file, 'md5')
+    assert get_copy_method_counts() == {'buffered': 1}
+
+
+def short_copy_file_range(src_fd, dst_fd, count, offset_src, offset_dst):
+    # copies the first 1000 bytes, then stops early like copy_file_range on some FUSE/NFS mounts
+    if offset_src >= 1000:
+        return 0
+    return os.pwrite(dst_fd, os.pread(src_fd, 1000, offset_src), offset_dst)
+
+
+def short_sendfile(out_fd, in_fd, offset, count):
+    if offset >= 1000:
+        return 0
+    return os.pwrite(out_fd, os.pread(in_fd, 1000, offset), offset)
+
+
+@pytest.mark.parametrize('method_name', ['copy_file_range', 'sendfile'])
+def test_short_count_raises(tmp_path, monkeypatch, kernel_copy_methods, method_name):
+    monkeypatch.setattr(os, 'copy_file_range', short_copy_file_range, raising=False)
+    monkeypatch.setattr(os, 'sendfile', short_sendfile, raising=False)
+    copy_method = dict(copy_engine.COPY_METHODS)[method_name]
+    input_file, output_file = fast_copyfile_input(tmp_path, 5000)
+    with open(input_file, 'rb') as fsrc, open(output_file, 'wb') as fdst:
+        with pytest.raises(copy_engine.ShortCopyError, match=method_name + ' copied 1000 of 5000 bytes'):
+            copy_method(fsrc.fileno(), fdst.fileno(), 5000)
+
+
+def test_fast_copyfile_short_counts_fall_back(tmp_path, monkeypatch, kernel_copy_methods):
+    monkeypatch.setattr(os, 'copy_file_range', short_copy_file_range, raising=False)
+    # claims the whole count was sent without writing anything; caught by fast_copyfile's size check
+    monkeypatch.setattr(os, 'sendfile', lambda out_fd, in_fd, offset, count: count, raising=False)
+    input_file, output_file = fast_copyfile_input(tmp_path)
+    # the partial copy_file_range output is truncated before the next method
+    assert copy_engine.fast_copyfile(input_file, output_file) == 'buffered'
+    assert get_digest(output_file, 'md5') == get_digest(input_file, 'md5')
+    assert get_copy_method_counts() == {'buffered': 1}
+
+
+def test_fast_copyfile_short_buffered_copy_raises(tmp_path, monkeypatch):
+    def short_buffered_file(src_fd, dst_fd, size):
+        os.write(dst_fd, os.read(src_fd, size // 2))
+
+    monkeypatch.setattr(copy_engine, 'COPY_METHODS', [('buffered', short_buffered_file)])
+    input_file, output_file = fast_copyfile_input(tmp_path)
+    with pytest.raises(copy_engine.ShortCopyError, match='buffered copied 150000 of 300000 bytes'):
+        copy_engine.fast_copyfile(input_file, output_file)
+
+
+@pytest.mark.parametrize('errno_value', [errno.ENOSPC, errno.EACCES, errno.EIO])
+def test_fast_copyfile_raises_other_errors(tmp_path, monkeypatch, kernel_copy_methods, errno_value):
+    sendfile_calls = []
+    monkeypatch.setattr(os, 'copy_file_range', raise_oserror(errno_value), raising=False)
+    monkeypatch.setattr(os, 'sendfile', lambda *args: sendfile_calls.append(args), raising=False)
+    input_file, output_file = fast_copyfile_input(tmp_path)
+    with pytest.raises(OSError) as excinfo:
+        copy_engine.fast_copyfile(input_file, output_file)
+    assert excinfo.value.errno == errno_value
+    assert not isinstance(excinfo.value, copy_engine.ShortCopyError)
+    assert sendfile_calls == []
+    assert get_copy_method_counts() == {}
+
+
+@pytest.fixture
+def fail_second_file(monkeypatch):
+    """
+     copy_file fails for sample_1 only; every other file is copied
+    """
+    copy_file = copy_engine.copy_file
+
+    def failing_copy_file(input_file, output_file, *args):
+        if os.path.basename(input_file).startswith('sample_1.'):
+            raise OSError(errno.EIO, 'Input/output error', input_file)
+        return copy_file(input_file, output_file, *args)
+    monkeypatch.setattr(copy_engine, 'copy_file', failing_copy_file)
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_copy_files_collects_errors(tmp_path, fail_second_file, max_workers):
+    copy_list = get_copy_list(write_files(tmp_path / 'Staging', 5), tmp_path / 'Upload')
+    file_count, bytes_copied, elapsed_time, errors, file_infos = copy_files(
+        copy_list, max_workers=max_workers, checksum_algorithms=['md5'])
+    failed_input_file, failed_output_file = copy_list[1]
+    assert [input_file for input_file, error in errors] == [failed_input_file]
+    assert 'Input/output error' in errors[0][1]
+    # the other copies still finish and are recorded
+    assert file_count == 4
+    assert sorted(file_infos) == sorted(input_file for input_file, output_file in copy_list
+                                        if input_file != failed_input_file)
+    assert bytes_copied == sum(file_info['size'] for file_info in file_infos.values())
+    for input_file, output_file in copy_list:
+        assert os.path.exists(output_file) is (input_file != failed_input_file)
+        assert not os.path.exists(output_file + '.part')
+
+
+def test_one_worker_matches_concurrent(tmp_path):
+    input_files = write_files(tmp_path / 'Staging', 6)
+    results = {}
+    for max_workers in (1, 4):
+        output_dir = tmp_path / ('Upload_' + str(max_workers))
+        file_count, bytes_copied, elapsed_time, errors, file_infos = copy_files(
+            get_copy_list(input_files, output_dir), max_workers=max_workers, checksum_algorithms=['md5'])
+        results[max_workers] = (file_count, bytes_copied, errors, file_infos,
+                                {path.name: path.read_bytes() for path in output_dir.iterdir()})
+    assert results[1] == results[4]
+    assert results[1][0] == 6
+
+
+def test_symlinks_survive_materialize_links(tmp_path):
+    input_files = write_files(tmp_path / 'Staging', 3)
+    input_bytes = {}
+    for input_file in input_files:
+        with open(input_file, 'rb') as input_f:
+            input_bytes[os.path.basename(input_file)] = input_f.read()
+    copy_list = get_copy_list(input_files, tmp_path / 'Upload' / 'Fastq')
+    get_metrics().reset()
+    file_count, bytes_copied, elapsed_time, errors, file_infos = copy_files(copy_list, link_mode='symlink')
+    assert (file_count, bytes_copied, errors) == (3, 0, [])
+    assert get_copy_method_counts() == {'symlink': 3}
+    for input_file, output_file in copy_list:
+        assert os.readlink(output_file) == os.path.abspath(input_file)
+
+    assert copy_engine.materialize_links(str(tmp_path / 'Upload')) == 3
+    # the Upload tree no longer depends on Staging, e.g., once Staging is moved to Backup
+    for input_file in input_files:
+        os.remove(input_file)
+    for input_file, output_file in copy_list:
+        assert not os.path.islink(output_file)
+        with open(output_file, 'rb') as output_f:
+            assert output_f.read() == input_bytes[os.path.basename(input_file)]
+    assert copy_engine.materialize_links(str(tmp_path / 'Upload')) == 0
+
+
+def test_materialize_broken_link(tmp_path):
+    (tmp_path / 'Upload').mkdir()
+    os.symlink(str(tmp_path / 'Staging' / 'missing.fastq.gz'), str(tmp_path / 'Upload' / 'missing.fastq.gz'))
+    with pytest.raises(RuntimeError, match='broken symlink'):
+        copy_engine.materialize_links(str(tmp_path / 'Upload'))
+
+
+def test_hardlink(tmp_path):
+    copy_list = get_copy_list(write_files(tmp_path / 'Staging', 2), tmp_path / 'Upload')
+    get_metrics().reset()
+    file_count, bytes_copied, elapsed_time, errors, file_infos = copy_files(copy_list, link_mode='hardlink')
+    assert (file_count, bytes_copied, errors) == (2, 0, [])
+    assert get_copy_method_counts() == {'hardlink': 2}
+    for input_file, output_file in copy_list:
+        assert os.path.samefile(input_file, output_file)
+
+
+@pytest.mark.parametrize('errno_value', [errno.EXDEV, errno.EPERM, errno.EMLINK])
+def test_hardlink_falls_back_to_copy(tmp_path, monkeypatch, errno_value):
+    # Staging and Upload on different volumes
+    monkeypatch.setattr(os, 'link', raise_oserror(errno_value))
+    copy_list = get_copy_list(write_files(tmp_path / 'Staging', 2), tmp_path / 'Upload')
+    get_metrics().reset()
+    file_count, bytes_copied, elapsed_time, errors, file_infos = copy_files(
+        copy_list, link_mode='hardlink', checksum_algorithms=['md5'])
+    assert (file_count, errors) == (2, [])
+    assert bytes_copied == sum(os.path.getsize(input_file) for input_file, output_file in copy_list)
+    assert 'hardlink' not in get_copy_method_counts()
+    assert sum(get_copy_method_counts().values()) == 2
+    for input_file, output_file in copy_list:
+        assert not os.path.samefile(input_file, output_file)
+        assert file_infos[input_file]['md5'] == get_digest(input_file, 'md5')
+
+
+def test_hardlink_raises_other_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(os, 'link', raise_oserror(errno.EACCES))
+    copy_list = get_copy_list(write_files(tmp_path / 'Staging', 1), tmp_path / 'Upload')
+    file_count, bytes_copied, elapsed_time, errors, file_infos = copy_files(copy_list, link_mode='hardlink')
+    assert file_count == 0
+    assert [input_file for input_file, error in errors] == [copy_list[0][0]]
+    assert not os.path.exists(copy_list[0][1])
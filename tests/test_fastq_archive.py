@@ -0,0 +1,85 @@
+"""
+test_fastq_archive.py
+FastqArchive append, read-time dedup and compaction in a tmp dir; the parquet tests need the opt-in pyarrow
+Created By: mkimble
+"""
+
+import glob
+import os
+import pandas as pd
+import pytest
+from mytd_parser.fastq_archive import FastqArchive
+
+PROJECT = 'maine-edna'
+RUN_ID = '210126_M05543_0033_000000000-00033'
+
+
+def get_fastq_df(sizes):
+    """
+     fastq records as written by write_fastq_manifest, one per size
+    """
+    return pd.DataFrame({'sample_id': ['E' + str(number) for number in range(len(sizes))],
+                         'fastq_path': ['/Staging/E' + str(number) + '_R1.fastq.gz' for number in range(len(sizes))],
+                         'size': sizes})
+
+
+def get_part_filepaths(archive, run_id=RUN_ID):
+    return glob.glob(os.path.join(archive.get_partition_dir(PROJECT, run_id), 'part-*.parquet'))
+
+
+def test_append_without_pyarrow(tmp_path):
+    archive = FastqArchive(archive_dir=str(tmp_path / 'fastq_archive'))
+    archive.pa, archive.ds, archive.pq = None, None, None
+    assert archive.append(PROJECT, RUN_ID, get_fastq_df([10])) is False
+    assert not os.path.exists(archive.archive_dir)
+    with pytest.raises(RuntimeError, match='pyarrow is not installed'):
+        archive.read()
+
+
+def test_append(tmp_path):
+    pytest.importorskip('pyarrow')
+    archive = FastqArchive(archive_dir=str(tmp_path / 'fastq_archive'))
+    assert archive.append(PROJECT, RUN_ID, get_fastq_df([10, 20]))
+    assert len(get_part_filepaths(archive)) == 1
+    # no half-written temp parts are left behind
+    assert not glob.glob(os.path.join(archive.get_partition_dir(PROJECT, RUN_ID), '.*.tmp'))
+    fastq_df = archive.read(project=PROJECT, run_id=RUN_ID)
+    assert list(fastq_df['project']) == [PROJECT, PROJECT]
+    assert list(fastq_df['run_id']) == [RUN_ID, RUN_ID]
+    assert sorted(fastq_df['size']) == [10, 20]
+
+
+def test_read_dedup_keeps_newest(tmp_path):
+    pytest.importorskip('pyarrow')
+    archive = FastqArchive(archive_dir=str(tmp_path / 'fastq_archive'))
+    archive.append(PROJECT, RUN_ID, get_fastq_df([10, 20]))
+    # the second pass re-parses E0 only, with a new size
+    archive.append(PROJECT, RUN_ID, get_fastq_df([11]))
+    # the same fastq path in another run is a different record
+    archive.append(PROJECT, '210127_M05543_0034_000000000-00034', get_fastq_df([30]))
+    assert len(get_part_filepaths(archive)) == 2
+    fastq_df = archive.read(project=PROJECT, run_id=RUN_ID)
+    assert dict(zip(fastq_df['sample_id'], fastq_df['size'])) == {'E0': 11, 'E1': 20}
+    assert len(archive.read()) == 3
+    # the key and archive_date columns are always read
+    assert set(archive.read(run_id=RUN_ID, columns=['size']).columns) == {'project', 'run_id', 'fastq_path',
+                                                                          'archive_date', 'size'}
+
+
+def test_compact_past_max_parts(tmp_path):
+    pytest.importorskip('pyarrow')
+    archive = FastqArchive(archive_dir=str(tmp_path / 'fastq_archive'), max_parts=2)
+    archive.append(PROJECT, RUN_ID, get_fastq_df([10, 20]))
+    archive.append(PROJECT, RUN_ID, get_fastq_df([11]))
+    assert len(get_part_filepaths(archive)) == 2
+    # the third part is past max_parts, so the partition is rewritten as one deduplicated part
+    archive.append(PROJECT, RUN_ID, get_fastq_df([12, 21, 30]))
+    part_filepaths = get_part_filepaths(archive)
+    assert len(part_filepaths) == 1
+    assert part_filepaths[0].endswith('-compact.parquet')
+    fastq_df = archive.read(project=PROJECT, run_id=RUN_ID)
+    assert dict(zip(fastq_df['sample_id'], fastq_df['size'])) == {'E0': 12, 'E1': 21, 'E2': 30}
+    # later appends dedup against the compacted part
+    archive.append(PROJECT, RUN_ID, get_fastq_df([13]))
+    fastq_df = archive.read(project=PROJECT, run_id=RUN_ID)
+    assert dict(zip(fastq_df['sample_id'], fastq_df['size'])) == {'E0': 13, 'E1': 21, 'E2': 30}
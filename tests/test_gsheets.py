@@ -0,0 +1,280 @@
+"""
+test_gsheets.py
+GsheetSnapshot TTL and cell index, GsheetStatusWriter batching against an in-memory worksheet, and the lazily
+authorized gspread client shared by the parsers of a process
+Created By: mkimble
+"""
+
+import os
+import pytest
+from gspread.utils import a1_to_rowcol
+from mytd_parser import gsheets
+from mytd_parser.gsheets import GsheetSnapshot, GsheetStatusWriter, get_gsheet_snapshot, GSHEETS_PARSE_STATUS_COLUMN
+from mytd_parser.parse_seq_run import update_parse_status_runid_gsheets, MiSeqParser
+from mytd_parser.pipeline import ParsePipeline, COPY_METADATA, COPY_FASTQ, MANIFEST, BACKUP
+from mytd_parser.synthetic import make_miseq_run
+
+RUN_IDS = ['210126_M05543_0033_000000000-00033', '210127_M05543_0034_000000000-00034',
+           '210128_M05543_0035_000000000-00035']
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000
+
+    def time(self):
+        return self.now
+
+
+class FakeWorksheet:
+    """
+     worksheet that counts get_all_values fetches and applies batch_update to its rows
+    """
+    def __init__(self, rows):
+        self.id = 0
+        self.spreadsheet = None
+        self.rows = [list(row) for row in rows]
+        self.num_fetches = 0
+        self.batch_updates = []
+
+    def get_all_values(self):
+        self.num_fetches += 1
+        return [list(row) for row in self.rows]
+
+    def batch_update(self, data):
+        self.batch_updates.append(data)
+        for update in data:
+            row_num, col_num = a1_to_rowcol(update['range'])
+            self.rows[row_num - 1][col_num - 1] = update['values'][0][0]
+
+
+def get_worksheet():
+    return FakeWorksheet([['RunID', 'Number of FASTQ files', GSHEETS_PARSE_STATUS_COLUMN]] +
+                         [[run_id, str(24 + run_number), ''] for run_number, run_id in enumerate(RUN_IDS)])
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(gsheets, 'time', clock)
+    gsheets.clear_gsheet_snapshots()
+    yield clock
+    gsheets.clear_gsheet_snapshots()
+
+
+def test_snapshot_ttl(clock):
+    worksheet = get_worksheet()
+    snapshot = get_gsheet_snapshot(worksheet, ttl_seconds=300)
+    assert snapshot.get_value(RUN_IDS[1], 'Number of FASTQ files') == '25'
+    clock.now += 299
+    assert get_gsheet_snapshot(worksheet, ttl_seconds=300) is snapshot
+    assert worksheet.num_fetches == 1
+    # an expired snapshot is fetched again and sees changes made in the sheet since
+    worksheet.rows[2][1] = '30'
+    clock.now += 1
+    snapshot = get_gsheet_snapshot(worksheet, ttl_seconds=300)
+    assert worksheet.num_fetches == 2
+    assert snapshot.get_value(RUN_IDS[1], 'Number of FASTQ files') == '30'
+    assert snapshot.get_value('unknown run', 'Number of FASTQ files') is None
+
+
+def test_set_value_updates_cell_index(clock):
+    snapshot = GsheetSnapshot(FakeWorksheet([['RunID', 'status'], ['a', 'x'], ['b', 'x'], ['c', '']]))
+    snapshot.refresh()
+    assert snapshot.find('x') == (1, 1)
+    # the first 'x' is overwritten: 'x' is found in the next row, and 'y' where it was written
+    snapshot.set_value(1, 1, 'y')
+    assert (snapshot.find('x'), snapshot.find('y')) == ((2, 1), (1, 1))
+    snapshot.set_value(2, 1, 'y')
+    assert (snapshot.find('x'), snapshot.find('y')) == (None, (1, 1))
+    # a value written above its first cell becomes its first cell
+    snapshot.set_value(3, 1, 'z')
+    snapshot.set_value(0, 1, 'z')
+    assert snapshot.find('z') == (0, 1)
+    assert snapshot.find('status') is None
+    # cells past the fetched values
+    snapshot.set_value(5, 3, 'w')
+    assert snapshot.find('w') == (5, 3)
+    assert snapshot.get_cell_value(5, 3) == 'w'
+    assert snapshot.get_cell_value(4, 0) == ''
+    # the index matches a fresh fetch of the same values
+    written_values = [list(row) for row in snapshot.values]
+    fetched_snapshot = GsheetSnapshot(FakeWorksheet(written_values))
+    fetched_snapshot.refresh()
+    for value in ('x', 'y', 'z', 'w', 'a', 'RunID'):
+        assert snapshot.find(value) == fetched_snapshot.find(value)
+
+
+def test_status_writer_batches_until_flush(clock):
+    worksheet = get_worksheet()
+    status_writer = GsheetStatusWriter(worksheet, max_updates=100)
+    for run_id in RUN_IDS:
+        status_writer.add(run_id, GSHEETS_PARSE_STATUS_COLUMN, 'IN PROGRESS')
+    # a later update of the same cell replaces the buffered one
+    status_writer.add(RUN_IDS[0], GSHEETS_PARSE_STATUS_COLUMN, 'COMPLETE')
+    status_writer.add('unknown run', GSHEETS_PARSE_STATUS_COLUMN, 'COMPLETE')
+    assert worksheet.batch_updates == []
+    assert status_writer.flush() == 3
+    assert len(worksheet.batch_updates) == 1
+    assert sorted(update['range'] for update in worksheet.batch_updates[0]) == ['C2', 'C3', 'C4']
+    assert [row[2] for row in worksheet.rows[1:]] == ['COMPLETE', 'IN PROGRESS', 'IN PROGRESS']
+    # the snapshot is kept in step, so reads don't fetch again
+    assert get_gsheet_snapshot(worksheet).get_value(RUN_IDS[0], GSHEETS_PARSE_STATUS_COLUMN) == 'COMPLETE'
+    assert worksheet.num_fetches == 1
+    assert status_writer.flush() == 0
+    assert len(worksheet.batch_updates) == 1
+
+
+def test_status_writer_flush_threshold(clock):
+    worksheet = get_worksheet()
+    status_writer = GsheetStatusWriter(worksheet, max_updates=2)
+    status_writer.add(RUN_IDS[0], GSHEETS_PARSE_STATUS_COLUMN, 'COMPLETE')
+    assert worksheet.batch_updates == []
+    # the second update reaches max_updates and is written with the first
+    status_writer.add(RUN_IDS[1], GSHEETS_PARSE_STATUS_COLUMN, 'COMPLETE')
+    assert len(worksheet.batch_updates) == 1
+    assert len(worksheet.batch_updates[0]) == 2
+    assert status_writer.updates == {}
+    status_writer.add(RUN_IDS[2], GSHEETS_PARSE_STATUS_COLUMN, 'COMPLETE')
+    assert len(worksheet.batch_updates) == 1
+    status_writer.flush()
+    assert len(worksheet.batch_updates) == 2
+
+
+def test_status_writer_skips_unchanged_cells(clock):
+    worksheet = get_worksheet()
+    worksheet.rows[1][2] = 'COMPLETE'
+    # every server parse moves its complete runs again and adds their COMPLETE
+    for parse_pass in range(3):
+        status_writer = GsheetStatusWriter(worksheet)
+        for run_id in RUN_IDS[:2]:
+            status_writer.add(run_id, GSHEETS_PARSE_STATUS_COLUMN, 'COMPLETE')
+        status_writer.flush()
+    assert len(worksheet.batch_updates) == 1
+    assert [update['range'] for update in worksheet.batch_updates[0]] == ['C3']
+
+
+def test_failed_flush_keeps_updates(clock):
+    worksheet = get_worksheet()
+
+    def failing_batch_update(data):
+        raise IOError('quota exceeded')
+    worksheet.batch_update = failing_batch_update
+    status_writer = GsheetStatusWriter(worksheet)
+    status_writer.add(RUN_IDS[0], GSHEETS_PARSE_STATUS_COLUMN, 'COMPLETE')
+    with pytest.raises(RuntimeError, match='quota exceeded'):
+        status_writer.flush()
+    assert status_writer.updates == {(RUN_IDS[0], GSHEETS_PARSE_STATUS_COLUMN): 'COMPLETE'}
+
+
+def test_update_parse_status_one_flush_per_pass(clock):
+    worksheet = get_worksheet()
+    status_writer = GsheetStatusWriter(worksheet)
+    for run_id in RUN_IDS:
+        assert update_parse_status_runid_gsheets(worksheet, run_id, status_writer) == 0
+    assert worksheet.batch_updates == []
+    assert status_writer.flush() == 3
+    assert len(worksheet.batch_updates) == 1
+    # without a status_writer the cell is written right away
+    gsheets.clear_gsheet_snapshots()
+    worksheet.rows[1][2] = ''
+    assert update_parse_status_runid_gsheets(worksheet, RUN_IDS[0]) == 1
+    assert len(worksheet.batch_updates) == 2
+
+
+class FakeGspread:
+    """
+     stands in for gspread.authorize and ServiceAccountCredentials; counts authorizations and spreadsheet opens.
+     Each open hands out a new worksheet handle over the same rows, like a re-authorized gspread client
+    """
+    def __init__(self, rows):
+        self.rows = rows
+        self.num_authorizes = 0
+        self.num_opens = 0
+        self.worksheets = []
+
+    def from_json_keyfile_name(self, private_key, scope):
+        return 'credentials'
+
+    def authorize(self, credentials):
+        self.num_authorizes += 1
+        return self
+
+    def open_by_url(self, spreadsheet_url):
+        self.num_opens += 1
+        return self
+
+    def worksheet(self, worksheet_name):
+        worksheet = FakeWorksheet(self.rows)
+        # the rows are shared, so every handle sees the same sheet
+        worksheet.rows = self.rows
+        self.worksheets.append(worksheet)
+        return worksheet
+
+    def get_num_fetches(self):
+        return sum(worksheet.num_fetches for worksheet in self.worksheets)
+
+
+@pytest.fixture
+def fake_gspread(tmp_path, clock, monkeypatch):
+    """
+     no process-wide client yet, and a FakeGspread behind GsheetClient.authorize; the sheet lists runs 33 and
+     34 of the staging tree in tmp_path with their 2 fastq files
+    """
+    run_dirs = [make_miseq_run(str(tmp_path / 'Staging'), 'maine-edna', run_number, num_fastq_files=2,
+                               fastq_size=16, num_thumbnails=2) for run_number in (33, 34)]
+    rows = [['RunID', 'Number of FASTQ files', GSHEETS_PARSE_STATUS_COLUMN]] + \
+        [[os.path.basename(run_dir.rstrip('/')), '2', ''] for run_dir in run_dirs]
+    fake_gspread = FakeGspread(rows)
+    monkeypatch.setattr(gsheets, 'gsheet_client', None)
+    monkeypatch.setattr(gsheets.gspread, 'authorize', fake_gspread.authorize)
+    monkeypatch.setattr(gsheets.ServiceAccountCredentials, 'from_json_keyfile_name',
+                        fake_gspread.from_json_keyfile_name)
+    fake_gspread.run_dirs = run_dirs
+    return fake_gspread
+
+
+def validate_run(tmp_path, run_dir, check_gdrive=True):
+    """
+     discover and validate run_dir with its own MiSeqParser; returns the number of valid fastq dirs
+    """
+    parser = MiSeqParser('maine-edna', run_dir, 2, check_gdrive, staging_dir=str(tmp_path / 'Staging') + '/',
+                         output_dir=str(tmp_path / 'Upload') + '/', backup_dir=str(tmp_path / 'Backup') + '/',
+                         extra_backup_dirs=[], log_file_dir=str(tmp_path / 'logs') + '/')
+    context = ParsePipeline(parser, skip_stages=(COPY_METADATA, COPY_FASTQ, MANIFEST, BACKUP)).run()
+    return len(context.valid_records)
+
+
+def test_parsers_share_one_lazy_client(tmp_path, fake_gspread):
+    # parsers without check_gdrive never authorize
+    assert validate_run(tmp_path, fake_gspread.run_dirs[0], check_gdrive=False) == 1
+    assert fake_gspread.num_authorizes == 0
+    for run_dir in fake_gspread.run_dirs:
+        assert validate_run(tmp_path, run_dir) == 1
+    assert (fake_gspread.num_authorizes, fake_gspread.num_opens) == (1, 1)
+    # one get_all_values fetch for both parsers' lookups
+    assert fake_gspread.get_num_fetches() == 1
+
+
+def test_snapshot_ttl_refresh_keeps_client(tmp_path, fake_gspread, clock):
+    validate_run(tmp_path, fake_gspread.run_dirs[0])
+    clock.now += gsheets.settings.GSHEETS_SNAPSHOT_TTL_SECONDS
+    # the sheet was updated since the first fetch: the second run isn't ready yet
+    fake_gspread.rows[2][1] = '3'
+    assert validate_run(tmp_path, fake_gspread.run_dirs[1]) == 0
+    assert fake_gspread.get_num_fetches() == 2
+    assert (fake_gspread.num_authorizes, fake_gspread.num_opens) == (1, 1)
+
+
+def test_client_authorized_again_after_refresh_seconds(tmp_path, fake_gspread, clock):
+    validate_run(tmp_path, fake_gspread.run_dirs[0])
+    clock.now += gsheets.gsheet_client.refresh_seconds - 1
+    validate_run(tmp_path, fake_gspread.run_dirs[1])
+    assert (fake_gspread.num_authorizes, fake_gspread.num_opens) == (1, 1)
+    clock.now += 1
+    validate_run(tmp_path, fake_gspread.run_dirs[1])
+    assert (fake_gspread.num_authorizes, fake_gspread.num_opens) == (2, 2)
+    # the snapshot of the worksheet moves to the new handle
+    snapshot = get_gsheet_snapshot(fake_gspread.worksheets[-1])
+    assert snapshot.worksheet is fake_gspread.worksheets[-1]
+    assert len(gsheets.gsheet_snapshots) == 1
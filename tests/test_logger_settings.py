@@ -0,0 +1,66 @@
+"""
+test_logger_settings.py
+Debug sampling, the default log level, and the queue listeners only being started by the entry points
+Created By: mkimble
+"""
+
+import os
+import sys
+import logging
+import subprocess
+from mytd_parser import settings
+from mytd_parser.logger_settings import DebugSampleFilter, api_logger, batch_process_logger
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def get_record(level):
+    return logging.LogRecord('api_logger', level, __file__, 1, 'moved [%s]', ('E1_R1.fastq.gz',), None)
+
+
+def run_python(code):
+    """
+     run code in a fresh interpreter, so the logging config is set up from an import
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([REPO_DIR] + sys.path))
+    result = subprocess.run([sys.executable, '-c', code], cwd=REPO_DIR, env=env, capture_output=True, text=True,
+                            timeout=60)
+    assert result.returncode == 0, result.stderr
+    return result.stdout.split()
+
+
+def test_debug_sample_filter():
+    debug_sample_filter = DebugSampleFilter(sample_every=3)
+    assert [debug_sample_filter.filter(get_record(logging.DEBUG)) for number in range(7)] == [
+        True, False, False, True, False, False, True]
+    # INFO and above always pass
+    assert all(debug_sample_filter.filter(get_record(logging.INFO)) for number in range(4))
+    assert all(DebugSampleFilter(sample_every=1).filter(get_record(logging.DEBUG)) for number in range(4))
+
+
+def test_default_level_drops_debug():
+    # per-run and per-file records are DEBUG, dropped before formatting at the default level
+    assert settings.LOG_LEVEL == 'INFO'
+    assert not api_logger.isEnabledFor(logging.DEBUG)
+    assert api_logger.isEnabledFor(logging.INFO)
+    # the sampling filter is only attached when it would drop records
+    if settings.LOG_DEBUG_SAMPLE_EVERY == 1:
+        assert api_logger.filters == [] and batch_process_logger.filters == []
+
+
+def test_import_starts_no_threads():
+    assert run_python('import threading\n'
+                      'from mytd_parser import parse_seq_run, parse_server_copy, logger_settings\n'
+                      'print(threading.active_count(), len(logger_settings.queue_listeners))') == ['1', '0']
+
+
+def test_start_async_logging():
+    assert run_python('import threading\n'
+                      'from mytd_parser import settings, logger_settings\n'
+                      'settings.LOG_ASYNC = False\n'
+                      'print(logger_settings.start_async_logging(), threading.active_count())\n'
+                      'settings.LOG_ASYNC = True\n'
+                      'print(logger_settings.start_async_logging(), logger_settings.start_async_logging())\n'
+                      'print(threading.active_count(), sorted(logger_settings.queue_listeners))\n'
+                      'logger_settings.api_logger.info("queued")') == [
+        'False', '1', 'True', 'True', '3', "['api_logger',", "'batch_process_logger']", 'INFO', 'queued']
@@ -0,0 +1,111 @@
+"""
+test_metrics.py
+Prometheus text format of Metrics (histogram buckets, label escaping) and the atomic write_metrics in tmp dirs
+Created By: mkimble
+"""
+
+import os
+import json
+import glob
+import pytest
+from mytd_parser import settings
+from mytd_parser import metrics as metrics_module
+from mytd_parser.metrics import Metrics, write_metrics, STAGE_SECONDS, API_REQUESTS, RUNS, METRIC_PREFIX
+
+
+def get_samples(prometheus_text):
+    """
+     {metric name and labels: value} of the sample lines
+    """
+    samples = {}
+    for line in prometheus_text.splitlines():
+        if not line.startswith('#'):
+            name_labels, value = line.rsplit(' ', 1)
+            samples[name_labels] = value
+    return samples
+
+
+def get_metrics():
+    metrics = Metrics(enabled=True)
+    metrics.inc(RUNS, state='parsed')
+    metrics.inc(RUNS, 2, state='failed')
+    return metrics
+
+
+def test_histogram_buckets():
+    metrics = Metrics(enabled=True)
+    # an observation equal to a bucket's upper bound is counted in that bucket (le)
+    observations = (0.02, 0.05, 1, 7200)
+    for seconds in observations:
+        metrics.observe(STAGE_SECONDS, seconds, stage='copy_fastq')
+    prometheus_text = metrics.to_prometheus('parse_seq_dirs')
+    metric_name = METRIC_PREFIX + STAGE_SECONDS
+    assert '# TYPE ' + metric_name + ' histogram' in prometheus_text.splitlines()
+    samples = get_samples(prometheus_text)
+    labels = 'job="parse_seq_dirs",stage="copy_fastq"'
+    buckets = settings.METRICS_HISTOGRAM_BUCKETS
+    assert 0.05 in buckets and 1 in buckets and max(buckets) < 7200
+    bucket_counts = [samples[metric_name + '_bucket{' + labels + ',le="' + str(bucket) + '"}'] for bucket in buckets]
+    assert bucket_counts == [str(sum(seconds <= bucket for seconds in observations)) for bucket in buckets]
+    assert samples[metric_name + '_bucket{' + labels + ',le="+Inf"}'] == '4'
+    assert samples[metric_name + '_count{' + labels + '}'] == '4'
+    assert float(samples[metric_name + '_sum{' + labels + '}']) == pytest.approx(7201.07)
+    # every bucket line comes before the sum and count of its series
+    sample_names = [name_labels for name_labels in samples if name_labels.startswith(metric_name)]
+    assert sample_names[-2:] == [metric_name + '_sum{' + labels + '}', metric_name + '_count{' + labels + '}']
+
+
+def test_counters():
+    samples = get_samples(get_metrics().to_prometheus('server_parse'))
+    assert samples[METRIC_PREFIX + RUNS + '{job="server_parse",state="failed"}'] == '2'
+    assert samples[METRIC_PREFIX + RUNS + '{job="server_parse",state="parsed"}'] == '1'
+    assert METRIC_PREFIX + 'last_run_timestamp_seconds{job="server_parse"}' in samples
+
+
+def test_label_escaping():
+    metrics = Metrics(enabled=True)
+    metrics.inc(API_REQUESTS, api='my"tardis', operation='C:\\Upload', status='503\nretry')
+    prometheus_text = metrics.to_prometheus('dataset_filter')
+    sample_line = (METRIC_PREFIX + API_REQUESTS + '{job="dataset_filter",api="my\\"tardis",operation="C:\\\\Upload",'
+                   'status="503\\nretry"} 1')
+    assert sample_line in prometheus_text.splitlines()
+
+
+def test_write_metrics(tmp_path):
+    summary_dir = str(tmp_path / 'metrics')
+    textfile_dir = str(tmp_path / 'textfile')
+    summary_path = write_metrics('parse_seq_dirs', get_metrics(), summary_dir=summary_dir, textfile_dir=textfile_dir)
+    with open(summary_path) as summary_file:
+        summary = json.load(summary_file)
+    assert summary['job'] == 'parse_seq_dirs'
+    assert ['runs_total', [['state', 'parsed']], 1] in summary['counters']
+    with open(os.path.join(textfile_dir, 'mytd_parser_parse_seq_dirs.prom')) as prom_file:
+        samples = get_samples(prom_file.read())
+    assert samples[METRIC_PREFIX + RUNS + '{job="parse_seq_dirs",state="failed"}'] == '2'
+    assert not glob.glob(str(tmp_path / '*' / '*.tmp'))
+    assert write_metrics('parse_seq_dirs', Metrics(enabled=False), summary_dir=str(tmp_path / 'disabled'),
+                         textfile_dir=str(tmp_path / 'disabled')) is None
+    assert not os.path.exists(str(tmp_path / 'disabled'))
+
+
+def test_failed_write_keeps_previous_textfile(tmp_path, monkeypatch):
+    textfile_dir = str(tmp_path / 'textfile')
+    prom_filepath = os.path.join(textfile_dir, 'mytd_parser_server_parse.prom')
+    write_metrics('server_parse', get_metrics(), summary_dir=str(tmp_path / 'metrics'), textfile_dir=textfile_dir)
+    with open(prom_filepath) as prom_file:
+        previous_text = prom_file.read()
+
+    def failing_replace(src, dst):
+        raise OSError(28, 'No space left on device')
+    monkeypatch.setattr(metrics_module.os, 'replace', failing_replace)
+    metrics = get_metrics()
+    metrics.inc(RUNS, state='moved')
+    # logged, not raised
+    assert write_metrics('server_parse', metrics, summary_dir=str(tmp_path / 'metrics'),
+                         textfile_dir=textfile_dir) is None
+    monkeypatch.undo()
+    # node_exporter still reads the last complete textfile, and no temp file is left behind
+    with open(prom_filepath) as prom_file:
+        assert prom_file.read() == previous_text
+    assert sorted(os.listdir(textfile_dir)) == ['mytd_parser_server_parse.prom']
+    assert not glob.glob(str(tmp_path / 'metrics' / '*.tmp'))
@@ -0,0 +1,169 @@
+"""
+test_mydata_uploader.py
+MyDataUploader.upload and the backup moves that depend on it, with mydata-python and MyTardis replaced by stubs
+Created By: mkimble
+"""
+
+import os
+import glob
+from types import SimpleNamespace
+import pandas as pd
+import pytest
+from mytd_parser import mydata_uploader
+from mytd_parser.mydata_uploader import MyDataUploader
+from mytd_parser.parse_seq_run import MiSeqParser
+from mytd_parser.pipeline import ParsePipeline, BACKUP
+from mytd_parser.synthetic import make_miseq_run
+
+PROJECT = 'maine-edna'
+
+
+class Abort(RuntimeError):
+    """
+     stands in for click.Abort
+    """
+
+
+class StubUploadCmd:
+    def __init__(self, result):
+        self.result = result
+        self.calls = []
+
+    def main(self, args=None, standalone_mode=True):
+        self.calls.append(args)
+        if isinstance(self.result, BaseException):
+            raise self.result
+        return self.result
+
+
+def get_uploader(monkeypatch, tmp_path, upload_result=None, server_ok=True):
+    upload_cmd = StubUploadCmd(upload_result)
+    mydata_settings = SimpleNamespace(data_directory=str(tmp_path), folder_structure='User Group / Dataset',
+                                      mytardis_url='http://localhost')
+    mydata = SimpleNamespace(conf=SimpleNamespace(settings=mydata_settings),
+                             models=SimpleNamespace(settings=SimpleNamespace(serialize=None)),
+                             commands=SimpleNamespace(upload=SimpleNamespace(upload_cmd=upload_cmd)))
+    monkeypatch.setattr(mydata_uploader, 'get_mydata', lambda: mydata)
+    uploader = MyDataUploader(str(tmp_path), 'User Group / Dataset', 'http://localhost')
+    monkeypatch.setattr(uploader, 'check_server', lambda: server_ok)
+    return uploader, upload_cmd
+
+
+@pytest.mark.parametrize('upload_result', [None, 0, SystemExit(0), SystemExit(None)])
+def test_upload(monkeypatch, tmp_path, upload_result):
+    uploader, upload_cmd = get_uploader(monkeypatch, tmp_path, upload_result)
+    assert uploader.upload([str(tmp_path)]) is True
+    assert upload_cmd.calls == [['-v']]
+
+
+@pytest.mark.parametrize('upload_result, message', [
+    (1, r'exited with \[1\]'),
+    (SystemExit(2), r'exited with \[2\]'),
+    (Abort(), 'Abort'),
+])
+def test_upload_failed(monkeypatch, tmp_path, upload_result, message):
+    uploader, upload_cmd = get_uploader(monkeypatch, tmp_path, upload_result)
+    with pytest.raises(RuntimeError, match=message):
+        uploader.upload()
+
+
+def test_upload_server_unavailable(monkeypatch, tmp_path):
+    uploader, upload_cmd = get_uploader(monkeypatch, tmp_path, server_ok=False)
+    with pytest.raises(RuntimeError, match='MyTardis not available'):
+        uploader.upload()
+    assert upload_cmd.calls == []
+
+
+def test_upload_nothing_to_upload(monkeypatch, tmp_path):
+    uploader, upload_cmd = get_uploader(monkeypatch, tmp_path)
+    assert uploader.upload([str(tmp_path / 'missing')]) is False
+    assert upload_cmd.calls == []
+
+
+def get_parser(tmp_path):
+    staging_dir = str(tmp_path / 'Staging') + '/'
+    run_dir = make_miseq_run(staging_dir, PROJECT, 33, num_fastq_files=2, fastq_size=16, num_thumbnails=2)
+    parser = MiSeqParser(PROJECT, run_dir, 1, False, staging_dir=staging_dir,
+                         output_dir=str(tmp_path / 'Upload') + '/', backup_dir=str(tmp_path / 'Backup') + '/',
+                         extra_backup_dirs=[])
+    run_id = os.path.basename(run_dir.rstrip('/'))
+    return parser, run_dir, pd.DataFrame({'project': [PROJECT], 'run_id': [run_id]})
+
+
+def test_failed_upload_skips_backup(monkeypatch, tmp_path):
+    parser, run_dir, dirs_df = get_parser(tmp_path)
+
+    def failed_upload(paths=None):
+        raise RuntimeError('MyTardis not available')
+    monkeypatch.setattr(parser, 'upload_mydata', failed_upload)
+    with pytest.raises(RuntimeError, match='MyTardis not available'):
+        parser.complete_upload_backup(dirs_df, True, False, True)
+    assert os.path.exists(run_dir + 'RunInfo.xml')
+    assert not os.path.exists(run_dir + 'MYTDComplete.txt')
+    assert not (tmp_path / 'Backup').exists()
+
+
+@pytest.mark.parametrize('marker_upload', ['failed', 'nothing_uploaded'])
+def test_mytd_complete_not_uploaded(monkeypatch, tmp_path, marker_upload):
+    parser, run_dir, dirs_df = get_parser(tmp_path)
+    backup_run_dir = str(tmp_path / 'Backup' / 'Staging' / PROJECT / dirs_df['run_id'][0]) + '/'
+
+    def marker_upload_mydata(paths=None):
+        if marker_upload == 'failed':
+            raise RuntimeError('mydata upload exited with [1]')
+        return False
+    monkeypatch.setattr(parser, 'upload_mydata', marker_upload_mydata)
+    with pytest.raises(RuntimeError):
+        parser.move_staging_backup(dirs_df, True)
+    # the run was moved, but no MYTDComplete.txt is left behind for a later upload or in backup
+    assert os.path.exists(backup_run_dir + 'RunInfo.xml')
+    assert not os.path.exists(run_dir)
+    assert not os.path.exists(backup_run_dir + 'MYTDComplete.txt')
+
+
+def test_mytd_complete_uploaded(monkeypatch, tmp_path):
+    parser, run_dir, dirs_df = get_parser(tmp_path)
+    backup_run_dir = str(tmp_path / 'Backup' / 'Staging' / PROJECT / dirs_df['run_id'][0]) + '/'
+    uploaded_paths = []
+
+    def upload_mydata(paths=None):
+        uploaded_paths.append(paths)
+        return True
+    monkeypatch.setattr(parser, 'upload_mydata', upload_mydata)
+    upload_action, parsing_action, staging_action = parser.complete_upload_backup(dirs_df, True, False, True)
+    assert upload_action == "Data uploaded with MyData-Python"
+    assert uploaded_paths == [None, [run_dir]]
+    assert os.path.exists(backup_run_dir + 'MYTDComplete.txt')
+    assert not os.path.exists(backup_run_dir + dirs_df['run_id'][0])
+    assert not os.path.exists(run_dir)
+
+
+@pytest.mark.parametrize('upload_parsing', [True, False])
+def test_move_parsing_and_staging_backup(monkeypatch, tmp_path, upload_parsing):
+    parser, run_dir, dirs_df = get_parser(tmp_path)
+    run_id = dirs_df['run_id'][0]
+    context = ParsePipeline(parser, skip_stages=(BACKUP,)).run()
+    upload_run_dir = parser.output_dir + PROJECT + '/' + run_id + '/'
+    assert os.path.exists(upload_run_dir)
+    uploaded_paths = []
+
+    def upload_mydata(paths=None):
+        uploaded_paths.append(paths)
+        return True
+    monkeypatch.setattr(parser, 'upload_mydata', upload_mydata)
+    upload_action, parsing_action, staging_action = parser.complete_upload_backup(
+        context.get_backup_df(), upload_parsing, True, True)
+
+    backup_dir = str(tmp_path / 'Backup') + '/'
+    for backup_run_dir in (backup_dir + 'Upload/' + PROJECT + '/' + run_id + '/',
+                           backup_dir + 'Staging/' + PROJECT + '/' + run_id + '/'):
+        assert os.path.exists(backup_run_dir + 'MYTDComplete.txt')
+        assert not os.path.exists(backup_run_dir + run_id)
+    assert glob.glob(backup_dir + 'Upload/' + PROJECT + '/' + run_id + '/Fastq_*/Fastq_filelist.csv')
+    assert os.path.exists(backup_dir + 'Staging/' + PROJECT + '/' + run_id + '/RunInfo.xml')
+    assert not os.path.exists(upload_run_dir)
+    assert not os.path.exists(run_dir)
+    if upload_parsing:
+        assert uploaded_paths == [None, [upload_run_dir], [run_dir]]
+    else:
+        assert uploaded_paths == []
@@ -0,0 +1,101 @@
+"""
+test_mytardis_api.py
+MyTardisClient paging, conditional requests and the dataset filter file, against a requests-mock MyTardis
+Created By: mkimble
+"""
+
+import re
+import pytest
+from mytd_parser.mytardis_api import MyTardisClient, DatasetFilter
+
+API_URL = 'http://mytardis.test/api/v1/'
+DATASETS = [{'id': dataset_id, 'description': '2101' + str(dataset_id).zfill(2) + '_M05543_0033',
+             'experiments': ['/api/v1/experiment/1/']} for dataset_id in range(1, 6)]
+
+
+def get_listing(objects, with_total_count=True):
+    """
+     requests-mock callback serving objects as a tastypie listing, paged by the limit/offset params
+    """
+    def listing(request, context):
+        limit = int(request.qs['limit'][0])
+        offset = int(request.qs['offset'][0])
+        meta = {'limit': limit, 'offset': offset, 'next': None}
+        if offset + limit < len(objects):
+            meta['next'] = '/api/v1/dataset/?experiments__id=1&format=json&limit=' + str(limit) + '&offset=' + \
+                           str(offset + limit)
+        if with_total_count:
+            meta['total_count'] = len(objects)
+        return {'meta': meta, 'objects': objects[offset:offset + limit]}
+    return listing
+
+
+def get_client(tmp_path, page_size=2):
+    return MyTardisClient(API_URL, 'user', 'password', page_size=page_size, max_workers=2,
+                          cache_dir=str(tmp_path / 'cache'))
+
+
+@pytest.mark.parametrize('with_total_count', [True, False])
+def test_get_objects_pages(requests_mock, tmp_path, with_total_count):
+    requests_mock.get(re.compile(API_URL + 'dataset/'), json=get_listing(DATASETS, with_total_count))
+    objects, status_code = get_client(tmp_path).get_objects('dataset', {'experiments__id': 1})
+    assert status_code == 200
+    assert objects == DATASETS
+    assert requests_mock.call_count == 3
+    assert sorted(int(request.qs['offset'][0]) for request in requests_mock.request_history) == [0, 2, 4]
+
+
+def test_get_objects_fields(requests_mock, tmp_path):
+    requests_mock.get(re.compile(API_URL + 'dataset/'), json=get_listing(DATASETS))
+    objects, status_code = get_client(tmp_path).get_objects('dataset', {'experiments__id': 1},
+                                                            fields=['id', 'description'])
+    assert objects == [{'id': dataset['id'], 'description': dataset['description']} for dataset in DATASETS]
+
+
+@pytest.mark.parametrize('with_total_count', [True, False])
+def test_get_objects_failed_page(requests_mock, tmp_path, with_total_count):
+    listing = get_listing(DATASETS, with_total_count)
+
+    def failing_listing(request, context):
+        if request.qs['offset'] == ['2']:
+            context.status_code = 500
+            return {'error_message': 'server error'}
+        return listing(request, context)
+    requests_mock.get(re.compile(API_URL + 'dataset/'), json=failing_listing)
+    assert get_client(tmp_path).get_objects('dataset', {'experiments__id': 1}) == (False, 500)
+
+
+def test_get_objects_first_page_failed(requests_mock, tmp_path):
+    requests_mock.get(re.compile(API_URL + 'dataset/'), status_code=401)
+    assert get_client(tmp_path).get_objects('dataset', {'experiments__id': 1}) == (False, 401)
+
+
+def test_get_json_not_modified(requests_mock, tmp_path):
+    client = get_client(tmp_path)
+    uri = client.get_uri('dataset', {'experiments__id': 1, 'format': 'json'})
+    requests_mock.get(uri, json={'meta': {}, 'objects': DATASETS}, headers={'ETag': '"v1"'})
+    assert client.get_json(uri) == ({'meta': {}, 'objects': DATASETS}, 200)
+
+    requests_mock.get(uri, status_code=304)
+    assert client.get_json(uri) == ({'meta': {}, 'objects': DATASETS}, 304)
+    assert requests_mock.last_request.headers['If-None-Match'] == '"v1"'
+
+
+def test_get_json_without_cache(requests_mock, tmp_path):
+    client = MyTardisClient(API_URL, None, None, cache_dir=None)
+    uri = client.get_uri('dataset', {'format': 'json'})
+    requests_mock.get(uri, json={'meta': {}, 'objects': DATASETS}, headers={'ETag': '"v1"'})
+    client.get_json(uri)
+    client.get_json(uri)
+    assert 'If-None-Match' not in requests_mock.last_request.headers
+    assert not (tmp_path / 'cache').exists()
+
+
+def test_write_filter_file(requests_mock, tmp_path):
+    requests_mock.get(re.compile(API_URL + 'dataset/'), json=get_listing(DATASETS))
+    dataset_filter = DatasetFilter('dataset', {'experiments__id': 1}, 'filter-datasets',
+                                   rclone_filter_file_dir=str(tmp_path) + '/', mytardis_api_url=API_URL,
+                                   mytardis_api_user='user', mytardis_api_password='password')
+    dataset_filter.write_filter_file()
+    filter_lines = (tmp_path / 'filter-datasets.txt').read_text().splitlines()
+    assert filter_lines == ['+ ' + dataset['description'] + '*/**' for dataset in DATASETS] + ['- **']
@@ -0,0 +1,73 @@
+"""
+test_parse_seq_run.py
+sample id, primer pair and Illumina fields parsed from fastq filenames
+Created By: mkimble
+"""
+
+import pandas as pd
+import pytest
+from mytd_parser.parse_seq_run import get_sampleid_primerpair_name, parse_fastq_name, get_fastq_name_fields, \
+    FASTQ_NAME_COLUMNS
+
+# (fastq filename, (sample_id, primer_pair, sampleid_primerpair, sample_number, lane, read))
+FASTQ_NAMES = [
+    ('eSG-L01-19w-0001-MiFishU_S1_L001_R1_001.fastq.gz',
+     ('eSG_L01_19w_0001', 'MiFishU', 'eSG_L01_19w_0001-MiFishU', 1, 1, 'R1')),
+    # lanes merged
+    ('eSG-L01-19w-0002-riaz_S12_R2_001.fastq.gz',
+     ('eSG_L01_19w_0002', 'riaz', 'eSG_L01_19w_0002-riaz', 12, None, 'R2')),
+    # no primer pair, index read
+    ('eSG-L01-19w-0003_S3_L002_I1_001.fastq.gz',
+     ('eSG_L01_19w_0003', '', 'eSG_L01_19w_0003', 3, 2, 'I1')),
+    ('Undetermined_S0_L001_R1_001.fastq.gz',
+     ('Undetermined', '', 'Undetermined', 0, 1, 'R1')),
+    # not Illumina names: the sample id is kept as is, the Illumina fields are None
+    ('SampleNotFollowingConvention_R1.fastq.gz',
+     ('SampleNotFollowingConvention', '', 'SampleNotFollowingConvention', None, None, None)),
+    ('eSG-L01-19w-0001-MiFishU_S1_L001_R1_001.fastq',
+     ('eSG_L01_19w_0001', 'MiFishU', 'eSG_L01_19w_0001-MiFishU', None, None, None)),
+    ('Fastq_filelist.csv',
+     ('Fastq', '', 'Fastq', None, None, None)),
+]
+
+
+@pytest.mark.parametrize('sample_id, expected', [
+    ('eSG-L01-19w-0001-MiFishU', ('eSG_L01_19w_0001', 'MiFishU', 'eSG_L01_19w_0001-MiFishU')),
+    ('eSG-L01-19w-0001', ('eSG_L01_19w_0001', '', 'eSG_L01_19w_0001')),
+    # 14 characters or fewer are never converted
+    ('eSG-L01-19w-01', ('eSG-L01-19w-01', '', 'eSG-L01-19w-01')),
+    ('NotAMaineEdnaSampleId', ('NotAMaineEdnaSampleId', '', 'NotAMaineEdnaSampleId')),
+])
+def test_get_sampleid_primerpair_name(sample_id, expected):
+    assert get_sampleid_primerpair_name(sample_id) == expected
+
+
+def test_get_sampleid_primerpair_name_is_memoized():
+    get_sampleid_primerpair_name.cache_clear()
+    # R1 and R2 of one sample
+    parse_fastq_name('eSG-L01-19w-0004-riaz_S4_L001_R1_001.fastq.gz')
+    parse_fastq_name('eSG-L01-19w-0004-riaz_S4_L001_R2_001.fastq.gz')
+    cache_info = get_sampleid_primerpair_name.cache_info()
+    assert (cache_info.hits, cache_info.misses) == (1, 1)
+
+
+@pytest.mark.parametrize('fastq_name, expected', FASTQ_NAMES)
+def test_parse_fastq_name(fastq_name, expected):
+    assert parse_fastq_name(fastq_name) == expected
+
+
+def test_get_fastq_name_fields():
+    fastq_files_list = ['/Staging/maine-edna/run/Alignment_1/20201224_215858/Fastq/' + fastq_name
+                        for fastq_name, expected in FASTQ_NAMES]
+    fastq_name_df = get_fastq_name_fields(fastq_files_list)
+    assert list(fastq_name_df.columns) == FASTQ_NAME_COLUMNS
+    assert str(fastq_name_df['sample_number'].dtype) == 'Int64'
+    assert str(fastq_name_df['lane'].dtype) == 'Int64'
+    for row, (fastq_name, expected) in zip(fastq_name_df.itertuples(index=False), FASTQ_NAMES):
+        assert tuple(None if pd.isna(value) else value for value in row) == expected
+
+
+def test_get_fastq_name_fields_empty():
+    fastq_name_df = get_fastq_name_fields([])
+    assert fastq_name_df.empty
+    assert list(fastq_name_df.columns) == FASTQ_NAME_COLUMNS
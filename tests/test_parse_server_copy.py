@@ -0,0 +1,102 @@
+"""
+test_parse_server_copy.py
+check_upload_complete against Fastq_filelist.csv manifests and synced fastq dirs, and ServerParse.get_dirs on
+scan cache hits
+Created By: mkimble
+"""
+
+import glob
+import pandas as pd
+import pytest
+from mytd_parser.parse_server_copy import check_upload_complete, ServerParse
+from mytd_parser.parse_seq_run import MiSeqParser
+from mytd_parser.pipeline import ParsePipeline, VALIDATE, BACKUP
+from mytd_parser.synthetic import make_miseq_run
+
+FASTQ_DIR_NAME = 'Fastq_20201224_205858'
+# {file name: size} in the manifest
+MANIFEST_FILES = {'eSG-L01-19w-0001-MiFishU_S1_L001_R1_001.fastq.gz': 100,
+                  'eSG-L01-19w-0001-MiFishU_S1_L001_R2_001.fastq.gz': 200,
+                  'eSG-L01-19w-0002-riaz_S2_L001_R1_001.fastq.gz': 300}
+
+
+def write_run(run_dir, synced_files, with_size=True):
+    """
+     run_dir/Fastq_*/ with a manifest of MANIFEST_FILES and synced_files {file name: size} written into it.
+     Returns the manifest path
+    """
+    fastq_dir = run_dir / FASTQ_DIR_NAME
+    fastq_dir.mkdir(parents=True)
+    manifest = {'fastq_path': [FASTQ_DIR_NAME + '/' + file_name for file_name in MANIFEST_FILES]}
+    if with_size:
+        manifest['size'] = list(MANIFEST_FILES.values())
+    manifest_path = fastq_dir / 'Fastq_filelist.csv'
+    pd.DataFrame(manifest).to_csv(manifest_path, index=False)
+    for file_name, size in synced_files.items():
+        (fastq_dir / file_name).write_bytes(b'\0' * size)
+    return str(manifest_path)
+
+
+def get_run_dir(tmp_path):
+    run_dir = tmp_path / 'maine-edna' / '201224_M05543_0033_000000000-JCFTD'
+    return run_dir, str(run_dir).replace('\\', '/') + '/'
+
+
+@pytest.mark.parametrize('synced_files, expected', [
+    (dict(MANIFEST_FILES), True),
+    # rclone hasn't synced the last file yet
+    ({file_name: size for file_name, size in list(MANIFEST_FILES.items())[:2]}, False),
+    # a file still being synced is smaller than in the manifest
+    (dict(MANIFEST_FILES, **{'eSG-L01-19w-0002-riaz_S2_L001_R1_001.fastq.gz': 150}), False),
+    # files that aren't in the manifest don't hold up the move
+    (dict(MANIFEST_FILES, **{'Undetermined_S0_L001_R1_001.fastq.gz': 10, 'AdapterTrimming.txt': 5}), True),
+], ids=['complete', 'missing', 'size_mismatch', 'extra_files'])
+def test_check_upload_complete(tmp_path, synced_files, expected):
+    run_dir, run_dir_path = get_run_dir(tmp_path)
+    manifest_path = write_run(run_dir, synced_files)
+    assert check_upload_complete(manifest_path, run_dir_path) is expected
+
+
+def test_check_upload_complete_without_size_column(tmp_path):
+    # manifests written before the size column only need the files to exist
+    run_dir, run_dir_path = get_run_dir(tmp_path)
+    synced_files = {file_name: 1 for file_name in MANIFEST_FILES}
+    manifest_path = write_run(run_dir, synced_files, with_size=False)
+    assert check_upload_complete(manifest_path, run_dir_path) is True
+
+
+def test_check_upload_complete_nothing_synced(tmp_path):
+    run_dir, run_dir_path = get_run_dir(tmp_path)
+    manifest_path = write_run(run_dir, {})
+    assert check_upload_complete(manifest_path, run_dir_path) is False
+
+
+def test_cached_rows_are_refreshed(tmp_path):
+    # a run parsed into Upload, as synced to the server's download dir
+    run_dir = make_miseq_run(str(tmp_path / 'Staging'), 'maine-edna', 33, num_fastq_files=2, fastq_size=16,
+                             num_thumbnails=2)
+    parser = MiSeqParser('maine-edna', run_dir, 1, False, staging_dir=str(tmp_path / 'Staging') + '/',
+                         output_dir=str(tmp_path / 'Upload') + '/', backup_dir=str(tmp_path / 'Backup') + '/',
+                         extra_backup_dirs=[], log_file_dir=str(tmp_path / 'logs') + '/')
+    ParsePipeline(parser, skip_stages=(VALIDATE, BACKUP)).run()
+    manifest_path = glob.glob(str(tmp_path / 'Upload' / '*' / '*' / '*' / 'Fastq_filelist.csv'))[0]
+    manifest_df = pd.read_csv(manifest_path)
+    # the manifest expects a bigger file than the one synced so far
+    manifest_df.loc[0, 'size'] += 1
+    manifest_df.to_csv(manifest_path, index=False)
+
+    server_parse = ServerParse(download_dir=str(tmp_path / 'Upload') + '/', log_file_dir=str(tmp_path / 'logs') + '/')
+    dirs_df = server_parse.get_dirs(complete_upload=False)
+    assert dirs_df['upload_complete'].tolist() == [False]
+    server_parse.scan_cache.entries[dirs_df['run_dir'][0]]['dirs_df']['server_parse_date'] = '2021-01-01 00:00:00'
+    server_parse.scan_cache.save()
+
+    # the manifest is rewritten in place; the run's fingerprint doesn't change
+    manifest_df.loc[0, 'size'] -= 1
+    manifest_df.to_csv(manifest_path, index=False)
+    server_parse = ServerParse(download_dir=str(tmp_path / 'Upload') + '/', log_file_dir=str(tmp_path / 'logs') + '/')
+    dirs_df = server_parse.get_dirs(complete_upload=True)
+    assert server_parse.scan_cache.num_hits == 1
+    assert len(dirs_df) == 1
+    assert dirs_df['upload_complete'].tolist() == [True]
+    assert dirs_df['server_parse_date'].tolist() != ['2021-01-01 00:00:00']
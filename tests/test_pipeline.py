@@ -0,0 +1,211 @@
+"""
+test_pipeline.py
+ParsePipeline stages on synthetic runs; only runs that pass validate are backed up, and parse_seq_dirs with a
+process pool parses a synthetic tree the same as one run after another
+Created By: mkimble
+"""
+
+import os
+import errno
+import glob
+import hashlib
+import logging
+import functools
+import multiprocessing
+import pandas as pd
+import pytest
+from mytd_parser import gsheets, copy_engine, settings
+from mytd_parser import parse_seq_run as parse_seq_run_module
+from mytd_parser.bench import StubWorksheet, StubGsheetClient
+from mytd_parser.pipeline import ParsePipeline, VALIDATE, BACKUP
+from mytd_parser.parse_seq_run import MiSeqParser
+from mytd_parser.logger_settings import api_logger
+from mytd_parser.metrics import get_metrics
+from mytd_parser.scan_cache import ScanCache
+from mytd_parser.synthetic import make_miseq_run, make_staging_tree
+
+PROJECT = 'maine-edna'
+NUM_FASTQ_FILES = 4
+
+
+@pytest.fixture
+def stub_gsheet(monkeypatch):
+    """
+     set_rows(rows) puts a stub worksheet of rows behind the process-wide gsheet client
+    """
+    def set_rows(rows):
+        gsheets.clear_gsheet_snapshots()
+        monkeypatch.setattr(gsheets, 'gsheet_client', StubGsheetClient(StubWorksheet(rows)))
+    yield set_rows
+    gsheets.clear_gsheet_snapshots()
+
+
+def get_parser(tmp_path, run_dir, check_gdrive=True):
+    return MiSeqParser(PROJECT, run_dir, 1, check_gdrive, staging_dir=str(tmp_path / 'Staging') + '/',
+                       output_dir=str(tmp_path / 'Upload') + '/', backup_dir=str(tmp_path / 'Backup') + '/',
+                       extra_backup_dirs=[], log_file_dir=str(tmp_path / 'logs') + '/')
+
+
+@pytest.mark.parametrize('num_fastq_gsheets, is_moved', [
+    (NUM_FASTQ_FILES, True),
+    # the gsheet doesn't list every fastq file yet: validate fails
+    (NUM_FASTQ_FILES + 1, False),
+])
+def test_backup_only_validated_runs(tmp_path, stub_gsheet, num_fastq_gsheets, is_moved):
+    run_dir = make_miseq_run(str(tmp_path / 'Staging'), PROJECT, 33, num_fastq_files=NUM_FASTQ_FILES,
+                             fastq_size=16, num_thumbnails=2)
+    run_id = os.path.basename(run_dir.rstrip('/'))
+    stub_gsheet([[run_id, str(num_fastq_gsheets), '']])
+    context = ParsePipeline(get_parser(tmp_path, run_dir), move_staging=True).run()
+
+    assert len(context.run_records) == 1
+    assert len(context.valid_records) == int(is_moved)
+    backup_run_dir = str(tmp_path / 'Backup' / 'Staging' / PROJECT / run_id) + '/'
+    assert os.path.exists(backup_run_dir + 'RunInfo.xml') is is_moved
+    assert os.path.exists(run_dir + 'RunInfo.xml') is not is_moved
+    if not is_moved:
+        assert context.actions is None
+        assert not os.path.exists(run_dir + 'MYTDComplete.txt')
+
+
+def test_backup_without_validate(tmp_path):
+    run_dir = make_miseq_run(str(tmp_path / 'Staging'), PROJECT, 33, num_fastq_files=NUM_FASTQ_FILES,
+                             fastq_size=16, num_thumbnails=2)
+    # with validate skipped, every discovered fastq dir is backed up
+    context = ParsePipeline(get_parser(tmp_path, run_dir, check_gdrive=False), skip_stages=(VALIDATE, BACKUP)).run()
+    assert context.valid_records is None
+    assert context.get_backup_df()['run_id'].tolist() == [os.path.basename(run_dir.rstrip('/'))]
+    assert list(context.get_backup_df().columns) == list(context.dirs_df.columns)
+
+
+def test_manifest_checksums(tmp_path):
+    run_dir = make_miseq_run(str(tmp_path / 'Staging'), PROJECT, 33, num_fastq_files=NUM_FASTQ_FILES,
+                             fastq_size=16, num_thumbnails=2)
+    for fastq_path in glob.glob(run_dir + 'Alignment_1/*/Fastq/*.fastq.gz'):
+        with open(fastq_path, 'wb') as fastq_file:
+            fastq_file.write(os.urandom(4096))
+    parser = get_parser(tmp_path, run_dir, check_gdrive=False)
+    ParsePipeline(parser, skip_stages=(BACKUP,)).run()
+    upload_run_dir = parser.output_dir + PROJECT + '/' + os.path.basename(run_dir.rstrip('/')) + '/'
+    manifest_paths = glob.glob(upload_run_dir + 'Fastq_*/Fastq_filelist.csv')
+    assert len(manifest_paths) == 1
+    manifest_df = pd.read_csv(manifest_paths[0])
+    assert len(manifest_df) == NUM_FASTQ_FILES
+    for fastq_path, md5 in zip(manifest_df['fastq_path'], manifest_df['md5']):
+        with open(upload_run_dir + fastq_path, 'rb') as fastq_file:
+            assert md5 == hashlib.md5(fastq_file.read()).hexdigest()
+
+
+def test_copy_error_fails_fastq_dir(tmp_path, monkeypatch):
+    run_dir = make_miseq_run(str(tmp_path / 'Staging'), PROJECT, 33, num_fastq_files=NUM_FASTQ_FILES,
+                             fastq_size=16, num_thumbnails=2)
+    copy_file = copy_engine.copy_file
+    failed_fastq_filenames = []
+
+    def failing_copy_file(input_file, output_file, *args):
+        if not failed_fastq_filenames:
+            failed_fastq_filenames.append(os.path.basename(input_file))
+            raise OSError(errno.EIO, 'Input/output error')
+        return copy_file(input_file, output_file, *args)
+    monkeypatch.setattr(copy_engine, 'copy_file', failing_copy_file)
+
+    with pytest.raises(RuntimeError, match='1 of ' + str(NUM_FASTQ_FILES) + ' fastq files failed to copy'):
+        ParsePipeline(get_parser(tmp_path, run_dir, check_gdrive=False), skip_stages=(VALIDATE, BACKUP)).run()
+    upload_fastq_filenames = [os.path.basename(fastq_path) for fastq_path in
+                              glob.glob(str(tmp_path / 'Upload' / '**' / '*.fastq.gz'), recursive=True)]
+    # the other fastq files are copied, but the fastq dir is not written up as parsed
+    assert len(upload_fastq_filenames) == NUM_FASTQ_FILES - 1
+    assert failed_fastq_filenames[0] not in upload_fastq_filenames
+    assert not glob.glob(str(tmp_path / 'Upload' / '**' / 'Fastq_filelist.csv'), recursive=True)
+
+
+class RecordingHandler(logging.Handler):
+    """
+     keeps every record it handles
+    """
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def parse_staging_tree(tmp_path, monkeypatch, jobs):
+    """
+     parse_seq_dirs of a synthetic tree (3 MiSeq and 1 generic run) under tmp_path/jobs_<jobs>/. Returns the
+     root dir, the metrics counters and the api_logger records written in this process
+    """
+    root_dir = tmp_path / ('jobs_' + str(jobs))
+    staging_dir = str(root_dir / 'Staging') + '/'
+    log_file_dir = str(root_dir / 'logs') + '/'
+    make_staging_tree(staging_dir, 3, 1, project=PROJECT, num_fastq_files=NUM_FASTQ_FILES, fastq_size=16,
+                      num_thumbnails=2)
+    monkeypatch.setattr(settings, 'MISEQ_STAGING_DIR', staging_dir)
+    monkeypatch.setattr(settings, 'LOG_FILE_DIR', log_file_dir)
+    monkeypatch.setattr(parse_seq_run_module, 'write_metrics', lambda job_name: None)
+    get_parser_class = parse_seq_run_module.get_parser_class
+
+    def get_tmp_parser_class(run_dir):
+        # the process pool is forked, so the workers' parsers write under root_dir too
+        return functools.partial(get_parser_class(run_dir), staging_dir=staging_dir,
+                                 output_dir=str(root_dir / 'Upload') + '/',
+                                 backup_dir=str(root_dir / 'Backup') + '/', extra_backup_dirs=[],
+                                 log_file_dir=log_file_dir)
+    monkeypatch.setattr(parse_seq_run_module, 'get_parser_class', get_tmp_parser_class)
+    recording_handler = RecordingHandler()
+    api_logger.addHandler(recording_handler)
+    try:
+        parse_seq_run_module.parse_seq_dirs(check_gdrive=False, jobs=jobs, profile=False)
+    finally:
+        api_logger.removeHandler(recording_handler)
+    return root_dir, get_metrics().to_dict()['counters'], recording_handler.records
+
+
+def get_upload_files(root_dir):
+    """
+     {path relative to Upload: contents} of the fastq files, and the fastq_path, size and md5 of each manifest
+    """
+    upload_dir = str(root_dir / 'Upload') + '/'
+    upload_files = {}
+    for upload_path in sorted(glob.glob(upload_dir + '**/*', recursive=True)):
+        if upload_path.endswith('Fastq_filelist.csv'):
+            manifest_df = pd.read_csv(upload_path).sort_values('fastq_path')
+            upload_files[upload_path[len(upload_dir):]] = manifest_df[['fastq_path', 'size', 'md5']].values.tolist()
+        elif upload_path.endswith('.fastq.gz'):
+            upload_files[upload_path[len(upload_dir):]] = os.path.getsize(upload_path)
+    return upload_files
+
+
+def get_run_ids(records, message_start):
+    return sorted(record.getMessage().split(', ')[1] for record in records
+                  if record.getMessage().startswith(message_start))
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason='the monkeypatched parser dirs only reach forked workers')
+def test_jobs_match_one_job(tmp_path, monkeypatch):
+    one_job_dir, one_job_counters, one_job_records = parse_staging_tree(tmp_path, monkeypatch, 1)
+    two_jobs_dir, two_jobs_counters, two_jobs_records = parse_staging_tree(tmp_path, monkeypatch, 2)
+
+    one_job_files = get_upload_files(one_job_dir)
+    assert sum(upload_path.endswith('Fastq_filelist.csv') for upload_path in one_job_files) == 4
+    assert get_upload_files(two_jobs_dir) == one_job_files
+    # each worker only returns the metrics of its own runs, so merged they count every run once
+    assert ['runs_total', [('state', 'parsed')], 4] in one_job_counters
+    assert two_jobs_counters == one_job_counters
+    # and the scan cache saved by the parent holds every run parsed in a worker
+    one_job_cache = ScanCache(str(one_job_dir / 'logs' / settings.SEQ_SCAN_CACHE_FILENAME))
+    two_jobs_cache = ScanCache(str(two_jobs_dir / 'logs' / settings.SEQ_SCAN_CACHE_FILENAME))
+    assert [os.path.basename(run_dir.rstrip('/')) for run_dir in sorted(two_jobs_cache.entries)] == [
+        os.path.basename(run_dir.rstrip('/')) for run_dir in sorted(one_job_cache.entries)]
+
+    # the workers' records are written by this process's handlers
+    run_ids = get_run_ids(one_job_records, 'copy_run_metadata: ')
+    assert len(run_ids) == 4
+    assert get_run_ids(two_jobs_records, 'copy_run_metadata: ') == run_ids
+    assert {record.process for record in one_job_records} == {os.getpid()}
+    worker_pids = {record.process for record in two_jobs_records
+                   if record.getMessage().startswith('copy_run_metadata: ')}
+    assert os.getpid() not in worker_pids
+    assert 1 <= len(worker_pids) <= 2
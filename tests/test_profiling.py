@@ -0,0 +1,88 @@
+"""
+test_profiling.py
+profiling and profile_stage write a .pstats (and reports) per run and stage, and leave tracemalloc as they found it
+Created By: mkimble
+"""
+
+import os
+import glob
+import pstats
+import pytest
+import tracemalloc
+from mytd_parser.profiling import profiling, profile_stage, get_profiler
+
+RUN_ID = '210126_M05543_0033_000000000-00033'
+
+
+def parse_fastq_names():
+    # something for cProfile and tracemalloc to see
+    return sorted('E' + str(number) + '_R1.fastq.gz' for number in range(2000))
+
+
+def get_report_names(profile_dir, run_id):
+    return sorted(os.path.basename(report_path)
+                  for report_path in glob.glob(os.path.join(profile_dir, run_id, '*')))
+
+
+@pytest.fixture
+def restore_tracemalloc():
+    was_tracing = tracemalloc.is_tracing()
+    yield
+    if tracemalloc.is_tracing() and not was_tracing:
+        tracemalloc.stop()
+
+
+def test_pstats_per_run(tmp_path):
+    profile_dir = str(tmp_path / 'profiles')
+    with profiling('parse_seq_dirs', enabled=True, use_tracemalloc=False, profile_dir=profile_dir):
+        start_time = get_profiler().start_time
+        for number in range(2):
+            with profile_stage('copy_fastq', RUN_ID):
+                parse_fastq_names()
+                # a stage inside a profiled stage is part of it, not profiled on its own
+                with profile_stage('manifest', RUN_ID):
+                    parse_fastq_names()
+        # stages that cover every run go under the job name
+        with profile_stage('server_move'):
+            parse_fastq_names()
+    assert get_profiler() is None
+    assert get_report_names(profile_dir, RUN_ID) == [
+        'copy_fastq_' + start_time + '.pstats', 'copy_fastq_' + start_time + '.txt',
+        'copy_fastq_' + start_time + '_2.pstats', 'copy_fastq_' + start_time + '_2.txt']
+    assert get_report_names(profile_dir, 'parse_seq_dirs') == ['server_move_' + start_time + '.pstats',
+                                                               'server_move_' + start_time + '.txt']
+    stats = pstats.Stats(os.path.join(profile_dir, RUN_ID, 'copy_fastq_' + start_time + '.pstats'))
+    assert any(function_name == 'parse_fastq_names' for file_name, line, function_name in stats.stats)
+    with open(os.path.join(profile_dir, RUN_ID, 'copy_fastq_' + start_time + '.txt')) as report_file:
+        assert report_file.readline().startswith('parse_seq_dirs ' + RUN_ID + ' copy_fastq: ')
+
+
+def test_not_profiled(tmp_path):
+    profile_dir = str(tmp_path / 'profiles')
+    with profiling('parse_seq_dirs', enabled=False, profile_dir=profile_dir):
+        assert get_profiler() is None
+        with profile_stage('copy_fastq', RUN_ID):
+            parse_fastq_names()
+    assert not os.path.exists(profile_dir)
+
+
+@pytest.mark.parametrize('was_tracing', [False, True])
+def test_tracemalloc_state_is_restored(tmp_path, restore_tracemalloc, was_tracing):
+    if was_tracing:
+        tracemalloc.start()
+    profile_dir = str(tmp_path / 'profiles')
+    with pytest.raises(ValueError):
+        with profiling('parse_seq_dirs', enabled=True, use_tracemalloc=True, profile_dir=profile_dir):
+            start_time = get_profiler().start_time
+            with profile_stage('copy_fastq', RUN_ID):
+                assert tracemalloc.is_tracing()
+                parse_fastq_names()
+                # a failing stage still writes its reports
+                raise ValueError('copy failed')
+    assert tracemalloc.is_tracing() is was_tracing
+    assert get_profiler() is None
+    assert get_report_names(profile_dir, RUN_ID) == [
+        'copy_fastq_' + start_time + '.pstats', 'copy_fastq_' + start_time + '.txt',
+        'copy_fastq_' + start_time + '_alloc.txt']
+    with open(os.path.join(profile_dir, RUN_ID, 'copy_fastq_' + start_time + '_alloc.txt')) as alloc_file:
+        assert 'peak' in alloc_file.readline()
@@ -0,0 +1,126 @@
+"""
+test_reconcile.py
+reconcile_uploads of Fastq_filelist.csv manifests against paged dataset and dataset_file listings served by
+requests-mock
+Created By: mkimble
+"""
+
+import re
+import pandas as pd
+import pytest
+from mytd_parser.mytardis_api import MyTardisClient
+from mytd_parser.reconcile import reconcile_uploads, STATUS_MISSING_DATASET, STATUS_MISSING, \
+    STATUS_SIZE_MISMATCH, STATUS_MD5_MISMATCH
+
+API_URL = 'http://mytardis.test/api/v1/'
+PROJECT = 'maine-edna'
+UPLOADED_RUN_ID = '201224_M05543_0033_000000000-JCFTD'
+MISSING_RUN_ID = '210107_M05543_0034_000000000-JCFTF'
+FASTQ_DIR_NAME = 'Fastq_20201224_215858'
+# {run_id: [(filename, size, md5)]} in the manifests
+MANIFEST_FILES = {
+    UPLOADED_RUN_ID: [('eSG-L01-19w-0001-MiFishU_S1_L001_R1_001.fastq.gz', 100, 'a' * 32),
+                      ('eSG-L01-19w-0001-MiFishU_S1_L001_R2_001.fastq.gz', 200, 'b' * 32),
+                      ('eSG-L01-19w-0002-riaz_S2_L001_R1_001.fastq.gz', 300, 'c' * 32),
+                      ('eSG-L01-19w-0002-riaz_S2_L001_R2_001.fastq.gz', 400, 'd' * 32),
+                      ('eSG-L01-19w-0003-riaz_S3_L001_R1_001.fastq.gz', 500, 'e' * 32)],
+    MISSING_RUN_ID: [('eSG-L01-19w-0004-riaz_S1_L001_R1_001.fastq.gz', 600, 'f' * 32)],
+}
+# the uploaded run was uploaded twice; the newest dataset (3) is the one compared
+DATASETS = [{'id': 1, 'description': '201201_M05543_0030_000000000-JCFTA'},
+            {'id': 2, 'description': UPLOADED_RUN_ID},
+            {'id': 3, 'description': UPLOADED_RUN_ID}]
+# (dataset id, filename, size, md5sum); R1 of sample 0001 matches, R2 of 0001 is missing
+DATAFILES = [(2, 'eSG-L01-19w-0001-MiFishU_S1_L001_R2_001.fastq.gz', 200, 'b' * 32),
+             (3, 'eSG-L01-19w-0001-MiFishU_S1_L001_R1_001.fastq.gz', 100, 'a' * 32),
+             (3, 'eSG-L01-19w-0002-riaz_S2_L001_R1_001.fastq.gz', 301, 'c' * 32),
+             (3, 'eSG-L01-19w-0002-riaz_S2_L001_R2_001.fastq.gz', 400, '0' * 32),
+             # no md5 in MyTardis yet, only the size is compared
+             (3, 'eSG-L01-19w-0003-riaz_S3_L001_R1_001.fastq.gz', 500, None),
+             (1, 'eSG-L01-19w-0001-MiFishU_S1_L001_R1_001.fastq.gz', 100, 'a' * 32)]
+EXPECTED_STATUSES = {
+    (UPLOADED_RUN_ID, 'eSG-L01-19w-0001-MiFishU_S1_L001_R2_001.fastq.gz'): STATUS_MISSING,
+    (UPLOADED_RUN_ID, 'eSG-L01-19w-0002-riaz_S2_L001_R1_001.fastq.gz'): STATUS_SIZE_MISMATCH,
+    (UPLOADED_RUN_ID, 'eSG-L01-19w-0002-riaz_S2_L001_R2_001.fastq.gz'): STATUS_MD5_MISMATCH,
+    (MISSING_RUN_ID, 'eSG-L01-19w-0004-riaz_S1_L001_R1_001.fastq.gz'): STATUS_MISSING_DATASET,
+}
+
+
+def write_manifests(upload_dir):
+    for run_id, manifest_files in MANIFEST_FILES.items():
+        fastq_dir = upload_dir / PROJECT / run_id / FASTQ_DIR_NAME
+        fastq_dir.mkdir(parents=True)
+        pd.DataFrame({'fastq_path': [FASTQ_DIR_NAME + '/' + file_name for file_name, size, md5 in manifest_files],
+                      'size': [size for file_name, size, md5 in manifest_files],
+                      'md5': [md5 for file_name, size, md5 in manifest_files]}).to_csv(
+            fastq_dir / 'Fastq_filelist.csv', index=False)
+
+
+def get_listing(get_objects):
+    """
+     requests-mock callback serving get_objects(request) as a tastypie listing, paged by limit/offset
+    """
+    def listing(request, context):
+        objects = get_objects(request)
+        limit = int(request.qs['limit'][0])
+        offset = int(request.qs['offset'][0])
+        return {'meta': {'limit': limit, 'offset': offset, 'total_count': len(objects)},
+                'objects': objects[offset:offset + limit]}
+    return listing
+
+
+def get_datafiles(request):
+    dataset_ids = [int(dataset_id) for dataset_id in request.qs['dataset__id__in'][0].split(',')]
+    return [{'dataset': '/api/v1/dataset/' + str(dataset_id) + '/', 'directory': FASTQ_DIR_NAME + '/',
+             'filename': filename, 'size': str(size), 'md5sum': md5sum}
+            for dataset_id, filename, size, md5sum in DATAFILES if dataset_id in dataset_ids]
+
+
+def mock_mytardis(requests_mock, datafile_status_code=200):
+    requests_mock.get(re.compile(API_URL + 'dataset/'), json=get_listing(lambda request: DATASETS))
+    if datafile_status_code == 200:
+        requests_mock.get(re.compile(API_URL + 'dataset_file/'), json=get_listing(get_datafiles))
+    else:
+        requests_mock.get(re.compile(API_URL + 'dataset_file/'), status_code=datafile_status_code)
+
+
+def get_client():
+    return MyTardisClient(API_URL, 'user', 'password', page_size=2, max_workers=2, cache_dir=None)
+
+
+def test_reconcile_uploads(requests_mock, tmp_path):
+    write_manifests(tmp_path / 'Upload')
+    mock_mytardis(requests_mock)
+    output_csv = str(tmp_path / 'missing.csv')
+    reconcile_df = reconcile_uploads(output_csv, manifest_dirs=[str(tmp_path / 'Upload')], client=get_client(),
+                                     dataset_params={'experiments__id': 1})
+    statuses = {(row.run_id, row.fastq_path.split('/', 1)[1]): row.status for row in reconcile_df.itertuples()}
+    assert statuses == EXPECTED_STATUSES
+    assert set(reconcile_df['project']) == {PROJECT}
+    # both listings were paged
+    dataset_offsets = sorted(int(request.qs['offset'][0]) for request in requests_mock.request_history
+                             if request.path == '/api/v1/dataset/')
+    assert dataset_offsets == [0, 2]
+    assert pd.read_csv(output_csv)['status'].tolist() == reconcile_df['status'].tolist()
+
+
+def test_reconcile_row_values(requests_mock, tmp_path):
+    write_manifests(tmp_path / 'Upload')
+    mock_mytardis(requests_mock)
+    reconcile_df = reconcile_uploads(str(tmp_path / 'missing.csv'), manifest_dirs=[str(tmp_path / 'Upload')],
+                                     client=get_client(), dataset_params={'experiments__id': 1})
+    size_mismatch = reconcile_df[reconcile_df['status'] == STATUS_SIZE_MISMATCH].iloc[0]
+    assert (size_mismatch['size'], size_mismatch['mytardis_size']) == (300, 301)
+    md5_mismatch = reconcile_df[reconcile_df['status'] == STATUS_MD5_MISMATCH].iloc[0]
+    assert (md5_mismatch['md5'], md5_mismatch['mytardis_md5']) == ('d' * 32, '0' * 32)
+    missing_dataset = reconcile_df[reconcile_df['status'] == STATUS_MISSING_DATASET].iloc[0]
+    assert pd.isna(missing_dataset['mytardis_size'])
+
+
+def test_reconcile_datafile_listing_failed(requests_mock, tmp_path):
+    write_manifests(tmp_path / 'Upload')
+    mock_mytardis(requests_mock, datafile_status_code=500)
+    with pytest.raises(RuntimeError, match='dataset_file listing failed'):
+        reconcile_uploads(str(tmp_path / 'missing.csv'), manifest_dirs=[str(tmp_path / 'Upload')],
+                          client=get_client(), dataset_params={'experiments__id': 1})
+    assert not (tmp_path / 'missing.csv').exists()
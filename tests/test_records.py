@@ -0,0 +1,80 @@
+"""
+test_records.py
+records_to_df and df_to_records round trips: column order, bool and missing fields, and FastqRecord checksums
+Created By: mkimble
+"""
+
+import pandas as pd
+from mytd_parser.records import RunRecord, FastqRecord, records_to_df, df_to_records
+
+RUN_DIR = '/Staging/maine-edna/210126_M05543_0033_000000000-00033/'
+CHECKSUM_COLUMNS = ['md5', 'blake2b']
+
+
+def get_fields(record):
+    return {field: getattr(record, field) for field in record.__slots__}
+
+
+def get_run_records():
+    return [RunRecord(run_id='210126_M05543_0033_000000000-00033', project='maine-edna', run_dir=RUN_DIR,
+                      num_run_dir=2, fastq_dir='Fastq_1', num_fastq_files=4, rta_complete=True,
+                      sequencing_complete=True),
+            # a run still sequencing: False and unset (None) bools, no fastq files yet
+            RunRecord(run_id='210127_M05543_0034_000000000-00034', project='maine-edna', run_dir=RUN_DIR,
+                      num_run_dir=2, fastq_dir='Run Failed', rta_complete=False)]
+
+
+def get_fastq_records():
+    return [FastqRecord(sample_id='E1', fastq_path='/Staging/E1_R1.fastq.gz',
+                        upload_fastq_path='Fastq_1/E1_R1.fastq.gz', sample_number=1, lane=1, read='R1', size=100,
+                        mtime_ns=1000,
+                        checksums={'md5': 'md5_1', 'blake2b': 'blake2b_1'}),
+            # not an Illumina name and not copied yet: no sample number, lane, size or checksums
+            FastqRecord(sample_id='E2', fastq_path='/Staging/E2.fastq.gz')]
+
+
+def test_run_records_round_trip():
+    run_records = get_run_records()
+    dirs_df = records_to_df(run_records, RunRecord)
+    assert list(dirs_df.columns) == list(RunRecord.COLUMNS)
+    assert dirs_df['rta_complete'].tolist() == [True, False]
+    round_trip_records = df_to_records(dirs_df, RunRecord)
+    assert [get_fields(record) for record in round_trip_records] == [get_fields(record) for record in run_records]
+
+
+def test_run_records_csv_round_trip(tmp_path):
+    run_records = get_run_records()
+    records_to_df(run_records, RunRecord).to_csv(str(tmp_path / 'seq_dirlist.csv'), index=False)
+    dirs_df = pd.read_csv(str(tmp_path / 'seq_dirlist.csv'))
+    # read back with NaN for the empty cells, e.g., sequencing_complete of the second run
+    assert dirs_df['sequencing_complete'].isna().tolist() == [False, True]
+    round_trip_records = df_to_records(dirs_df, RunRecord)
+    assert [get_fields(record) for record in round_trip_records] == [get_fields(record) for record in run_records]
+    # NaN is not mistaken for a set (truthy) field
+    assert round_trip_records[1].sequencing_complete is None
+    assert round_trip_records[1].num_fastq_files is None
+
+
+def test_fastq_records_round_trip():
+    fastq_records = get_fastq_records()
+    columns = ['fastq_path', 'sample_id', 'size'] + CHECKSUM_COLUMNS + ['sample_number', 'lane', 'read',
+                                                                        'upload_fastq_path', 'mtime_ns']
+    fastq_df = records_to_df(fastq_records, FastqRecord, columns)
+    assert list(fastq_df.columns) == columns
+    assert str(fastq_df['size'].dtype) == 'Int64'
+    assert fastq_df['md5'].tolist() == ['md5_1', None]
+    round_trip_records = df_to_records(fastq_df, FastqRecord)
+    assert [get_fields(record) for record in round_trip_records] == [get_fields(record) for record in fastq_records]
+    assert round_trip_records[0].checksums == {'md5': 'md5_1', 'blake2b': 'blake2b_1'}
+    assert round_trip_records[1].checksums is None
+    assert round_trip_records[1].size is None
+
+
+def test_df_to_records_drops_unknown_columns():
+    dirs_df = records_to_df(get_run_records(), RunRecord)
+    dirs_df['status'] = 'complete'
+    # column order of the df doesn't matter
+    dirs_df = dirs_df[list(reversed(dirs_df.columns))]
+    run_records = df_to_records(dirs_df, RunRecord)
+    assert [get_fields(record) for record in run_records] == [get_fields(record) for record in get_run_records()]
+    assert list(records_to_df(run_records, RunRecord).columns) == list(RunRecord.COLUMNS)
@@ -0,0 +1,124 @@
+"""
+test_run_catalog.py
+RunCatalog upserts, removal of fastq dirs no longer found, the one-time DDL and catalog-export of the csv files
+Created By: mkimble
+"""
+
+import os
+import pandas as pd
+import pytest
+from mytd_parser import run_catalog as run_catalog_module
+from mytd_parser.run_catalog import RunCatalog, STATUS_COMPLETE, STATUS_INCOMPLETE, STATUS_PARSED
+from mytd_parser.records import RunRecord, FastqRecord
+from mytd_parser.parse_seq_run import MiSeqParser
+from mytd_parser.synthetic import make_miseq_run
+
+PROJECT = 'maine-edna'
+RUN_DIR = '/Staging/maine-edna/210126_M05543_0033_000000000-00033/'
+# header of seq_dirlist.csv as MiSeqParser.get_dirs wrote it before the run catalog
+SEQ_DIRLIST_COLUMNS = ['run_id', 'parse_type', 'parse_date', 'project', 'run_date', 'run_completion_time',
+                       'run_dir', 'run_dir_create_date', 'num_run_dir',
+                       'align_subdir', 'align_subdir_create_date', 'num_align_subdir',
+                       'fastq_dir', 'num_fastq_files', 'fastq_dir_create_date',
+                       'rta_complete', 'rta_complete_time', 'sequencing_complete']
+
+
+@pytest.fixture
+def run_catalog(tmp_path):
+    return RunCatalog(str(tmp_path / 'logs' / 'run_catalog.sqlite3'))
+
+
+def get_run_record(fastq_dir, num_fastq_files=4, sequencing_complete=True):
+    return RunRecord(run_id='210126_M05543_0033_000000000-00033', project=PROJECT, run_dir=RUN_DIR,
+                     fastq_dir=fastq_dir, num_fastq_files=num_fastq_files, rta_complete=True,
+                     sequencing_complete=sequencing_complete)
+
+
+def get_statuses(run_catalog):
+    runs_df = run_catalog.get_runs_df('seq_runs')
+    return dict(zip(runs_df['fastq_dir'], runs_df['status']))
+
+
+def test_ddl_once_per_catalog_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_catalog_module, 'created_catalog_filepaths', set())
+    ddl_calls = []
+    execute_ddl = RunCatalog.execute_ddl
+
+    def counting_execute_ddl(self):
+        ddl_calls.append(self.catalog_filepath)
+        execute_ddl(self)
+    monkeypatch.setattr(RunCatalog, 'execute_ddl', counting_execute_ddl)
+    catalog_filepath = str(tmp_path / 'run_catalog.sqlite3')
+    for parser_number in range(3):
+        RunCatalog(catalog_filepath)
+    assert ddl_calls == [catalog_filepath]
+    RunCatalog(str(tmp_path / 'other_catalog.sqlite3'))
+    assert len(ddl_calls) == 2
+    # a deleted catalog gets its tables again
+    os.remove(catalog_filepath)
+    RunCatalog(catalog_filepath).upsert_runs('seq_runs', [get_run_record('Fastq_1')])
+    assert len(ddl_calls) == 3
+
+
+def test_upsert_runs(run_catalog):
+    run_catalog.upsert_runs('seq_runs', [get_run_record('Fastq_1'),
+                                         get_run_record('Fastq_2', sequencing_complete=False)])
+    assert get_statuses(run_catalog) == {'Fastq_1': STATUS_COMPLETE, 'Fastq_2': STATUS_INCOMPLETE}
+    run_catalog.set_status('seq_runs', RUN_DIR, 'Fastq_1', STATUS_PARSED)
+    # a rescan updates the fields, but a parsed fastq dir is not moved back to complete
+    run_catalog.upsert_runs('seq_runs', [get_run_record('Fastq_1', num_fastq_files=6), get_run_record('Fastq_2')])
+    assert get_statuses(run_catalog) == {'Fastq_1': STATUS_PARSED, 'Fastq_2': STATUS_COMPLETE}
+    runs_df = run_catalog.get_runs_df('seq_runs', fastq_dir='Fastq_1')
+    assert runs_df['num_fastq_files'].tolist() == [6]
+    # unless it is no longer complete
+    run_catalog.upsert_runs('seq_runs', [get_run_record('Fastq_1', sequencing_complete=False),
+                                         get_run_record('Fastq_2')])
+    assert get_statuses(run_catalog)['Fastq_1'] == STATUS_INCOMPLETE
+
+
+def test_upsert_removes_fastq_dirs_no_longer_found(run_catalog):
+    other_run_record = get_run_record('Fastq_1').copy(run_dir='/Staging/maine-edna/other_run/')
+    run_catalog.upsert_runs('seq_runs', [get_run_record('Run Failed', sequencing_complete=False),
+                                         other_run_record])
+    # the run has since completed: the "Run Failed" row is replaced, the other run is left alone
+    run_catalog.upsert_runs('seq_runs', [get_run_record('Fastq_1'), get_run_record('Fastq_2')])
+    runs_df = run_catalog.get_runs_df('seq_runs')
+    assert sorted(zip(runs_df['run_dir'], runs_df['fastq_dir'])) == [
+        (RUN_DIR, 'Fastq_1'), (RUN_DIR, 'Fastq_2'), ('/Staging/maine-edna/other_run/', 'Fastq_1')]
+    assert run_catalog.get_done_run_dirs('seq_runs') == set()
+
+
+def test_upsert_fastq_files(run_catalog):
+    fastq_records = [FastqRecord(sample_id='E' + str(number), fastq_path='/Staging/E' + str(number) + '.fastq.gz',
+                                 size=100 + number, mtime_ns=1000 + number, checksums={'md5': 'md5_' + str(number)})
+                     for number in range(2)]
+    run_catalog.upsert_fastq_files('210126', PROJECT, RUN_DIR, 'Fastq_1', fastq_records)
+    run_catalog.upsert_fastq_files('210126', PROJECT, RUN_DIR, 'Fastq_1',
+                                   [fastq_records[0].copy(size=200, checksums={'md5': 'changed'})])
+    file_infos = run_catalog.get_fastq_file_infos(['/Staging/E0.fastq.gz', '/Staging/E1.fastq.gz',
+                                                   '/Staging/missing.fastq.gz'])
+    assert file_infos == {'/Staging/E0.fastq.gz': {'size': 200, 'mtime_ns': 1000, 'md5': 'changed'},
+                          '/Staging/E1.fastq.gz': {'size': 101, 'mtime_ns': 1001, 'md5': 'md5_1'}}
+
+
+def test_catalog_export_matches_seq_dirlist(tmp_path):
+    staging_dir = str(tmp_path / 'Staging') + '/'
+    log_file_dir = str(tmp_path / 'logs') + '/'
+    run_dir = make_miseq_run(staging_dir, PROJECT, 33, num_fastq_files=2, fastq_size=16, num_thumbnails=2)
+    parser = MiSeqParser(PROJECT, run_dir, 1, False, staging_dir=staging_dir, output_dir=str(tmp_path / 'Upload') + '/',
+                         backup_dir=str(tmp_path / 'Backup') + '/', extra_backup_dirs=[], log_file_dir=log_file_dir)
+    dirs_df = parser.get_dirs(export_csv=True, rta_complete=True)
+    # seq_dirlist.csv the way get_dirs used to write it
+    dirs_df.to_csv(str(tmp_path / 'seq_dirlist_old.csv'), encoding='utf-8', index=False)
+
+    output_csv_filenames = RunCatalog(log_file_dir + 'run_catalog.sqlite3').export_csv(str(tmp_path / 'export'))
+    assert [os.path.basename(output_csv_filename) for output_csv_filename in output_csv_filenames] == [
+        'seq_dirlist.csv', 'server_dirlist.csv', 'fastq_filelist.csv']
+    export_df = pd.read_csv(str(tmp_path / 'export' / 'seq_dirlist.csv'))
+    # the old columns in the old order, then the catalog's status
+    assert list(export_df.columns) == SEQ_DIRLIST_COLUMNS + ['status', 'updated_date']
+    assert export_df['status'].tolist() == [STATUS_COMPLETE]
+    old_df = pd.read_csv(str(tmp_path / 'seq_dirlist_old.csv'))
+    assert list(old_df.columns) == SEQ_DIRLIST_COLUMNS
+    pd.testing.assert_frame_equal(export_df[SEQ_DIRLIST_COLUMNS], old_df)
+    assert not os.path.exists(str(tmp_path / 'export' / 'seq_dirlist.csv.tmp'))
@@ -0,0 +1,41 @@
+"""
+test_run_tree_index.py
+cached RunTreeIndex of get_run_tree_index for lookups that aren't handed the parser's index
+Created By: mkimble
+"""
+
+import os
+from mytd_parser import run_tree_index
+from mytd_parser.run_tree_index import get_run_tree_index, RTA_COMPLETE
+from mytd_parser.parse_seq_run import get_run_id_xml, get_run_date_xml, check_rta_complete
+from mytd_parser.synthetic import make_miseq_run
+
+
+def test_helpers_share_one_walk(tmp_path, monkeypatch):
+    run_dir = make_miseq_run(str(tmp_path), 'maine-edna', 33, num_fastq_files=2, fastq_size=16, num_thumbnails=2)
+    walked_dirs = []
+    run_tree_init = run_tree_index.RunTreeIndex.__init__
+
+    def counting_init(self, walk_dir, *args, **kwargs):
+        walked_dirs.append(walk_dir)
+        run_tree_init(self, walk_dir, *args, **kwargs)
+    monkeypatch.setattr(run_tree_index.RunTreeIndex, '__init__', counting_init)
+    monkeypatch.setattr(run_tree_index, 'run_tree_index_cache', run_tree_index.OrderedDict())
+
+    assert get_run_id_xml(run_dir) == os.path.basename(run_dir.rstrip('/'))
+    assert get_run_date_xml(run_dir)
+    assert check_rta_complete(run_dir)[0] is True
+    assert len(walked_dirs) == 1
+
+
+def test_changed_run_dir_is_walked_again(tmp_path, monkeypatch):
+    run_dir = make_miseq_run(str(tmp_path), 'maine-edna', 33, num_fastq_files=2, fastq_size=16, num_thumbnails=2)
+    monkeypatch.setattr(run_tree_index, 'run_tree_index_cache', run_tree_index.OrderedDict())
+    first_index = get_run_tree_index(run_dir)
+    assert get_run_tree_index(run_dir) is first_index
+
+    os.remove(run_dir + 'RTAComplete.txt')
+    second_index = get_run_tree_index(run_dir)
+    assert second_index is not first_index
+    assert second_index.num_files(RTA_COMPLETE) == 0
+    assert check_rta_complete(run_dir) == (False, False)
@@ -0,0 +1,115 @@
+"""
+test_scan_cache.py
+ScanCache hits and parsed state per fingerprint, the atomic save and recovery from a corrupt cache file
+Created By: mkimble
+"""
+
+import os
+import pickle
+import pandas as pd
+import pytest
+from mytd_parser import scan_cache as scan_cache_module
+from mytd_parser.scan_cache import ScanCache
+
+FINGERPRINT = {'num_dirs': 3, 'num_files': 2, 'total_size': 32, 'digest': 'abc'}
+CHANGED_FINGERPRINT = dict(FINGERPRINT, total_size=48, digest='def')
+
+
+def get_run_dir(tmp_path, run_id='210126_M05543_0033_000000000-00033'):
+    run_dir = tmp_path / 'Staging' / 'maine-edna' / run_id
+    run_dir.mkdir(parents=True)
+    return str(run_dir) + '/'
+
+
+def get_dirs_df(run_dir):
+    return pd.DataFrame({'run_dir': [run_dir, run_dir], 'fastq_dir': ['Fastq_1', 'Fastq_2']})
+
+
+def test_get_dirs_df(tmp_path):
+    run_dir = get_run_dir(tmp_path)
+    scan_cache = ScanCache(None)
+    assert scan_cache.get_dirs_df(run_dir, FINGERPRINT) is None
+    scan_cache.set_dirs_df(run_dir, FINGERPRINT, get_dirs_df(run_dir))
+    cached_dirs_df = scan_cache.get_dirs_df(run_dir, FINGERPRINT)
+    pd.testing.assert_frame_equal(cached_dirs_df, get_dirs_df(run_dir))
+    # callers get a copy they can change
+    cached_dirs_df['fastq_dir'] = 'changed'
+    assert scan_cache.get_dirs_df(run_dir, FINGERPRINT)['fastq_dir'].tolist() == ['Fastq_1', 'Fastq_2']
+    assert scan_cache.get_dirs_df(run_dir, CHANGED_FINGERPRINT) is None
+    assert (scan_cache.num_hits, scan_cache.num_misses) == (2, 2)
+
+
+def test_is_parsed(tmp_path):
+    run_dir = get_run_dir(tmp_path)
+    scan_cache = ScanCache(None)
+    # unknown runs are not parsed, and set_parsed doesn't add them
+    scan_cache.set_parsed(run_dir)
+    assert not scan_cache.is_parsed(run_dir, FINGERPRINT)
+    scan_cache.set_dirs_df(run_dir, FINGERPRINT, get_dirs_df(run_dir))
+    assert not scan_cache.is_parsed(run_dir, FINGERPRINT)
+    scan_cache.set_parsed(run_dir)
+    assert scan_cache.is_parsed(run_dir, FINGERPRINT)
+    # a changed run has to be parsed again
+    assert not scan_cache.is_parsed(run_dir, CHANGED_FINGERPRINT)
+    scan_cache.set_parsed(run_dir, False)
+    assert not scan_cache.is_parsed(run_dir, FINGERPRINT)
+    # a rescan stores new rows that are not parsed yet
+    scan_cache.set_parsed(run_dir)
+    scan_cache.set_dirs_df(run_dir, CHANGED_FINGERPRINT, get_dirs_df(run_dir))
+    assert not scan_cache.is_parsed(run_dir, CHANGED_FINGERPRINT)
+
+
+def test_save_and_load(tmp_path):
+    run_dir = get_run_dir(tmp_path)
+    moved_run_dir = get_run_dir(tmp_path, '210127_M05543_0034_000000000-00034')
+    cache_filepath = str(tmp_path / 'logs' / 'seq_scan_cache.pkl')
+    scan_cache = ScanCache(cache_filepath)
+    for cached_run_dir in (run_dir, moved_run_dir):
+        scan_cache.set_dirs_df(cached_run_dir, FINGERPRINT, get_dirs_df(cached_run_dir))
+    scan_cache.set_parsed(run_dir)
+    # moved to Backup before the save
+    os.rmdir(moved_run_dir)
+    scan_cache.save()
+    assert not os.path.exists(cache_filepath + '.tmp')
+    loaded_scan_cache = ScanCache(cache_filepath)
+    assert list(loaded_scan_cache.entries) == [run_dir]
+    assert loaded_scan_cache.is_parsed(run_dir, FINGERPRINT)
+
+
+def test_failed_save_keeps_previous_cache(tmp_path, monkeypatch):
+    run_dir = get_run_dir(tmp_path)
+    cache_filepath = str(tmp_path / 'seq_scan_cache.pkl')
+    scan_cache = ScanCache(cache_filepath)
+    scan_cache.set_dirs_df(run_dir, FINGERPRINT, get_dirs_df(run_dir))
+    scan_cache.save()
+    with open(cache_filepath, 'rb') as cache_file:
+        saved_bytes = cache_file.read()
+
+    def failing_dump(obj, cache_file, protocol=None):
+        # crash halfway through writing the cache
+        cache_file.write(b'\x80\x05partial')
+        raise OSError(28, 'No space left on device')
+    monkeypatch.setattr(scan_cache_module.pickle, 'dump', failing_dump)
+    scan_cache.set_dirs_df(run_dir, CHANGED_FINGERPRINT, get_dirs_df(run_dir))
+    with pytest.raises(RuntimeError, match='No space left on device'):
+        scan_cache.save()
+    # the cache file is still the last complete save
+    with open(cache_filepath, 'rb') as cache_file:
+        assert cache_file.read() == saved_bytes
+    monkeypatch.undo()
+    assert ScanCache(cache_filepath).get_dirs_df(run_dir, FINGERPRINT) is not None
+
+
+@pytest.mark.parametrize('cache_bytes', [b'', b'not a pickle', pickle.dumps({'a': 1})[:-3]],
+                         ids=['empty', 'garbage', 'truncated'])
+def test_corrupt_cache_starts_empty(tmp_path, cache_bytes):
+    run_dir = get_run_dir(tmp_path)
+    cache_filepath = str(tmp_path / 'seq_scan_cache.pkl')
+    with open(cache_filepath, 'wb') as cache_file:
+        cache_file.write(cache_bytes)
+    scan_cache = ScanCache(cache_filepath)
+    assert scan_cache.entries == {}
+    # and the next save replaces the corrupt file
+    scan_cache.set_dirs_df(run_dir, FINGERPRINT, get_dirs_df(run_dir))
+    scan_cache.save()
+    assert list(ScanCache(cache_filepath).entries) == [run_dir]
@@ -0,0 +1,147 @@
+"""
+test_watch.py
+RunDirWatcher debounce and the polling fallback of watch on synthetic runs, with a fake clock
+Created By: mkimble
+"""
+
+import os
+import glob
+import pytest
+from mytd_parser import settings
+from mytd_parser import watch as watch_module
+from mytd_parser.watch import RunDirWatcher, has_rta_complete, watch
+from mytd_parser.records import RunRecord
+from mytd_parser.run_catalog import RunCatalog, STATUS_PARSED
+from mytd_parser.synthetic import make_miseq_run
+
+PROJECT = 'maine-edna'
+
+
+class FakeClock:
+    """
+     stands in for the time module in watch.py; sleep advances the clock and calls on_sleep(now)
+    """
+    def __init__(self, on_sleep=None):
+        self.now = 0
+        self.on_sleep = on_sleep
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        if self.on_sleep is not None:
+            self.on_sleep(self.now)
+
+
+def make_run(staging_dir, run_number):
+    return make_miseq_run(staging_dir, PROJECT, run_number, num_fastq_files=2, fastq_size=16, num_thumbnails=2)
+
+
+def get_watcher(staging_dir, dispatched):
+    return RunDirWatcher(staging_dir, has_rta_complete,
+                         lambda project, run_dir, num_run_dir: dispatched.append((project, run_dir, num_run_dir)),
+                         debounce_seconds=60)
+
+
+def test_dispatch_once_fingerprint_is_stable(tmp_path):
+    run_dir = make_run(str(tmp_path / 'Staging'), 33)
+    dispatched = []
+    watcher = get_watcher(str(tmp_path / 'Staging'), dispatched)
+    watcher.mark_changed(run_dir, now=0)
+    watcher.dispatch_settled(now=59)
+    assert run_dir in watcher.pending
+    # first check after the debounce only records the fingerprint
+    watcher.dispatch_settled(now=60)
+    assert dispatched == []
+    assert watcher.pending[run_dir]['fingerprint'] is not None
+    watcher.dispatch_settled(now=119)
+    assert dispatched == []
+    # unchanged over a second debounce period: dispatched once
+    watcher.dispatch_settled(now=120)
+    assert dispatched == [(PROJECT, run_dir, 1)]
+    assert watcher.pending == {}
+    watcher.dispatch_settled(now=500)
+    assert len(dispatched) == 1
+
+
+def test_changed_fingerprint_waits_another_debounce(tmp_path):
+    run_dir = make_run(str(tmp_path / 'Staging'), 33)
+    dispatched = []
+    watcher = get_watcher(str(tmp_path / 'Staging'), dispatched)
+    watcher.mark_changed(run_dir, now=0)
+    watcher.dispatch_settled(now=60)
+    # a fastq file written below the watched depth, without any event
+    fastq_dir = glob.glob(os.path.join(run_dir, 'Alignment_1', '*', 'Fastq'))[0]
+    with open(os.path.join(fastq_dir, 'E99_R1.fastq.gz'), 'wb') as fastq_file:
+        fastq_file.write(b'late')
+    watcher.dispatch_settled(now=120)
+    assert dispatched == []
+    watcher.dispatch_settled(now=179)
+    assert dispatched == []
+    watcher.dispatch_settled(now=180)
+    assert dispatched == [(PROJECT, run_dir, 1)]
+
+
+def test_run_without_trigger_is_dropped(tmp_path):
+    run_dir = make_run(str(tmp_path / 'Staging'), 33)
+    os.remove(run_dir + 'RTAComplete.txt')
+    dispatched = []
+    watcher = get_watcher(str(tmp_path / 'Staging'), dispatched)
+    watcher.mark_changed(run_dir, now=0)
+    watcher.dispatch_settled(now=60)
+    assert (dispatched, watcher.pending) == ([], {})
+
+
+def add_catalog_run(run_catalog, run_dir, fastq_dir_statuses):
+    """
+     seq_runs rows for run_dir, {fastq_dir: status}
+    """
+    run_id = os.path.basename(run_dir.rstrip('/'))
+    run_records = [RunRecord(run_id=run_id, project=PROJECT, run_dir=run_dir, fastq_dir=fastq_dir, rta_complete=True,
+                             sequencing_complete=True) for fastq_dir in fastq_dir_statuses]
+    run_catalog.upsert_runs('seq_runs', run_records)
+    for fastq_dir, status in fastq_dir_statuses.items():
+        if status is not None:
+            run_catalog.set_status('seq_runs', run_dir, fastq_dir, status)
+
+
+def test_polling_catch_up_and_dispatch(tmp_path, monkeypatch):
+    staging_dir = str(tmp_path / 'Staging')
+    parsed_run_dir = make_run(staging_dir, 33)
+    # one of its two fastq dirs is not parsed yet, so it is caught up
+    unfinished_run_dir = make_run(staging_dir, 34)
+    run_catalog = RunCatalog(str(tmp_path / 'logs' / settings.RUN_CATALOG_FILENAME))
+    add_catalog_run(run_catalog, parsed_run_dir, {'Fastq_1': STATUS_PARSED, 'Fastq_2': STATUS_PARSED})
+    add_catalog_run(run_catalog, unfinished_run_dir, {'Fastq_1': STATUS_PARSED, 'Fastq_2': None})
+    assert run_catalog.get_done_run_dirs('seq_runs') == {parsed_run_dir}
+
+    new_run_dirs = []
+
+    def add_run(now):
+        # a run copied into staging while watching
+        if now == 60:
+            new_run_dirs.append(make_run(staging_dir, 35))
+    monkeypatch.setattr(watch_module, 'time', FakeClock(add_run))
+    dispatched = []
+    monkeypatch.setattr(watch_module, 'parse_seq_run_dir', lambda project, run_dir, *args: dispatched.append(
+        (run_dir, watch_module.time.time())))
+    monkeypatch.setattr(watch_module, 'write_metrics', lambda job_name: None)
+    monkeypatch.setattr(settings, 'LOG_FILE_DIR', str(tmp_path / 'logs') + '/')
+
+    watch(server=False, use_inotify=False, staging_dir=staging_dir, debounce_seconds=60, poll_seconds=30,
+          run_catalog=run_catalog, max_loops=6)
+    # caught up: checked at 60, dispatched at 120. New run: polled at 60, checked at 120, dispatched at 180
+    assert dispatched == [(unfinished_run_dir, 120), (new_run_dirs[0], 180)]
+
+
+@pytest.mark.parametrize('path, run_dir', [
+    ('Staging/maine-edna/210126_M05543_0033/Alignment_1/RTAComplete.txt', 'Staging/maine-edna/210126_M05543_0033/'),
+    ('Staging/maine-edna/210126_M05543_0033', 'Staging/maine-edna/210126_M05543_0033/'),
+    ('Staging/maine-edna', None),
+])
+def test_get_run_dir(tmp_path, path, run_dir):
+    watcher = get_watcher(str(tmp_path / 'Staging'), [])
+    if run_dir is not None:
+        run_dir = str(tmp_path) + '/' + run_dir
+    assert watcher.get_run_dir(str(tmp_path) + '/' + path) == run_dir